@@ -6,10 +6,11 @@ import io
 import typing
 from dataclasses import dataclass
 from time import sleep, time
-from typing import Any, Dict, List, Literal, Optional, Union, IO
+from typing import Any, Callable, Dict, List, Literal, Optional, Union, IO
 from uuid import UUID
 
 import pandas as pd
+import pyarrow as pa
 
 from breadbox_client import Client
 from breadbox_client.api.health_check import ok
@@ -51,6 +52,7 @@ from breadbox_client.api.types import update_dimension_type as update_dimension_
 from breadbox_client.api.temp import get_associations as get_associations_client
 from breadbox_client.api.temp import add_associations as add_associations_client
 from breadbox_client.api.temp import get_associations_for_slice as get_associations_for_slice_client
+from breadbox_client.api.temp import get_associations_for_slices as get_associations_for_slices_client
 from breadbox_client.api.temp import evaluate_context as evaluate_context_client
 from breadbox_client.api.temp import get_sql_schema
 from breadbox_client.api.temp import query_sql
@@ -61,6 +63,7 @@ from breadbox_client.api.temp import create_predictive_model_configs as create_p
 from breadbox_client.api.temp import update_predictive_model_configs as update_predictive_model_configs_client
 from breadbox_client.api.temp import delete_predictive_model_configs as delete_predictive_model_configs_client
 from breadbox_client.api.temp import get_predictive_models_for_feature as get_predictive_models_for_feature_client
+from breadbox_client.api.temp import get_predictive_models_for_features as get_predictive_models_for_features_client
 from breadbox_client.api.temp import bulk_load_predictive_model_results as bulk_load_predictive_model_results_client
 from breadbox_client.api.temp import delete_predictive_model_results as delete_predictive_model_results_client
 from breadbox_client.api.release_versions import get_release_versions as get_release_versions_client
@@ -79,6 +82,8 @@ from breadbox_client.models import (
     AddDatasetResponse,
     AddDimensionType,
     Associations,
+    AssociationsForSlices,
+    AssociationsForSlicesParams,
     AssociationTable,
     AssociationsIn,
     AssociationsInAxis,
@@ -135,6 +140,7 @@ from breadbox_client.models import (
     PredictiveModelConfigIn,
     PredictiveModelConfigOut,
     PredictiveModelResultOut,
+    PredictiveModelsForFeaturesIn,
     PredictiveModelsResponse,
     ReleaseVersionResponse,
     CreateReleaseVersionParams,
@@ -148,6 +154,7 @@ from breadbox_client.models import (
 
 from breadbox_client.types import UNSET, Unset, File, Response
 from breadbox_facade.exceptions import BreadboxException
+from breadbox_facade.pooling import CallRecord, ClientTransport, call_many, get_shared_transport
 
 
 class TimeoutError(Exception):
@@ -168,12 +175,23 @@ class BBClient:
     PUBLIC_GROUP_ID = str(UUID("00000000-0000-0000-0000-000000000000"))
     TRANSIENT_GROUP_ID = str(UUID("11111111-1111-1111-1111-111111111111"))
 
-    def __init__(self, base_url: str, user: str, password: Optional[str] = None):
+    def __init__(
+        self,
+        base_url: str,
+        user: str,
+        password: Optional[str] = None,
+        http2: bool = False,
+        on_call: Optional[Callable[[CallRecord], None]] = None,
+    ):
         """
         Instantiate a client which can make requests to breadbox.
 
         If a proxy_password is provided, then basic authentication will be used. 
         This is only necessary for non-public environments. 
+
+        Requests are sent over the process's shared pool of keep-alive connections (see pooling.py), so creating
+        a client per request is cheap. If on_call is provided, it's called with a CallRecord after each request
+        to breadbox completes (possibly from another thread, when using the *_many methods).
         """
         headers = {"X-Forwarded-User": user, "X-Forwarded-Email": user}
 
@@ -186,8 +204,14 @@ class BBClient:
         autogenerated_client = Client(
             base_url,
             raise_on_unexpected_status=True,
+            httpx_args={"transport": ClientTransport(get_shared_transport(http2), on_call)},
         ).with_headers(headers)
         self.client = autogenerated_client
+        # create the httpx client up front, rather than on the first call, since the *_many methods share it between
+        # threads
+        self.client.get_httpx_client()
+        # identical calls made by clients for the same user can share a response
+        self._identity = (base_url, user)
 
     def _parse_client_response(self, response: Response[Any]) -> Any:
         """
@@ -199,6 +223,13 @@ class BBClient:
         else:
             return response.parsed
 
+    def _call_many(self, method: Callable[..., Any], calls: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Makes the calls to method (one per dict of keyword arguments) concurrently, and returns their results in
+        order. Identical calls are only made once, and share the same result, so callers must not modify results.
+        """
+        return call_many((*self._identity, method.__name__), method, calls)
+
     # DATASETS
 
     def get_dataset(
@@ -322,6 +353,26 @@ class BBClient:
         breadbox_response = get_dataset_samples_client.sync_detailed(dataset_id=dataset_id, client=self.client)
         return self._parse_client_response(breadbox_response)
 
+    def get_dataset_data_many(self, calls: List[Dict[str, Any]]) -> List[pd.DataFrame]:
+        """Calls get_dataset_data with each dict of keyword arguments concurrently. Returns the results in order."""
+        return self._call_many(self.get_dataset_data, calls)
+
+    def get_tabular_dataset_data_many(self, calls: List[Dict[str, Any]]) -> List[pd.DataFrame]:
+        """Calls get_tabular_dataset_data with each dict of keyword arguments concurrently. Returns the results in order."""
+        return self._call_many(self.get_tabular_dataset_data, calls)
+
+    def get_matrix_dataset_data_many(self, calls: List[Dict[str, Any]]) -> List[pd.DataFrame]:
+        """Calls get_matrix_dataset_data with each dict of keyword arguments concurrently. Returns the results in order."""
+        return self._call_many(self.get_matrix_dataset_data, calls)
+
+    def get_dataset_features_many(self, dataset_ids: List[str]) -> List[list[dict[str, str]]]:
+        """Get the features of each of the given datasets concurrently."""
+        return self._call_many(self.get_dataset_features, [{"dataset_id": dataset_id} for dataset_id in dataset_ids])
+
+    def get_dataset_samples_many(self, dataset_ids: List[str]) -> List[list[dict[str, str]]]:
+        """Get the samples of each of the given datasets concurrently."""
+        return self._call_many(self.get_dataset_samples, [{"dataset_id": dataset_id} for dataset_id in dataset_ids])
+
     def get_feature_data(self, dataset_ids: list[str], feature_ids: list[str]) -> list[FeatureResponse]:
         """Get the column data values for a given set of features."""
         breadbox_response = get_feature_data_client.sync_detailed(
@@ -731,6 +782,15 @@ class BBClient:
                                                                                     identifier_type=SliceQueryIdentifierType(identifier_type))))
         return self._parse_client_response(breadbox_response)
     
+    def get_associations_for_slices(self, slice_queries: List[dict], association_datasets: Optional[List[str]] = None) -> AssociationsForSlices:
+        """Look up the associations of many slices in one request. Each slice query is a dict with dataset_id, identifier and identifier_type.
+        The associations are returned as columns, where slice_index is the position of the row's slice in slice_queries."""
+        params = {"slice_queries": slice_queries}
+        if association_datasets is not None:
+            params["association_datasets"] = association_datasets
+        breadbox_response = get_associations_for_slices_client.sync_detailed(client=self.client, body=AssociationsForSlicesParams.from_dict(params))
+        return self._parse_client_response(breadbox_response)
+
     def evaluate_context(self, context_expression: dict) -> ContextMatchResponse:
         request_body = Context.from_dict(context_expression)
         breadbox_response = evaluate_context_client.sync_detailed(client=self.client, body=request_body)
@@ -740,10 +800,13 @@ class BBClient:
         breadbox_response = get_sql_schema.sync_detailed(client=self.client, dataset_given_id=dataset_given_id if dataset_given_id else UNSET)
         return self._parse_client_response(breadbox_response)
 
-    def query_sql(self, sql: str) -> str:
-        request_body = SqlQuery(sql=sql)
+    def query_sql(self, sql: str) -> pd.DataFrame:
+        """Run a read-only SQL query. Results are sent as arrow record batches, so the columns keep their types."""
+        request_body = SqlQuery.from_dict({"sql": sql, "format": "arrow-ipc"})
         breadbox_response = query_sql.sync_detailed(client=self.client, body=request_body)
-        return self._parse_client_response(breadbox_response)
+        # raises if the query failed
+        self._parse_client_response(breadbox_response)
+        return pa.ipc.open_stream(breadbox_response.content).read_pandas()
     
     # RELEASE VERSIONS
     
@@ -901,6 +964,14 @@ class BBClient:
         )
         return self._parse_client_response(breadbox_response)
 
+    def get_predictive_models_for_features(self, dataset_id: str, feature_given_ids: List[str]) -> List[PredictiveModelsResponse]:
+        """Get the predictive model results for each of the given features in a dataset (in a single request)."""
+        body = PredictiveModelsForFeaturesIn(feature_given_ids=feature_given_ids)
+        breadbox_response = get_predictive_models_for_features_client.sync_detailed(
+            dataset_id=dataset_id, client=self.client, body=body
+        )
+        return self._parse_client_response(breadbox_response)
+
     def bulk_load_predictive_model_results(
         self,
         dimension_type_name: str,
@@ -0,0 +1,205 @@
+import copy
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+import httpx
+
+# Each process (ie: each gunicorn worker) shares one pool of keep-alive connections to breadbox between all of its
+# clients, so that a request doesn't pay for a new TCP connection on every call.
+MAX_CONNECTIONS = 20
+MAX_KEEPALIVE_CONNECTIONS = 10
+KEEPALIVE_EXPIRY = 30.0
+
+# the number of calls made at the same time by the *_many methods (shared by every client in the process)
+MAX_CONCURRENT_CALLS = 8
+
+T = TypeVar("T")
+
+
+@dataclass
+class CallRecord:
+    "Describes a single HTTP request made to breadbox"
+    method: str
+    path: str
+    status_code: Optional[int]  # None if the request failed without a response
+    elapsed: float  # in seconds, including reading the body of the response
+
+
+class _ProcessState:
+    def __init__(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.transports: Dict[bool, httpx.HTTPTransport] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+
+_state = _ProcessState()
+
+
+def _get_state() -> _ProcessState:
+    global _state
+    # connections and threads created before a fork can't be used by the child
+    if _state.pid != os.getpid():
+        _state = _ProcessState()
+    return _state
+
+
+def get_shared_transport(http2: bool = False) -> httpx.HTTPTransport:
+    """
+    Returns this process's pool of connections to breadbox. http2 requires the h2 package (ie: httpx[http2])
+    and a server which supports it.
+    """
+    state = _get_state()
+    with state.lock:
+        transport = state.transports.get(http2)
+        if transport is None:
+            transport = httpx.HTTPTransport(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+            )
+            state.transports[http2] = transport
+        return transport
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    state = _get_state()
+    with state.lock:
+        if state.executor is None:
+            state.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CALLS, thread_name_prefix="breadbox-client")
+        return state.executor
+
+
+class _TimedByteStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._on_close()
+
+
+class ClientTransport(httpx.BaseTransport):
+    """
+    The transport used by a single client: sends its requests through the shared pool of connections (which
+    closing the client must not close), and reports each request to on_call if given.
+    """
+
+    def __init__(self, transport: httpx.BaseTransport, on_call: Optional[Callable[[CallRecord], None]] = None):
+        self._transport = transport
+        self._on_call = on_call
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self._on_call is None:
+            return self._transport.handle_request(request)
+
+        on_call = self._on_call
+        start = time.perf_counter()
+        try:
+            response = self._transport.handle_request(request)
+        except Exception:
+            on_call(CallRecord(request.method, request.url.path, None, time.perf_counter() - start))
+            raise
+
+        def on_close():
+            on_call(CallRecord(request.method, request.url.path, response.status_code, time.perf_counter() - start))
+
+        assert isinstance(response.stream, httpx.SyncByteStream)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TimedByteStream(response.stream, on_close),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        # the shared transport stays open for the other clients
+        pass
+
+
+class InFlightCalls:
+    """
+    Tracks the calls which are in progress, so that an identical call made while one is already in progress (ie: by
+    another thread handling a different request for the same page) waits for that call's result instead of making
+    the same request again. Callers which waited get a copy of the result, so they can't modify each other's.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def call(self, key: Hashable, function: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = function()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+_in_flight = InFlightCalls()
+
+
+def make_call_key(*parts: Any) -> str:
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+def call_many(key_prefix: Tuple, function: Callable[..., T], calls: List[Dict[str, Any]]) -> List[T]:
+    """
+    Calls function once per set of keyword arguments in calls, concurrently, and returns the results in the same
+    order. Identical calls (including ones already in progress elsewhere in the process with the same key_prefix) are
+    only made once, and each repeat gets its own copy of the result. Raises the exception of the first call which
+    failed.
+    """
+    keys = [make_call_key(*key_prefix, kwargs) for kwargs in calls]
+    kwargs_by_key = dict(zip(keys, calls))
+
+    def call(key: str):
+        return _in_flight.call(key, lambda: function(**kwargs_by_key[key]))
+
+    if len(kwargs_by_key) == 1:
+        # no point in handing a single call to another thread
+        (key,) = kwargs_by_key
+        result = call(key)
+        return [result] + [copy.deepcopy(result) for _ in calls[1:]]
+
+    executor = _get_executor()
+    futures = {key: executor.submit(call, key) for key in kwargs_by_key}
+    results = []
+    returned = set()
+    for key in keys:
+        result = futures[key].result()
+        results.append(copy.deepcopy(result) if key in returned else result)
+        returned.add(key)
+    return results
@@ -6,6 +6,8 @@ import pandas as pd
 from breadbox_client.models import ModelConfigIn, ColumnType, FlatTableColumnMetadata, MenuIn
 from breadbox_facade import AXIS_SAMPLE, AXIS_FEATURE, COL_TYPE_CONTINUOUS, COL_TYPE_TEXT, BBClient, ColumnMetadata
 
+from .conftest import base_url, user
+
 def unique_name(prefix):
     return prefix + str(uuid.uuid4())
 
@@ -85,6 +87,35 @@ def test_add_matrix_dataset(breadbox_client):
     assert response.id == dataset_id
 
 
+def test_get_matrix_dataset_data_many(breadbox_client):
+    data_type = _create_data_type(breadbox_client)
+
+    dataset_id = breadbox_client.add_matrix_dataset(
+        name=unique_name("data-many"),
+        units="ponies",
+        feature_type=None,
+        data_type=data_type,
+        data_df=pd.DataFrame({"label": ["X", "Y"], "score1": [1.0, 2.0], "score2": [3.0, 4.0]}),
+        sample_type="depmap_model",
+        group_id=breadbox_client.PUBLIC_GROUP_ID,
+        timeout=5,
+    )["datasetId"]
+
+    calls = []
+    client = BBClient(base_url, user, on_call=calls.append)
+    calls_by_feature = [
+        dict(dataset_id=dataset_id, features=[feature], feature_identifier="label")
+        for feature in ["score1", "score2", "score1"]
+    ]
+    results = client.get_matrix_dataset_data_many(calls_by_feature)
+
+    assert [list(df.columns) for df in results] == [["score1"], ["score2"], ["score1"]]
+    assert results[0]["score1"].to_dict() == {"X": 1.0, "Y": 2.0}
+    # the duplicate call was only made once
+    assert len(calls) == 2
+    assert all(call.status_code == 200 and call.method == "POST" for call in calls)
+
+
 def test_add_dataset_with_dataset_metadata(breadbox_client):
 
     data_type = _create_data_type(breadbox_client)
@@ -0,0 +1,162 @@
+import threading
+
+import httpx
+import pandas as pd
+import pytest
+
+from breadbox_facade.pooling import ClientTransport, InFlightCalls, call_many
+
+
+def _call_in_thread(in_flight, key, function):
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = in_flight.call(key, function)
+        except Exception as ex:
+            outcome["error"] = ex
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+
+def _wait_for_waiter(in_flight, key, thread):
+    # the second caller blocks on the owner's future. There's no hook for "is waiting", so give it a moment to get
+    # there, and check it hasn't finished on its own.
+    thread.join(timeout=0.2)
+    assert thread.is_alive()
+    assert key in in_flight._calls
+
+
+def test_in_flight_calls_coalesces_identical_calls():
+    in_flight = InFlightCalls()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def function():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return pd.DataFrame({"a": [1.0, 2.0]})
+
+    owner, owner_outcome = _call_in_thread(in_flight, "key", function)
+    assert started.wait(5)
+    waiter, waiter_outcome = _call_in_thread(in_flight, "key", function)
+    _wait_for_waiter(in_flight, "key", waiter)
+
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(owner_outcome["result"], waiter_outcome["result"])
+    assert owner_outcome["result"] is not waiter_outcome["result"]
+
+    # the waiter's copy is its own
+    waiter_outcome["result"].loc[0, "a"] = 100.0
+    assert owner_outcome["result"].loc[0, "a"] == 1.0
+
+    # once the call has finished, the next one is made again
+    assert "key" not in in_flight._calls
+    in_flight.call("key", function)
+    assert len(calls) == 2
+
+
+def test_in_flight_calls_propagates_errors_to_waiters():
+    in_flight = InFlightCalls()
+    started = threading.Event()
+    release = threading.Event()
+
+    def function():
+        started.set()
+        release.wait(5)
+        raise ValueError("failed")
+
+    owner, owner_outcome = _call_in_thread(in_flight, "key", function)
+    assert started.wait(5)
+    waiter, waiter_outcome = _call_in_thread(in_flight, "key", function)
+    _wait_for_waiter(in_flight, "key", waiter)
+
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert isinstance(owner_outcome["error"], ValueError)
+    assert waiter_outcome["error"] is owner_outcome["error"]
+    # a failed call isn't remembered
+    assert in_flight.call("key", lambda: 1) == 1
+
+
+def test_call_many_makes_each_distinct_call_once():
+    calls = []
+    lock = threading.Lock()
+
+    def function(feature):
+        with lock:
+            calls.append(feature)
+        return pd.Series([1.0, 2.0], name=feature)
+
+    results = call_many(
+        ("test_call_many_makes_each_distinct_call_once",),
+        function,
+        [{"feature": "a"}, {"feature": "b"}, {"feature": "a"}],
+    )
+
+    assert sorted(calls) == ["a", "b"]
+    assert [result.name for result in results] == ["a", "b", "a"]
+    assert results[0] is not results[2]
+    results[2].iloc[0] = 100.0
+    assert results[0].iloc[0] == 1.0
+
+
+def test_call_many_single_call_returns_copies():
+    calls = []
+
+    def function(feature):
+        calls.append(feature)
+        return pd.DataFrame({feature: [1.0]})
+
+    results = call_many(
+        ("test_call_many_single_call_returns_copies",),
+        function,
+        [{"feature": "a"}, {"feature": "a"}],
+    )
+
+    assert calls == ["a"]
+    assert results[0] is not results[1]
+    results[1].loc[0, "a"] = 100.0
+    assert results[0].loc[0, "a"] == 1.0
+
+
+def test_call_many_raises_first_error():
+    def function(feature):
+        if feature == "bad":
+            raise KeyError(feature)
+        return feature
+
+    with pytest.raises(KeyError):
+        call_many(
+            ("test_call_many_raises_first_error",),
+            function,
+            [{"feature": "good"}, {"feature": "bad"}],
+        )
+
+
+def test_client_transport_reports_calls():
+    records = []
+    transport = ClientTransport(
+        httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True})),
+        on_call=records.append,
+    )
+
+    with httpx.Client(transport=transport, base_url="http://breadbox") as client:
+        response = client.get("/datasets/")
+
+    assert response.json() == {"ok": True}
+    assert len(records) == 1
+    assert records[0].method == "GET"
+    assert records[0].path == "/datasets/"
+    assert records[0].status_code == 200
+    assert records[0].elapsed >= 0
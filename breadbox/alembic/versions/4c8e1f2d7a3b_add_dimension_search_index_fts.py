@@ -0,0 +1,65 @@
+"""Add full-text index over dimension search index values
+
+Revision ID: 4c8e1f2d7a3b
+Revises: 9b2e6f4d1a7c
+Create Date: 2026-10-17 16:41:09.583120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "4c8e1f2d7a3b"
+down_revision = "9b2e6f4d1a7c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # An external content table: the values are only stored in dimension_search_index, and the
+    # triggers below keep the trigram index in sync with it. The trigram tokenizer lets the index
+    # answer substring searches, which can't use a b-tree index.
+    op.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS dimension_search_index_fts USING fts5(
+        value,
+        content='dimension_search_index',
+        content_rowid='rowid',
+        tokenize='trigram'
+        );
+    """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS dimension_search_index_fts_insert AFTER INSERT ON dimension_search_index BEGIN
+            INSERT INTO dimension_search_index_fts(rowid, value) VALUES (new.rowid, new.value);
+        END;
+    """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS dimension_search_index_fts_delete AFTER DELETE ON dimension_search_index BEGIN
+            INSERT INTO dimension_search_index_fts(dimension_search_index_fts, rowid, value) VALUES ('delete', old.rowid, old.value);
+        END;
+    """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS dimension_search_index_fts_update AFTER UPDATE ON dimension_search_index BEGIN
+            INSERT INTO dimension_search_index_fts(dimension_search_index_fts, rowid, value) VALUES ('delete', old.rowid, old.value);
+            INSERT INTO dimension_search_index_fts(rowid, value) VALUES (new.rowid, new.value);
+        END;
+    """
+    )
+    # index the existing contents of dimension_search_index
+    op.execute(
+        "INSERT INTO dimension_search_index_fts(dimension_search_index_fts) VALUES ('rebuild');"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS dimension_search_index_fts_update;")
+    op.execute("DROP TRIGGER IF EXISTS dimension_search_index_fts_delete;")
+    op.execute("DROP TRIGGER IF EXISTS dimension_search_index_fts_insert;")
+    op.execute("DROP TABLE IF EXISTS dimension_search_index_fts;")
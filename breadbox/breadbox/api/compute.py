@@ -1,7 +1,9 @@
 import datetime
 import os
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 from logging import getLogger
+from uuid import uuid4
+from celery.result import EagerResult
 from fastapi import APIRouter, HTTPException, Depends
 
 from breadbox.config import Settings, get_settings
@@ -12,9 +14,15 @@ from ..db.session import SessionWithUser
 from ..models.dataset import MatrixDataset
 from ..schemas.compute import ComputeParams, ComputeResponse
 from ..compute import analysis_tasks
+from ..compute.analysis_result_cache import (
+    AnalysisResultCache,
+    get_analysis_result_cache,
+    get_cache_key,
+)
 from .dependencies import get_user, get_db_with_user
 from ..celery_task import utils
 from ..crud import dataset as crud_dataset
+from ..crud.dimension_types import get_dimension_type
 from ..schemas.dataset import ValueType
 
 router = APIRouter(prefix="/compute", tags=["compute"])
@@ -41,7 +49,8 @@ def _validate_parameters(
     query_dataset_id: Optional[str],
     query_values: Optional[List[str]],
     depmap_model_ids: Optional[List[str]],
-):
+) -> Tuple[MatrixDataset, Optional[MatrixDataset]]:
+    """Returns the dataset to search and the dataset of the query feature (if any)"""
     dataset = crud_dataset.get_dataset(db, db.user, dataset_id)
     if dataset is None:
         raise UserError(f"dataset {dataset_id} is not found")
@@ -52,6 +61,7 @@ def _validate_parameters(
             f"Can only perform analysis on datasets with value_type=continuous, but value_type was {dataset.value_type}"
         )
 
+    query_dataset = None
     if query_dataset_id is not None:
         query_dataset = crud_dataset.get_dataset(db, db.user, query_dataset_id)
         if query_dataset is None:
@@ -79,6 +89,44 @@ def _validate_parameters(
     else:
         raise UserError(f"Unexpected analysis type {analysis_type}")
 
+    return dataset, query_dataset
+
+
+def _get_dataset_versions(
+    db: SessionWithUser, dataset: MatrixDataset, query_dataset: Optional[MatrixDataset]
+):
+    # the labels of the features in the results come from the feature type's metadata
+    feature_type = None
+    if dataset.feature_type_name is not None:
+        feature_type = get_dimension_type(db, dataset.feature_type_name)
+    return {
+        "dataset": crud_dataset.get_dataset_version(dataset),
+        "query_dataset": crud_dataset.get_dataset_version(query_dataset),
+        "feature_type": crud_dataset.get_dataset_version(
+            None if feature_type is None else feature_type.dataset
+        ),
+    }
+
+
+def _get_cached_result(
+    db: SessionWithUser, cache: AnalysisResultCache, cache_key: str
+) -> Optional[dict]:
+    result = cache.get(cache_key)
+    if result is None:
+        return None
+
+    # the cell line groups which were created for the result are transient datasets, which eventually get
+    # deleted. After that, the analysis has to be run again.
+    for slice_id in [result["filterSliceId"], result["colorSliceId"]]:
+        if slice_id is None:
+            continue
+        _, dataset_id, _ = slice_id.split("/", 2)
+        if crud_dataset.get_dataset(db, db.user, dataset_id) is None:
+            cache.discard(cache_key)
+            return None
+
+    return result
+
 
 @router.post(
     "/compute_univariate_associations",
@@ -110,7 +158,7 @@ def compute_univariate_associations(
     }[computeParams.analysisType]
 
     assert dataset_id is not None
-    _validate_parameters(
+    dataset, query_dataset = _validate_parameters(
         db,
         dataset_id=dataset_id,
         analysis_type=analysis_type,
@@ -122,6 +170,25 @@ def compute_univariate_associations(
 
     vector_is_dependent = _get_vector_is_dependent(analysis_type, vector_variable_type)
 
+    # the user has access to every dataset the analysis reads (checked above), so they can be given the
+    # result of the same analysis run by anyone
+    cache_key = None
+    cache = get_analysis_result_cache(settings)
+    if cache is not None:
+        cache_key = get_cache_key(
+            analysis_type,
+            _get_dataset_versions(db, dataset, query_dataset),
+            query_feature_id=computeParams.queryFeatureId,
+            depmap_model_ids=depmap_model_ids,
+            query_values=query_values,
+            vector_is_dependent=vector_is_dependent,
+        )
+        cached_result = _get_cached_result(db, cache, cache_key)
+        if cached_result is not None:
+            return utils.format_task_status(
+                EagerResult(str(uuid4()), cached_result, utils.TaskState.SUCCESS.name)
+            )
+
     results_dir = settings.get_todays_result_dir()
 
     result = utils.cast_celery_task(analysis_tasks.run_custom_analysis).delay(
@@ -135,6 +202,7 @@ def compute_univariate_associations(
         query_values=query_values,
         vector_is_dependent=vector_is_dependent,
         results_dir=results_dir,
+        cache_key=cache_key,
     )
 
     return utils.format_task_status(result)
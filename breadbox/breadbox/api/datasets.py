@@ -1,4 +1,4 @@
-from typing import List, Optional, Set, Annotated
+from typing import Iterable, Iterator, List, Optional, Set, Annotated
 from logging import getLogger
 from ..db.util import transaction
 from breadbox.utils.asserts import index_error_msg
@@ -17,6 +17,8 @@ from fastapi import (
     Response,
     Query,
 )
+from fastapi.responses import StreamingResponse
+import pandas as pd
 
 
 from breadbox.db.session import SessionWithUser
@@ -285,6 +287,15 @@ def get_matrix_dataset_data(
 ):
     dataset = _get_required_matrix_dataset(db, dataset_id)
 
+    if matrix_dimensions_info.aggregate is None:
+        # stream the result a block of features at a time, so that the size of the slice isn't limited by memory
+        blocks = dataset_service.iter_subsetted_matrix_dataset_df_blocks(
+            db, dataset, matrix_dimensions_info, settings.filestore_location, strict,
+        )
+        return StreamingResponse(
+            _stream_columns_as_json(blocks), media_type="application/json"
+        )
+
     df = dataset_service.get_subsetted_matrix_dataset_df(
         db, dataset, matrix_dimensions_info, settings.filestore_location, strict,
     )
@@ -292,6 +303,24 @@ def get_matrix_dataset_data(
     return Response(df.to_json(), media_type="application/json")
 
 
+def _stream_columns_as_json(blocks: Iterable[pd.DataFrame]) -> Iterator[str]:
+    """
+    Write blocks of columns as a single JSON object, identical to what DataFrame.to_json() would give for
+    all of the blocks concatenated (ie: {column: {index: value}})
+    """
+    yield "{"
+    first = True
+    for df in blocks:
+        if len(df.columns) == 0:
+            continue
+        if not first:
+            yield ","
+        # strip the enclosing braces, leaving the comma separated columns
+        yield df.to_json()[1:-1]
+        first = False
+    yield "}"
+
+
 @router.post(
     "/tabular/{dataset_id}", operation_id="get_tabular_dataset_data",
 )
@@ -25,6 +25,12 @@ from .dependencies import get_user, get_db_with_user
 router = APIRouter(prefix="/downloads", tags=["downloads"])
 log = getLogger(__name__)
 
+EXPORT_MEDIA_TYPES = {
+    ".csv": "text/csv",
+    ".parquet": "application/vnd.apache.parquet",
+    ".json": "application/json",
+}
+
 
 class ExportDatasetParams(BaseModel):
     # The ID of the dataset to download
@@ -37,6 +43,8 @@ class ExportDatasetParams(BaseModel):
     dropEmpty: Optional[bool] = False
     # If true, add metadata (name, lineages) to csv .
     addCellLineMetadata: Optional[bool] = False
+    # The format of the exported file. Defaults to csv.
+    fileFormat: Optional[download_tasks.ExportFormat] = "csv"
 
 
 class ExportMergedDatasetParams(BaseModel):
@@ -50,6 +58,8 @@ class ExportMergedDatasetParams(BaseModel):
     dropEmpty: Optional[bool] = False
     # If true, add metadata (name, lineages) to csv .
     addCellLineMetadata: Optional[bool] = False
+    # The format of the exported file. Defaults to csv.
+    fileFormat: Optional[download_tasks.ExportFormat] = "csv"
 
 
 class ExportDatasetResponse(BaseModel):
@@ -73,6 +83,7 @@ def export_dataset(
     sample_ids = exportParams.cellLineIds
     drop_nas = exportParams.dropEmpty
     add_metadata = exportParams.addCellLineMetadata
+    file_format = exportParams.fileFormat or "csv"
 
     assert dataset_id is not None
 
@@ -88,6 +99,7 @@ def export_dataset(
         add_metadata,
         result_dir,
         user,
+        file_format,
     )
 
     return utils.format_task_status(result)
@@ -108,6 +120,7 @@ def export_merged_dataset(
     sample_ids = exportParams.cellLineIds
     drop_nas = exportParams.dropEmpty
     add_metadata = exportParams.addCellLineMetadata
+    file_format = exportParams.fileFormat or "csv"
 
     assert len(dataset_ids) > 1
 
@@ -123,6 +136,7 @@ def export_merged_dataset(
         add_metadata,
         result_dir,
         user,
+        file_format,
     )
 
     return utils.format_task_status(result)
@@ -137,8 +151,9 @@ def data_slicer_download(
         settings.compute_results_location, file_path
     )
 
+    _, extension = os.path.splitext(file_path)
     file_response = FileResponse(
-        media_type="text/csv",
+        media_type=EXPORT_MEDIA_TYPES.get(extension, "text/csv"),
         filename=filename_for_user,
         path=file_path_from_compute_results_dir,
         content_disposition_type="attachment",
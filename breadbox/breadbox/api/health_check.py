@@ -2,6 +2,7 @@ from importlib.metadata import version
 
 from fastapi import APIRouter, status
 from breadbox.compute import site_check_task
+from breadbox.crud.access_control import get_access_control_cache
 from breadbox.celery_task.utils import format_task_status
 from breadbox.schemas.custom_http_exception import HTTPError
 
@@ -27,3 +28,9 @@ def ok():
     task.wait(timeout=60, interval=0.5)
 
     return format_task_status(task)
+
+
+@router.get("/access_control_cache", operation_id="access_control_cache_stats")
+def access_control_cache_stats():
+    """Hit rate of this process's cache of the groups each user has access to"""
+    return get_access_control_cache().get_stats()
@@ -1,6 +1,6 @@
 import os.path
 from typing import Annotated, List, Optional
-import shutil
+import numpy as np
 
 from fastapi import Body, Depends
 from itsdangerous import URLSafeSerializer
@@ -12,6 +12,8 @@ from breadbox.service.upload import construct_file_from_ids
 from breadbox.depmap_compute_embed.slice import SliceQuery
 from breadbox.schemas.associations import (
     Associations,
+    AssociationsForSlices,
+    AssociationsForSlicesParams,
     AssociationTable,
     AssociationsIn,
     ComputeAssociationsParams,
@@ -61,16 +63,17 @@ def compute_associations_for_slice(
 
     log.warning("Starting calc")
     correlations = associations_service.compute_associations(
-        db, settings.filestore_location, dataset, params.slice_query
+        db, settings.filestore_location, dataset, params.slice_query, params.limit
     )
     log.warning("Calc finished")
 
-    correlations.sort_values("cor", inplace=True)  # type: ignore
+    correlations = correlations.sort_values("cor")  # type: ignore
 
     return LongAssociationsTable(
         label=correlations["label"].to_list(),  # type: ignore
         given_id=correlations["given_id"].to_list(),  # type: ignore
         cor=correlations["cor"].to_list(),  # type: ignore
+        log10qvalue=[None if np.isnan(x) else x for x in correlations["log10qvalue"]],
     )
 
 
@@ -93,6 +96,31 @@ def query_associations_for_slice(
     )
 
 
+@router.post(
+    "/associations/query-slices",
+    operation_id="get_associations_for_slices",
+    response_model=AssociationsForSlices,
+    response_model_exclude_none=False,
+)
+def query_associations_for_slices(
+    db: Annotated[SessionWithUser, Depends(get_db_with_user)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    params: Annotated[
+        AssociationsForSlicesParams,
+        Body(
+            description="The slices to look up precomputed associations for, and optionally which datasets to restrict the associations to"
+        ),
+    ],
+):
+    """Like /associations/query-slice, but for many slices at once. The associations of all slices are returned as columns, with slice_index referring to the position of the slice in slice_queries."""
+    return associations_service.get_associations_for_slices(
+        db,
+        settings.filestore_location,
+        params.slice_queries,
+        params.association_datasets,
+    )
+
+
 @router.get(
     "/associations",
     operation_id="get_associations",
@@ -150,12 +178,14 @@ def add_associations(
         settings.compute_results_location,
     )
 
-    dest_filename = f"associations/{uuid.uuid4()}.sqlite3"
+    dest_filename = (
+        f"associations/{uuid.uuid4()}{associations_crud.ASSOCIATION_TABLE_EXTENSION}"
+    )
     full_dest_filename = os.path.join(settings.filestore_location, dest_filename)
     # make sure the directory exists before trying to move the file to it's final name
     os.makedirs(os.path.dirname(full_dest_filename), exist_ok=True)
 
-    shutil.move(full_file, full_dest_filename)
+    associations_crud.store_association_table_file(full_file, full_dest_filename)
 
     try:
         with transaction(db):
@@ -168,7 +198,7 @@ def add_associations(
                 dest_filename,
             )
     except:
-        # if add_association_table fails, clean up the sqlite3 file
+        # if add_association_table fails, clean up the table's file
         os.remove(full_dest_filename)
         # ...before continuing on raising the exception
         raise
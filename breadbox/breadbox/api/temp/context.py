@@ -1,10 +1,13 @@
-from typing import Annotated
+from typing import Annotated, Optional
 from logging import getLogger
 from fastapi import Body, Depends
+from fastapi.concurrency import run_in_threadpool
 
 from breadbox.crud.dimension_ids import get_dimension_type_labels_by_id
-from breadbox.api.dependencies import get_db_with_user
+from breadbox.crud.dimension_types import get_dimension_type
+from breadbox.api.dependencies import get_cache, get_db_with_user
 from breadbox.config import Settings, get_settings
+from breadbox.models.dataset import Dataset, MatrixDataset, TabularDataset
 from breadbox.schemas.custom_http_exception import UserError
 from breadbox.db.session import SessionWithUser
 from breadbox.crud import dataset as dataset_crud
@@ -12,10 +15,12 @@ from breadbox.schemas.context import (
     Context,
     ContextDatasetCoverageResponse,
     ContextMatchResponse,
+    SliceQueryRef,
 )
 from breadbox.service import slice as slice_service
+from breadbox.utils.caching import CachingCaller
 
-from breadbox.depmap_compute_embed.context import ContextEvaluator
+from breadbox.depmap_compute_embed.context import ContextEvaluator, ContextMatch
 
 from .router import router
 
@@ -52,15 +57,101 @@ def _evaluate(db: SessionWithUser, settings: Settings, context: Context):
         raise UserError(f"Context evaluation error: {e}") from e
 
 
+def _get_referenced_datasets(
+    db: SessionWithUser, context: Context
+) -> dict[str, Optional[Dataset]]:
+    """
+    Every dataset a context's result depends on (or None for those which don't
+    exist): the datasets its vars read from (including their reindex_through
+    chains), and the metadata of the dimension types whose labels are looked up,
+    both for the ids being matched and for resolving vars by label.
+    """
+    datasets: dict[str, Optional[Dataset]] = {}
+    dimension_type_names: set[str] = set()
+
+    def add_slice_query(slice_query: Optional[SliceQueryRef]):
+        while slice_query is not None:
+            key = f"dataset:{slice_query.dataset_id}"
+            if key not in datasets:
+                dataset = dataset_crud.get_dataset(db, db.user, slice_query.dataset_id)
+                datasets[key] = dataset
+                if isinstance(dataset, MatrixDataset):
+                    dimension_type_names.update(
+                        x
+                        for x in [dataset.feature_type_name, dataset.sample_type_name]
+                        if x is not None
+                    )
+                elif isinstance(dataset, TabularDataset):
+                    dimension_type_names.add(dataset.index_type_name)
+            slice_query = slice_query.reindex_through
+
+    def add_context(context_: Context):
+        dimension_type_names.add(context_.dimension_type)
+        for slice_query in context_.vars.values():
+            add_slice_query(slice_query)
+        for inner_context in context_.contexts.values():
+            add_context(inner_context)
+
+    add_context(context)
+
+    for name in sorted(dimension_type_names):
+        dimension_type = get_dimension_type(db, name)
+        if dimension_type is not None and dimension_type.dataset is not None:
+            datasets[f"dimension_type:{name}"] = dimension_type.dataset
+
+    return datasets
+
+
+async def _evaluate_with_cache(
+    db: SessionWithUser, settings: Settings, cache: CachingCaller, context: Context
+) -> ContextMatch:
+    """
+    The same contexts (lineage filters, their complements, two-class outgroups)
+    are evaluated over and over, so memoize the result keyed by the context and
+    the versions of the datasets it references.
+
+    A result which only depends on public datasets is the same for every user,
+    so it's shared between them. (It's evaluated with the request's own session
+    rather than memoize_db_query's anonymous one, since every dataset it can
+    read has already been checked.)
+
+    Both the lookups of the referenced datasets and the evaluation itself are
+    blocking, so they're run in the threadpool rather than on the event loop.
+    """
+
+    def get_dependencies():
+        referenced_datasets = _get_referenced_datasets(db, context)
+        versions = {
+            k: dataset_crud.get_dataset_version(v)
+            for k, v in referenced_datasets.items()
+        }
+        is_public = all(
+            x is not None and dataset_crud.is_public_dataset(x)
+            for x in referenced_datasets.values()
+        )
+        return versions, is_public
+
+    versions, is_public = await run_in_threadpool(get_dependencies)
+
+    if not is_public:
+        return await run_in_threadpool(_evaluate, db, settings, context)
+
+    return await cache.memoize(
+        lambda: run_in_threadpool(_evaluate, db, settings, context),
+        depends_on=["evaluate_context", context.model_dump(mode="json"), versions],
+    )
+
+
 @router.post(
     "/context",
     operation_id="evaluate_context",
     response_model=ContextMatchResponse,
     response_model_exclude_none=False,
 )
-def evaluate_context(
+async def evaluate_context(
     db: Annotated[SessionWithUser, Depends(get_db_with_user)],
     settings: Annotated[Settings, Depends(get_settings)],
+    cache: Annotated[CachingCaller, Depends(get_cache)],
     context: Annotated[
         Context, Body(description="A Data Explorer 2 context expression")
     ],
@@ -70,7 +161,7 @@ def evaluate_context(
     Also get the total number of "candidate" records (all records with labels belonging to the dimension type).
     Requests must be in the version 2 context format.
     """
-    result = _evaluate(db, settings, context)
+    result = await _evaluate_with_cache(db, settings, cache, context)
 
     return ContextMatchResponse(
         ids=result.ids, labels=result.labels, num_candidates=result.num_candidates,
@@ -83,9 +174,10 @@ def evaluate_context(
     response_model=ContextDatasetCoverageResponse,
     response_model_exclude_none=False,
 )
-def get_context_dataset_coverage(
+async def get_context_dataset_coverage(
     db: Annotated[SessionWithUser, Depends(get_db_with_user)],
     settings: Annotated[Settings, Depends(get_settings)],
+    cache: Annotated[CachingCaller, Depends(get_cache)],
     context: Annotated[
         Context, Body(description="A Data Explorer 2 context expression")
     ],
@@ -105,10 +197,14 @@ def get_context_dataset_coverage(
 
     Datasets with no matching entity are omitted rather than reported as zero.
     """
-    result = _evaluate(db, settings, context)
-
-    counts = dataset_crud.count_dataset_coverage(
-        db, db.user, context.dimension_type, result.ids
+    result = await _evaluate_with_cache(db, settings, cache, context)
+
+    counts = await run_in_threadpool(
+        dataset_crud.count_dataset_coverage,
+        db,
+        db.user,
+        context.dimension_type,
+        result.ids,
     )
 
     return ContextDatasetCoverageResponse(counts=counts, total=len(result.ids))
@@ -16,6 +16,7 @@ from breadbox.schemas.predictive_models import (
     PredictiveModelConfigIn,
     PredictiveModelConfigOut,
     PredictiveModelResultOut,
+    PredictiveModelsForFeaturesIn,
     PredictiveModelsResponse,
 )
 
@@ -56,6 +57,31 @@ def get_predictive_models_for_feature(
     return result
 
 
+@router.post(
+    "/predictive_models/features/{dataset_id}",
+    operation_id="get_predictive_models_for_features",
+    response_model=List[PredictiveModelsResponse],
+)
+def get_predictive_models_for_features(
+    dataset_id: str,
+    db: Annotated[SessionWithUser, Depends(get_db_with_user)],
+    settings: Annotated[Settings, Depends(get_settings)],
+    features_in: Annotated[
+        PredictiveModelsForFeaturesIn,
+        Body(description="The given IDs of the features to get results for"),
+    ],
+):
+    """Get predictive model results for each of the given features in a dataset, in the same order"""
+    result = predictive_models_crud.get_predictive_models_for_features(
+        db, settings, dataset_id, features_in.feature_given_ids
+    )
+    if result is None:
+        raise ResourceNotFoundError(
+            f"Dataset {dataset_id} not found or has no predictive models"
+        )
+    return result
+
+
 @router.get(
     "/predictive_models/configs/{dimension_type_name}",
     operation_id="get_predictive_model_configs_for_dimension_type",
@@ -9,7 +9,11 @@ from breadbox.crud import dataset as dataset_crud
 from breadbox.schemas.custom_http_exception import ResourceNotFoundError, UserError
 from ...config import get_settings, Settings
 from ...db.session import SessionWithUser
-from ...service.sql import generate_simulated_schema, execute_sql_in_virtual_db
+from ...service.sql import (
+    generate_simulated_schema,
+    execute_sql_in_virtual_db,
+    SqlResultFormat,
+)
 from fastapi.responses import PlainTextResponse, FileResponse, Response
 from ...celery_task import utils
 import asyncio
@@ -33,6 +37,13 @@ class CSVFileResponse(FileResponse):
     media_type = "text/csv"
 
 
+SQL_RESULT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow-ipc": "application/vnd.apache.arrow.stream",
+}
+
+
 async def _concurrency_guard(callback: Callable[[], Awaitable[Response]]):
     """
     Used to ensure that we are not running too many queries in parallel. If we see we're executing more than MAX_PENDING_SQL_QUERIES
@@ -61,6 +72,8 @@ async def _concurrency_guard(callback: Callable[[], Awaitable[Response]]):
 
 class SqlQuery(BaseModel):
     sql: str
+    # csv is the simplest to read, but parquet and arrow-ipc are much faster to write and parse for large results
+    format: SqlResultFormat = "csv"
 
 
 @router.get(
@@ -132,7 +145,18 @@ async def _run_time_bounded_celery_task(
     raise TimeoutError(f"Task {task.id} did not complete in time")
 
 
-@router.post("/sql/query", operation_id="query_sql", response_class=CSVFileResponse)
+@router.post(
+    "/sql/query",
+    operation_id="query_sql",
+    response_class=CSVFileResponse,
+    responses={
+        200: {
+            "content": {
+                media_type: {} for media_type in SQL_RESULT_MEDIA_TYPES.values()
+            }
+        }
+    },
+)
 async def query_sql(
     query: SqlQuery,
     db: SessionWithUser = Depends(get_db_with_user),
@@ -167,7 +191,13 @@ async def query_sql(
         try:
             output_file = await _run_time_bounded_celery_task(
                 execute_sql_in_virtual_db_task,
-                [db.user, results_dir, query.sql, settings.filestore_location],
+                [
+                    db.user,
+                    results_dir,
+                    query.sql,
+                    settings.filestore_location,
+                    query.format,
+                ],
                 time_limit=SQL_QUERY_TIMELIMIT,
             )
         except CeleryTaskTimeout:
@@ -186,6 +216,10 @@ async def query_sql(
             raise Exception(f"Exception executing sql query {query.sql}") from e
 
         assert isinstance(output_file, str)
-        return CSVFileResponse(output_file)
+        if query.format == "csv":
+            return CSVFileResponse(output_file)
+        return FileResponse(
+            output_file, media_type=SQL_RESULT_MEDIA_TYPES[query.format]
+        )
 
     return await _concurrency_guard(_run)
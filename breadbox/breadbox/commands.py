@@ -60,6 +60,146 @@ def delete_expired_datasets(maxdays, dryrun):
     print("Done")
 
 
+@cli.command()
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Rewrite the columnar file even for datasets which already have one",
+)
+def write_tabular_dataset_files(force: bool):
+    """Write the columnar (parquet) copy of each tabular dataset's cells. Used to migrate
+    datasets which were uploaded before tabular datasets were stored that way."""
+    from breadbox.io.filestore_crud import has_tabular_dataset_file
+    from breadbox.models.dataset import TabularDataset
+
+    db = _get_db_connection()
+    settings = get_settings()
+
+    dataset_ids = [
+        dataset_id
+        for (dataset_id,) in db.query(TabularDataset)
+        .with_entities(TabularDataset.id)
+        .all()
+    ]
+    print(f"Found {len(dataset_ids)} tabular datasets")
+
+    for dataset_id in dataset_ids:
+        if not force and has_tabular_dataset_file(
+            dataset_id, settings.filestore_location
+        ):
+            print(f"Skipping {dataset_id} which already has a columnar file")
+            continue
+
+        dataset = db.get(TabularDataset, dataset_id)
+        assert dataset is not None
+        print(f"Writing columnar file for {dataset_id} ({dataset.name})")
+        dataset_crud.write_tabular_dataset_file_from_cells(
+            db, dataset, settings.filestore_location
+        )
+        # avoid accumulating every dataset's columns in the session
+        db.expunge_all()
+    print("Done")
+
+
+@cli.command()
+@click.option(
+    "--dataset-id",
+    "dataset_ids",
+    multiple=True,
+    help="Only rewrite these datasets (may be repeated). Defaults to all matrix datasets",
+)
+@click.option(
+    "--row-chunked-copy/--no-row-chunked-copy",
+    default=None,
+    help="Whether to also store a copy of each matrix chunked by row, which makes reads by sample fast. Defaults to the matrix_storage_row_chunked_copy setting",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Rewrite the file even for datasets which already use the chunked layout",
+)
+def rewrite_matrix_dataset_files(
+    dataset_ids, row_chunked_copy: Optional[bool], force: bool
+):
+    """Rewrite the hdf5 file of matrix datasets using the chunked and compressed layout. Used to migrate
+    datasets which were uploaded before that layout existed."""
+    from breadbox.io.filestore_crud import (
+        DATA_FILE,
+        get_file_location,
+        rewrite_dataset_file_layout,
+    )
+    from breadbox.io.hdf5_utils import HDF5StorageOptions
+
+    db = _get_db_connection()
+    settings = get_settings()
+    if row_chunked_copy is None:
+        row_chunked_copy = settings.matrix_storage_row_chunked_copy
+    storage = HDF5StorageOptions(
+        row_chunked_copy=row_chunked_copy,
+        compression=settings.matrix_storage_compression,
+        compression_level=settings.matrix_storage_compression_level,
+    )
+
+    query = db.query(MatrixDataset).with_entities(
+        MatrixDataset.id, MatrixDataset.storage_layout_version
+    )
+    if len(dataset_ids) > 0:
+        query = query.filter(MatrixDataset.id.in_(dataset_ids))
+    datasets = query.all()
+    print(f"Found {len(datasets)} matrix datasets")
+
+    for dataset_id, storage_layout_version in datasets:
+        if not force and storage_layout_version == storage.layout_version:
+            print(f"Skipping {dataset_id} which already uses the chunked layout")
+            continue
+
+        path = get_file_location(dataset_id, settings.filestore_location, DATA_FILE)
+        print(f"Rewriting {path}")
+        rewrite_dataset_file_layout(dataset_id, settings.filestore_location, storage)
+        with transaction(db):
+            db.query(MatrixDataset).filter(MatrixDataset.id == dataset_id).update(
+                {MatrixDataset.storage_layout_version: storage.layout_version}
+            )
+        db.expunge_all()
+    print("Done")
+
+
+@cli.command()
+def convert_association_tables():
+    """Convert association tables which were uploaded in version 1 of the packed correlation table format
+    (sqlite) to version 2, which is much faster to query"""
+    import uuid
+
+    import packed_cor_tables
+    from breadbox.crud.associations import ASSOCIATION_TABLE_EXTENSION
+    from breadbox.models.dataset import PrecomputedAssociation
+
+    db = _get_db_connection()
+    settings = get_settings()
+
+    tables = db.query(PrecomputedAssociation).with_entities(
+        PrecomputedAssociation.id, PrecomputedAssociation.filename
+    )
+    for table_id, filename in tables.all():
+        path = os.path.join(settings.filestore_location, filename)
+        if packed_cor_tables.get_format_version(path) == 2:
+            continue
+
+        new_filename = f"associations/{uuid.uuid4()}{ASSOCIATION_TABLE_EXTENSION}"
+        print(f"Converting {filename} to {new_filename}")
+        packed_cor_tables.convert(
+            path, os.path.join(settings.filestore_location, new_filename)
+        )
+        with transaction(db):
+            db.query(PrecomputedAssociation).filter(
+                PrecomputedAssociation.id == table_id
+            ).update({PrecomputedAssociation.filename: new_filename})
+        os.remove(path)
+    print("Done")
+
+
 @cli.command()
 @click.argument("user_email")
 @click.argument("group_name")
@@ -122,7 +262,10 @@ def _get_db_connection():
 
 def _regenerate_entire_search_index(db: SessionWithUser):
     from breadbox.crud.dimension_types import get_dimension_types, get_dimension_type
-    from breadbox.service.search import populate_search_index_after_update
+    from breadbox.service.search import (
+        populate_search_index_after_update,
+        rebuild_dimension_search_index_fts,
+    )
 
     dimension_type_names = [x.name for x in get_dimension_types(db)]
     # re-look up each dimension_type by name to make sure the instance of dimension_type we have is associated with
@@ -137,6 +280,7 @@ def _regenerate_entire_search_index(db: SessionWithUser):
             # and then clear the db session for each call to populate_search_index_after_update
             db.flush()
             db.expunge_all()
+        rebuild_dimension_search_index_fts(db)
 
 
 def _regenerate_all_dim_type_labels(db: SessionWithUser):
@@ -0,0 +1,169 @@
+"""
+A store for the results of custom analyses, so that repeating an analysis (ie: the same "find correlated
+genes" query, submitted by any user) returns the stored result instead of running another celery task.
+
+Results are content addressed: each is stored under a hash of the normalized parameters of the analysis and
+the versions of the datasets it read, so a result is never reused after any of those datasets change. The
+least recently used results are deleted once the store exceeds its size budget. Entries are written to a
+temporary directory and renamed into place, so the store can be shared by every process using the same
+compute_results_location.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from breadbox.config import Settings
+
+log = logging.getLogger(__name__)
+
+# bump this when a change to the analyses changes their results, so results stored before the change aren't reused
+CACHE_KEY_VERSION = 1
+
+RESULT_FILE_NAME = "result.json"
+DATA_FILE_NAME = "results.json"
+TEMP_DIR_PREFIX = ".tmp-"
+# temporary directories older than this were left behind by a process which died while writing
+MAX_TEMP_DIR_AGE = 60 * 60
+
+
+def get_cache_key(
+    analysis_type: str,
+    dataset_versions: Dict[str, Any],
+    query_feature_id: Optional[str],
+    depmap_model_ids: Optional[List[str]],
+    query_values: Optional[List[Any]],
+    vector_is_dependent: Optional[bool],
+) -> str:
+    """
+    Returns the key of an analysis's result. dataset_versions identifies the contents of every dataset the
+    analysis reads (see dataset_crud.get_dataset_version). The order of the cell lines doesn't change the
+    result, so it isn't part of the key.
+    """
+    cell_lines: Any = None
+    if query_values is not None:
+        assert depmap_model_ids is not None
+        cell_lines = sorted(
+            zip(depmap_model_ids, query_values), key=lambda pair: pair[0]
+        )
+    elif depmap_model_ids is not None:
+        cell_lines = sorted(set(depmap_model_ids))
+
+    parameters = {
+        "version": CACHE_KEY_VERSION,
+        "analysis_type": analysis_type,
+        "datasets": dataset_versions,
+        "query_feature_id": query_feature_id,
+        "cell_lines": cell_lines,
+        "vector_is_dependent": vector_is_dependent,
+    }
+    return hashlib.sha256(
+        json.dumps(parameters, sort_keys=True).encode("utf8")
+    ).hexdigest()
+
+
+def _get_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class AnalysisResultCache:
+    def __init__(self, location: str, max_bytes: int):
+        self.location = location
+        self.max_bytes = max_bytes
+
+    def _get_entry_path(self, key: str):
+        return os.path.join(self.location, key[:2], key)
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Returns the stored result of the analysis, with its table under the "data" key (the same way the task
+        status endpoint returns it), or None if it isn't stored.
+        """
+        path = self._get_entry_path(key)
+        try:
+            with open(os.path.join(path, RESULT_FILE_NAME), "rt") as fd:
+                result = json.load(fd)
+            with open(os.path.join(path, DATA_FILE_NAME), "rt") as fd:
+                data = json.load(fd)
+            # the modification time of the entry records when it was last used
+            os.utime(path)
+        except FileNotFoundError:
+            # not stored, or evicted while being read
+            return None
+        result["data"] = data
+        return result
+
+    def put(self, key: str, result: dict):
+        """
+        Stores the result returned by the analysis task, along with the table in its data_json_file_path
+        """
+        path = self._get_entry_path(key)
+        if os.path.exists(path):
+            return
+
+        os.makedirs(self.location, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=self.location, prefix=TEMP_DIR_PREFIX)
+        try:
+            shutil.copyfile(
+                result["data_json_file_path"], os.path.join(temp_dir, DATA_FILE_NAME)
+            )
+            with open(os.path.join(temp_dir, RESULT_FILE_NAME), "wt") as fd:
+                json.dump(
+                    {k: v for k, v in result.items() if k != "data_json_file_path"}, fd,
+                )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.rename(temp_dir, path)
+            except OSError:
+                # another process stored the same result first
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+        self._enforce_budget()
+
+    def discard(self, key: str):
+        shutil.rmtree(self._get_entry_path(key), ignore_errors=True)
+
+    def _enforce_budget(self):
+        now = time.time()
+        entries = []
+        for prefix_dir in os.scandir(self.location):
+            if not prefix_dir.is_dir():
+                continue
+            if prefix_dir.name.startswith(TEMP_DIR_PREFIX):
+                if now - prefix_dir.stat().st_mtime > MAX_TEMP_DIR_AGE:
+                    shutil.rmtree(prefix_dir.path, ignore_errors=True)
+                continue
+            for entry in os.scandir(prefix_dir.path):
+                try:
+                    entries.append(
+                        (entry.stat().st_mtime, _get_size(entry.path), entry.path)
+                    )
+                except FileNotFoundError:
+                    # evicted by another process
+                    pass
+
+        # evict the least recently used entries, but always keep the most recent one
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def get_analysis_result_cache(settings: Settings) -> Optional[AnalysisResultCache]:
+    """Returns the store of custom analysis results, or None if it's disabled"""
+    if settings.custom_analysis_cache_max_bytes <= 0:
+        return None
+    return AnalysisResultCache(
+        os.path.join(settings.compute_results_location, "custom_analysis_cache"),
+        settings.custom_analysis_cache_max_bytes,
+    )
@@ -3,6 +3,7 @@ import time
 from typing import Any, List, Optional, Tuple, Union
 from uuid import uuid4
 import dataclasses
+import logging
 import warnings
 from typing import cast, Sequence
 import pandas as pd
@@ -17,7 +18,7 @@ import numpy as np
 from breadbox.db.session import SessionWithUser
 from breadbox.config import get_settings
 from breadbox.io.data_validation import validate_and_upload_dataset_files
-from breadbox.io.filestore_crud import get_slice
+from breadbox.io.filestore_crud import get_slice, get_slice_values
 from breadbox.utils.asserts import index_error_msg
 from breadbox.crud.dimension_ids import (
     get_dataset_feature_by_given_id,
@@ -45,9 +46,12 @@ from ..service import dataset as dataset_service
 from ..crud import group as group_crud
 from ..io import filestore_crud
 from .celery import app, LogErrorsTask
+from .analysis_result_cache import get_analysis_result_cache
 from ..db.util import db_context
 from breadbox.io.upload_utils import create_upload_file
 
+log = logging.getLogger(__name__)
+
 
 @app.task()
 def test_task(message):
@@ -289,18 +293,15 @@ class CustomAnalysisCallbacksImpl:
         assert is_increasing(
             self.sample_matrix_indices
         ), "Sample matrix indices out of order"
-        m = get_slice(
+        assert (
+            self.dataset.value_type == ValueType.continuous
+        ), f"Cannot use this method with a non-numeric dataset {self.dataset}"
+        return get_slice_values(
             self.dataset,
-            feature_matrix_indices,
+            list(feature_matrix_indices),
             self.sample_matrix_indices,
             self.filestore_location,
-            keep_nans=True,
         )
-        m_values = m.values
-        assert m_values.dtype == np.dtype(
-            "float64"
-        ), f"Cannot use this method with a non-numeric dataset {self.dataset}"
-        return m_values
 
 
 def is_increasing(values: Sequence):
@@ -335,7 +336,12 @@ def run_custom_analysis(
     results_dir: str,
     depmap_model_ids: List[str] = [],
     query_values: Optional[List[Any]] = None,
+    cache_key: Optional[str] = None,
 ):
+    """
+    If cache_key is given, the result is stored under that key (see analysis_result_cache) so the same
+    analysis won't need to be run again.
+    """
 
     update_message_callback = UpdateMessageCallback(self)
 
@@ -435,8 +441,18 @@ def run_custom_analysis(
             callbacks=callbacks,
             use_feature_ids=True,
             features_per_batch=features_per_batch,
+            max_workers=get_settings().custom_analysis_compute_threads,
         )
 
+        if cache_key is not None:
+            cache = get_analysis_result_cache(get_settings())
+            if cache is not None:
+                try:
+                    cache.put(cache_key, result)
+                except OSError:
+                    # the result is still returned, it just won't be reused
+                    log.exception("Failed to store result of custom analysis")
+
         return result
 
 
@@ -19,7 +19,15 @@ from breadbox.schemas.dataset import (
 from breadbox.schemas.custom_http_exception import ResourceNotFoundError
 from breadbox.models.dataset import DimensionType
 from fastapi import HTTPException
-from breadbox.io.filestore_crud import save_dataset_file
+from breadbox.io.filestore_crud import (
+    delete_data_files,
+    get_dataset_file_labels,
+    link_dataset_file_to_blob,
+    save_dataset_file,
+    store_dataset_file_blob,
+)
+from breadbox.io.dataset_blob_store import get_matrix_blob_key
+from breadbox.io.hdf5_utils import HDF5StorageOptions
 from ..io.hdf5_value_mapping import get_encoder_function
 from ..service import dataset as dataset_service
 from ..crud import dimension_types as type_crud
@@ -27,7 +35,7 @@ from ..crud import group as group_crud
 from ..crud import data_type as data_type_crud
 from ..crud import dataset as dataset_crud
 from .dataset_tasks import db_context
-from ..service.upload import construct_file_from_ids
+from ..service.upload import construct_file_and_md5_from_ids
 from ..io.data_validation import (
     read_and_validate_matrix_df,
     _get_dimension_labels_and_warnings,
@@ -79,7 +87,7 @@ def dataset_upload(
 
     serializer = URLSafeSerializer(settings.breadbox_secret)
 
-    file_path = construct_file_from_ids(
+    file_path, content_md5 = construct_file_and_md5_from_ids(
         dataset_params.file_ids,
         dataset_params.dataset_md5,
         serializer,
@@ -108,15 +116,45 @@ def dataset_upload(
             dataset_params.value_type, dataset_params.allowed_values
         )
 
-        df_wrapper = read_and_validate_matrix_df(
-            file_path,
+        row_chunked_copy = dataset_params.row_chunked_copy
+        if row_chunked_copy is None:
+            row_chunked_copy = settings.matrix_storage_row_chunked_copy
+        storage = HDF5StorageOptions(
+            row_chunked_copy=row_chunked_copy,
+            compression=settings.matrix_storage_compression,
+            compression_level=settings.matrix_storage_compression_level,
+            float32=dataset_params.store_as_float32,
+        )
+
+        blob_key = get_matrix_blob_key(
+            content_md5,
             dataset_params.value_type,
-            value_mapping,
+            dataset_params.allowed_values,
             dataset_params.data_file_format,
+            storage,
         )
+        # If the same file was uploaded (with the same parameters) before, the dataset uses the file it was
+        # converted to instead of validating and converting it again
+        reused_file = settings.deduplicate_matrix_files and link_dataset_file_to_blob(
+            dataset_id, blob_key, settings.filestore_location
+        )
+        if reused_file:
+            df_wrapper = None
+            feature_given_ids, sample_given_ids = get_dataset_file_labels(
+                dataset_id, settings.filestore_location
+            )
+        else:
+            df_wrapper = read_and_validate_matrix_df(
+                file_path,
+                dataset_params.value_type,
+                value_mapping,
+                dataset_params.data_file_format,
+            )
+            feature_given_ids = df_wrapper.get_column_names()
+            sample_given_ids = df_wrapper.get_index_names()
 
         feature_labels_and_warnings = _get_dimension_labels_and_warnings(
-            db, df_wrapper.get_column_names(), feature_type
+            db, feature_given_ids, feature_type
         )
         if len(feature_labels_and_warnings.warnings) > 0:
             assert feature_type is not None
@@ -128,7 +166,7 @@ def dataset_upload(
                 )
             )
         sample_labels_and_warnings = _get_dimension_labels_and_warnings(
-            db, df_wrapper.get_index_names(), sample_type
+            db, sample_given_ids, sample_type
         )
         if len(sample_labels_and_warnings.warnings) > 0:
             unknown_ids.append(
@@ -157,27 +195,41 @@ def dataset_upload(
             allowed_values=dataset_params.allowed_values,
             dataset_metadata=dataset_params.dataset_metadata,
             dataset_md5=dataset_params.dataset_md5,
+            storage_layout_version=storage.layout_version,
         )
 
-        added_dataset = dataset_service.add_matrix_dataset(
-            db,
-            user,
-            dataset_in,
-            feature_labels_and_warnings.given_id_to_index,
-            sample_labels_and_warnings.given_id_to_index,
-            feature_type,
-            sample_type,
-            dataset_params.short_name,
-            dataset_params.version,
-            dataset_params.description,
-        )
-        save_dataset_file(
-            dataset_id,
-            df_wrapper,
-            dataset_params.value_type,
-            value_mapping,
-            settings.filestore_location,
-        )
+        try:
+            added_dataset = dataset_service.add_matrix_dataset(
+                db,
+                user,
+                dataset_in,
+                feature_labels_and_warnings.given_id_to_index,
+                sample_labels_and_warnings.given_id_to_index,
+                feature_type,
+                sample_type,
+                dataset_params.short_name,
+                dataset_params.version,
+                dataset_params.description,
+            )
+        except Exception:
+            if reused_file:
+                delete_data_files(dataset_id, settings.filestore_location)
+            raise
+
+        if not reused_file:
+            assert df_wrapper is not None
+            save_dataset_file(
+                dataset_id,
+                df_wrapper,
+                dataset_params.value_type,
+                value_mapping,
+                settings.filestore_location,
+                storage=storage,
+            )
+            if settings.deduplicate_matrix_files:
+                store_dataset_file_blob(
+                    dataset_id, blob_key, settings.filestore_location
+                )
 
     else:
         index_type = _get_dimension_type(db, dataset_params.index_type)
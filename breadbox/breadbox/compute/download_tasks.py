@@ -1,16 +1,20 @@
 from datetime import datetime
 import os
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from breadbox.db.session import SessionWithUser
 from breadbox.compute.analysis_tasks import get_features_info_and_dataset
-from breadbox.io.filestore_crud import get_slice
+from breadbox.io.filestore_crud import MAX_STREAMED_BLOCK_IN_BYTES, get_slice
 from breadbox.schemas.custom_http_exception import UserError
 from breadbox.crud.dimension_ids import (
     get_sample_indexes_by_given_ids,
     get_all_sample_indexes,
+    get_matrix_dataset_sample_df,
 )
 from breadbox.crud.partial import get_cell_line_selector_lines
 from ..config import get_settings
@@ -24,6 +28,8 @@ from .celery import app, LogErrorsTask
 from ..db.util import db_context
 from breadbox.service import metadata as metadata_service
 
+ExportFormat = Literal["csv", "parquet", "json"]
+
 
 def _progress_callback(task, percentage, message="Fetching data"):
     last_state_update = {"message": message, "percent_complete": percentage}
@@ -132,6 +138,118 @@ def get_processed_df(
     return df
 
 
+def get_processed_df_blocks(
+    db: SessionWithUser,
+    dataset: MatrixDataset,
+    filestore_location: str,
+    feature_indices: List[int],
+    sample_indices: List[int],
+    sample_ids: Optional[List[str]],
+    drop_nas: bool,
+    add_metadata: bool,
+    progress_callback: Callable[[int], None],
+    user: str,
+    max_block_bytes: int = MAX_STREAMED_BLOCK_IN_BYTES,
+) -> Tuple[bool, Iterator[pd.DataFrame]]:
+    """
+    Streaming version of get_processed_df followed by _handle_df_nas and _add_metadata: returns whether any
+    NAs were dropped, and the rows of the export as a sequence of dataframes which each hold at most
+    max_block_bytes of data. Writing the blocks one after another gives the same file as writing the whole
+    dataframe, but without ever holding the whole dataframe in memory.
+    """
+    if dataset.value_type != ValueType.continuous:
+        raise NotImplementedError
+
+    if len(feature_indices) == 0:
+        raise UserError(
+            "The chosen genes, compounds, or cell lines do not exist in this dataset. Nothing to export."
+        )
+
+    feature_indices = sorted(feature_indices)
+    sample_given_ids = get_matrix_dataset_sample_df(db, dataset, None).given_id
+    index_by_sample_id = {
+        sample_given_ids[index]: index for index in sorted(sample_indices)
+    }
+    feature_labels = metadata_service.get_matrix_dataset_feature_labels_by_id(
+        db, user, dataset
+    )
+
+    def rows_per_block(feature_count):
+        return max(1, max_block_bytes // (max(1, feature_count) * 8))
+
+    def read_rows(sample_ids_in_block: List[str], features: List[int]):
+        return get_slice(
+            dataset,
+            features,
+            [index_by_sample_id[x] for x in sample_ids_in_block],
+            filestore_location,
+            keep_nans=True,
+        )
+
+    # 90% arbitrarily assigned to reading the data, which takes two passes if NAs are being dropped
+    max_percent = 90
+    first_pass_percent = max_percent // 2 if drop_nas else 0
+
+    rows = list(index_by_sample_id)
+    nas_dropped = False
+    if drop_nas:
+        # find the rows and columns which have at least one value before writing anything
+        blocks = list(chunk_iter(rows, rows_per_block(len(feature_indices))))
+        rows_with_values = []
+        columns_with_values = np.zeros(len(feature_indices), dtype=bool)
+        for i, block in enumerate(blocks):
+            has_value = read_rows(block, feature_indices).notna()
+            rows_with_values.extend(has_value.index[has_value.any(axis=1)])
+            columns_with_values |= has_value.any(axis=0).values
+            progress_callback(int((i + 1) / len(blocks) * first_pass_percent))
+
+        nas_dropped = (
+            len(rows_with_values) != len(rows) or not columns_with_values.all()
+        )
+        rows = rows_with_values
+        feature_indices = [
+            index
+            for index, has_value in zip(feature_indices, columns_with_values)
+            if has_value
+        ]
+    elif sample_ids:
+        # populate cell lines that were specified by the user but not in the dataset with NaN's
+        rows = sample_ids
+
+    metadata_df = None
+    if add_metadata:
+        metadata_df = _get_metadata_df(db)
+        # merging with the metadata keeps only the rows which have metadata, in the metadata's order
+        row_set = set(rows)
+        rows = [x for x in metadata_df.index if x in row_set]
+
+    def read_blocks():
+        blocks = list(chunk_iter(rows, rows_per_block(len(feature_indices))))
+        if len(blocks) == 0:
+            # still write the header
+            blocks = [[]]
+        for i, block in enumerate(blocks):
+            df = read_rows(
+                [x for x in block if x in index_by_sample_id], feature_indices
+            )
+            df = df.reindex(index=block)
+            df.rename(
+                columns={col: f"{feature_labels.get(col, col)}" for col in df.columns},
+                inplace=True,
+            )
+            if metadata_df is not None:
+                df = metadata_df.loc[block].merge(df, left_index=True, right_index=True)
+            yield df
+            progress_callback(
+                int(
+                    first_pass_percent
+                    + (i + 1) / len(blocks) * (max_percent - first_pass_percent)
+                )
+            )
+
+    return nas_dropped, read_blocks()
+
+
 def _estimate_result_size(datasets, sample_indices, feature_indices):
     size_estimate = 0
     assert sample_indices != None
@@ -215,6 +333,7 @@ def _get_filename_for_user(
     nas_dropped: bool,
     feature_labels: Optional[List[str]],
     sample_ids: Optional[List[str]],
+    file_format: ExportFormat = "csv",
 ) -> str:
     filename_for_user = file_name
 
@@ -225,24 +344,89 @@ def _get_filename_for_user(
         filename_for_user = filename_for_user + "_NAsdropped"
 
     filename_for_user = (
-        filename_for_user + ".csv"
-    )  # ends in .csv is for the user, but also for morpheus requirements. see the docstring of the download.data_slicer_download endpoint
+        filename_for_user + "." + file_format
+    )  # csv exports ending in .csv is for the user, but also for morpheus requirements. see the docstring of the download.data_slicer_download endpoint
 
     return filename_for_user
 
 
-def _add_metadata(db: SessionWithUser, df: pd.DataFrame) -> pd.DataFrame:
+def _get_metadata_df(db: SessionWithUser) -> pd.DataFrame:
     metadata_df = get_cell_line_selector_lines(db)
     metadata_cols = ["cell_line_name"] + [
         col for col in metadata_df if col.startswith("lineage")
     ]
     metadata_df = metadata_df[metadata_cols]
     assert isinstance(metadata_df, pd.DataFrame)
+    return metadata_df
+
+
+def _add_metadata(db: SessionWithUser, df: pd.DataFrame) -> pd.DataFrame:
+    metadata_df = _get_metadata_df(db)
     df = metadata_df.merge(df, left_index=True, right_index=True)
 
     return df
 
 
+def _write_csv_blocks(blocks: Iterator[pd.DataFrame], path: str):
+    with open(path, "w", newline="") as fd:
+        for i, df in enumerate(blocks):
+            df.to_csv(fd, index=True, header=(i == 0))
+
+
+def _write_parquet_blocks(blocks: Iterator[pd.DataFrame], path: str):
+    writer = None
+    try:
+        for df in blocks:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            if writer is None:
+                # a column which is entirely missing in the first block would otherwise be typed as null,
+                # and then fail to hold the values in later blocks. Only metadata columns hold strings.
+                schema = pa.schema(
+                    [
+                        pa.field(field.name, pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                        for field in table.schema
+                    ],
+                    metadata=table.schema.metadata,
+                )
+                writer = pq.ParquetWriter(path, schema)
+            # each block becomes (at least) one row group
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_json_blocks(blocks: Iterator[pd.DataFrame], path: str):
+    # one object per row, keyed by sample ID (ie: DataFrame.to_json(orient="index"))
+    with open(path, "w") as fd:
+        fd.write("{")
+        first = True
+        for df in blocks:
+            if len(df) == 0:
+                continue
+            if not first:
+                fd.write(",")
+            fd.write(df.to_json(orient="index")[1:-1])
+            first = False
+        fd.write("}")
+
+
+_EXPORT_WRITERS: Dict[str, Callable[[Iterator[pd.DataFrame], str], None]] = {
+    "csv": _write_csv_blocks,
+    "parquet": _write_parquet_blocks,
+    "json": _write_json_blocks,
+}
+
+
+def write_export_blocks(
+    blocks: Iterator[pd.DataFrame], path: str, file_format: ExportFormat
+):
+    """Write the blocks of rows of an export to a single file, holding only one block in memory at a time"""
+    _EXPORT_WRITERS[file_format](blocks, path)
+
+
 def _get_download_result(
     self,
     db: SessionWithUser,
@@ -251,18 +435,37 @@ def _get_download_result(
     result_path: str,
     filename_for_user: str,
     compute_results_location: str,
+    file_format: ExportFormat = "csv",
 ) -> Dict[str, str]:
     if add_metadata:
         df = _add_metadata(db, df)
 
+    return _write_download_result(
+        self,
+        iter([df]),
+        result_path,
+        filename_for_user,
+        compute_results_location,
+        file_format,
+    )
+
+
+def _write_download_result(
+    self,
+    blocks: Iterator[pd.DataFrame],
+    result_path: str,
+    filename_for_user: str,
+    compute_results_location: str,
+    file_format: ExportFormat = "csv",
+) -> Dict[str, str]:
     # file should end up being saved as COMPUTE_RESULTS_LOCATION/<time>/<task_id>/export.csv
     #   time helps us for deleting results
     #   task_id provides security through non-guessability, since we send this to the front end
     #   naming the file export.csv instead of filename_for_user provides security to our local filesystem by always writing an expected and sane filename
-    download_file_path = os.path.join(result_path, "export.csv")
-    df.to_csv(download_file_path, index=True, header=True)
+    download_file_path = os.path.join(result_path, "export." + file_format)
+    write_export_blocks(blocks, download_file_path, file_format)
 
-    # After writing to csv is considered full completion
+    # After writing the file is considered full completion
     _progress_callback(self, percentage=100, message="Finished")
 
     # get the path of file relative to the result root, as a security measure
@@ -347,6 +550,7 @@ def export_merged_datasets(
     add_metadata: bool,
     result_dir: str,
     user: str,
+    file_format: ExportFormat = "csv",
 ):
     if self.request.called_directly:
         task_id = "called_directly"
@@ -392,7 +596,7 @@ def export_merged_datasets(
 
         file_name = f"depmap_export_{datetime.now()}"
         filename_for_user = _get_filename_for_user(
-            file_name, nas_dropped, feature_labels, sample_ids
+            file_name, nas_dropped, feature_labels, sample_ids, file_format
         )
 
         result = _get_download_result(
@@ -403,6 +607,7 @@ def export_merged_datasets(
             result_path=result_path,
             filename_for_user=filename_for_user,
             compute_results_location=settings.compute_results_location,
+            file_format=file_format,
         )
 
         return result
@@ -433,6 +638,7 @@ def export_dataset(
     add_metadata: bool,
     result_dir: str,
     user: str,
+    file_format: ExportFormat = "csv",
 ):
     if self.request.called_directly:
         task_id = "called_directly"
@@ -444,7 +650,7 @@ def export_dataset(
     result_path = _make_result_task_directory(result_dir, task_id)
 
     def progress_callback(percentage):
-        # get_processed_df needs a callback which doesn't take the task as a parameter
+        # get_processed_df_blocks needs a callback which doesn't take the task as a parameter
         _progress_callback(self, percentage)
 
     with db_context(user) as db:
@@ -460,33 +666,32 @@ def export_dataset(
             db=db, user=user, dataset=dataset, given_ids=sample_ids
         )
 
-        df = get_processed_df(
+        # the dataset is read and written a block of rows at a time, so the export isn't limited by memory
+        nas_dropped, blocks = get_processed_df_blocks(
             db=db,
             dataset=dataset,
             filestore_location=settings.filestore_location,
             feature_indices=feature_indices.index.to_list(),
             sample_indices=sample_indices,
+            sample_ids=sample_ids,
+            drop_nas=drop_nas,
+            add_metadata=add_metadata,
             progress_callback=progress_callback,
             user=user,
         )
 
-        df, nas_dropped = _handle_df_nas(
-            drop_nas, df, df.columns.values.tolist(), sample_ids
-        )
-
         file_name = dataset.name.replace(" ", "_")
         filename_for_user = _get_filename_for_user(
-            file_name, nas_dropped, feature_labels, sample_ids
+            file_name, nas_dropped, feature_labels, sample_ids, file_format
         )
 
-        result = _get_download_result(
+        result = _write_download_result(
             self,
-            db=db,
-            df=df,
-            add_metadata=add_metadata,
+            blocks,
             result_path=result_path,
             filename_for_user=filename_for_user,
             compute_results_location=settings.compute_results_location,
+            file_format=file_format,
         )
 
         return result
@@ -10,7 +10,12 @@ import os
 
 @app.task(base=LogErrorsTask, bind=True)
 def execute_sql_in_virtual_db_task(
-    self, user: str, results_dir: str, sql_statement: str, filestore_location: str
+    self,
+    user: str,
+    results_dir: str,
+    sql_statement: str,
+    filestore_location: str,
+    result_format: sql.SqlResultFormat = "csv",
 ):
     if self.request.called_directly:
         task_id = "called_directly"
@@ -24,10 +29,9 @@ def execute_sql_in_virtual_db_task(
     )
 
     with db_context(user) as db:
-        output = sql.execute_sql_in_virtual_db(db, filestore_location, sql_statement)
-        with open(output_filename, "wt") as fd:
-            for line in output:
-                fd.write(line)
+        sql.write_sql_query_result(
+            db, filestore_location, sql_statement, output_filename, result_format
+        )
 
     log.warning(f"Completed SQL execution, wrote to {output_filename}")
     return output_filename
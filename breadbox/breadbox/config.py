@@ -1,11 +1,14 @@
 from functools import lru_cache
+import logging
 import os
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 
-from pydantic import RedisDsn, field_validator
+from pydantic import RedisDsn, ValidationError, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import datetime
 
+log = logging.getLogger(__name__)
+
 
 class Settings(BaseSettings):
     breadbox_secret: str
@@ -19,6 +22,43 @@ class Settings(BaseSettings):
     sql_endpoints_enabled: bool = False
     breadbox_env: str = "dev"
 
+    # settings for the pool of database connections shared by all requests/tasks within a process
+    db_pool_size: int = 10
+    db_pool_max_overflow: int = 20
+    db_pool_timeout: float = 30
+
+    # upper bound on the memory used by HDF5 files kept open between reads (per process). Each
+    # open file counts its raw chunk cache plus its decoded feature and sample labels.
+    hdf5_file_cache_max_bytes: int = 512 * 1024 * 1024
+    # size of the HDF5 raw chunk cache of each open file
+    hdf5_chunk_cache_bytes: int = 4 * 1024 * 1024
+
+    # compression filter used for newly uploaded matrix datasets, which are stored using the chunked layout.
+    # gzip makes smaller files, but reading a single sample from a gzip file without a row-chunked copy is
+    # roughly 500x slower than from an lzf file with one.
+    matrix_storage_compression: Optional[Literal["gzip", "lzf"]] = "lzf"
+    matrix_storage_compression_level: int = 4
+    # whether newly uploaded matrix datasets also store a copy chunked by row (unless the upload says otherwise),
+    # so that reading a few samples is as fast as reading a few features
+    matrix_storage_row_chunked_copy: bool = True
+
+    # keep the files of uploaded matrices (under filestore_location/blobs, hard linked to each dataset's file) so
+    # that uploading an identical matrix again links to the existing file instead of converting it again
+    deduplicate_matrix_files: bool = True
+
+    # number of threads each custom analysis task uses to compute its batches of features (while another
+    # thread reads the next batches). Set per celery worker, taking into account its concurrency.
+    custom_analysis_compute_threads: int = 1
+
+    # results of custom analyses are stored (under compute_results_location) so that repeating an analysis
+    # returns the stored result instead of computing it again. The least recently used results are deleted
+    # once they take up more than this. 0 disables storing results.
+    custom_analysis_cache_max_bytes: int = 1024 * 1024 * 1024
+
+    # how long the groups a user has access to are cached for (per process). Changes to groups made by other
+    # processes can take this long to be seen. 0 disables the cache.
+    access_control_cache_ttl_seconds: float = 60
+
     # prefix all routes with api_prefix if it's not an empty string
     api_prefix: str = ""
 
@@ -77,3 +117,15 @@ def get_settings():
     # in tests to override the value of get_settings. Otherwise we'd have to monkey patch _every_
     # module get_settings is imported in which is a lot of places.
     return _get_settings()
+
+
+def try_get_settings(defaults_description: str) -> Optional[Settings]:
+    """
+    Returns the settings, or None if they can't be loaded (ie: when imported by a script which isn't run with
+    breadbox's environment), in which case the caller falls back to its defaults.
+    """
+    try:
+        return get_settings()
+    except ValidationError:
+        log.warning(f"Could not load settings, so using default {defaults_description}")
+        return None
@@ -1,9 +1,17 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
 from uuid import UUID
 
+from sqlalchemy import String, and_, event, func, literal, or_, select
 from sqlalchemy.orm import Session
 
-from breadbox.models.group import AccessType, Group
+from breadbox.models.group import AccessType, Group, GroupEntry
 from breadbox import config
+from breadbox.utils.fork_safe import ForkSafe
 
 PUBLIC_GROUP_ID = str(UUID("00000000-0000-0000-0000-000000000000"))
 TRANSIENT_GROUP_ID = str(UUID("11111111-1111-1111-1111-111111111111"))
@@ -66,16 +74,187 @@ def user_can_view_group_contents(group: Group, user: str) -> bool:
 
 
 def get_read_access_group_ids(
-    db: Session, user: str, write_access: bool = False,
+    db: Session, user: str, write_access: bool = False, use_cache: bool = True,
 ) -> list[str]:
     """
     Get all groups that the user can read data from (used for global access controls).
     Note: Users may read from the transient group when they know the dataset ID.
+    If use_cache is True, the groups may have been resolved by a previous call (see AccessControlCache).
     """
-    all_groups = db.query(Group).all()
+    if use_cache:
+        access = get_access_control_cache().get(db, user)
+    else:
+        access = resolve_group_access(db, user)
+
+    group_ids = access.write_group_ids if write_access else access.read_group_ids
+    return sorted(group_ids)
+
+
+@dataclass(frozen=True)
+class GroupAccess:
+    "The ids of the groups a user can read from and write to"
+    read_group_ids: frozenset[str]
+    write_group_ids: frozenset[str]
+
+
+def resolve_group_access(db: Session, user: str) -> GroupAccess:
+    """
+    Resolves the groups a user has access to with a single query (the same rules as
+    user_has_access_to_group, but without loading every group and its entries).
+    """
+    assert user is not None
+
+    settings = config.get_settings()
+    if user in settings.admin_users:
+        all_group_ids = frozenset(db.execute(select(Group.id)).scalars())
+        return GroupAccess(read_group_ids=all_group_ids, write_group_ids=all_group_ids)
+
+    user_param = literal(user, String)
+    is_suffix_of_user = or_(
+        GroupEntry.email == "",
+        func.substr(user_param, -func.length(GroupEntry.email)) == GroupEntry.email,
+    )
+    rows = db.execute(
+        select(GroupEntry.group_id, GroupEntry.access_type).where(
+            or_(
+                and_(GroupEntry.exact_match.is_(True), GroupEntry.email == user_param),
+                # a null exact_match is treated as a suffix match, as in user_has_access_to_group
+                and_(
+                    or_(
+                        GroupEntry.exact_match.is_(False),
+                        GroupEntry.exact_match.is_(None),
+                    ),
+                    is_suffix_of_user,
+                ),
+            )
+        )
+    ).all()
+
+    return GroupAccess(
+        read_group_ids=frozenset(group_id for group_id, _ in rows),
+        write_group_ids=frozenset(
+            group_id
+            for group_id, access_type in rows
+            if access_type in (AccessType.write, AccessType.owner)
+        ),
+    )
+
+
+DEFAULT_TTL_SECONDS = 60
+DEFAULT_MAX_USERS = 10000
+
+
+class AccessControlCache(ForkSafe):
+    """
+    A per-process cache of the groups each user has access to, so that every request and task doesn't
+    resolve them again. Entries expire after ttl_seconds, and the whole cache is cleared when a session in
+    this process changes a group or group entry (see _clear_cache_after_acl_changes). Changes made by other
+    processes are seen once the entries expire.
+    """
+
+    def __init__(self, ttl_seconds: float, max_users: int = DEFAULT_MAX_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        super().__init__()
+        # incremented by clear(), so that a result resolved before a change isn't stored after it
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _reset(self):
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, GroupAccess]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user: str) -> GroupAccess:
+        self._check_pid()
+        # keyed by database too, since in tests every test has its own
+        key = (str(db.get_bind().url), user)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        access = resolve_group_access(db, user)
+
+        if self.ttl_seconds > 0:
+            with self._lock:
+                if self._generation == generation:
+                    self._entries[key] = (time.monotonic() + self.ttl_seconds, access)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_users:
+                        self._entries.popitem(last=False)
+        return access
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups > 0 else None,
+            }
+
+
+_access_control_cache: Optional[AccessControlCache] = None
+
+
+def get_access_control_cache() -> AccessControlCache:
+    global _access_control_cache
+    if _access_control_cache is None:
+        settings = config.try_get_settings("access control cache TTL")
+        if settings is None:
+            _access_control_cache = AccessControlCache(ttl_seconds=DEFAULT_TTL_SECONDS)
+        else:
+            _access_control_cache = AccessControlCache(
+                ttl_seconds=settings.access_control_cache_ttl_seconds
+            )
+    return _access_control_cache
+
+
+def _is_acl_entity(obj) -> bool:
+    return isinstance(obj, (Group, GroupEntry))
+
+
+@event.listens_for(Session, "after_flush")
+def _note_acl_changes(session, flush_context):
+    if any(
+        _is_acl_entity(obj)
+        for obj in itertools.chain(session.new, session.dirty, session.deleted)
+    ):
+        # cleared now so this session sees its own changes, and again once they're committed (or
+        # rolled back) in case another session cached the old groups in the meantime
+        session.info["acl_changed"] = True
+        get_access_control_cache().clear()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _note_bulk_acl_changes(execute_state):
+    # bulk updates/deletes (ie: query(GroupEntry).filter(...).delete()) don't go through the flush
+    if (execute_state.is_update or execute_state.is_delete) and any(
+        mapper.class_ in (Group, GroupEntry) for mapper in execute_state.all_mappers
+    ):
+        execute_state.session.info["acl_changed"] = True
+        get_access_control_cache().clear()
+
 
-    return [
-        group.id
-        for group in all_groups
-        if user_has_access_to_group(group, user, write_access)
-    ]
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _clear_cache_after_acl_changes(session):
+    if session.info.pop("acl_changed", False):
+        get_access_control_cache().clear()
@@ -9,17 +9,47 @@ from breadbox.schemas.custom_http_exception import (
     HTTPException,
 )
 import os
+import shutil
+import sqlite3
 from ..service import metadata
 from ..crud import access_control
 from typing import Optional, List
 import packed_cor_tables
+import pandas as pd
 from sqlalchemy import or_
 
+# the extension of association tables stored using version 2 of the packed correlation table format
+ASSOCIATION_TABLE_EXTENSION = ".pctbl"
+
+
+def store_association_table_file(src_filename: str, dest_filename: str):
+    """
+    Moves the uploaded association table in src_filename to dest_filename. A table in version 1 of the
+    packed correlation table format (sqlite) is converted to version 2, which is memory mapped once per
+    process instead of queried through a new sqlite connection on every lookup.
+    """
+    try:
+        format_version = packed_cor_tables.get_format_version(src_filename)
+        if format_version == 2:
+            shutil.move(src_filename, dest_filename)
+        else:
+            packed_cor_tables.convert(src_filename, dest_filename, format_version=2)
+            os.remove(src_filename)
+    except (
+        packed_cor_tables.InvalidAssociationTable,
+        sqlite3.DatabaseError,
+        pd.errors.DatabaseError,
+    ) as ex:
+        for filename in [src_filename, dest_filename]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        raise UserError("Invalid association table") from ex
+
 
 def _validate_association_table(
     dataset_1_given_ids: set[str], dataset_2_given_ids: set[str], filename: str
 ):
-    """Opens file as a sqlite3 db and verifies the dimensions have the expected IDs. Raises an UserError if any issues found"""
+    """Opens file as a packed correlation table (of either format version) and verifies the dimensions have the expected IDs. Raises an UserError if any issues found"""
 
     def check_given_ids(expected_given_ids: set[str], dim: str):
         assoc_dataset_given_ids = packed_cor_tables.get_given_ids(filename, dim)
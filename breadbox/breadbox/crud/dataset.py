@@ -5,7 +5,18 @@ from typing import Any, Dict, Optional, List, Type, Union, Tuple, Set
 from uuid import UUID, uuid4
 
 import pandas as pd
-from sqlalchemy import and_, func, or_, select, true
+from sqlalchemy import (
+    Integer,
+    and_,
+    case,
+    func,
+    literal,
+    literal_column,
+    or_,
+    select,
+    true,
+    union,
+)
 from sqlalchemy.sql import distinct
 from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.orm import aliased, with_polymorphic
@@ -15,6 +26,7 @@ from ..io.data_validation import dimension_label_df_schema
 from ..schemas.dataset import (
     DimensionSearchIndexResponse,
     ColumnMetadata,
+    NameAndID,
     UpdateDatasetParams,
 )
 
@@ -32,18 +44,27 @@ from breadbox.models.dataset import (
     DatasetSample,
     Dimension,
     DimensionSearchIndex,
+    DimensionSearchIndexFTS,
     TabularColumn,
     TabularCell,
     ValueType,
     DimensionType,
     PrecomputedAssociation,
+    CatalogVersion,
+    CATALOG_VERSION_ROW_ID,
+    bump_catalog_version,
 )
 from breadbox.crud.group import (
     get_group,
     get_groups_with_visible_contents,
 )
-from breadbox.io.filestore_crud import delete_data_files
-import typing
+from breadbox.io.filestore_crud import (
+    delete_data_files,
+    get_tabular_subset,
+    has_data_files,
+    save_tabular_dataset_file,
+)
+from breadbox.config import get_settings
 
 log = logging.getLogger(__name__)
 
@@ -56,6 +77,22 @@ def assert_user_has_access_to_dataset(dataset: Dataset, user: str):
         raise DatasetAccessError("User does not have access to dataset")
 
 
+def get_catalog_version(db: SessionWithUser) -> int:
+    """
+    Returns a counter which changes whenever datasets, their dimensions or their tabular values are added, updated
+    or deleted.
+    """
+    catalog_version = (
+        db.query(CatalogVersion)
+        .filter(CatalogVersion.id == CATALOG_VERSION_ROW_ID)
+        .one_or_none()
+    )
+    if catalog_version is None:
+        # the counter row is created by the first change
+        return 0
+    return catalog_version.version
+
+
 def get_dataset_filter_clauses(db, user):
     # Get groups for which the user has read-access
     groups = get_groups_with_visible_contents(db, user)  # TODO: update
@@ -304,6 +341,7 @@ def add_matrix_dataset_dimensions(
         )
 
     db.bulk_save_objects(dimensions)
+    bump_catalog_version(db.connection())
     db.flush()
 
 
@@ -320,9 +358,14 @@ def add_tabular_dimensions(
     """
     dimensions = []
     values = []
+    index_given_ids = [str(x) for x in data_df[dimension_type.id_column]]
+    values_by_column: Dict[str, List[Optional[str]]] = {}
 
     for col in data_df.columns:
         annotation_id = str(uuid4())
+        # Val could be pd.NA. Store null as None
+        column_values = [None if pd.isnull(val) else str(val) for val in data_df[col]]
+        values_by_column[col] = column_values
         dimensions.append(
             TabularColumn(
                 id=annotation_id,
@@ -340,62 +383,68 @@ def add_tabular_dimensions(
                 TabularCell(
                     tabular_column_id=annotation_id,
                     dimension_given_id=index,
-                    value=None
-                    if pd.isnull(val)
-                    else str(val),  # Val could be pd.NA. Store null as None
+                    value=val,
                     group_id=group_id,
                 )
-                for index, val in zip(data_df[dimension_type.id_column], data_df[col],)
+                for index, val in zip(data_df[dimension_type.id_column], column_values)
             ]
         )
 
     db.bulk_save_objects(dimensions)
     db.flush()
     db.bulk_save_objects(values)
+    bump_catalog_version(db.connection())
     db.flush()
 
+    save_tabular_dataset_file(
+        dataset_id, index_given_ids, values_by_column, get_settings().filestore_location
+    )
+
 
 def _find_datasets_referencing(
-    db: SessionWithUser, dataset_filter_clause, dimension_type_name: str, given_id: str,
-):
-    with_feature = (
-        db.query(DatasetFeature)
-        .join(MatrixDataset)
-        .filter(
-            DatasetFeature.given_id == given_id,
-            MatrixDataset.feature_type_name == dimension_type_name,
-            *dataset_filter_clause,
+    db: SessionWithUser, dataset_filter_clause, dimensions: List[Tuple[str, str]],
+) -> Dict[Tuple[str, str], List[NameAndID]]:
+    """
+    Look up the datasets which have each of the given (dimension_type_name, given_id) pairs as a feature
+    or sample, ordered by dataset name. Makes one query per dimension type instead of one per dimension.
+    """
+    given_ids_by_type_name = defaultdict(list)
+    for dimension_type_name, given_id in dimensions:
+        given_ids_by_type_name[dimension_type_name].append(given_id)
+
+    datasets_by_dimension: Dict[Tuple[str, str], List[NameAndID]] = defaultdict(list)
+    for dimension_type_name, given_ids in given_ids_by_type_name.items():
+        with_feature = (
+            db.query(DatasetFeature)
+            .join(MatrixDataset)
+            .filter(
+                DatasetFeature.given_id.in_(given_ids),
+                MatrixDataset.feature_type_name == dimension_type_name,
+                *dataset_filter_clause,
+            )
+            .with_entities(
+                DatasetFeature.given_id, MatrixDataset.id, MatrixDataset.name
+            )
         )
-        .with_entities(MatrixDataset.id, MatrixDataset.name, MatrixDataset.group_id)
-    )
 
-    with_sample = (
-        db.query(DatasetSample)
-        .join(MatrixDataset)
-        .filter(
-            DatasetFeature.given_id == given_id,
-            MatrixDataset.sample_type_name == dimension_type_name,
-            *dataset_filter_clause,
+        with_sample = (
+            db.query(DatasetSample)
+            .join(MatrixDataset)
+            .filter(
+                DatasetSample.given_id.in_(given_ids),
+                MatrixDataset.sample_type_name == dimension_type_name,
+                *dataset_filter_clause,
+            )
+            .with_entities(DatasetSample.given_id, MatrixDataset.id, MatrixDataset.name)
         )
-        .with_entities(MatrixDataset.id, MatrixDataset.name, MatrixDataset.group_id)
-    )
-
-    query = with_feature.union(with_sample).order_by(MatrixDataset.name)
 
-    #
-    # def has_access_to_group(group_id):
-    #     # this would likely be much more efficient if it was lifted into the query above,
-    #     # however, I'm not confident that the check can be efficiently implemented in SQL.
-    #     # I'll use the existing method we'll see how bad performance is. Might not be so
-    #     # bad because we have relatively few groups and sqlalchemy should cache the objects
-    #     group = db.get(Group, group_id)
-    #     return user_has_access_to_group(group, user)
-    from breadbox.schemas.dataset import NameAndID
+        query = with_feature.union(with_sample).order_by(MatrixDataset.name)
+        for given_id, id, name in query.all():
+            datasets_by_dimension[(dimension_type_name, given_id)].append(
+                NameAndID(name=name, id=id)
+            )
 
-    datasets = [
-        NameAndID(name=name, id=id) for id, name, dataset_group_id in query.all()
-    ]
-    return datasets
+    return datasets_by_dimension
 
 
 def get_dataset_dimension_search_index_entries(
@@ -462,6 +511,22 @@ def get_dataset_dimension_search_index_entries(
     return results
 
 
+# the trigram tokenizer used by dimension_search_index_fts can't find anything shorter than this
+FTS_MIN_TERM_LENGTH = 3
+
+
+def _fts_candidates(term: str):
+    """
+    Returns a query for the rowids of the search index entries whose value contains `term`. The
+    full-text index ignores case for all of unicode, whereas LIKE only does for ASCII, so this finds a
+    superset of what the LIKE predicates match and they still need to be applied to the candidates.
+    """
+    phrase = '"' + term.replace('"', '""') + '"'
+    return select(DimensionSearchIndexFTS.rowid).where(
+        DimensionSearchIndexFTS.value.match(phrase)
+    )
+
+
 def query_search_index_entries(
     db: SessionWithUser,
     user: str,
@@ -471,94 +536,170 @@ def query_search_index_entries(
     dimension_type_name: Optional[str],
     include_referenced_by: bool,
 ):
+    """
+    Find the dimensions with search index entries matching every prefix and substring, ordered by how
+    well they matched and then by label. Dimensions whose value exactly matches a term come before ones
+    where it's only a prefix, which come before ones where it's only a substring, and within those, a
+    match on the label beats a match on another property, which beats a match on a property of a
+    referenced dimension (ie: exact label > alias > target.alias). The limit is applied to the number
+    of dimensions returned.
+    """
     # Filter out any datasets the user doesn't have access to
     visible_database_clause = get_dataset_filter_clauses(db, user)
 
-    search_index_filter_clauses = []
-    outer = aliased(DimensionSearchIndex)
+    entry = aliased(DimensionSearchIndex, name="entry")
+    entry_rowid = literal_column("entry.rowid", Integer)
+    other_entry = aliased(DimensionSearchIndex, name="other_entry")
+    other_entry_rowid = literal_column("other_entry.rowid", Integer)
+
+    def matches_prefix(table, prefix):
+        return table.value.startswith(prefix, autoescape=True)
+
+    def matches_substring(table, substring):
+        return table.value.contains(substring, autoescape=True)
 
+    def matches_any(table, rowid, values, predicate_constructor):
+        clause = or_(*[predicate_constructor(table, value) for value in values])
+        if all(len(value) >= FTS_MIN_TERM_LENGTH for value in values):
+            # use the full-text index to narrow down which entries need to be checked, instead of
+            # scanning every value in the table
+            candidates = [_fts_candidates(value) for value in values]
+            if len(candidates) > 1:
+                candidates = [union(*candidates)]
+            clause = and_(rowid.in_(candidates[0]), clause)
+        return clause
+
+    search_index_filter_clauses = []
     if dimension_type_name:
         search_index_filter_clauses.append(
-            outer.dimension_type_name == dimension_type_name
+            entry.dimension_type_name == dimension_type_name
         )
 
-    def filter_per_value(values, predicate_constructor):
+    for values, predicate_constructor in [
+        (prefixes, matches_prefix),
+        (substrings, matches_substring),
+    ]:
         if len(values) == 0:
-            return []
+            continue
 
-        exists_clause_per_value = [
-            db.query(DimensionSearchIndex)
-            .filter(
-                and_(
-                    predicate_constructor(DimensionSearchIndex, value),
-                    *search_index_filter_clauses,
-                    outer.dimension_type_name
-                    == DimensionSearchIndex.dimension_type_name,
-                    outer.dimension_given_id == DimensionSearchIndex.dimension_given_id,
+        search_index_filter_clauses.append(
+            matches_any(entry, entry_rowid, values, predicate_constructor)
+        )
+
+        if len(values) > 1:
+            # each entry only needs to match one of the values, but every value must be matched by one of
+            # the entries for the same dimension
+            for value in values:
+                search_index_filter_clauses.append(
+                    select(other_entry.id)
+                    .where(
+                        other_entry.dimension_type_name == entry.dimension_type_name,
+                        other_entry.dimension_given_id == entry.dimension_given_id,
+                        matches_any(
+                            other_entry,
+                            other_entry_rowid,
+                            [value],
+                            predicate_constructor,
+                        ),
+                    )
+                    .exists()
                 )
-            )
-            .with_entities(
-                DimensionSearchIndex.dimension_type_name,
-                DimensionSearchIndex.dimension_given_id,
-            )
-            .exists()
-            for value in values
-        ]
 
-        property_matches_at_least_one_predicate = or_(
-            *[predicate_constructor(outer, value) for value in values]
+    terms = prefixes + substrings
+    if len(terms) == 0:
+        # nothing to rank by, so order by label alone
+        tier = literal(0)
+    else:
+        match_quality = case(
+            (or_(*[func.lower(entry.value) == func.lower(term) for term in terms]), 0),
+            (or_(*[matches_prefix(entry, term) for term in terms]), 1),
+            else_=2,
         )
+        property_rank = case(
+            (entry.property == "label", 0),
+            # properties of referenced dimensions are named "<column>.<property>"
+            (entry.property.contains("."), 2),
+            else_=1,
+        )
+        tier = match_quality * 3 + property_rank
 
-        return [property_matches_at_least_one_predicate] + exists_clause_per_value
-
-    filters_for_prefixes = filter_per_value(
-        prefixes, lambda table, prefix: table.value.startswith(prefix, autoescape=True)
+    matching_entries = (
+        db.query(entry)
+        .filter(*search_index_filter_clauses)
+        .with_entities(
+            entry.dimension_type_name,
+            entry.dimension_given_id,
+            entry.label,
+            tier.label("tier"),
+        )
+        .subquery()
     )
-
-    filters_for_substrings = filter_per_value(
-        substrings,
-        lambda table, substring: table.value.contains(substring, autoescape=True),
+    search_rank = func.min(matching_entries.c.tier).label("search_rank")
+    label = func.min(matching_entries.c.label).label("label")
+    ranked_dimensions = (
+        select(
+            matching_entries.c.dimension_type_name,
+            matching_entries.c.dimension_given_id,
+            label,
+            search_rank,
+        )
+        .group_by(
+            matching_entries.c.dimension_type_name,
+            matching_entries.c.dimension_given_id,
+        )
+        .order_by(
+            search_rank,
+            label,
+            matching_entries.c.dimension_type_name,
+            matching_entries.c.dimension_given_id,
+        )
+        .limit(limit)
+        .cte("ranked_dimensions")
     )
 
+    # fetch all the matching entries of the top dimensions, in the order they were indexed
     search_index_query = (
-        db.query(outer)
-        .filter(
+        db.query(entry)
+        .join(
+            ranked_dimensions,
             and_(
-                True,
-                *(
-                    search_index_filter_clauses
-                    + filters_for_substrings
-                    + filters_for_prefixes
-                ),
-            )
+                entry.dimension_type_name == ranked_dimensions.c.dimension_type_name,
+                entry.dimension_given_id == ranked_dimensions.c.dimension_given_id,
+            ),
         )
-        .limit(limit)
+        .filter(*search_index_filter_clauses)
         .with_entities(
-            outer.dimension_type_name,
-            outer.dimension_given_id,
-            outer.label,
-            outer.property,
-            outer.value,
+            ranked_dimensions.c.dimension_type_name,
+            ranked_dimensions.c.dimension_given_id,
+            ranked_dimensions.c.label,
+            entry.property,
+            entry.value,
+        )
+        .order_by(
+            ranked_dimensions.c.search_rank,
+            ranked_dimensions.c.label,
+            ranked_dimensions.c.dimension_type_name,
+            ranked_dimensions.c.dimension_given_id,
+            entry_rowid,
         )
     )
 
-    search_index_entries = pd.read_sql(
-        search_index_query.statement, search_index_query.session.connection()
-    )
-    #    search_index_entries.columns = ["type_name", "dimension_given_id", "label", "property", "value"]
+    entries_by_dimension: Dict[Tuple[str, str], list] = {}
+    for row in search_index_query.all():
+        entries_by_dimension.setdefault(
+            (row.dimension_type_name, row.dimension_given_id), []
+        ).append(row)
 
-    grouped_search_index_entries = search_index_entries.groupby(
-        ["dimension_given_id", "dimension_type_name"],
-        sort=False,  # set sort=False to preserve the ordering from the original search_index_query
-    )
+    if include_referenced_by:
+        referenced_by_dimension = _find_datasets_referencing(
+            db, visible_database_clause, list(entries_by_dimension)
+        )
 
     group_entries: List[DimensionSearchIndexResponse] = []
-    for id_type_name_tuple, group in grouped_search_index_entries:
-        dimension_given_id, type_name = typing.cast(typing.Tuple, id_type_name_tuple)
-
+    for (type_name, dimension_given_id), entries in entries_by_dimension.items():
         if include_referenced_by:
-            referenced_by = _find_datasets_referencing(
-                db, visible_database_clause, type_name, dimension_given_id
+            referenced_by = referenced_by_dimension.get(
+                (type_name, dimension_given_id), []
             )
         else:
             referenced_by = None
@@ -566,21 +707,17 @@ def query_search_index_entries(
         group_entries.append(
             DimensionSearchIndexResponse(
                 type_name=type_name,
-                label=group["label"].values[0],
+                label=entries[0].label,
                 id=dimension_given_id,
                 referenced_by=referenced_by,
                 matching_properties=[
-                    {"property": str(row["property"]), "value": str(row["value"]),}
-                    for _, row in group.iterrows()
-                    if row["value"] is not None
+                    {"property": str(row.property), "value": str(row.value)}
+                    for row in entries
+                    if row.value is not None
                 ],
             )
         )
 
-    # sort at the end. This has been moved out of the sql query because we
-    # want the sort to happen after "limit" has been applied.
-    group_entries.sort(key=lambda x: (x.label, x.type_name))
-
     return group_entries
 
 
@@ -681,9 +818,12 @@ def delete_dataset(
     log.info("delete_dataset %s delete dataset itself", dataset.id)
     db.delete(dataset)
 
-    # Matrix dataset files are stored as hdf5 and need to be deleted as well
+    # Matrix dataset files are stored as hdf5 and need to be deleted as well. Tabular datasets
+    # may have a columnar copy of their cells which needs to be cleaned up too.
     if dataset.format == "matrix_dataset":
         delete_data_files(dataset.id, filestore_location)
+    elif has_data_files(dataset.id, filestore_location):
+        delete_data_files(dataset.id, filestore_location)
 
     log.info("delete_dataset %s complete", dataset.id)
     return True
@@ -694,6 +834,25 @@ def get_subset_of_tabular_data_as_df(
     dataset: TabularDataset,
     column_names: Optional[list[str]],
     index_given_ids: Optional[list[str]],
+) -> pd.DataFrame:
+    # Prefer the columnar copy of the dataset: it only reads the requested columns and rows,
+    # instead of materializing one row per cell and pivoting
+    result = get_tabular_subset(
+        dataset, get_settings().filestore_location, column_names, index_given_ids
+    )
+    if result is not None:
+        return result
+
+    return _get_subset_of_tabular_data_from_cells(
+        db, dataset, column_names, index_given_ids
+    )
+
+
+def _get_subset_of_tabular_data_from_cells(
+    db: SessionWithUser,
+    dataset: TabularDataset,
+    column_names: Optional[list[str]],
+    index_given_ids: Optional[list[str]],
 ) -> pd.DataFrame:
     filter_statements = [TabularColumn.dataset_id == dataset.id]
     if column_names is not None:
@@ -726,6 +885,35 @@ def get_subset_of_tabular_data_as_df(
     return result
 
 
+def write_tabular_dataset_file_from_cells(
+    db: SessionWithUser, dataset: TabularDataset, filestore_location: str
+):
+    """
+    (Re)build the columnar copy of a tabular dataset from its TabularCell rows. Used for migrating
+    datasets which were uploaded before the columnar copy existed.
+    """
+    df = _get_subset_of_tabular_data_from_cells(db, dataset, None, None)
+    # columns which had no cells at all still need to exist in the file
+    column_names = [
+        given_id
+        for (given_id,) in db.query(TabularColumn)
+        .filter(TabularColumn.dataset_id == dataset.id)
+        .with_entities(TabularColumn.given_id)
+        .all()
+    ]
+    if df.empty:
+        df = pd.DataFrame(columns=column_names)
+    else:
+        df = df.reindex(columns=column_names)
+    values_by_column = {
+        col: [None if pd.isnull(val) else val for val in df[col]]
+        for col in column_names
+    }
+    save_tabular_dataset_file(
+        dataset.id, [str(x) for x in df.index], values_by_column, filestore_location
+    )
+
+
 def get_unique_dimension_ids_from_datasets(
     db: SessionWithUser, dataset_ids: List[str], dimension_type: DimensionType
 ) -> Set[str]:
@@ -809,3 +997,14 @@ def get_metadata_used_in_matrix_dataset(
 
 def is_public_dataset(dataset: Dataset):
     return dataset.group_id == PUBLIC_GROUP_ID
+
+
+def get_dataset_version(dataset: Optional[Dataset]):
+    """
+    Identifies the contents of a dataset, for use in cache keys. A dataset's data is never modified in
+    place (a new upload, or new metadata for a dimension type, gets a new id) but include when it was
+    last updated to be safe.
+    """
+    if dataset is None:
+        return None
+    return [dataset.id, str(dataset.update_date), dataset.md5_hash]
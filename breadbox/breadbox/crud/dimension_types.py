@@ -6,7 +6,13 @@ from sqlalchemy import and_, inspect
 import pandas as pd
 import numpy as np
 
+from breadbox.config import get_settings
 from breadbox.db.session import SessionWithUser
+from breadbox.io.filestore_crud import (
+    delete_data_files,
+    has_data_files,
+    save_tabular_dataset_file,
+)
 from breadbox.schemas.custom_http_exception import DimensionTypeNotFoundError
 from breadbox.schemas.dataset import TabularDatasetIn
 from breadbox.models.dataset import (
@@ -19,6 +25,7 @@ from breadbox.models.dataset import (
     DimensionType,
     PropertyToIndex,
     DimensionTypeLabel,
+    bump_catalog_version,
 )
 
 
@@ -62,9 +69,14 @@ def add_metadata_dimensions(
     col_annotations: List[TabularColumn] = []
     col_annotation_ids: Dict = {}
     annotation_values: List[TabularCell] = []
+    values_by_column: Dict[str, List[Optional[str]]] = {}
 
     for col in annotations_df.columns:
         annotation_id = str(uuid4())
+        column_values = [
+            str(val) if val is not None else val for val in annotations_df[col]
+        ]
+        values_by_column[col] = column_values
         annotation_type = annotation_type_mapping[col]
         references_dimension_type_name = reference_column_mappings.get(col)
         units = None
@@ -90,10 +102,10 @@ def add_metadata_dimensions(
                 TabularCell(
                     tabular_column_id=annotation_id,
                     dimension_given_id=index,
-                    value=str(val) if val is not None else val,
+                    value=val,
                     group_id=dataset.group_id,
                 )
-                for index, val in zip(annotations_df[id_column], annotations_df[col],)
+                for index, val in zip(annotations_df[id_column], column_values)
             ]
         )
 
@@ -102,8 +114,16 @@ def add_metadata_dimensions(
     db.bulk_save_objects(col_annotations)
     db.flush()
     db.bulk_save_objects(annotation_values)
+    bump_catalog_version(db.connection())
     db.flush()
 
+    save_tabular_dataset_file(
+        dataset.id,
+        [str(x) for x in annotations_df[id_column]],
+        values_by_column,
+        get_settings().filestore_location,
+    )
+
 
 def add_dimension_type(
     db: SessionWithUser,
@@ -247,6 +267,9 @@ def update_dataset_dimensions_with_dimension_type(
 def delete_dimension_type(db: SessionWithUser, dimension_type: DimensionType):
     """Delete the dimension type as well as its metadata dataset."""
     if dimension_type.dataset is not None:
+        filestore_location = get_settings().filestore_location
+        if has_data_files(dimension_type.dataset.id, filestore_location):
+            delete_data_files(dimension_type.dataset.id, filestore_location)
         db.delete(dimension_type.dataset)
         dimension_type.dataset = None
         db.flush()
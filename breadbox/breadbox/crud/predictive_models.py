@@ -1,7 +1,7 @@
 import os
 import sqlite3
 import uuid
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import pandas as pd
 from sqlalchemy import and_
@@ -10,6 +10,7 @@ from sqlalchemy.orm import joinedload
 from breadbox.config import Settings
 from breadbox.crud import dataset as dataset_crud
 from breadbox.db.session import SessionWithUser
+from breadbox.io.sqlite_file_cache import get_sqlite_file_cache
 from breadbox.models.dataset import MatrixDataset
 from breadbox.models.predictive_models import (
     PredictiveModelConfig,
@@ -43,6 +44,7 @@ def _delete_result(
 ):
     """Delete a PredictiveModelResult and its associated SQLite file."""
     full_path = os.path.join(filestore_location, result.filename)
+    get_sqlite_file_cache().evict(full_path)
     if os.path.exists(full_path):
         os.remove(full_path)
     db.delete(result)
@@ -321,6 +323,9 @@ def _convert_parquet_to_sqlite(df: pd.DataFrame, output_path: str):
     """Convert parquet dataframe to SQLite format"""
     conn = sqlite3.connect(output_path)
     cursor = conn.cursor()
+    # the file is new and unused until the result record is added, so there's nothing a journal would protect
+    cursor.execute("PRAGMA journal_mode = OFF")
+    cursor.execute("PRAGMA synchronous = OFF")
 
     # Create model_fit table
     cursor.execute(
@@ -347,48 +352,70 @@ def _convert_parquet_to_sqlite(df: pd.DataFrame, output_path: str):
     """
     )
 
-    # Insert data
-    for _, row in df.iterrows():
-        feature_id = row["actuals_feature_given_id"]
-        correlation = row["prediction_actual_correlation"]
+    model_fit = df[["actuals_feature_given_id", "prediction_actual_correlation"]]
+    top_features = _get_top_features_long_form(df)
 
-        cursor.execute(
+    # all rows are inserted in one transaction
+    with conn:
+        cursor.executemany(
             "INSERT INTO model_fit (actuals_feature_given_id, prediction_actual_correlation) VALUES (?, ?)",
-            (feature_id, correlation),
+            _iter_rows(model_fit),
+        )
+        cursor.executemany(
+            """
+            INSERT INTO top_features
+            (actuals_feature_given_id, rank, feature_dataset_id, feature_given_id,
+             importance, correlation_with_actual)
+            VALUES (?, ?, ?, ?, ?, ? )
+        """,
+            _iter_rows(top_features),
         )
 
-        # Find all feature columns (feature_1_*, feature_2_*, etc.)
-        rank = 1
-        while f"feature_{rank}_given_id" in row:
-            given_id_col = f"feature_{rank}_given_id"
-            dataset_id_col = f"feature_{rank}_dataset_id"
-            importance_col = f"feature_{rank}_importance"
-            correlation_col = f"feature_{rank}_correlation"
-
-            given_id_val = row.get(given_id_col)
-            if given_id_val is None or pd.isna(given_id_val):
-                break
-
-            cursor.execute(
-                """
-                INSERT INTO top_features
-                (actuals_feature_given_id, rank, feature_dataset_id, feature_given_id,
-                 importance, correlation_with_actual)
-                VALUES (?, ?, ?, ?, ?, ? )
-            """,
-                (
-                    feature_id,
-                    rank,
-                    row[dataset_id_col],
-                    row[given_id_col],
-                    row[importance_col],
-                    row[correlation_col],
-                ),
+    conn.close()
+
+
+def _get_top_features_long_form(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reshapes the feature_{rank}_* columns (one set per rank) into one row per actuals feature and
+    rank. The top features of an actuals feature end at the first rank with a missing given ID.
+    """
+    columns = [
+        "actuals_feature_given_id",
+        "rank",
+        "feature_dataset_id",
+        "feature_given_id",
+        "importance",
+        "correlation_with_actual",
+    ]
+    per_rank = []
+    has_previous_ranks = pd.Series(True, index=df.index)
+    rank = 1
+    while f"feature_{rank}_given_id" in df.columns:
+        has_previous_ranks &= df[f"feature_{rank}_given_id"].notna()
+        ranked = df.loc[has_previous_ranks]
+        per_rank.append(
+            pd.DataFrame(
+                {
+                    "actuals_feature_given_id": ranked["actuals_feature_given_id"],
+                    "rank": rank,
+                    "feature_dataset_id": ranked[f"feature_{rank}_dataset_id"],
+                    "feature_given_id": ranked[f"feature_{rank}_given_id"],
+                    "importance": ranked[f"feature_{rank}_importance"],
+                    "correlation_with_actual": ranked[f"feature_{rank}_correlation"],
+                },
+                columns=columns,
             )
-            rank += 1
+        )
+        rank += 1
 
-    conn.commit()
-    conn.close()
+    if len(per_rank) == 0:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(per_rank, ignore_index=True)
+
+
+def _iter_rows(df: pd.DataFrame):
+    # tolist() converts numpy scalars to the python types sqlite3 knows how to bind
+    return zip(*[df[column].tolist() for column in df.columns])
 
 
 def delete_results(
@@ -432,6 +459,24 @@ def get_predictive_models_for_feature(
     db: SessionWithUser, settings: Settings, dataset_id: str, feature_given_id: str,
 ) -> Optional[PredictiveModelsResponse]:
     """Get predictive model results for a specific feature"""
+    responses = get_predictive_models_for_features(
+        db, settings, dataset_id, [feature_given_id]
+    )
+    if responses is None:
+        return None
+    return responses[0]
+
+
+def get_predictive_models_for_features(
+    db: SessionWithUser,
+    settings: Settings,
+    dataset_id: str,
+    feature_given_ids: List[str],
+) -> Optional[List[PredictiveModelsResponse]]:
+    """
+    Get predictive model results for each of the given features, in the same order. Each results
+    file is queried once for all of the features.
+    """
     # Get the dataset
     dataset = dataset_crud.get_dataset(db, db.user, dataset_id)
     if dataset is None:
@@ -445,11 +490,10 @@ def get_predictive_models_for_feature(
     if feature_type_name is None:
         return None
 
-    # Get feature label
+    # Get feature labels
     labels_by_id = metadata.get_matrix_dataset_feature_labels_by_id(
         db, db.user, dataset
     )
-    feature_label = labels_by_id.get(feature_given_id, feature_given_id)
 
     # Find all results for this dataset
     results = (
@@ -468,90 +512,88 @@ def get_predictive_models_for_feature(
         .all()
     )
 
-    if not results:
-        return PredictiveModelsResponse(
-            actuals_dataset=IDAndName(id=dataset.id, name=dataset.name),
-            actuals_feature_given_id=feature_given_id,
-            actuals_feature_label=feature_label,
-            model_fits=[],
-        )
-
-    model_fits = []
+    model_fits_by_feature: dict[str, List[ModelFit]] = {
+        feature_given_id: [] for feature_given_id in feature_given_ids
+    }
     for result in results:
         sqlite_path = os.path.join(settings.filestore_location, result.filename)
 
         if not os.path.exists(sqlite_path):
             continue
 
-        model_fit_data = _read_model_fit_from_sqlite(sqlite_path, feature_given_id)
-        if model_fit_data is None:
-            continue
-
-        correlation, top_features = model_fit_data
-
-        model_fits.append(
-            ModelFit(
-                predictions_dataset=IDAndName(
-                    id=result.predictions_dataset.id,
-                    name=result.predictions_dataset.name,
-                ),
-                config_name=result.config.model_config_name,
-                config_description=result.config.model_config_description,
-                prediction_actual_correlation=correlation,
-                top_features=top_features,
-            )
+        model_fit_data = _read_model_fits_from_sqlite(
+            sqlite_path, list(model_fits_by_feature)
         )
 
-    return PredictiveModelsResponse(
-        actuals_dataset=IDAndName(id=dataset.id, name=dataset.name),
-        actuals_feature_given_id=feature_given_id,
-        actuals_feature_label=feature_label,
-        model_fits=model_fits,
-    )
-
-
-def _read_model_fit_from_sqlite(
-    sqlite_path: str, feature_given_id: str
-) -> Optional[tuple[float, List[PredictiveFeature]]]:
-    """Read model fit data from SQLite file"""
-    conn = sqlite3.connect(sqlite_path)
-    cursor = conn.cursor()
-
-    # Get correlation
-    cursor.execute(
-        "SELECT prediction_actual_correlation FROM model_fit WHERE actuals_feature_given_id = ?",
-        (feature_given_id,),
-    )
-    row = cursor.fetchone()
-    if row is None:
-        conn.close()
-        return None
-
-    correlation = row[0]
-
-    # Get top features
-    cursor.execute(
-        """
-        SELECT rank, feature_dataset_id, feature_given_id,
-               importance, correlation_with_actual
-        FROM top_features
-        WHERE actuals_feature_given_id = ?
-        ORDER BY rank
-    """,
-        (feature_given_id,),
-    )
-
-    top_features = []
-    for row in cursor.fetchall():
-        top_features.append(
-            PredictiveFeature(
-                rank=row[0],
-                feature_dataset_id=row[1],
-                feature_given_id=row[2],
-                importance=row[3],
-                correlation_with_actual=row[4],
+        for feature_given_id, (correlation, top_features) in model_fit_data.items():
+            model_fits_by_feature[feature_given_id].append(
+                ModelFit(
+                    predictions_dataset=IDAndName(
+                        id=result.predictions_dataset.id,
+                        name=result.predictions_dataset.name,
+                    ),
+                    config_name=result.config.model_config_name,
+                    config_description=result.config.model_config_description,
+                    prediction_actual_correlation=correlation,
+                    top_features=top_features,
+                )
             )
+
+    return [
+        PredictiveModelsResponse(
+            actuals_dataset=IDAndName(id=dataset.id, name=dataset.name),
+            actuals_feature_given_id=feature_given_id,
+            actuals_feature_label=labels_by_id.get(feature_given_id, feature_given_id),
+            model_fits=model_fits_by_feature[feature_given_id],
         )
+        for feature_given_id in feature_given_ids
+    ]
 
-    conn.close()
-    return correlation, top_features
+
+# stays well under sqlite's limit on the number of parameters in a query
+_MAX_QUERY_PARAMETERS = 500
+
+
+def _read_model_fits_from_sqlite(
+    sqlite_path: str, feature_given_ids: List[str]
+) -> Dict[str, tuple[float, List[PredictiveFeature]]]:
+    """Read model fit data for each of the given features found in the SQLite file"""
+    model_fits: Dict[str, tuple[float, List[PredictiveFeature]]] = {}
+
+    with get_sqlite_file_cache().open(sqlite_path) as conn:
+        for i in range(0, len(feature_given_ids), _MAX_QUERY_PARAMETERS):
+            batch = feature_given_ids[i : i + _MAX_QUERY_PARAMETERS]
+            placeholders = ", ".join("?" * len(batch))
+
+            # Get correlations
+            for feature_given_id, correlation in conn.execute(
+                f"SELECT actuals_feature_given_id, prediction_actual_correlation FROM model_fit WHERE actuals_feature_given_id IN ({placeholders})",
+                batch,
+            ):
+                model_fits[feature_given_id] = (correlation, [])
+
+            # Get top features
+            for row in conn.execute(
+                f"""
+                SELECT actuals_feature_given_id, rank, feature_dataset_id, feature_given_id,
+                       importance, correlation_with_actual
+                FROM top_features
+                WHERE actuals_feature_given_id IN ({placeholders})
+                ORDER BY actuals_feature_given_id, rank
+            """,
+                batch,
+            ):
+                model_fit = model_fits.get(row[0])
+                if model_fit is None:
+                    continue
+                model_fit[1].append(
+                    PredictiveFeature(
+                        rank=row[1],
+                        feature_dataset_id=row[2],
+                        feature_given_id=row[3],
+                        importance=row[4],
+                        correlation_with_actual=row[5],
+                    )
+                )
+
+    return model_fits
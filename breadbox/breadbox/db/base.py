@@ -8,6 +8,7 @@ from breadbox.models.dataset import (
     DatasetFeature,
     DatasetSample,
     DimensionType,
+    CatalogVersion,
 )
 from breadbox.models.group import Group, GroupEntry
 from breadbox.models.predictive_models import (
@@ -1,4 +1,7 @@
-from typing import Optional, Callable
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional, Callable, Tuple
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.engine import Engine
@@ -61,7 +64,9 @@ class SessionWithUser(Session):
             assert (
                 self.user is not None
             ), "User must be set on SessionWithUser before querying."
-            self.read_group_ids = get_read_access_group_ids(db=super(), user=self.user)
+            self.read_group_ids = get_read_access_group_ids(
+                db=super(), user=self.user, use_cache=not self.is_test_db_session
+            )
         return self.read_group_ids
 
     def reset_user(self, user):
@@ -102,21 +107,80 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.close()
 
 
-def SessionLocalWithUser(user: str) -> SessionWithUser:
-    settings = get_settings()
+@dataclass(frozen=True)
+class _EngineState:
+    key: Tuple[str, int]
+    engine: Engine
+    session_maker: sessionmaker
+
 
-    engine = create_engine(
+_engine_state: Optional[_EngineState] = None
+_engine_lock = threading.Lock()
+
+
+def _create_engine(settings) -> Engine:
+    pool_kwargs = {}
+    # in-memory sqlite databases can't use a QueuePool (each connection would be a different database)
+    if settings.sqlalchemy_database_url not in ("sqlite://", "sqlite:///:memory:"):
+        pool_kwargs = dict(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_pool_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+
+    return create_engine(
         settings.sqlalchemy_database_url,
         connect_args={"check_same_thread": False},
         future=True,
+        **pool_kwargs,
     )
 
-    l = sessionmaker(
-        autoflush=False,
-        bind=engine,
-        class_=SessionWithUser,
-        future=True,  # In SQLAlchemy 2.0, autocommit is deprecated
-    )
-    session = l()
-    session.set_user(user, l)
+
+def _get_engine_state() -> _EngineState:
+    """
+    Returns the engine (and the session factory bound to it) shared by every session in this process.
+
+    The engine is keyed by the database url and the pid: in tests the url changes from one test to the
+    next, and a process forked by a celery worker must not reuse connections opened by its parent.
+    """
+    global _engine_state
+
+    settings = get_settings()
+    key = (settings.sqlalchemy_database_url, os.getpid())
+
+    state = _engine_state
+    if state is not None and state.key == key:
+        return state
+
+    with _engine_lock:
+        state = _engine_state
+        if state is None or state.key != key:
+            if state is not None and state.key[1] == key[1]:
+                # the url changed, so we're done with the old database
+                state.engine.dispose()
+
+            engine = _create_engine(settings)
+            session_maker = sessionmaker(
+                autoflush=False,
+                bind=engine,
+                class_=SessionWithUser,
+                future=True,  # In SQLAlchemy 2.0, autocommit is deprecated
+            )
+            state = _EngineState(key, engine, session_maker)
+            _engine_state = state
+
+    return state
+
+
+def get_engine() -> Engine:
+    return _get_engine_state().engine
+
+
+def SessionLocalWithUser(user: str) -> SessionWithUser:
+    # Sessions are cheap, so one is created per request/task, but they all draw connections from
+    # the same pool. (Creating an engine per session would mean a new connection each time,
+    # re-running set_sqlite_pragma and throwing away sqlite's page cache.)
+    session_maker = _get_engine_state().session_maker
+    session = session_maker()
+    session.set_user(user, session_maker)
     return session
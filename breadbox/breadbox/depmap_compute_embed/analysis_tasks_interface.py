@@ -1,5 +1,17 @@
-from typing import Callable, Dict, List, Optional, Union, Protocol
-
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Protocol,
+)
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
 import numpy as np
@@ -25,6 +37,7 @@ class CustomAnalysisCallbacks(Protocol):
     ) -> str:
         ...
 
+    # called from a background thread, which reads the next batches while the current ones are processed
     def get_dataset_df(self, feature_matrix_indices: List[int]) -> np.ndarray:
         ...
 
@@ -81,6 +94,7 @@ def run_pearson_correlations(
     value_query_vector: Union[List[int], List[float]],
     features_df: FeaturesExtDataFrame,
     features_per_batch: int,
+    max_workers: int = 1,
 ) -> pd.DataFrame:
 
     assert np.isnan(value_query_vector).sum() == 0
@@ -89,8 +103,7 @@ def run_pearson_correlations(
 
     vector_for_pearson = np.asarray([value_query_vector], dtype=float).transpose()
 
-    def process_batch(batch):
-        dataset = callbacks.get_dataset_df(batch)
+    def process_batch(batch, dataset):
         batch_result_df = run_pearson(vector_for_pearson, dataset)
         batch_result_df.index = batch
         return batch_result_df
@@ -99,7 +112,9 @@ def run_pearson_correlations(
         features_df,
         features_per_batch,
         _make_progress_callback(callbacks, "Running Pearson correlation..."),
+        callbacks.get_dataset_df,
         process_batch,
+        max_workers=max_workers,
     )
 
     results_df = results_df[["Cor", "PValue", "numCellLines"]]
@@ -116,6 +131,7 @@ def run_linear_model_fits(
     features_df: FeaturesExtDataFrame,
     vector_is_dependent: bool,
     features_per_batch: int,
+    max_workers: int = 1,
 ):
     # only supporting AnalysisType.two_class
     assert vector_is_dependent is not None
@@ -124,9 +140,7 @@ def run_linear_model_fits(
 
     update_message("Running two class comparison...")
 
-    def process_batch(batch):
-        dataset = callbacks.get_dataset_df(batch)
-
+    def process_batch(batch, dataset):
         batch_result_df = _compute_lm_associations(
             dataset, value_query_vector, vector_is_dependent
         )
@@ -143,7 +157,9 @@ def run_linear_model_fits(
         features_df,
         features_per_batch,
         _make_progress_callback(callbacks, "Running linear model..."),
+        callbacks.get_dataset_df,
         process_batch,
+        max_workers=max_workers,
     )
 
     # rename columns
@@ -192,28 +208,68 @@ def write_custom_analysis_table(df, result_task_dir, effect_size_column):
     return data_json_file_path
 
 
+def _prefetch(
+    batches: Iterable[pd.Index],
+    read_batch: Callable[[List[int]], np.ndarray],
+    depth: int,
+) -> Iterator[Tuple[pd.Index, np.ndarray]]:
+    """
+    Yields each batch along with the values read_batch returns for it. The batches are read in order by a
+    background thread, which stays up to depth batches ahead of the consumer.
+    """
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, reader.submit(read_batch, batch)))
+            while len(pending) > depth:
+                batch, values = pending.popleft()
+                yield batch, values.result()
+        while len(pending) > 0:
+            batch, values = pending.popleft()
+            yield batch, values.result()
+
+
 def _process_features_in_batches(
     features_df: FeaturesExtDataFrame,
     features_per_batch: int,
     progress_callback: Callable[[float], None],
-    process_batch: Callable[[List[int]], pd.DataFrame],
+    read_batch: Callable[[List[int]], np.ndarray],
+    process_batch: Callable[[pd.Index, np.ndarray], pd.DataFrame],
+    max_workers: int = 1,
 ):
+    """
+    Reads the data of each batch of features with read_batch and computes its results with process_batch.
+    The next batches are read on a background thread while a pool of max_workers threads processes the
+    ones already read, so at most 2 * max_workers + 1 batches are in memory at a time. progress_callback is
+    only called from the calling thread.
+    """
     batches = []
     for batch_start in range(0, len(features_df), features_per_batch):
         batch_end = min(batch_start + features_per_batch, len(features_df))
         batches.append(features_df.index[batch_start:batch_end])
 
     results = []
-    for i, batch in enumerate(batches):
-        progress_callback(i / len(batches))
 
-        batch_result_df = process_batch(batch)
+    def add_result(batch, batch_result):
+        progress_callback(len(results) / len(batches))
+
+        batch_result_df = batch_result.result()
 
         # the index of each row should match up with the indices in batch. (They might be a subset if process_batch does not return a row for each feature, but there should never be any extra)
         assert set(batch_result_df.index).issubset(batch)
 
         results.append(batch_result_df)
 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for batch, dataset in _prefetch(batches, read_batch, max_workers):
+            pending.append((batch, executor.submit(process_batch, batch, dataset)))
+            # results are collected in order, so the combined table doesn't depend on max_workers
+            while len(pending) > max_workers:
+                add_result(*pending.popleft())
+        while len(pending) > 0:
+            add_result(*pending.popleft())
+
     # combine the tables from each batch.
     results_df = pd.concat(results)
     return results_df
@@ -274,11 +330,13 @@ def run_custom_analysis(
     use_feature_ids: bool,
     callbacks: CustomAnalysisCallbacks,
     features_per_batch: int,
+    max_workers: int = 1,
 ):
     """
     Notes:
         - lm and pearson will both run with only 2 points. pearson will just return cor 1, and p val and q val NaN
         - if there is only 1 point (e.g. due to NaNs), the code will leave out the entity. lmstats and pearson each individually drop it before the merge
+        - max_workers is the number of threads computing batches while the next batches are read
     """
     update_message = callbacks.update_message
 
@@ -301,7 +359,11 @@ def run_custom_analysis(
 
     if analysis_type == AnalysisType.pearson:
         df = run_pearson_correlations(
-            callbacks, value_query_vector, features_df, features_per_batch,
+            callbacks,
+            value_query_vector,
+            features_df,
+            features_per_batch,
+            max_workers=max_workers,
         )
         effect_size_column = "Cor"
     else:
@@ -312,6 +374,7 @@ def run_custom_analysis(
             features_df,
             vector_is_dependent,
             features_per_batch,
+            max_workers=max_workers,
         )
         effect_size_column = "EffectSize"
 
@@ -1,12 +1,14 @@
 from dataclasses import dataclass
+import math
 
 # Note: There is another python implementation of JsonLogic floating out there.
 # It looks very robust but it's 10 times slower! I've decided against using it
 # but it serves as a good reference for patching operators:
 # https://github.com/panzi/panzi-json-logic
 from json_logic import jsonLogic, operations  # type: ignore
+import numpy as np
 import pandas as pd
-from typing import Callable
+from typing import Any, Callable, Optional, Union
 
 from breadbox.depmap_compute_embed.slice import SliceQuery
 
@@ -211,12 +213,13 @@ class ContextEvaluator:
         Returns all matching IDs and labels for this context's dimension_type.
         """
         all_labels_by_id = self._get_labels_by_id(self.dimension_type)
-        matching_ids = []
-        matching_labels = []
-        for given_id, label in all_labels_by_id.items():
-            if self._is_match(given_id):
-                matching_ids.append(given_id)
-                matching_labels.append(label)
+        given_ids = list(all_labels_by_id)
+        matching_ids = [
+            given_id
+            for given_id, is_match in zip(given_ids, self._match(given_ids))
+            if is_match
+        ]
+        matching_labels = [all_labels_by_id[given_id] for given_id in matching_ids]
 
         return ContextMatch(
             ids=matching_ids,
@@ -226,8 +229,22 @@ class ContextEvaluator:
 
     def _evaluate_ids(self) -> list[str]:
         """Used internally for resolving nested context references."""
-        all_labels_by_id = self._get_labels_by_id(self.dimension_type)
-        return [cid for cid in all_labels_by_id if self._is_match(cid)]
+        given_ids = list(self._get_labels_by_id(self.dimension_type))
+        return [
+            cid for cid, is_match in zip(given_ids, self._match(given_ids)) if is_match
+        ]
+
+    def _match(self, given_ids: list) -> np.ndarray:
+        """
+        Evaluates `expr` for all of `given_ids` at once, returning a boolean
+        mask. Expressions which can't be vectorized with exactly the same
+        semantics as JsonLogic (see _MaskEvaluation) are evaluated one id at a
+        time with _is_match instead.
+        """
+        try:
+            return _MaskEvaluation(given_ids, self.slice_data).evaluate(self.expr)
+        except _Unvectorizable:
+            return np.array([self._is_match(cid) for cid in given_ids], dtype=bool)
 
     def _is_match(self, given_id: str) -> bool:
         """
@@ -455,3 +472,319 @@ def _resolve_complements(expr):
     if isinstance(expr, list):
         return [_resolve_complements(x) for x in expr]
     return expr
+
+
+class _Unvectorizable(Exception):
+    """
+    Raised when an expression can't be evaluated as masks with exactly the
+    semantics JsonLogic would have given it, so it has to be evaluated one id
+    at a time instead.
+    """
+
+
+# Operators which _MaskEvaluation knows how to vectorize. Anything else (ie:
+# "if", "cat", "+") falls back to evaluating one id at a time.
+_VECTORIZED_OPS = {
+    "==",
+    "!=",
+    "<",
+    ">",
+    "<=",
+    ">=",
+    "in",
+    "!in",
+    "in_context",
+    "!in_context",
+    "has_any",
+    "!has_any",
+    "is_null",
+    "not_null",
+    "!",
+    "!!",
+    "and",
+    "or",
+}
+
+# Operators which, given a number on one side, compare as floats on the other.
+# Maps each to the equivalent numpy ufunc, with the var on the left hand side.
+_NUMERIC_COMPARISONS = {
+    "==": np.equal,
+    "<": np.less,
+    ">": np.greater,
+    "<=": np.less_equal,
+    ">=": np.greater_equal,
+}
+_FLIPPED_COMPARISONS = {"==": "==", "<": ">", ">": "<", "<=": ">=", ">=": "<="}
+
+# Integers beyond this lose precision when converted to float64
+_MAX_EXACT_INT = 2 ** 53
+
+
+def _is_plain_number(value) -> bool:
+    if type(value) is float:
+        return True
+    return type(value) is int and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT
+
+
+def _distinct_key(value):
+    """
+    A hashable key which is only shared by values JsonLogic can't tell apart.
+    The type is part of the key since, for instance, 1, 1.0 and True compare as
+    equal but stringify differently (which is what "==" against a string does).
+    """
+    if type(value) is str:
+        return value
+    if isinstance(value, float):
+        # -0.0 == 0.0 but str(-0.0) != str(0.0)
+        return (type(value), value, math.copysign(1.0, value))
+    if isinstance(value, list):
+        return (list, tuple(_distinct_key(x) for x in value))
+    key = (type(value), value)
+    try:
+        hash(key)
+    except TypeError:
+        return (object, id(value))
+    return key
+
+
+class _Column:
+    """
+    Some per-id values (a var or the result of an operator applied to one),
+    aligned to the ids being evaluated. They're stored as the list of distinct
+    `uniques` and the position of each id's value in it, so operators only need
+    to be applied once per distinct value.
+    """
+
+    def __init__(self, uniques: list, codes: np.ndarray):
+        self.uniques = uniques
+        self.codes = codes
+
+    @staticmethod
+    def from_values(values: list) -> "_Column":
+        uniques: list = []
+        positions: dict = {}
+        codes = []
+        for value in values:
+            key = _distinct_key(value)
+            position = positions.get(key)
+            if position is None:
+                position = positions[key] = len(uniques)
+                uniques.append(value)
+            codes.append(position)
+        return _Column(uniques, np.array(codes, dtype=np.intp))
+
+    @staticmethod
+    def from_mask(mask: np.ndarray) -> "_Column":
+        return _Column([False, True], mask.astype(np.intp))
+
+    def is_bool(self) -> bool:
+        return all(type(x) is bool for x in self.uniques)
+
+    def to_mask(self) -> np.ndarray:
+        """The truthiness of each id's value"""
+        try:
+            truthy = np.array([bool(x) for x in self.uniques], dtype=bool)
+        except Exception as e:
+            raise _Unvectorizable() from e
+        return truthy[self.codes]
+
+    def as_floats(self) -> Optional[np.ndarray]:
+        """The uniques as floats (with None as NaN), if they're all numbers"""
+        if not all(x is None or _is_plain_number(x) for x in self.uniques):
+            return None
+        return np.array(
+            [np.nan if x is None else float(x) for x in self.uniques], dtype=float
+        )
+
+    def map(self, f: Callable[[Any], Any]) -> "_Column":
+        try:
+            results = [f(x) for x in self.uniques]
+        except Exception as e:
+            # the same error will be raised (and reported for the id which
+            # caused it) when falling back to evaluating one id at a time
+            raise _Unvectorizable() from e
+        if all(type(x) is bool for x in results):
+            return _Column.from_mask(np.array(results, dtype=bool)[self.codes])
+        return _Column(results, self.codes)
+
+
+@dataclass
+class _Constant:
+    """The value of a subexpression which doesn't depend on the id"""
+
+    value: Any
+
+
+def _hashed(values: list) -> Optional[frozenset]:
+    try:
+        return frozenset(values)
+    except TypeError:
+        return None
+
+
+def _membership_test(op: str, b: list) -> Optional[Callable[[Any], bool]]:
+    """
+    For an operator testing membership of a var in a constant list (ie: a
+    resolved context), a function which answers it with a set lookup rather
+    than scanning the list for every value.
+    """
+    b_set = _hashed(b)
+    if b_set is None:
+        return None
+
+    def contains(a) -> bool:
+        try:
+            return a in b_set
+        except TypeError:
+            # unhashable values (which can't be in b_set) still need the
+            # list's `==` semantics
+            return a in b
+
+    if op == "in":
+        return contains
+    if op == "in_context":
+        return lambda a: (
+            not b_set.isdisjoint(set(a))
+            if isinstance(a, list)
+            else a is not None and contains(a)
+        )
+    if op == "has_any":
+        return lambda a: (
+            not b_set.isdisjoint(set(a)) if isinstance(a, list) else False
+        )
+    return None
+
+
+class _MaskEvaluation:
+    """
+    Evaluates a (desugared) context expression for many ids at once.
+
+    Each subexpression evaluates to either a _Constant or a _Column, and
+    operators are applied to the distinct values of their var rather than to
+    each id. Comparisons of numbers and membership tests against lists are
+    vectorized further with numpy and sets. Operators are otherwise applied
+    using the same JsonLogic functions as _is_match, so the results are the
+    same by construction. Anything which can't be evaluated that way (ie:
+    operators comparing two vars, or which raise an error) raises
+    _Unvectorizable.
+    """
+
+    def __init__(self, given_ids: list, slice_data: dict[str, dict]):
+        self.given_ids = given_ids
+        self.slice_data = slice_data
+        self._columns: dict[str, _Column] = {}
+
+    def evaluate(self, expr) -> np.ndarray:
+        result = self._evaluate(expr)
+        if isinstance(result, _Constant):
+            return np.full(len(self.given_ids), bool(result.value), dtype=bool)
+        return result.to_mask()
+
+    def _get_column(self, var_name) -> _Column:
+        var_name = str(var_name)
+        column = self._columns.get(var_name)
+        if column is None:
+            if var_name in self.slice_data:
+                slice_values = self.slice_data[var_name]
+                values = [slice_values.get(cid) for cid in self.given_ids]
+            elif var_name == "given_id":
+                values = self.given_ids
+            else:
+                raise _Unvectorizable()
+            column = _Column.from_values(values)
+            self._columns[var_name] = column
+        return column
+
+    def _evaluate(self, node) -> Union[_Constant, _Column]:
+        if not isinstance(node, dict):
+            return _Constant(node)
+        if len(node) == 0:
+            raise _Unvectorizable()
+
+        op = next(iter(node))
+        args = node[op]
+        if not isinstance(args, (list, tuple)):
+            args = [args]
+
+        if op == "var":
+            if not 1 <= len(args) <= 2 or any(isinstance(x, dict) for x in args):
+                raise _Unvectorizable()
+            var_name = args[0]
+            if not isinstance(var_name, (str, int)) or "." in str(var_name):
+                raise _Unvectorizable()
+            return self._get_column(var_name)
+
+        if op not in _VECTORIZED_OPS:
+            raise _Unvectorizable()
+        values = [self._evaluate(x) for x in args]
+
+        if op in ("and", "or"):
+            return self._evaluate_and_or(op, values)
+
+        columns = [x for x in values if isinstance(x, _Column)]
+        if len(columns) == 0:
+            try:
+                return _Constant(operations[op](*[x.value for x in values]))
+            except Exception as e:
+                raise _Unvectorizable() from e
+        if len(columns) > 1:
+            raise _Unvectorizable()
+
+        column = columns[0]
+        position = next(i for i, x in enumerate(values) if x is column)
+        constants = [x.value if isinstance(x, _Constant) else None for x in values]
+        if len(values) == 2:
+            fast = self._evaluate_binary(op, column, position, constants[1 - position])
+            if fast is not None:
+                return fast
+
+        func = operations[op]
+
+        def apply(value):
+            constants[position] = value
+            return func(*constants)
+
+        return column.map(apply)
+
+    def _evaluate_and_or(self, op: str, values: list) -> Union[_Constant, _Column]:
+        # JsonLogic's and/or return one of their operands rather than a bool,
+        # which is only the same as combining masks when every operand is a bool
+        masks = []
+        for value in values:
+            if isinstance(value, _Constant):
+                if type(value.value) is not bool:
+                    raise _Unvectorizable()
+                masks.append(np.full(len(self.given_ids), value.value, dtype=bool))
+            else:
+                if not value.is_bool():
+                    raise _Unvectorizable()
+                masks.append(value.to_mask())
+        if len(masks) == 0:
+            return _Constant(op == "and")
+        combine = np.logical_and if op == "and" else np.logical_or
+        return _Column.from_mask(combine.reduce(masks))
+
+    def _evaluate_binary(
+        self, op: str, column: _Column, position: int, constant
+    ) -> Optional[_Column]:
+        """
+        Vectorized versions of binary operators between a var and a constant,
+        or None if there isn't one for these operands.
+        """
+        if op in _NUMERIC_COMPARISONS and _is_plain_number(constant):
+            floats = column.as_floats()
+            if floats is None:
+                return None
+            # with a number on either side, JsonLogic compares both as floats,
+            # where None (and NaN) never compares as less, greater or equal
+            if position == 1:
+                op = _FLIPPED_COMPARISONS[op]
+            results = _NUMERIC_COMPARISONS[op](floats, float(constant))
+            return _Column.from_mask(results[column.codes])
+
+        if position == 0 and isinstance(constant, list):
+            contains = _membership_test(op, constant)
+            if contains is not None:
+                return column.map(contains)
+
+        return None
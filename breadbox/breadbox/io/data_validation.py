@@ -3,10 +3,13 @@ from dataclasses import dataclass
 from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Callable
 import io
 import json
+import os
+import tempfile
 
 import numpy as np
 import pandas as pd
 import pandera as pa
+import pyarrow
 from pandera.errors import SchemaError, SchemaErrorReason
 from fastapi import UploadFile
 from sqlalchemy import and_, or_
@@ -14,6 +17,7 @@ import logging
 
 from .hdf5_value_mapping import get_encoder_function
 from .hdf5_value_mapping import _parse_list_strings
+from .parquet_utils import write_matrix_csv_as_parquet
 
 log = logging.getLogger(__name__)
 
@@ -37,8 +41,6 @@ from breadbox.schemas.custom_http_exception import (
     AnnotationValidationError,
     UserError,
 )
-from typing import cast
-
 from breadbox.schemas.dataset import ColumnMetadata
 from ..crud.dimension_types import get_dimension_type
 
@@ -199,37 +201,41 @@ def _read_parquet(file) -> ParquetDataFrameWrapper:
     return parquet_wrapper
 
 
-def _read_csv(file: BinaryIO, value_type: ValueType) -> PandasDataFrameWrapper:
-    # When pandas reads non-unique columns from a CSV, it mangles them to make them unique.
-    # As a workaround, load and validate the columns first using csv.DictReader.
+def _read_csv(
+    file: BinaryIO, value_type: ValueType, temp_dir: Optional[str] = None
+) -> ParquetDataFrameWrapper:
+    """
+    Parse a matrix CSV (whose first column is the index) into a temporary parquet file, in parallel and without
+    loading the whole matrix into memory. Raises a ValueError if the values can't be parsed as value_type.
+    """
+    # Columns are parsed and stored by name, so make sure the names are unique first
     text_io = io.TextIOWrapper(file, encoding="utf-8")
-    dict_reader = csv.DictReader(text_io)
-    headers = dict_reader.fieldnames
-    if headers and len(set(headers)) != len(headers):
+    headers = next(csv.reader(text_io), None)
+    # detach so that the wrapper doesn't close file when it's garbage collected
+    text_io.detach()
+    if headers is None:
+        raise FileValidationError("The file is empty.")
+    if len(set(headers)) != len(headers):
         raise FileValidationError(f"Make sure all column names are unique.")
 
-    # Reset the cursor and read the file into a dataframe
-    file.seek(0)
-    cols = pd.read_csv(file, nrows=0).columns
-
     if value_type == ValueType.continuous:
-        dtypes_ = dict(zip(cols, ["string"] + (["Float64"] * (len(cols) - 1))))
+        arrow_type = pyarrow.float64()
     elif value_type == ValueType.categorical or value_type == ValueType.list_strings:
-        dtypes_ = dict(zip(cols, ["string"] * len(cols)))
+        arrow_type = pyarrow.string()
     else:
         raise ValueError(f"Invalid value type: {value_type}")
 
-    dtypes = cast(Dict[str, str], dtypes_)
-
     file.seek(0)
-
-    # may throw a ValueError as well
-    df = pd.read_csv(file, dtype=dtypes)  # pyright: ignore
-
-    # set the first column as index
-    df.set_index(df.columns[0], inplace=True)
-
-    return PandasDataFrameWrapper(df)
+    # deleted as soon as it's closed
+    parquet_file = tempfile.TemporaryFile(suffix=".parquet", dir=temp_dir)
+    try:
+        # may throw a ValueError as well
+        write_matrix_csv_as_parquet(file, parquet_file, headers, arrow_type)
+        parquet_file.seek(0)
+        return ParquetDataFrameWrapper(parquet_file)
+    except BaseException:
+        parquet_file.close()
+        raise
 
 
 def _validate_data_file(
@@ -529,7 +535,9 @@ def read_and_validate_matrix_df(
     elif data_file_format == "csv":
         try:
             with open(file_path, "rb") as fd:
-                df_wrapper = _read_csv(fd, value_type)
+                df_wrapper = _read_csv(
+                    fd, value_type, temp_dir=os.path.dirname(file_path)
+                )
         except ValueError as e:
             raise FileValidationError(str(e))
     else:
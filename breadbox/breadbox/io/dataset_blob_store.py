@@ -0,0 +1,114 @@
+"""
+A content addressed store of matrix dataset files, so that re-uploading a matrix which was uploaded before (ie: an
+unchanged dataset in a new release) links to the existing file instead of validating and converting it again.
+
+Each blob is keyed by a hash of the uploaded file's contents and of every parameter which changes how it's
+converted. A dataset's data file is a hard link to its blob, so the link count of a blob is its reference count:
+deleting a dataset removes one link, and the blob is removed along with the last dataset linking to it. On
+filesystems without hard links, nothing is stored and every upload is converted.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional
+
+from breadbox.io.hdf5_utils import HDF5StorageOptions
+from breadbox.schemas.dataset import ValueType
+
+log = logging.getLogger(__name__)
+
+BLOBS_DIR = "blobs"
+# written next to a dataset's data file, if that file is linked to a blob
+BLOB_KEY_FILE = "blob_key"
+
+# bump this when a change to validation or conversion changes the files written for the same upload
+BLOB_KEY_VERSION = 1
+
+
+def get_matrix_blob_key(
+    content_md5: str,
+    value_type: ValueType,
+    allowed_values: Optional[List[str]],
+    data_file_format: str,
+    storage: HDF5StorageOptions,
+) -> str:
+    parameters = {
+        "version": BLOB_KEY_VERSION,
+        "md5": content_md5,
+        "value_type": value_type.value,
+        "allowed_values": allowed_values,
+        "data_file_format": data_file_format,
+        "storage": {
+            "layout_version": storage.layout_version,
+            "row_chunked_copy": storage.row_chunked_copy,
+            "compression": storage.compression,
+            "compression_level": storage.compression_level,
+            "float32": storage.float32,
+        },
+    }
+    return hashlib.sha256(
+        json.dumps(parameters, sort_keys=True).encode("utf8")
+    ).hexdigest()
+
+
+def _get_blob_path(filestore_location: str, key: str) -> str:
+    return os.path.join(filestore_location, BLOBS_DIR, key[:2], key)
+
+
+def _write_blob_key(data_path: str, key: str):
+    with open(os.path.join(os.path.dirname(data_path), BLOB_KEY_FILE), "wt") as fd:
+        fd.write(key)
+
+
+def link_to_blob(filestore_location: str, key: str, data_path: str) -> bool:
+    """
+    Creates data_path as a link to the blob stored under key. Returns False (without creating anything) if there
+    is no such blob.
+    """
+    try:
+        os.link(_get_blob_path(filestore_location, key), data_path)
+    except FileNotFoundError:
+        return False
+    _write_blob_key(data_path, key)
+    return True
+
+
+def store_blob(filestore_location: str, key: str, data_path: str):
+    """Stores the dataset file in data_path (which was converted from the upload identified by key) as a blob"""
+    blob_path = _get_blob_path(filestore_location, key)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    try:
+        os.link(data_path, blob_path)
+    except FileExistsError:
+        # stored by a concurrent upload of the same file
+        return
+    except OSError:
+        log.warning("Could not link %s to %s", data_path, blob_path, exc_info=True)
+        return
+    _write_blob_key(data_path, key)
+
+
+def release_blob(filestore_location: str, data_path: str):
+    """
+    Called before the dataset file in data_path is deleted or replaced. Deletes the blob it's linked to, if no
+    other dataset is linked to it, and forgets the link.
+    """
+    key_path = os.path.join(os.path.dirname(data_path), BLOB_KEY_FILE)
+    try:
+        with open(key_path, "rt") as fd:
+            key = fd.read().strip()
+    except FileNotFoundError:
+        return
+    os.unlink(key_path)
+
+    blob_path = _get_blob_path(filestore_location, key)
+    try:
+        blob_stat = os.stat(blob_path)
+        data_stat = os.stat(data_path)
+    except FileNotFoundError:
+        return
+
+    # the blob's links are itself and this dataset's file
+    if os.path.samestat(blob_stat, data_stat) and blob_stat.st_nlink <= 2:
+        os.unlink(blob_path)
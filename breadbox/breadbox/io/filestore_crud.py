@@ -1,24 +1,31 @@
 import os
 import shutil
-import json
-from typing import Any, List, Optional, Union, Callable
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
 from ..schemas.dataframe_wrapper import DataFrameWrapper
 from ..models.dataset import Dataset, MatrixDataset, ValueType
 from .hdf5_utils import (
+    HDF5StorageOptions,
     write_hdf5_file,
     read_hdf5_file,
+    read_hdf5_values,
+    get_hdf5_file_matrix_size,
+    rewrite_hdf5_file_layout,
 )
 from .hdf5_value_mapping import get_decoder_function
-from .hdf5_utils import write_hdf5_file, read_hdf5_file, get_hdf5_file_matrix_size
+from .hdf5_file_cache import get_hdf5_file_cache
+from .parquet_utils import write_tabular_parquet_file, read_tabular_parquet_file
+from . import dataset_blob_store
 from breadbox.schemas.custom_http_exception import (
     SampleNotFoundError,
     FeatureNotFoundError,
 )
 
 DATA_FILE: str = "data.hdf5"
+TABULAR_DATA_FILE: str = "data.parquet"
 
 
 def save_dataset_file(
@@ -27,6 +34,7 @@ def save_dataset_file(
     value_type: ValueType,
     map_values: Optional[Callable[[pd.DataFrame], pd.DataFrame]],
     filestore_location: str,
+    storage: Optional[HDF5StorageOptions] = None,
 ):
     base_path = os.path.join(filestore_location, dataset_id)
     os.makedirs(base_path)
@@ -41,9 +49,101 @@ def save_dataset_file(
         df_wrapper,
         dtype,
         map_values if map_values is not None else lambda x: x,
+        storage=storage,
+    )
+
+
+def link_dataset_file_to_blob(
+    dataset_id: str, blob_key: str, filestore_location: str
+) -> bool:
+    """
+    Use the stored copy of a matrix which was uploaded before (see dataset_blob_store) as the dataset's file.
+    Returns False if there's no stored copy.
+    """
+    base_path = os.path.join(filestore_location, dataset_id)
+    os.makedirs(base_path)
+    if not dataset_blob_store.link_to_blob(
+        filestore_location,
+        blob_key,
+        get_file_location(dataset_id, filestore_location, DATA_FILE),
+    ):
+        os.rmdir(base_path)
+        return False
+    return True
+
+
+def get_dataset_file_labels(
+    dataset_id: str, filestore_location: str
+) -> Tuple[List[str], List[str]]:
+    """Returns the (feature, sample) given IDs stored in a matrix dataset's file"""
+    path = get_file_location(dataset_id, filestore_location, DATA_FILE)
+    with get_hdf5_file_cache().open(path) as cached:
+        return (
+            cached.get_labels("features").tolist(),
+            cached.get_labels("samples").tolist(),
+        )
+
+
+def store_dataset_file_blob(dataset_id: str, blob_key: str, filestore_location: str):
+    """Keep the dataset's file, so that later uploads of the same matrix can link to it"""
+    dataset_blob_store.store_blob(
+        filestore_location,
+        blob_key,
+        get_file_location(dataset_id, filestore_location, DATA_FILE),
     )
 
 
+def rewrite_dataset_file_layout(
+    dataset_id: str, filestore_location: str, storage: HDF5StorageOptions
+):
+    """
+    Rewrite a matrix dataset's file using the given storage layout. The rewritten file is no longer a copy of the
+    stored upload it may be linked to, so the dataset stops using that blob (deleting it if nothing else links to it).
+    """
+    path = get_file_location(dataset_id, filestore_location, DATA_FILE)
+    dataset_blob_store.release_blob(filestore_location, path)
+    rewrite_hdf5_file_layout(path, storage)
+
+
+def save_tabular_dataset_file(
+    dataset_id: str,
+    index_given_ids: List[str],
+    values_by_column: Dict[str, List[Optional[str]]],
+    filestore_location: str,
+):
+    """
+    Write the columnar copy of a tabular dataset's cells. Reads of whole columns (or of a subset of rows)
+    use this file rather than reassembling the table from one TabularCell row per value.
+    """
+    write_tabular_parquet_file(
+        get_file_location(dataset_id, filestore_location, TABULAR_DATA_FILE),
+        index_given_ids,
+        values_by_column,
+    )
+
+
+def has_tabular_dataset_file(dataset_id: str, filestore_location: str) -> bool:
+    return os.path.exists(
+        get_file_location(dataset_id, filestore_location, TABULAR_DATA_FILE)
+    )
+
+
+def get_tabular_subset(
+    dataset: Union[Dataset, str],
+    filestore_location: str,
+    column_names: Optional[List[str]],
+    index_given_ids: Optional[List[str]],
+) -> Optional[pd.DataFrame]:
+    """
+    Read a subset of a tabular dataset from its columnar file. Returns None if the dataset doesn't have
+    one (ie: it was uploaded before tabular datasets had a columnar copy and hasn't been migrated yet)
+    """
+    path = get_file_location(dataset, filestore_location, TABULAR_DATA_FILE)
+    if not os.path.exists(path):
+        return None
+    return read_tabular_parquet_file(path, column_names, index_given_ids)
+
+
 def get_file_location(
     dataset: Union[Dataset, str], filestore_location: str, file_name: str = DATA_FILE,
 ):
@@ -75,22 +175,101 @@ def get_slice(
     )
 
     value_mapping = _identity_if_none(
-        get_decoder_function(dataset.value_type, dataset.allowed_values)
+        get_decoder_function(dataset.value_type, dataset.allowed_values, dataset.id)
     )
 
     return value_mapping(df)
 
 
-MAX_MEMORY_PER_CHUNK = 1024 * 1024 * 300  # 50 MB
+def get_slice_values(
+    dataset: MatrixDataset,
+    feature_indexes: List[int],
+    sample_indexes: List[int],
+    filestore_location: str,
+) -> np.ndarray:
+    """
+    Reads the values at the given (sorted) indexes of a continuous dataset straight into a (samples, features)
+    float64 array, keeping NaNs. Faster than get_slice when the labels aren't needed.
+    """
+    if dataset.value_type != ValueType.continuous:
+        raise ValueError(
+            f"Cannot read the values of non-continuous dataset {dataset.id} as floats"
+        )
+    return read_hdf5_values(
+        get_file_location(dataset, filestore_location), feature_indexes, sample_indexes
+    )
+
+
+MAX_MEMORY_PER_CHUNK = 1024 * 1024 * 300  # 300 MB
 # MAX_MEMORY_PER_CHUNK = 1024 * 1024 * 50  # 50 MB
 
+# the size of each block read by iter_slice_blocks, which bounds the memory used while streaming a slice
+# which may be much larger than the MAX_HDF5_READ_IN_BYTES limit on a single read. Serializing a block (ie: to
+# JSON) takes several times the size of the block itself, so this is kept small.
+MAX_STREAMED_BLOCK_IN_BYTES = 1024 * 1024 * 16  # 16 MB
+
 
 def _chunk(values, per_chunk_size):
     for i in range(0, len(values), per_chunk_size):
         yield values[i : i + per_chunk_size]
 
 
-import numpy as np
+def iter_slice_blocks(
+    dataset: MatrixDataset,
+    feature_indexes: Optional[List[int]],
+    sample_indexes: Optional[List[int]],
+    filestore_location: str,
+    axis: Literal["features", "samples"] = "features",
+    max_block_bytes: int = MAX_STREAMED_BLOCK_IN_BYTES,
+    keep_nans: Optional[bool] = False,
+    indices_as_index: bool = False,
+    decode: bool = True,
+) -> Iterator[pd.DataFrame]:
+    """
+    Like get_slice, but returns the slice as a sequence of dataframes, each holding a block of the
+    features (columns) or samples (rows) which is at most max_block_bytes. Concatenating the blocks
+    along that axis gives the same dataframe as get_slice, but only one block is in memory at a time.
+
+    Everything needed from the dataset is looked up before this returns, so the blocks can be consumed
+    after the db session which loaded the dataset has been closed (ie: by a StreamingResponse). If decode is False,
+    the values are returned as they are stored in the file (see hdf5_value_mapping).
+    """
+    path = get_file_location(dataset, filestore_location)
+    value_mapping = _identity_if_none(
+        get_decoder_function(dataset.value_type, dataset.allowed_values, dataset.id)
+        if decode
+        else None
+    )
+
+    row_count, col_count = get_hdf5_file_matrix_size(path)
+    if feature_indexes is None:
+        feature_indexes = list(range(col_count))
+    if sample_indexes is None:
+        sample_indexes = list(range(row_count))
+    feature_indexes = sorted(feature_indexes)
+    sample_indexes = sorted(sample_indexes)
+
+    if axis == "features":
+        blocked_indexes, other_length = feature_indexes, len(sample_indexes)
+    else:
+        assert axis == "samples"
+        blocked_indexes, other_length = sample_indexes, len(feature_indexes)
+    per_block = max(1, max_block_bytes // (max(1, other_length) * 8))
+
+    def read_blocks():
+        for block in _chunk(blocked_indexes, per_block):
+            df = read_hdf5_file(
+                path,
+                feature_indexes=block if axis == "features" else feature_indexes,
+                sample_indexes=block if axis == "samples" else sample_indexes,
+                keep_nans=keep_nans,
+                indices_as_index=indices_as_index,
+            )
+            yield value_mapping(df)
+
+    return read_blocks()
+
+
 import logging
 
 log = logging.getLogger(__name__)
@@ -119,14 +298,14 @@ def read_chunked_feature_data(
 
     for feature_indexes in _chunk(np.arange(shape[1]), columns_per_chunk):
         start = time.time()
-        log.warning("starting read")
         df = read_hdf5_file(hdf5_path, feature_indexes=feature_indexes,)
-        log.warning("completed read")
         time_spent_reading += time.time() - start
 
-        df = get_df_by_value_type(df, dataset.value_type, dataset.allowed_values)
+        df = get_df_by_value_type(
+            df, dataset.value_type, dataset.allowed_values, dataset.id
+        )
         yield df
-    log.warning(f"{time_spent_reading} seconds spent reading")
+    log.debug(f"{time_spent_reading} seconds spent reading")
 
 
 def get_feature_slice(
@@ -144,7 +323,7 @@ def get_feature_slice(
     )
 
     value_mapping = _identity_if_none(
-        get_decoder_function(dataset.value_type, dataset.allowed_values)
+        get_decoder_function(dataset.value_type, dataset.allowed_values, dataset.id)
     )
 
     return value_mapping(df)
@@ -165,7 +344,7 @@ def get_sample_slice(
     )
 
     value_mapping = _identity_if_none(
-        get_decoder_function(dataset.value_type, dataset.allowed_values)
+        get_decoder_function(dataset.value_type, dataset.allowed_values, dataset.id)
     )
 
     return value_mapping(df)
@@ -175,22 +354,26 @@ def get_df_by_value_type(
     df: pd.DataFrame,
     value_type: Optional[ValueType],
     dataset_allowed_values: Optional[Any],
+    dataset_id: Optional[str] = None,
 ):
-    if value_type == ValueType.categorical:
-        assert dataset_allowed_values
-        dataset_allowed_values.append(None)
-        # Convert numerical values back to origincal categorical value
-        df = df.astype(int)
-        assert isinstance(df, pd.DataFrame)
-        df = df.applymap(lambda x: dataset_allowed_values[x])
-    elif value_type == ValueType.list_strings:
-        # NOTE: String data in HDF5 datasets is read as bytes by default
-        # len of byte encoded empty string should be 0
-        assert isinstance(df, pd.DataFrame)
-        df = df.applymap(lambda x: json.loads(x) if len(x) != 0 else None)
-    return df
+    if value_type is None or value_type == ValueType.continuous:
+        return df
+    # NOTE: categorical values are stored as indexes into the allowed values, and list_strings values are stored as
+    # json, which is read as bytes
+    decode = get_decoder_function(value_type, dataset_allowed_values, dataset_id)
+    assert decode is not None
+    return decode(df)
+
+
+def has_data_files(dataset_id: str, filestore_location: str) -> bool:
+    return os.path.isdir(os.path.join(filestore_location, dataset_id))
+
 
 def delete_data_files(dataset_id: str, filestore_location: str):
     base_path = os.path.join(filestore_location, dataset_id)
     assert os.path.isdir(base_path)
+    get_hdf5_file_cache().evict_under(base_path)
+    dataset_blob_store.release_blob(
+        filestore_location, get_file_location(dataset_id, filestore_location, DATA_FILE)
+    )
     shutil.rmtree(base_path)
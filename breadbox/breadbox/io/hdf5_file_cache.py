@@ -0,0 +1,179 @@
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+import h5py
+import numpy as np
+
+from breadbox.utils.fork_safe import ForkSafe
+
+# rough per-string overhead of a python str object, used when estimating how much memory
+# the decoded label indexes are using
+_STR_OVERHEAD_IN_BYTES = 50
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_CHUNK_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class CachedHDF5File:
+    """
+    An open, read-only HDF5 file along with lazily decoded copies of its feature and sample labels.
+    Instances are shared between callers, so they must not be closed by anything other than the cache.
+    """
+
+    def __init__(self, path: str, version: Tuple, chunk_cache_bytes: int):
+        self.path = path
+        self.version = version
+        self.file = h5py.File(path, mode="r", rdcc_nbytes=chunk_cache_bytes)
+        self.chunk_cache_bytes = chunk_cache_bytes
+        self._labels: Dict[str, np.ndarray] = {}
+        self._label_bytes = 0
+        # number of callers currently reading from this file. An evicted file is only closed once
+        # nobody is using it.
+        self.leases = 0
+        self.evicted = False
+
+    def get_dataset(self, name: str) -> h5py.Dataset:
+        dataset = self.file[name]
+        assert isinstance(dataset, h5py.Dataset)
+        return dataset
+
+    def get_labels(self, name: str) -> np.ndarray:
+        """Returns the decoded contents of the "features" or "samples" dataset as an array of str"""
+        labels = self._labels.get(name)
+        if labels is None:
+            labels = self.get_dataset(name).asstr()[()]
+            self._labels[name] = labels
+            self._label_bytes += sum(
+                len(x) for x in labels
+            ) + _STR_OVERHEAD_IN_BYTES * len(labels)
+        return labels
+
+    @property
+    def size_in_bytes(self):
+        return self.chunk_cache_bytes + self._label_bytes
+
+    def close(self):
+        self.file.close()
+
+
+def _get_file_version(path: str) -> Tuple:
+    # a file which is rewritten in place will have a different mtime/size/inode, so the stale handle
+    # will be replaced the next time it's requested
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class HDF5FileCache(ForkSafe):
+    """
+    An LRU cache of open read-only HDF5 files, bounded by an estimate of the memory used by each open
+    file (its raw chunk cache plus its decoded labels). Meant to be one per process: on a gene page which
+    loads 20 features from the same matrix, the file is opened and its labels decoded once, not 20 times.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        chunk_cache_bytes: int = DEFAULT_CHUNK_CACHE_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.chunk_cache_bytes = chunk_cache_bytes
+        super().__init__()
+
+    def _reset(self):
+        self._files: "OrderedDict[str, CachedHDF5File]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def open(self, path: str) -> Iterator[CachedHDF5File]:
+        cached = self._acquire(path)
+        try:
+            yield cached
+        finally:
+            self._release(cached)
+
+    def _acquire(self, path: str) -> CachedHDF5File:
+        self._check_pid()
+        # callers may pass any path-like object, but the handles are keyed by str
+        path = os.fspath(path)
+        version = _get_file_version(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached.version != version:
+                self._evict(path)
+                cached = None
+
+            if cached is None:
+                cached = CachedHDF5File(path, version, self.chunk_cache_bytes)
+                self._files[path] = cached
+            else:
+                self._files.move_to_end(path)
+
+            cached.leases += 1
+            return cached
+
+    def _release(self, cached: CachedHDF5File):
+        with self._lock:
+            cached.leases -= 1
+            if cached.evicted:
+                if cached.leases == 0:
+                    cached.close()
+            else:
+                # labels may have been decoded while this file was in use, so now is when we know its size
+                self._enforce_budget()
+
+    def _evict(self, path: str):
+        cached = self._files.pop(path, None)
+        if cached is None:
+            return
+        cached.evicted = True
+        if cached.leases == 0:
+            cached.close()
+
+    def _enforce_budget(self):
+        total = sum(x.size_in_bytes for x in self._files.values())
+        # always keep the most recently used file, even if it alone exceeds the budget
+        while total > self.max_bytes and len(self._files) > 1:
+            path, cached = next(iter(self._files.items()))
+            total -= cached.size_in_bytes
+            self._evict(path)
+
+    def evict(self, path: str):
+        """Close the cached handle for path (if any). Should be called before a file is rewritten or deleted."""
+        self._check_pid()
+        with self._lock:
+            self._evict(os.fspath(path))
+
+    def evict_under(self, directory: str):
+        self._check_pid()
+        prefix = os.path.join(os.fspath(directory), "")
+        with self._lock:
+            for path in [x for x in self._files if x.startswith(prefix)]:
+                self._evict(path)
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            for path in list(self._files):
+                self._evict(path)
+
+
+_file_cache: Optional[HDF5FileCache] = None
+
+
+def get_hdf5_file_cache() -> HDF5FileCache:
+    global _file_cache
+    if _file_cache is None:
+        from breadbox.config import try_get_settings
+
+        settings = try_get_settings("HDF5 file cache sizes")
+        if settings is None:
+            _file_cache = HDF5FileCache()
+        else:
+            _file_cache = HDF5FileCache(
+                max_bytes=settings.hdf5_file_cache_max_bytes,
+                chunk_cache_bytes=settings.hdf5_chunk_cache_bytes,
+            )
+    return _file_cache
@@ -0,0 +1,243 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import h5py
+import numpy as np
+from h5py import h5s
+
+# upper bound on the size of each block read when the selection has gaps which need to be dropped after reading
+MAX_BLOCK_BYTES = 64 * 1024 * 1024
+
+# results are float64 or object arrays, both of which use 8 bytes per element
+_RESULT_ITEMSIZE = 8
+
+
+def coalesce_runs(indexes: np.ndarray, max_gap: int = 0) -> List[Tuple[int, int]]:
+    """
+    Collapse sorted indexes into (start, stop) runs. Runs separated by at most max_gap unselected indexes are
+    merged, which costs reading the gap but avoids decompressing the chunk holding it a second time.
+    """
+    if len(indexes) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indexes) > max_gap + 1)
+    starts = indexes[np.concatenate(([0], breaks + 1))]
+    stops = indexes[np.concatenate((breaks, [len(indexes) - 1]))] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+@dataclass
+class ReadPlan:
+    """
+    Describes how to read the submatrix at the intersection of some rows and columns. The selected indexes
+    along the "outer" axis are coalesced into runs, which are read in batches directly into a preallocated
+    buffer. Each run spans from the first to the last selected index along the other ("inner") axis, and any
+    unselected indexes within that span are dropped afterwards.
+    """
+
+    outer_axis: int
+    batches: List[List[Tuple[int, int]]]
+    inner_start: int
+    inner_stop: int
+    # positions within inner_start:inner_stop to keep, or None if every index in that range was selected
+    inner_offsets: Optional[np.ndarray]
+
+
+def _get_outer_axis(
+    f_data: h5py.Dataset, row_indexes: np.ndarray, col_indexes: np.ndarray
+) -> int:
+    if f_data.chunks is None:
+        # unchunked data can be read efficiently along either axis, so first subset by the more selective one
+        if len(col_indexes) < len(row_indexes):
+            return 1
+        return 0
+    # otherwise read along the axis where chunks are thinnest, so each run only decompresses the chunks it needs
+    row_count, col_count = f_data.shape
+    row_chunk, col_chunk = f_data.chunks
+    if col_chunk / col_count < row_chunk / row_count:
+        return 1
+    return 0
+
+
+def plan_read(
+    f_data: h5py.Dataset, row_indexes: np.ndarray, col_indexes: np.ndarray
+) -> ReadPlan:
+    outer_axis = _get_outer_axis(f_data, row_indexes, col_indexes)
+    outer_indexes, inner_indexes = (
+        (row_indexes, col_indexes) if outer_axis == 0 else (col_indexes, row_indexes)
+    )
+
+    inner_start = int(inner_indexes[0])
+    inner_stop = int(inner_indexes[-1]) + 1
+    inner_offsets: Optional[np.ndarray] = inner_indexes - inner_start
+    if len(inner_indexes) == inner_stop - inner_start and np.array_equal(
+        inner_offsets, np.arange(inner_stop - inner_start)
+    ):
+        inner_offsets = None
+
+    max_gap = 0
+    if f_data.chunks is not None:
+        max_gap = f_data.chunks[outer_axis] - 1
+
+    # group the runs into batches which each stay within MAX_BLOCK_BYTES, splitting runs which are too long
+    max_batch_length = max(
+        1, MAX_BLOCK_BYTES // ((inner_stop - inner_start) * _RESULT_ITEMSIZE)
+    )
+    batches: List[List[Tuple[int, int]]] = [[]]
+    batch_length = 0
+    for start, stop in coalesce_runs(outer_indexes, max_gap):
+        while start < stop:
+            if batch_length == max_batch_length:
+                batches.append([])
+                batch_length = 0
+            run_stop = min(stop, start + max_batch_length - batch_length)
+            batches[-1].append((start, run_stop))
+            batch_length += run_stop - start
+            start = run_stop
+
+    # a run which was split may have unselected indexes at its ends, so trim them off
+    trimmed_batches = []
+    for batch in batches:
+        trimmed = []
+        for start, stop in batch:
+            lo = np.searchsorted(outer_indexes, start, side="left")
+            hi = np.searchsorted(outer_indexes, stop, side="left")
+            if lo < hi:
+                trimmed.append((int(outer_indexes[lo]), int(outer_indexes[hi - 1]) + 1))
+        if len(trimmed) > 0:
+            trimmed_batches.append(trimmed)
+
+    return ReadPlan(outer_axis, trimmed_batches, inner_start, inner_stop, inner_offsets)
+
+
+def _select(space, outer_axis: int, outer: Tuple[int, int], inner: Tuple[int, int], op):
+    outer_start, outer_stop = outer
+    inner_start, inner_stop = inner
+    if outer_axis == 0:
+        start = (outer_start, inner_start)
+        count = (outer_stop - outer_start, inner_stop - inner_start)
+    else:
+        start = (inner_start, outer_start)
+        count = (inner_stop - inner_start, outer_stop - outer_start)
+    space.select_hyperslab(start, count, op=op)
+
+
+def _read_runs(
+    f_data: h5py.Dataset,
+    outer_axis: int,
+    runs: List[Tuple[int, int]],
+    inner: Tuple[int, int],
+    dest: np.ndarray,
+    dest_outer: Tuple[int, int],
+):
+    """
+    Read the runs (each spanning inner) along outer_axis into dest, stacked along outer_axis in
+    positions dest_outer.
+    """
+    if h5py.check_string_dtype(f_data.dtype) is not None:
+        # variable length strings can't be read directly into a buffer, so read each run separately
+        dest_start, _ = dest_outer
+        for start, stop in runs:
+            source = slice(start, stop), slice(*inner)
+            target = slice(dest_start, dest_start + stop - start), slice(None)
+            if outer_axis == 1:
+                source, target = source[::-1], target[::-1]
+            dest[target] = f_data[source]
+            dest_start += stop - start
+        return
+
+    file_space = f_data.id.get_space()
+    mem_space = h5s.create_simple(dest.shape)
+    dest_inner = (0, dest.shape[1 - outer_axis])
+
+    # HDF5 converts from the stored type (ie: float32) to the type of dest while reading
+    if f_data.chunks is None:
+        # HDF5 reads the union of the runs in a single pass over the file
+        file_space.select_none()
+        for run in runs:
+            _select(file_space, outer_axis, run, inner, h5s.SELECT_OR)
+        _select(mem_space, outer_axis, dest_outer, dest_inner, h5s.SELECT_SET)
+        f_data.id.read(mem_space, file_space, dest)
+    else:
+        # but for chunked data, HDF5 intersects the whole selection with every chunk it touches, which
+        # is much slower than reading each run (which only touches a few chunks) separately
+        dest_start, _ = dest_outer
+        for start, stop in runs:
+            _select(file_space, outer_axis, (start, stop), inner, h5s.SELECT_SET)
+            _select(
+                mem_space,
+                outer_axis,
+                (dest_start, dest_start + stop - start),
+                dest_inner,
+                h5s.SELECT_SET,
+            )
+            f_data.id.read(mem_space, file_space, dest)
+            dest_start += stop - start
+
+
+def read_subset(
+    f_data: h5py.Dataset,
+    row_indexes: Optional[List[int]],
+    col_indexes: Optional[List[int]],
+) -> np.ndarray:
+    """
+    Read the submatrix at the intersection of the given (sorted) row and column indexes, where None means
+    every row or column. Floats are always returned as float64.
+    """
+    row_count, col_count = f_data.shape
+    rows = np.arange(row_count) if row_indexes is None else np.asarray(row_indexes)
+    cols = np.arange(col_count) if col_indexes is None else np.asarray(col_indexes)
+
+    if h5py.check_string_dtype(f_data.dtype) is not None:
+        dtype = np.dtype(object)
+    else:
+        dtype = np.dtype(np.float64)
+    result = np.empty((len(rows), len(cols)), dtype=dtype)
+    if result.size == 0:
+        return result
+
+    plan = plan_read(f_data, rows, cols)
+    outer_indexes = rows if plan.outer_axis == 0 else cols
+    inner = (plan.inner_start, plan.inner_stop)
+    inner_axis = 1 - plan.outer_axis
+
+    dest_start = 0
+    for runs in plan.batches:
+        run_lengths = [stop - start for start, stop in runs]
+        block_length = sum(run_lengths)
+        lo = int(np.searchsorted(outer_indexes, runs[0][0], side="left"))
+        hi = int(np.searchsorted(outer_indexes, runs[-1][1], side="left"))
+        dest_outer = (dest_start, dest_start + hi - lo)
+        dest_start += hi - lo
+
+        if block_length == hi - lo and plan.inner_offsets is None:
+            # every index read was selected, so read straight into the result
+            _read_runs(f_data, plan.outer_axis, runs, inner, result, dest_outer)
+            continue
+
+        # read the runs into a block and keep the selected rows/columns of it
+        block_shape = [0, 0]
+        block_shape[plan.outer_axis] = block_length
+        block_shape[inner_axis] = plan.inner_stop - plan.inner_start
+        block = np.empty(block_shape, dtype=dtype)
+        _read_runs(f_data, plan.outer_axis, runs, inner, block, (0, block_length))
+
+        if block_length != hi - lo:
+            # position of each selected index within the block
+            run_starts = np.array([start for start, _ in runs])
+            block_offsets = np.cumsum([0] + run_lengths[:-1])
+            selected = outer_indexes[lo:hi]
+            run_index = np.searchsorted(run_starts, selected, side="right") - 1
+            block = np.take(
+                block,
+                selected - run_starts[run_index] + block_offsets[run_index],
+                axis=plan.outer_axis,
+            )
+        if plan.inner_offsets is not None:
+            block = np.take(block, plan.inner_offsets, axis=inner_axis)
+
+        if plan.outer_axis == 0:
+            result[dest_outer[0] : dest_outer[1], :] = block
+        else:
+            result[:, dest_outer[0] : dest_outer[1]] = block
+
+    return result
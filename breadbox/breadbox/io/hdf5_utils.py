@@ -1,6 +1,8 @@
+import contextlib
 import os.path
 import tempfile
-from typing import List, Optional, Literal, Callable
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Literal, Optional, Tuple
 
 
 from breadbox.schemas.custom_http_exception import (
@@ -11,7 +13,10 @@ import h5py
 import numpy as np
 import pandas as pd
 
-from breadbox.io.data_validation import (
+from breadbox.io.hdf5_file_cache import CachedHDF5File, get_hdf5_file_cache
+from breadbox.io.hdf5_read_planner import read_subset
+
+from breadbox.schemas.dataframe_wrapper import (
     DataFrameWrapper,
     PandasDataFrameWrapper,
     column_batch_iterator,
@@ -34,56 +39,101 @@ def create_index_dataset(f: h5py.File, key: str, idx: pd.Index):
     )
 
 
+# a matrix is considered sparse if more than this fraction (~2/3) of its elements are null
+SPARSE_NULL_FRACTION = 0.6
+
+
 def is_sparse_df(df: pd.DataFrame) -> bool:
-    total_nulls = df.apply(lambda x: x.isna().sum()).sum()
+    if df.size == 0:
+        return False
+    total_nulls = np.count_nonzero(df.isna().to_numpy())
     # Determine whether matrix is considered sparse (~2/3 elements are null). Use chunked storage for sparse matrices for more optimal storage
-    is_sparse = total_nulls / df.size > 0.6
+    is_sparse = total_nulls / df.size > SPARSE_NULL_FRACTION
     return is_sparse
 
 
+def is_sparse_matrix(df_wrapper: DataFrameWrapper, batch_size: int) -> bool:
+    """
+    Like is_sparse_df, but for any wrapper (ie: the parquet file an uploaded CSV is parsed into). Reads the matrix a
+    batch of columns at a time, and stops as soon as there are too many values for it to be sparse.
+    """
+    if isinstance(df_wrapper, PandasDataFrameWrapper):
+        return is_sparse_df(df_wrapper.get_df())
+
+    size = len(df_wrapper.get_index_names()) * len(df_wrapper.get_column_names())
+    if size == 0:
+        return False
+    max_values = size * (1 - SPARSE_NULL_FRACTION)
+    total_values = 0
+    for _, _, chunk_df in column_batch_iterator(df_wrapper, batch_size=batch_size):
+        total_values += np.count_nonzero(chunk_df.notna().to_numpy())
+        if total_values >= max_values:
+            return False
+    return True
+
+
 def write_hdf5_file(
     path: str,
     df_wrapper: DataFrameWrapper,
     hdf5_dtype: Literal["float", "str"],
     map_values: Callable[[pd.DataFrame], pd.DataFrame],
     batch_size: int = 5000,  # Adjust batch size as needed
+    storage: Optional["HDF5StorageOptions"] = None,
 ):
+    """
+    Write the matrix in df_wrapper to path. If storage is not provided, the matrix is written using the
+    original contiguous layout (unless it's sparse), otherwise it's written using the chunked layout described
+    by storage.
+    """
+    # make sure no reader is holding on to a handle to a previous version of this file
+    get_hdf5_file_cache().evict(path)
+
+    if storage is None and is_sparse_matrix(df_wrapper, batch_size):
+        # Sparse matrices use compressed chunks, which are filled with missing values wherever nothing was
+        # written, so the missing values take almost no space and the matrix is still written in bulk.
+        storage = SPARSE_STORAGE
+
     f = h5py.File(path, mode="w")
     try:
-        if isinstance(df_wrapper, PandasDataFrameWrapper):
+        if storage is not None and storage.layout_version == CHUNKED_LAYOUT_VERSION:
+            shape = (
+                len(df_wrapper.get_index_names()),
+                len(df_wrapper.get_column_names()),
+            )
+
+            def get_column_batches(batch_size):
+                for start_col_index, end_col_index, chunk_df in column_batch_iterator(
+                    df_wrapper, batch_size=batch_size
+                ):
+                    chunk_df = map_values(chunk_df)
+                    if hdf5_dtype == "str":
+                        # NOTE: hdf5 will fail to stringify None or <NA>. Use empty string to represent NAs instead
+                        chunk_df = chunk_df.fillna("")
+                    else:
+                        chunk_df = chunk_df.astype("float")
+                    yield start_col_index, end_col_index, chunk_df.values
+
+            _write_chunked_matrix(
+                f, shape, hdf5_dtype, get_column_batches, batch_size, storage
+            )
+        elif isinstance(df_wrapper, PandasDataFrameWrapper):
             df = df_wrapper.get_df()
             df = map_values(df)
             # Convert to float type so hdf5 can store it as float64
             if hdf5_dtype == "float":
                 df = df.astype(np.float64)
-            # If the DataFrame is sparse, we need to store only
-            if is_sparse_df(df):
-                dataset = f.create_dataset(
-                    "data",
-                    shape=df.shape,
-                    dtype=h5py.string_dtype() if hdf5_dtype == "str" else np.float64,
-                    chunks=(
-                        1,
-                        1,
-                    ),  # Arbitrarily set size since it at least appears to yield smaller storage size than autochunking
-                )
-                # only insert nonnull values into hdf5 at given positions
-                for row_idx, col_idx in df_wrapper.get_nonnull_indices():
-                    dataset[row_idx, col_idx] = df.iloc[row_idx, col_idx]
-            else:
-                if hdf5_dtype == "str":
-                    # NOTE: hdf5 will fail to stringify None or <NA>. Use empty string to represent NAs instead
-                    df = df.fillna("")
-                # NOTE: For a large and dense string matrix, the size of the hdf5 will be very large. Right now, list of string matrices are a very rare use case and it is unlikely we'll encounter one that is not sparse. However, if that changes, we should consider other hdf5 size optimization methods such as compression
-                dataset = f.create_dataset(
-                    "data",
-                    shape=df.shape,
-                    dtype=h5py.string_dtype() if hdf5_dtype == "str" else np.float64,
-                    data=df.values,
-                )
+            if hdf5_dtype == "str":
+                # NOTE: hdf5 will fail to stringify None or <NA>. Use empty string to represent NAs instead
+                df = df.fillna("")
+            # NOTE: For a large and dense string matrix, the size of the hdf5 will be very large. Right now, list of string matrices are a very rare use case and it is unlikely we'll encounter one that is not sparse. However, if that changes, we should consider other hdf5 size optimization methods such as compression
+            dataset = f.create_dataset(
+                "data",
+                shape=df.shape,
+                dtype=h5py.string_dtype() if hdf5_dtype == "str" else np.float64,
+                data=df.values,
+            )
         else:
             # NOTE: Our number of columns are usually much larger than rows so we batch by columns to avoid memory issues
-            # TODO: If hdf5 file size becomes an issue, we can consider using compression or chunking
             cols = df_wrapper.get_column_names()
             rows = df_wrapper.get_index_names()
             shape = (len(rows), len(cols))
@@ -112,6 +162,9 @@ def write_hdf5_file(
                         f"Failed to update {start_col_index}:{end_col_index} of hdf5 file {path} with {values}"
                     ) from e
 
+        f.attrs[LAYOUT_VERSION_ATTR] = (
+            CONTIGUOUS_LAYOUT_VERSION if storage is None else storage.layout_version
+        )
         create_index_dataset(f, "features", pd.Index(df_wrapper.get_column_names()))
         create_index_dataset(f, "samples", pd.Index(df_wrapper.get_index_names()))
     except Exception as e:
@@ -120,94 +173,232 @@ def write_hdf5_file(
         f.close()
 
 
-DUPLICATE_STORAGE = "duplicate_storage"
-CHUNKED_STORAGE = "chunked_storage"
+# Version 1 files contain a single contiguous, uncompressed "data" matrix. Version 2 files contain "data" chunked by
+# column (so reading one feature only decompresses the few chunks containing it) and optionally a second copy of the
+# matrix chunked by row, for datasets which are frequently read one sample at a time.
+CONTIGUOUS_LAYOUT_VERSION = 1
+CHUNKED_LAYOUT_VERSION = 2
 
-import contextlib
-import typing
+LAYOUT_VERSION_ATTR = "layout_version"
+ROW_CHUNKED_DATASET = "data_by_row"
 
+# HDF5 recommends chunks of 10KB-1MB. Keep them on the small end, because a read of a single feature or sample
+# has to decompress every chunk it touches.
+TARGET_CHUNK_BYTES = 64 * 1024
 
-# def _cast_matrix(f_data):
-#     # the type information for return types
+# upper bound on the memory used for each block of rows while writing the row-chunked copy
+ROW_COPY_BLOCK_BYTES = 256 * 1024 * 1024
 
 
-@contextlib.contextmanager
-def with_hdf5_cache(
-    filename,
-    feature_indexes: Optional[List[int]],
-    sample_indexes: Optional[List[int]],
-    cache_strategy,
+@dataclass(frozen=True)
+class HDF5StorageOptions:
+    """How a matrix dataset's values are laid out on disk. Chosen when the dataset is uploaded."""
+
+    layout_version: int = CHUNKED_LAYOUT_VERSION
+    # also store a copy chunked by row. Makes reads of a few samples fast at the cost of doubling the file size
+    row_chunked_copy: bool = False
+    compression: Optional[Literal["gzip", "lzf"]] = "gzip"
+    # only used by gzip (0-9)
+    compression_level: int = 4
+    # store floats with single precision, halving the file size
+    float32: bool = False
+
+    def __post_init__(self):
+        if self.layout_version == CONTIGUOUS_LAYOUT_VERSION:
+            if self.row_chunked_copy or self.float32 or self.compression is not None:
+                raise ValueError(
+                    "Only the chunked layout supports compression, float32 or a row-chunked copy"
+                )
+        elif self.layout_version != CHUNKED_LAYOUT_VERSION:
+            raise ValueError(f"Unknown layout version: {self.layout_version}")
+
+
+# used for sparse matrices written without any storage options (see write_hdf5_file). Matches the
+# default for uploads (see Settings.matrix_storage_compression), so that reads by sample stay fast.
+SPARSE_STORAGE = HDF5StorageOptions(compression="lzf", row_chunked_copy=True)
+
+
+def _get_chunk_shape(shape, itemsize: int, by_row: bool):
+    """Chunks span as much of one axis as fits in TARGET_CHUNK_BYTES, and as few elements of the other axis as possible"""
+    row_count, col_count = shape
+    max_items = max(1, TARGET_CHUNK_BYTES // itemsize)
+    if by_row:
+        cols_per_chunk = min(col_count, max_items)
+        rows_per_chunk = min(row_count, max(1, max_items // cols_per_chunk))
+    else:
+        rows_per_chunk = min(row_count, max_items)
+        cols_per_chunk = min(col_count, max(1, max_items // rows_per_chunk))
+    return rows_per_chunk, cols_per_chunk
+
+
+def _create_chunked_dataset(
+    f: h5py.File, name: str, shape, dtype, storage: HDF5StorageOptions, by_row: bool
+) -> h5py.Dataset:
+    if 0 in shape:
+        # HDF5 can't chunk a dataset with no elements
+        return f.create_dataset(name, shape=shape, dtype=dtype)
+
+    is_float = dtype != STR_DTYPE
+    return f.create_dataset(
+        name,
+        shape=shape,
+        dtype=dtype,
+        chunks=_get_chunk_shape(shape, np.dtype(dtype).itemsize, by_row),
+        compression=storage.compression,
+        compression_opts=storage.compression_level
+        if storage.compression == "gzip"
+        else None,
+        # byte shuffling groups the exponents of neighboring floats together, which compresses much better
+        shuffle=storage.compression is not None and is_float,
+        fillvalue=np.nan if is_float else None,
+    )
+
+
+def _is_missing(values: np.ndarray) -> np.ndarray:
+    if values.dtype == object:
+        # missing strings are stored as empty strings (which h5py may return as bytes)
+        return (values == "") | (values == b"")
+    return np.isnan(values)
+
+
+def _write_nonempty_chunks(
+    dataset: h5py.Dataset,
+    values: np.ndarray,
+    start_row_index: int = 0,
+    start_col_index: int = 0,
 ):
-    if cache_strategy is None:
-        reformated_file = filename
+    """
+    Write the block of values at the given position (which must be on a chunk boundary), skipping the
+    chunks which only contain missing values. HDF5 doesn't store chunks which were never written, and
+    reads them as the dataset's fill value, so sparse matrices take little space.
+    """
+    row_count, col_count = values.shape
+    block = (
+        slice(start_row_index, start_row_index + row_count),
+        slice(start_col_index, start_col_index + col_count),
+    )
+    if dataset.chunks is None or values.size == 0:
+        dataset[block] = values
+        return
+
+    rows_per_chunk, cols_per_chunk = dataset.chunks
+    row_starts = np.arange(0, row_count, rows_per_chunk)
+    col_starts = np.arange(0, col_count, cols_per_chunk)
+    # which chunks (of those covering this block) contain at least one value
+    present = ~_is_missing(values)
+    chunk_has_values = np.logical_or.reduceat(
+        np.logical_or.reduceat(present, row_starts, axis=0), col_starts, axis=1
+    )
+
+    if chunk_has_values.all():
+        dataset[block] = values
+        return
+
+    for row_chunk, col_chunk in zip(*np.nonzero(chunk_has_values)):
+        row_start, col_start = row_starts[row_chunk], col_starts[col_chunk]
+        row_end, col_end = row_start + rows_per_chunk, col_start + cols_per_chunk
+        dataset[
+            start_row_index + row_start : start_row_index + row_end,
+            start_col_index + col_start : start_col_index + col_end,
+        ] = values[row_start:row_end, col_start:col_end]
+
+
+def _write_chunked_matrix(
+    f: h5py.File,
+    shape,
+    hdf5_dtype: Literal["float", "str"],
+    get_column_batches: Callable[[int], Iterator[Tuple[int, int, np.ndarray]]],
+    batch_size: int,
+    storage: HDF5StorageOptions,
+):
+    if hdf5_dtype == "str":
+        dtype = STR_DTYPE
+    elif storage.float32:
+        dtype = np.float32
     else:
-        reformated_file = f"{os.path.dirname(filename)}/temp/{cache_strategy}/{os.path.basename(filename)}.h5"
-        if not os.path.exists(reformated_file):
-            dest_dir = os.path.dirname(reformated_file)
-            os.makedirs(dest_dir, exist_ok=True)
-
-            # read the original and copy data to new file
-            tmp = tempfile.NamedTemporaryFile(suffix=".h5", delete=False, dir=dest_dir)
-            with h5py.File(filename, "r") as src:
-                with h5py.File(tmp.name, "w") as dest:
-                    for src_name in ["features", "samples"]:
-                        src_dataset = src[src_name]
-                        assert isinstance(src_dataset, h5py.Dataset)
-                        data = pd.Index([x.decode("utf8") for x in src_dataset])
-                        create_index_dataset(dest, src_name, data)
-
-                    f_data = src["data"]
-                    assert isinstance(f_data, h5py.Dataset)
-
-                    if cache_strategy == DUPLICATE_STORAGE:
-                        dest.create_dataset(
-                            "data_by_col",
-                            shape=f_data.shape,
-                            dtype=f_data.dtype,
-                            data=f_data,
-                            chunks=(f_data.shape[0], 1),
-                        )
-
-                        dest.create_dataset(
-                            "data_by_row",
-                            shape=f_data.shape,
-                            dtype=f_data.dtype,
-                            data=f_data,
-                            chunks=(1, f_data.shape[1]),
-                        )
-                    else:
-                        assert cache_strategy == CHUNKED_STORAGE
-
-                        dest.create_dataset(
-                            "data_by_chunk",
-                            shape=f_data.shape,
-                            dtype=f_data.dtype,
-                            data=f_data,
-                            chunks=True,
-                        )
-
-            os.rename(tmp.name, reformated_file)
-
-    with h5py.File(reformated_file, "r") as f:
-        if cache_strategy == DUPLICATE_STORAGE:
-            if feature_indexes is not None and sample_indexes is not None:
-                if len(feature_indexes) < len(sample_indexes):
-                    f_data = f["data_by_col"]
-                else:
-                    f_data = f["data_by_row"]
-            elif feature_indexes is not None:
-                f_data = f["data_by_col"]
-            elif sample_indexes is not None:
-                f_data = f["data_by_row"]
-            else:
-                f_data = f["data_by_row"]
-        elif cache_strategy == CHUNKED_STORAGE:
-            f_data = f["data_by_chunk"]
-        else:
-            assert cache_strategy is None
-            f_data = f["data"]
+        dtype = np.float64
+
+    dataset = _create_chunked_dataset(f, "data", shape, dtype, storage, by_row=False)
+
+    if dataset.chunks is not None:
+        # align batches to chunk boundaries, so that each compressed chunk is only written once
+        _, cols_per_chunk = dataset.chunks
+        batch_size = max(cols_per_chunk, batch_size - batch_size % cols_per_chunk)
+
+    for start_col_index, end_col_index, values in get_column_batches(batch_size):
+        try:
+            _write_nonempty_chunks(dataset, values, start_col_index=start_col_index)
+        except Exception as e:
+            raise FileValidationError(
+                f"Failed to update {start_col_index}:{end_col_index} of hdf5 file {f.filename}"
+            ) from e
+
+    if storage.row_chunked_copy:
+        by_row = _create_chunked_dataset(
+            f, ROW_CHUNKED_DATASET, shape, dtype, storage, by_row=True
+        )
+        # copy in blocks of whole row-chunks. Each block read decompresses every column chunk, so
+        # the blocks are as large as memory allows to keep the number of passes low.
+        row_count, col_count = shape
+        rows_per_chunk = by_row.chunks[0] if by_row.chunks is not None else 1
+        rows_per_block = ROW_COPY_BLOCK_BYTES // max(
+            1, col_count * np.dtype(dtype).itemsize
+        )
+        rows_per_block = max(
+            rows_per_chunk, rows_per_block - rows_per_block % rows_per_chunk
+        )
+        for start_row_index in range(0, row_count, rows_per_block):
+            end_row_index = min(start_row_index + rows_per_block, row_count)
+            _write_nonempty_chunks(
+                by_row,
+                dataset[start_row_index:end_row_index, :],
+                start_row_index=start_row_index,
+            )
+
+
+def rewrite_hdf5_file_layout(path: str, storage: HDF5StorageOptions):
+    """
+    Rewrite an existing dataset file using a different storage layout. The new file is written next to
+    the old one and renamed over it, so readers only ever see a complete file.
+    """
+    dest_dir = os.path.dirname(path)
+    tmp = tempfile.NamedTemporaryFile(suffix=".hdf5", delete=False, dir=dest_dir)
+    tmp.close()
+    try:
+        with h5py.File(path, "r") as src, h5py.File(tmp.name, "w") as dest:
+            src_data = _get_dataset(src, "data")
+            hdf5_dtype: Literal["float", "str"] = (
+                "str" if h5py.check_string_dtype(src_data.dtype) else "float"
+            )
+
+            def get_column_batches(batch_size):
+                col_count = src_data.shape[1]
+                for start_col_index in range(0, col_count, batch_size):
+                    end_col_index = min(start_col_index + batch_size, col_count)
+                    yield start_col_index, end_col_index, src_data[
+                        :, start_col_index:end_col_index
+                    ]
+
+            _write_chunked_matrix(
+                dest, src_data.shape, hdf5_dtype, get_column_batches, 5000, storage
+            )
+            dest.attrs[LAYOUT_VERSION_ATTR] = storage.layout_version
+            for name in ["features", "samples"]:
+                create_index_dataset(
+                    dest, name, pd.Index(_get_dataset(src, name).asstr()[()])
+                )
+        get_hdf5_file_cache().evict(path)
+        os.replace(tmp.name, path)
+    finally:
+        if os.path.exists(tmp.name):
+            os.unlink(tmp.name)
+
 
-        yield f, f_data
+def get_hdf5_file_layout_version(path: str) -> int:
+    with get_hdf5_file_cache().open(path) as cached:
+        return int(
+            cached.file.attrs.get(LAYOUT_VERSION_ATTR, CONTIGUOUS_LAYOUT_VERSION)
+        )
 
 
 def _get_dataset(hdf5_file: h5py.File, name: str) -> h5py.Dataset:
@@ -216,27 +407,58 @@ def _get_dataset(hdf5_file: h5py.File, name: str) -> h5py.Dataset:
     return dataset
 
 
+def _choose_orientation(
+    cached: CachedHDF5File,
+    feature_indexes: Optional[List[int]],
+    sample_indexes: Optional[List[int]],
+) -> h5py.Dataset:
+    """Use the row-chunked copy (if the file has one) when fewer samples than features are being read"""
+    if (
+        sample_indexes is not None
+        and (feature_indexes is None or len(sample_indexes) < len(feature_indexes))
+        and ROW_CHUNKED_DATASET in cached.file
+    ):
+        return cached.get_dataset(ROW_CHUNKED_DATASET)
+    return cached.get_dataset("data")
+
+
+@contextlib.contextmanager
+def _open_for_read(
+    path: str,
+    feature_indexes: Optional[List[int]],
+    sample_indexes: Optional[List[int]],
+):
+    """
+    Yields the matrix to read from and a function which returns the decoded labels for "features" or "samples".
+    The file comes from the per-process cache of open files, so repeated reads of the same file don't reopen
+    it or decode its labels again.
+    """
+    with get_hdf5_file_cache().open(path) as cached:
+        yield _choose_orientation(
+            cached, feature_indexes, sample_indexes
+        ), cached.get_labels
+
+
 def get_hdf5_file_matrix_size(path: str):
-    with h5py.File(path, mode="r") as f:
-        data = f["data"]
+    with get_hdf5_file_cache().open(path) as cached:
+        data = cached.file["data"]
         if hasattr(data, "shape"):
             return data.shape  # type: ignore
         raise ValueError("HDF5 file does not contain a dataset with shape")
-    
+
 
 def read_hdf5_file(
     path: str,
     feature_indexes: Optional[List[int]] = None,
     sample_indexes: Optional[List[int]] = None,
     keep_nans: Optional[bool] = False,
-    cache_strategy: Optional[str] = None,
     read_index_names: bool = True,
     indices_as_index: bool = False,
 ):
     """Return subsetted df based on provided feature and sample indexes. If either feature or sample indexes is None then return all features or samples"""
-    with with_hdf5_cache(path, feature_indexes, sample_indexes, cache_strategy) as (
-        f,
+    with _open_for_read(path, feature_indexes, sample_indexes) as (
         f_data,
+        get_labels,
     ):
         assert isinstance(f_data, h5py.Dataset)
         # HDF5 requires indices used by indexing are sorted
@@ -255,39 +477,35 @@ def read_hdf5_file(
 
         if feature_indexes is not None and sample_indexes is not None:
             _validate_read_size(len(feature_indexes), len(sample_indexes))
-            # subset first by the more selective axis. (HDF5 doesn't allow us to subset both axes in a single request)
-            if len(feature_indexes) < len(sample_indexes):
-                data = f_data[:, feature_indexes][sample_indexes, :]
-            else:
-                data = f_data[sample_indexes, :][:, feature_indexes]
             if read_index_names:
-                feature_ids = _get_dataset(f, "features")[feature_indexes]
-                sample_ids = _get_dataset(f, "samples")[sample_indexes]
+                feature_ids = get_labels("features")[feature_indexes]
+                sample_ids = get_labels("samples")[sample_indexes]
         elif feature_indexes is not None:
             _validate_read_size(len(feature_indexes), row_len)
-            data = f_data[:, feature_indexes]
             if read_index_names:
-                feature_ids = _get_dataset(f, "features")[feature_indexes]
-                sample_ids = _get_dataset(f, "samples")
+                feature_ids = get_labels("features")[feature_indexes]
+                sample_ids = get_labels("samples")
         elif sample_indexes is not None:
             _validate_read_size(col_len, len(sample_indexes))
-            data = f_data[sample_indexes]
             if read_index_names:
-                feature_ids = _get_dataset(f, "features")
-                sample_ids = _get_dataset(f, "samples")[sample_indexes]
+                feature_ids = get_labels("features")
+                sample_ids = get_labels("samples")[sample_indexes]
         else:
             _validate_read_size(col_len, row_len)
-            data = f_data
-            feature_ids = _get_dataset(f, "features")
-            sample_ids = _get_dataset(f, "samples")
+            feature_ids = get_labels("features")
+            sample_ids = get_labels("samples")
+
+        # reads both axes at once (rather than reading whole rows or columns and then subsetting those), and
+        # always returns floats as float64, even for datasets stored as float32
+        data = read_subset(f_data, sample_indexes, feature_indexes)
 
         if indices_as_index:
             feature_idx = pd.Index(feature_indexes)
             sample_idx = pd.Index(sample_indexes)
         else:
             assert feature_ids is not None and sample_ids is not None
-            feature_idx = pd.Index([x.decode("utf8") for x in feature_ids])
-            sample_idx = pd.Index([x.decode("utf8") for x in sample_ids])
+            feature_idx = pd.Index(feature_ids, dtype="object")
+            sample_idx = pd.Index(sample_ids, dtype="object")
 
         df = pd.DataFrame(data=data, columns=feature_idx, index=sample_idx)
 
@@ -298,10 +516,24 @@ def read_hdf5_file(
     return df
 
 
+def read_hdf5_values(
+    path: str, feature_indexes: List[int], sample_indexes: List[int],
+) -> np.ndarray:
+    """
+    Like read_hdf5_file, but returns the values at the given (sorted) indexes as a (samples, features) array,
+    without looking up the labels or building a dataframe. Floats are returned as float64 and missing values
+    are left as NaN.
+    """
+    with _open_for_read(path, feature_indexes, sample_indexes) as (f_data, _):
+        _validate_read_size(len(feature_indexes), len(sample_indexes))
+        return read_subset(f_data, sample_indexes, feature_indexes)
+
+
 def _validate_read_size(features_length: int, samples_length: int):
     """
-    Raise a 500 error if estimated size of reading columns and rows exceed 1GB indicating possible memory exhaustion. 
-    TODO: We will need to handle reading large data
+    Raise a 507 error if estimated size of reading columns and rows exceed 1GB indicating possible memory exhaustion.
+    Slices larger than this must be read in blocks (see filestore_crud.iter_slice_blocks), which keeps each read
+    under the limit.
     """
     if features_length * samples_length * 8 > MAX_HDF5_READ_IN_BYTES:
         raise LargeDatasetReadError(features_length, samples_length)
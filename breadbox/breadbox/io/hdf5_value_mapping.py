@@ -1,6 +1,9 @@
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
 from breadbox.schemas.custom_http_exception import FileValidationError
+import numpy as np
 import pandas as pd
 import json
 
@@ -30,14 +33,53 @@ def get_encoder_function(value_type: ValueType, allowed_values: Optional[List[st
         raise NotImplementedError(f"Unknown type: {value_type}")
 
 
-def get_decoder_function(value_type: ValueType, allowed_values: Optional[List[str]]):
+# Decoders are kept for the most recently read datasets. Building one can cost more than reading the data (ie: parsing
+# every distinct value of a list_strings matrix), and most reads are of a few columns from the same few datasets.
+MAX_CACHED_DECODERS = 64
+
+_decoder_cache: "OrderedDict[Tuple, Callable[[pd.DataFrame], pd.DataFrame]]" = OrderedDict()
+_decoder_cache_lock = threading.Lock()
+
+
+def get_decoder_function(
+    value_type: ValueType,
+    allowed_values: Optional[List[str]],
+    dataset_id: Optional[str] = None,
+):
+    """
+    Returns a function which converts a dataframe read from the HDF5 file back into the values which were uploaded,
+    or None if no conversion is needed. If dataset_id is given, the decoder is shared by every read of that dataset.
+    """
+    if value_type == ValueType.continuous:
+        return None
+
+    if dataset_id is None:
+        return _create_decoder(value_type, allowed_values)
+
+    key = (
+        dataset_id,
+        value_type,
+        None if allowed_values is None else tuple(allowed_values),
+    )
+    with _decoder_cache_lock:
+        decoder = _decoder_cache.get(key)
+        if decoder is None:
+            decoder = _create_decoder(value_type, allowed_values)
+            _decoder_cache[key] = decoder
+            while len(_decoder_cache) > MAX_CACHED_DECODERS:
+                _decoder_cache.popitem(last=False)
+        else:
+            _decoder_cache.move_to_end(key)
+    return decoder
+
+
+def _create_decoder(value_type: ValueType, allowed_values: Optional[List[str]]):
     if value_type == ValueType.categorical:
         assert allowed_values is not None
-        return lambda df: decode_categorical_df(df, allowed_values)
-    elif value_type == ValueType.continuous:
-        return None
+        lookup = _get_categorical_lookup(allowed_values)
+        return lambda df: _decode_categorical_codes(df, lookup)
     elif value_type == ValueType.list_strings:
-        return decode_list_strings_df
+        return ListStringsDecoder()
     else:
         raise NotImplementedError(f"Unknown type: {value_type}")
 
@@ -45,11 +87,22 @@ def get_decoder_function(value_type: ValueType, allowed_values: Optional[List[st
 ## support for ValueType.categorical
 
 
+def _get_categorical_lookup(allowed_values: List[str]) -> np.ndarray:
+    # missing values are stored as one past the last allowed value
+    lookup = np.empty(len(allowed_values) + 1, dtype=object)
+    for i, value in enumerate(allowed_values):
+        lookup[i] = value
+    lookup[len(allowed_values)] = None
+    return lookup
+
+
+def _decode_categorical_codes(df: pd.DataFrame, lookup: np.ndarray) -> pd.DataFrame:
+    codes = df.to_numpy().astype(int)
+    return pd.DataFrame(np.take(lookup, codes), index=df.index, columns=df.columns)
+
+
 def decode_categorical_df(df: pd.DataFrame, allowed_values: List[str]):
-    # the implementation I'm reworking was doing this -- but why?
-    allowed_values_ = allowed_values + [None]
-    df = df.astype(int)
-    return df.map(lambda x: allowed_values_[x])
+    return _decode_categorical_codes(df, _get_categorical_lookup(allowed_values))
 
 
 def encode_categorical_df(df: pd.DataFrame, allowed_values: List) -> pd.DataFrame:
@@ -124,5 +177,44 @@ def encode_list_strings_df(df: pd.DataFrame):
     return canonicalized
 
 
+# the number of distinct parsed values each ListStringsDecoder remembers
+MAX_CACHED_LIST_STRINGS = 100_000
+
+_NOT_PARSED = object()
+
+
+class ListStringsDecoder:
+    """
+    Decodes list_strings values, parsing each distinct value once. Matrices of this type (ie: mutations) are mostly
+    empty strings and a small number of distinct lists, so parsing every cell would repeat the same work many
+    times over. Parsed values are remembered between calls, which means cells holding the same value share one list
+    object: callers must not modify them.
+    """
+
+    def __init__(self, max_cached_values: int = MAX_CACHED_LIST_STRINGS):
+        self.max_cached_values = max_cached_values
+        self._parsed: Dict[object, Optional[List[str]]] = {}
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        codes, uniques = pd.factorize(df.to_numpy(dtype=object).ravel())
+
+        if len(self._parsed) + len(uniques) > self.max_cached_values:
+            self._parsed = {}
+
+        # the extra last element is for missing values, which factorize gives the code -1
+        parsed = np.empty(len(uniques) + 1, dtype=object)
+        for i, value in enumerate(uniques):
+            result = self._parsed.get(value, _NOT_PARSED)
+            if result is _NOT_PARSED:
+                result = _parse_list_strings_or_na(value)
+                self._parsed[value] = result
+            parsed[i] = result
+        parsed[len(uniques)] = pd.NA
+
+        return pd.DataFrame(
+            parsed[codes].reshape(df.shape), index=df.index, columns=df.columns
+        )
+
+
 def decode_list_strings_df(df: pd.DataFrame) -> pd.DataFrame:
-    return df.map(_parse_list_strings_or_na)
+    return ListStringsDecoder()(df)
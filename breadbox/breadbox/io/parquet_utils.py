@@ -0,0 +1,238 @@
+import os
+import re
+import tempfile
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from breadbox.schemas.custom_http_exception import FileValidationError
+
+# Name of the column which holds the given ID of each row. Tabular datasets also have
+# a column (named after the dimension type's id_column) holding the same values, but that
+# column is just another column from the user's perspective, so the index is stored
+# separately under a name which cannot collide with a user-supplied column.
+INDEX_COLUMN = "__breadbox_given_id__"
+
+# Rows are sorted by given ID before writing, so modestly sized row groups let the
+# min/max statistics prune most of the file when only a few given IDs are requested.
+ROW_GROUP_SIZE = 4096
+
+# CSVs are parsed in blocks of this many bytes, each by a separate thread
+CSV_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Parsed blocks of a matrix CSV are buffered until they hold this many bytes and then written as a single
+# row group. This bounds the memory used while converting. Larger row groups mean fewer (but larger) reads
+# of each column.
+MATRIX_ROW_GROUP_BYTES = 256 * 1024 * 1024
+
+# the strings which pandas.read_csv treats as missing values by default
+CSV_NULL_VALUES = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+]
+
+CSV_CONVERSION_ERROR_PATTERN = re.compile(
+    r"In CSV column #(\d+): Row #(\d+): CSV conversion error to \w+: invalid value '(.*)'"
+)
+
+
+def write_tabular_parquet_file(
+    path: str,
+    index_given_ids: Sequence[str],
+    values_by_column: Dict[str, Sequence[Optional[str]]],
+):
+    """
+    Write the cells of a tabular dataset as one string column per dataset column. Values are
+    stored exactly as they are in the TabularCell table (ie: stringified, with None for missing
+    values) so that both representations read back identically.
+    """
+    arrays = {INDEX_COLUMN: pa.array(list(index_given_ids), type=pa.string())}
+    for column_name, values in values_by_column.items():
+        if column_name == INDEX_COLUMN:
+            raise FileValidationError(f"Column name {INDEX_COLUMN} is reserved")
+        arrays[column_name] = pa.array(list(values), type=pa.string())
+
+    table = pa.table(arrays)
+    table = table.sort_by(INDEX_COLUMN)
+
+    # write to a temp file and rename so that readers never see a partially written file
+    dest_dir = os.path.dirname(path)
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp = tempfile.NamedTemporaryFile(suffix=".parquet", delete=False, dir=dest_dir)
+    tmp.close()
+    try:
+        pq.write_table(table, tmp.name, row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp.name, path)
+    except Exception as e:
+        if os.path.exists(tmp.name):
+            os.unlink(tmp.name)
+        raise FileValidationError("Failed to save dataset to parquet file!") from e
+
+
+def get_tabular_parquet_column_names(path: str) -> List[str]:
+    return [name for name in pq.read_schema(path).names if name != INDEX_COLUMN]
+
+
+def read_tabular_parquet_file(
+    path: str,
+    column_names: Optional[List[str]] = None,
+    index_given_ids: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Return a df indexed by given ID with a column per requested dataset column. Only the requested
+    columns are read from disk (projection) and the given ID filter is applied while scanning (predicate
+    pushdown). Columns or given IDs which don't exist are silently dropped.
+
+    The result is shaped like the pivot of the TabularCell rows: index and columns are sorted and
+    named "dimension_given_id" and "given_id" respectively, and an empty df is returned if nothing matched.
+    """
+    available_columns = get_tabular_parquet_column_names(path)
+    if column_names is None:
+        selected_columns = available_columns
+    else:
+        requested = set(column_names)
+        selected_columns = [x for x in available_columns if x in requested]
+
+    if len(selected_columns) == 0:
+        return pd.DataFrame()
+
+    filters = None
+    if index_given_ids is not None:
+        if len(index_given_ids) == 0:
+            return pd.DataFrame()
+        filters = [(INDEX_COLUMN, "in", list(set(index_given_ids)))]
+
+    table = pq.read_table(
+        path, columns=[INDEX_COLUMN] + selected_columns, filters=filters
+    )
+    if table.num_rows == 0:
+        return pd.DataFrame()
+
+    df = table.to_pandas()
+    df = df.set_index(INDEX_COLUMN)
+    df = df.sort_index()
+    df = df[sorted(selected_columns)]
+    df.index.name = "dimension_given_id"
+    df.columns.name = "given_id"
+
+    return df
+
+
+def write_matrix_csv_as_parquet(
+    csv_file: BinaryIO,
+    dest: BinaryIO,
+    column_names: List[str],
+    value_type: pa.DataType,
+):
+    """
+    Convert a matrix CSV (whose first column is the index) to parquet, streaming it so the whole matrix is never
+    in memory. column_names are the names in the CSV's header row. The index is parsed as strings and every
+    other column as value_type. Raises a ValueError if a value can't be parsed.
+    """
+    schema = pa.schema(
+        [pa.field(column_names[0], pa.string())]
+        + [pa.field(name, value_type) for name in column_names[1:]]
+    )
+
+    # pyarrow's parser is multithreaded, but unlike pandas it rejects rows with fewer values than there are
+    # columns (which pandas treats as missing values). Such files are parsed by pandas instead.
+    has_short_rows = False
+
+    def handle_invalid_row(row):
+        nonlocal has_short_rows
+        if row.actual_columns < row.expected_columns:
+            has_short_rows = True
+        return "error"
+
+    try:
+        reader = pa_csv.open_csv(
+            csv_file,
+            read_options=pa_csv.ReadOptions(
+                use_threads=True,
+                block_size=CSV_BLOCK_SIZE,
+                column_names=column_names,
+                skip_rows=1,
+            ),
+            parse_options=pa_csv.ParseOptions(invalid_row_handler=handle_invalid_row),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={field.name: field.type for field in schema},
+                null_values=CSV_NULL_VALUES,
+                strings_can_be_null=True,
+            ),
+        )
+        _write_row_groups(dest, schema, reader)
+    except pa.ArrowInvalid as e:
+        if not has_short_rows:
+            raise _describe_csv_error(e, column_names) from e
+        csv_file.seek(0)
+        dest.seek(0)
+        dest.truncate()
+        _write_row_groups(dest, schema, _read_csv_with_pandas(csv_file, schema))
+
+
+def _describe_csv_error(e: pa.ArrowInvalid, column_names: List[str]) -> ValueError:
+    # pyarrow refers to columns by number, which isn't helpful for a matrix with thousands of columns
+    match = CSV_CONVERSION_ERROR_PATTERN.search(str(e))
+    if match is None:
+        return e
+    column_index, row_number, value = match.groups()
+    return ValueError(
+        f'Unable to parse string "{value}" in column "{column_names[int(column_index)]}" (row {row_number})'
+    )
+
+
+def _read_csv_with_pandas(
+    csv_file: BinaryIO, schema: pa.Schema
+) -> Iterator[pa.RecordBatch]:
+    rows_per_batch = max(1, MATRIX_ROW_GROUP_BYTES // (8 * len(schema)))
+    dtypes = {
+        field.name: "float64" if pa.types.is_floating(field.type) else "object"
+        for field in schema
+    }
+    chunks = pd.read_csv(
+        csv_file, header=0, names=schema.names, dtype=dtypes, chunksize=rows_per_batch
+    )
+    for chunk in chunks:
+        yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def _write_row_groups(
+    dest: BinaryIO, schema: pa.Schema, batches: Iterable[pa.RecordBatch]
+):
+    # dictionary encoding only helps the (often repeated) values of string matrices
+    use_dictionary = any(pa.types.is_string(field.type) for field in list(schema)[1:])
+    with pq.ParquetWriter(dest, schema, use_dictionary=use_dictionary) as writer:
+        buffered: List[pa.RecordBatch] = []
+        buffered_bytes = 0
+        row_groups_written = 0
+        for batch in batches:
+            buffered.append(batch)
+            buffered_bytes += batch.nbytes
+            if buffered_bytes >= MATRIX_ROW_GROUP_BYTES:
+                writer.write_table(pa.Table.from_batches(buffered, schema))
+                row_groups_written += 1
+                buffered = []
+                buffered_bytes = 0
+        # a matrix without any rows still needs a row group for its schema
+        if len(buffered) > 0 or row_groups_written == 0:
+            writer.write_table(pa.Table.from_batches(buffered, schema))
@@ -0,0 +1,121 @@
+import contextlib
+import os
+import pathlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+from breadbox.utils.fork_safe import ForkSafe
+
+DEFAULT_MAX_FILES = 64
+
+
+class CachedSQLiteFile:
+    """
+    A read-only connection to a SQLite file which is never modified after it's written (ie: the
+    predictive model results). Instances are shared between threads, so a connection is only used
+    while holding its lock, and must not be closed by anything other than the cache.
+    """
+
+    def __init__(self, path: str, version: Tuple):
+        self.path = path
+        self.version = version
+        # immutable=1 lets sqlite skip locking and change detection, since nothing writes to these files
+        uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro&immutable=1"
+        self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        # number of callers currently reading from this file. An evicted file is only closed once
+        # nobody is using it.
+        self.leases = 0
+        self.evicted = False
+
+    def close(self):
+        self.connection.close()
+
+
+def _get_file_version(path: str) -> Tuple:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class SQLiteFileCache(ForkSafe):
+    """
+    An LRU cache of read-only connections to SQLite files, bounded by the number of open files. Meant
+    to be one per process, so that a request doesn't pay for opening (and reading the schema of) each
+    file it queries.
+    """
+
+    def __init__(self, max_files: int = DEFAULT_MAX_FILES):
+        self.max_files = max_files
+        super().__init__()
+
+    def _reset(self):
+        self._files: "OrderedDict[str, CachedSQLiteFile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def open(self, path: str) -> Iterator[sqlite3.Connection]:
+        cached = self._acquire(path)
+        try:
+            with cached.lock:
+                yield cached.connection
+        finally:
+            self._release(cached)
+
+    def _acquire(self, path: str) -> CachedSQLiteFile:
+        self._check_pid()
+        path = os.fspath(path)
+        version = _get_file_version(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is not None and cached.version != version:
+                self._evict(path)
+                cached = None
+
+            if cached is None:
+                cached = CachedSQLiteFile(path, version)
+                self._files[path] = cached
+                while len(self._files) > self.max_files:
+                    self._evict(next(iter(self._files)))
+            else:
+                self._files.move_to_end(path)
+
+            cached.leases += 1
+            return cached
+
+    def _release(self, cached: CachedSQLiteFile):
+        with self._lock:
+            cached.leases -= 1
+            if cached.evicted and cached.leases == 0:
+                cached.close()
+
+    def _evict(self, path: str):
+        cached = self._files.pop(path, None)
+        if cached is None:
+            return
+        cached.evicted = True
+        if cached.leases == 0:
+            cached.close()
+
+    def evict(self, path: str):
+        """Close the cached connection to path (if any). Should be called before a file is deleted."""
+        self._check_pid()
+        with self._lock:
+            self._evict(os.fspath(path))
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            for path in list(self._files):
+                self._evict(path)
+
+
+_file_cache: Optional[SQLiteFileCache] = None
+
+
+def get_sqlite_file_cache() -> SQLiteFileCache:
+    global _file_cache
+    if _file_cache is None:
+        _file_cache = SQLiteFileCache()
+    return _file_cache
@@ -11,15 +11,20 @@ from sqlalchemy import (
     JSON,
     Text,
     DateTime,
+    event,
+    insert,
+    inspect,
+    update,
 )
-from sqlalchemy.orm import relationship, backref, Mapped, mapped_column
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import relationship, backref, Mapped, mapped_column, Session
 from sqlalchemy.sql import func
 from breadbox.schemas.dataset import ColumnMetadata
 
 from breadbox.db.base_class import Base, UUIDMixin
 from breadbox.models.group import GroupMixin
 from breadbox.models.data_type import DataType
-from typing import Any, TypeVar, Type, TYPE_CHECKING, Optional
+from typing import Any, TypeVar, Type, TYPE_CHECKING, Optional, Set
 from ..schemas.dataset import ValueType, AnnotationType
 
 
@@ -37,6 +42,7 @@ else:
     from sqlalchemy import Enum
 
 import enum
+import itertools
 
 # context-sensitive default function
 def default_display_name(context):
@@ -215,6 +221,11 @@ class MatrixDataset(Dataset):
     allowed_values: Mapped[Optional[list]] = mapped_column(
         JSON, nullable=True
     )  # jsonfied string of a list_strings
+    # which on-disk layout the dataset's hdf5 file uses (see hdf5_utils.HDF5StorageOptions). 1 is the
+    # original contiguous layout, 2 is the chunked and compressed layout
+    storage_layout_version: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=1, server_default="1"
+    )
 
     __mapper_args__ = {"polymorphic_identity": "matrix_dataset"}
 
@@ -359,6 +370,22 @@ class DimensionSearchIndex(Base, UUIDMixin, GroupMixin):
     dimension_given_id: Mapped[str] = mapped_column(String, nullable=False)
 
 
+class DimensionSearchIndexFTS(Base):
+    """
+    FTS5 trigram index over DimensionSearchIndex.value, for substring searches. This is an external
+    content table (its rowids are the rowids of dimension_search_index) which triggers keep up to date,
+    so it never needs to be written to directly. However, anything which renumbers the rowids of
+    dimension_search_index (ie: VACUUM, or recreating the table in a migration) must be followed by
+    `rebuild_dimension_search_index_fts`.
+    """
+
+    __tablename__ = "dimension_search_index_fts"
+    __table_args__ = {"info": {"skip_autogenerate": True}}
+
+    rowid: Mapped[int] = mapped_column(Integer, primary_key=True)
+    value: Mapped[Optional[str]] = mapped_column(String)
+
+
 class PropertyToIndex(Base, UUIDMixin, GroupMixin):
     __tablename__ = "property_to_index"
 
@@ -401,3 +428,122 @@ class PrecomputedAssociation(Base, UUIDMixin):
     )  # "feature" or "sample" type
 
     filename: Mapped[str] = mapped_column(String, nullable=False)
+
+
+class CatalogVersion(Base):
+    """
+    A single row holding a counter which is incremented by any transaction that changes the set of datasets, their
+    dimensions or their tabular values. Processes which cache anything derived from the catalog (ie: the virtual SQL
+    schema) compare against it to know when their cache is stale, even when the change was made by another process.
+    """
+
+    __tablename__ = "catalog_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+CATALOG_VERSION_ROW_ID = 1
+
+# The attributes of each catalog class which change what the SQL endpoint sees: the names of its virtual tables, and
+# what they read or cache. Adding or deleting an instance of any of these classes always changes the catalog, but
+# editing (ie: a dataset's description or priority) only does when one of these attributes changed.
+_CATALOG_ATTRIBUTES = {
+    Dataset: {"name", "group_id", "dimensions"},
+    TabularDataset: {"index_type_name"},
+    MatrixDataset: {
+        "feature_type_name",
+        "sample_type_name",
+        "value_type",
+        "allowed_values",
+    },
+    DimensionType: {"name", "id_column", "dataset_id"},
+    Dimension: {"given_id", "index", "dataset_id", "group_id"},
+    TabularColumn: {
+        "annotation_type",
+        "references_dimension_type_name",
+        "tabular_cells",
+    },
+    TabularCell: {"tabular_column_id", "dimension_given_id", "value"},
+}
+
+_CATALOG_CLASSES = tuple(_CATALOG_ATTRIBUTES)
+
+
+def _get_catalog_attributes(cls: type) -> Set[str]:
+    return set().union(
+        *[
+            attributes
+            for catalog_class, attributes in _CATALOG_ATTRIBUTES.items()
+            if issubclass(cls, catalog_class)
+        ]
+    )
+
+
+def bump_catalog_version(connection: Connection):
+    """
+    Increment the catalog version within the current transaction. Must be called explicitly by anything which
+    changes the catalog without going through the unit of work (ie: bulk_save_objects)
+    """
+    table = CatalogVersion.__table__
+    result = connection.execute(
+        update(table)
+        .where(table.c.id == CATALOG_VERSION_ROW_ID)
+        .values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(id=CATALOG_VERSION_ROW_ID, version=1))
+
+
+def _is_catalog_change(obj: Any) -> bool:
+    "Whether flushing obj (which is in session.dirty) changes any of its catalog attributes"
+    state = inspect(obj)
+    return any(
+        state.attrs[key].history.has_changes()
+        for key in _get_catalog_attributes(type(obj))
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_catalog_version_after_flush(session, flush_context):
+    # the session's new/dirty/deleted and the attribute history still reflect what was just flushed
+    changed = itertools.chain(
+        (obj for obj in session.new if isinstance(obj, _CATALOG_CLASSES)),
+        (obj for obj in session.deleted if isinstance(obj, _CATALOG_CLASSES)),
+        (
+            obj
+            for obj in session.dirty
+            if isinstance(obj, _CATALOG_CLASSES) and _is_catalog_change(obj)
+        ),
+    )
+    if next(changed, None) is not None:
+        bump_catalog_version(session.connection())
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_catalog_version_on_bulk_change(execute_state):
+    # query(...).delete() and query(...).update() bypass the unit of work
+    if not (execute_state.is_delete or execute_state.is_update):
+        return
+
+    catalog_mappers = [
+        mapper
+        for mapper in execute_state.all_mappers
+        if issubclass(mapper.class_, _CATALOG_CLASSES)
+    ]
+    if len(catalog_mappers) == 0:
+        return
+
+    if execute_state.is_update:
+        # the values of an update(...).values(...) are keyed by column. Anything else (ie: a bulk update by primary
+        # key) is assumed to change the catalog.
+        values = getattr(execute_state.statement, "_values", None)
+        if values:
+            updated = {getattr(column, "key", column) for column in values}
+            if not any(
+                updated & _get_catalog_attributes(mapper.class_)
+                for mapper in catalog_mappers
+            ):
+                return
+
+    bump_catalog_version(execute_state.session.connection())
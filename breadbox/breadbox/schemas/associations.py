@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from breadbox.depmap_compute_embed.slice import SliceQuery
 from typing import List, Optional, Union
 
@@ -28,6 +28,36 @@ class Associations(BaseModel):
     associated_dimensions: List[Association]
 
 
+class SliceAssociationsSummary(BaseModel):
+    dataset_id: str
+    dataset_name: str
+    dataset_given_id: Union[str, None]
+    dimension_given_id: str
+    dimension_label: str
+    associated_datasets: List[DatasetSummary]
+
+
+class AssociationColumns(BaseModel):
+    "The associations of all the slices as columns. slice_index is the position of each row's slice in the request"
+    slice_index: List[int]
+    correlation: List[float]
+    log10qvalue: List[float]
+    other_dataset_id: List[str]
+    other_dataset_given_id: List[Union[str, None]]
+    other_dimension_given_id: List[str]
+    other_dimension_label: List[str]
+
+
+class AssociationsForSlices(BaseModel):
+    slices: List[SliceAssociationsSummary]
+    associations: AssociationColumns
+
+
+class AssociationsForSlicesParams(BaseModel):
+    slice_queries: List[SliceQuery]
+    association_datasets: Optional[List[str]] = None
+
+
 from typing import Literal
 
 
@@ -51,9 +81,16 @@ class AssociationTable(BaseModel):
 class ComputeAssociationsParams(BaseModel):
     dataset_id: str
     slice_query: SliceQuery
+    limit: Optional[int] = Field(
+        None,
+        description="If set, only return this many features: those with the largest absolute correlation",
+        gt=0,
+    )
 
 
 class LongAssociationsTable(BaseModel):
     label: List[str]
     given_id: List[str]
     cor: List[float]
+    # null where there were too few samples to compute a q-value
+    log10qvalue: List[Optional[float]]
@@ -1,4 +1,4 @@
-from typing import Protocol, List, Optional, Any
+from typing import BinaryIO, Protocol, List, Optional, Any, Union
 
 import h5py
 import pandas as pd
@@ -117,7 +117,7 @@ class HDF5DataFrameWrapper(DataFrameWrapper):
 
 
 class ParquetDataFrameWrapper(DataFrameWrapper):
-    def __init__(self, parquet_path: str):
+    def __init__(self, parquet_path: Union[str, BinaryIO]):
         self.parquet_path = parquet_path
         self.file = pq.ParquetFile(parquet_path)
         self.schema = self.file.schema_arrow
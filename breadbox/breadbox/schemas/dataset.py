@@ -165,6 +165,18 @@ class MatrixDatasetParams(SharedDatasetParams):
             description="The format of the uploaded data file. May either be 'csv', 'parquet' or 'hdf5'.",
         ),
     ] = "csv"
+    row_chunked_copy: Annotated[
+        Optional[bool],
+        Field(
+            description="If true, also store a copy of the data which is fast to read one sample at a time, at the cost of doubling the storage used. If not provided, the server's default is used (which stores the copy).",
+        ),
+    ] = None
+    store_as_float32: Annotated[
+        bool,
+        Field(
+            description="If true, store values with single precision (only applies to 'continuous' and 'categorical' value types). Halves the storage used, but values are only kept to ~7 significant digits.",
+        ),
+    ] = False
 
     @model_validator(mode="after")
     def check_feature_and_sample_type(self):
@@ -319,6 +331,7 @@ class MatrixDatasetBase(SharedDatasetFields):
 
 class MatrixDatasetIn(MatrixDatasetBase):
     id: str
+    storage_layout_version: int = 1
 
     # field_validator
     _check_uuid = field_validator("id")(check_uuid)
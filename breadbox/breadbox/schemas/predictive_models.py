@@ -69,6 +69,12 @@ class PredictiveModelsResponse(BaseModel):
     model_fits: List[ModelFit]
 
 
+class PredictiveModelsForFeaturesIn(BaseModel):
+    """Input for a query for many features at once"""
+
+    feature_given_ids: List[str]
+
+
 class BulkLoadResultsIn(BaseModel):
     """Input for bulk load of results"""
 
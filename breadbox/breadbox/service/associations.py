@@ -1,6 +1,7 @@
 import os
+import time
 from cProfile import label
-from typing import List, Union
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 from typing import List, Optional
@@ -16,8 +17,11 @@ from breadbox.models.dataset import MatrixDataset, DatasetFeature
 from breadbox.schemas.associations import (
     Associations,
     Association,
+    AssociationColumns,
+    AssociationsForSlices,
     DatasetSummary,
     LongAssociationsTable,
+    SliceAssociationsSummary,
 )
 from breadbox.crud import associations as associations_crud
 from breadbox.crud import dataset as dataset_crud
@@ -27,7 +31,9 @@ from breadbox.schemas.custom_http_exception import (
     DatasetNotAMatrix,
 )
 from breadbox.schemas.dataset import MatrixDimensionsInfo
+from breadbox.service import correlation
 from breadbox.service import slice as slice_service
+from breadbox.service.slice import ResolvedSliceIdentifiers
 import logging
 from breadbox.crud.dimension_ids import get_dimension_type_labels_by_id, get_dataset_feature_by_given_id
 import breadbox.crud.dimension_types as dimension_types_crud
@@ -40,152 +46,263 @@ log = logging.getLogger(__name__)
 from breadbox.utils.profiling import profiled_region
 
 
+# above this many ids, load all the labels of a dimension type instead of filtering by id
+MAX_LABEL_LOOKUP_IDS = 10000
+
+# the number of features correlated at a time by compute_associations, and the number of threads
+# correlating them
+COMPUTE_CHUNK_COLUMNS = 2000
+COMPUTE_THREADS = min(4, os.cpu_count() or 1)
+
+
 def get_associations(
     db: SessionWithUser,
     filestore_location: str,
     slice_query: SliceQuery,
     association_datasets: Optional[List[str]] = None,
 ) -> Associations:
-    dataset_id = slice_query.dataset_id
-
-    with profiled_region("in get_associations: get dataset"):
-        dataset = dataset_crud.get_dataset(db, db.user, dataset_id)
-        if dataset is None:
-            raise ResourceNotFoundError(f"Could not find dataset {dataset_id}")
-
-    with profiled_region("in get_associations: get_association_tables"):
-        precomputed_assoc_tables = associations_crud.get_association_tables(
-            db, dataset.id, association_datasets
-        )
-    datasets = []
-    associated_dimensions = []
-
     with profiled_region("in get_associations: resolve_slice_to_components"):
         resolved_slice = slice_service.resolve_slice_to_components(db, slice_query,)
 
-    for precomputed_assoc_table in precomputed_assoc_tables:
-        assert precomputed_assoc_table.dataset_1_id == dataset.id
-        other_dataset = precomputed_assoc_table.dataset_2
-
-        if slice_query.identifier_type in ["feature_id", "feature_label", "column"]:
-            other_dimension_type = other_dataset.feature_type_name
-        else:
-            assert slice_query.identifier_type in ["sample_id", "sample_label"]
-            other_dimension_type = other_dataset.sample_type_name
-
-        datasets.append(
-            DatasetSummary(
-                id=precomputed_assoc_table.id,
-                name=other_dataset.name,
-                dimension_type=other_dimension_type,
-                dataset_id=other_dataset.id,
-                dataset_given_id=other_dataset.given_id,
-            )
-        )
-
-        precomputed_assoc_table_path = os.path.join(
-            filestore_location, precomputed_assoc_table.filename
-        )
+    datasets_by_slice, associations_df = _read_precomputed_associations(
+        db, filestore_location, [slice_query], [resolved_slice], association_datasets
+    )
 
-        with profiled_region("in get_associations: read_cor_for_given_id"):
-            correlation_df = packed_cor_tables.read_cor_for_given_id(
-                precomputed_assoc_table_path, resolved_slice.given_id
+    with profiled_region("in get_associations: create Association records"):
+        associated_dimensions = [
+            Association(
+                correlation=row.correlation,
+                log10qvalue=row.log10qvalue,
+                other_dataset_id=row.other_dataset_id,
+                other_dataset_given_id=row.other_dataset_given_id,
+                other_dimension_given_id=row.other_dimension_given_id,
+                other_dimension_label=row.other_dimension_label,
             )
-
-        # look up all labels with a single query to produce a map that we'll use a little later.
-        label_id_mapping_df = get_dimension_type_label_mapping_df(
-            db,
-            other_dimension_type,
-            given_ids=correlation_df["feature_given_id_1"].tolist(),
-        )
-        label_by_given_id = {
-            row["given_id"]: row["label"]
-            for row in label_id_mapping_df.reset_index(drop=True).to_records()
-        }
-
-        with profiled_region("in get_associations: create Association records"):
-            for row in correlation_df.to_records():
-                other_dimension_given_id = row["feature_given_id_1"]
-                associated_label = label_by_given_id.get(other_dimension_given_id)
-                if associated_label is None:
-                    log.warning(
-                        f"Could not find {other_dimension_type} with id {other_dimension_given_id}"
-                    )
-                    continue
-
-                log10qvalue = row["log10qvalue"]
-
-                # if correlation is 1 then the qvalue can be 0 which results in log10 qvalue to be -inf
-                # if we see this, bound it at -1e100 to avoid json serialization error
-                if np.isinf(log10qvalue):
-                    log10qvalue = -1e100
-
-                associated_dimensions.append(
-                    Association(
-                        correlation=row["cor"],
-                        log10qvalue=log10qvalue,
-                        other_dataset_id=other_dataset.id,
-                        other_dataset_given_id=other_dataset.given_id,
-                        other_dimension_given_id=other_dimension_given_id,
-                        other_dimension_label=associated_label,
-                    )
-                )
+            for row in associations_df.itertuples(index=False)
+        ]
 
     return Associations(
-        dataset_name=dataset.name,
-        dataset_given_id=dataset.given_id,
+        dataset_name=resolved_slice.dataset.name,
+        dataset_given_id=resolved_slice.dataset.given_id,
         dimension_label=resolved_slice.label,
-        associated_datasets=datasets,
+        associated_datasets=datasets_by_slice[0],
         associated_dimensions=associated_dimensions,
     )
 
 
-def np_cor(col, m):
-    # compute pearson correlation coefficient on a single column (col) against all the columns in matrix m
-    # using numpy vectorized operations
+def get_associations_for_slices(
+    db: SessionWithUser,
+    filestore_location: str,
+    slice_queries: List[SliceQuery],
+    association_datasets: Optional[List[str]] = None,
+) -> AssociationsForSlices:
+    """
+    Looks up the precomputed associations of many slices at once. Each association table is only read
+    once for all the slices of its dataset, and the labels of the associated dimensions are fetched with
+    one query per dimension type.
+    """
+    resolved_slices = slice_service.resolve_slices_to_components(db, slice_queries)
+    datasets_by_slice, associations_df = _read_precomputed_associations(
+        db, filestore_location, slice_queries, resolved_slices, association_datasets
+    )
 
-    n_rows, n_cols = m.shape
+    return AssociationsForSlices(
+        slices=[
+            SliceAssociationsSummary(
+                dataset_id=resolved_slice.dataset.id,
+                dataset_name=resolved_slice.dataset.name,
+                dataset_given_id=resolved_slice.dataset.given_id,
+                dimension_given_id=resolved_slice.given_id,
+                dimension_label=resolved_slice.label,
+                associated_datasets=datasets,
+            )
+            for resolved_slice, datasets in zip(resolved_slices, datasets_by_slice)
+        ],
+        associations=AssociationColumns(
+            slice_index=associations_df["slice_index"].tolist(),
+            correlation=associations_df["correlation"].tolist(),
+            log10qvalue=associations_df["log10qvalue"].tolist(),
+            other_dataset_id=associations_df["other_dataset_id"].tolist(),
+            other_dataset_given_id=associations_df["other_dataset_given_id"].tolist(),
+            other_dimension_given_id=associations_df[
+                "other_dimension_given_id"
+            ].tolist(),
+            other_dimension_label=associations_df["other_dimension_label"].tolist(),
+        ),
+    )
 
-    col_v = col.reshape((n_rows, 1))
-    mask = np.isnan(m) | np.isnan(col_v)
 
-    n = np.sum(~mask, axis=0)
-    x_mean = np.sum(np.where(mask, 0, col_v), axis=0) / n
-    y_mean = np.sum(np.where(mask, 0, m), axis=0) / n
+def _read_precomputed_associations(
+    db: SessionWithUser,
+    filestore_location: str,
+    slice_queries: List[SliceQuery],
+    resolved_slices: List[ResolvedSliceIdentifiers],
+    association_datasets: Optional[List[str]],
+) -> Tuple[List[List[DatasetSummary]], pd.DataFrame]:
+    """
+    Returns the summaries of the association tables found for each slice, and a dataframe of all their
+    associations (ordered by slice, then table, then as stored in the table) with the columns slice_index,
+    correlation, log10qvalue, other_dataset_id, other_dataset_given_id, other_dimension_given_id and
+    other_dimension_label.
+    """
+    datasets_by_slice: List[List[DatasetSummary]] = [[] for _ in resolved_slices]
+
+    # the tables are looked up per dataset, and which dimension type they associate with depends on
+    # whether the slice is a feature or a sample
+    slice_indices_by_key: Dict[Tuple[str, bool], List[int]] = {}
+    for slice_index, (slice_query, resolved_slice) in enumerate(
+        zip(slice_queries, resolved_slices)
+    ):
+        is_feature = slice_query.identifier_type in [
+            "feature_id",
+            "feature_label",
+            "column",
+        ]
+        if not is_feature:
+            assert slice_query.identifier_type in ["sample_id", "sample_label"]
+        slice_indices_by_key.setdefault(
+            (resolved_slice.dataset.id, is_feature), []
+        ).append(slice_index)
+
+    dfs = []
+    for (dataset_id, is_feature), slice_indices in slice_indices_by_key.items():
+        with profiled_region("in get_associations: get_association_tables"):
+            precomputed_assoc_tables = associations_crud.get_association_tables(
+                db, dataset_id, association_datasets
+            )
 
-    x_centered = np.where(mask, 0, col_v - x_mean.reshape((1, n_cols)))
-    y_centered = np.where(mask, 0, m - y_mean.reshape((1, n_cols)))
+        slices_df = pd.DataFrame(
+            {
+                "slice_index": slice_indices,
+                "feature_given_id_0": [
+                    resolved_slices[i].given_id for i in slice_indices
+                ],
+            }
+        )
 
-    numerator = np.sum((x_centered * y_centered), axis=0)
-    denominator = np.sqrt(
-        np.sum((x_centered * x_centered), axis=0)
-        * np.sum((y_centered * y_centered), axis=0)
-    )
+        for table_index, precomputed_assoc_table in enumerate(precomputed_assoc_tables):
+            assert precomputed_assoc_table.dataset_1_id == dataset_id
+            other_dataset = precomputed_assoc_table.dataset_2
+
+            if is_feature:
+                other_dimension_type = other_dataset.feature_type_name
+            else:
+                other_dimension_type = other_dataset.sample_type_name
+
+            dataset_summary = DatasetSummary(
+                id=precomputed_assoc_table.id,
+                name=other_dataset.name,
+                dimension_type=other_dimension_type,
+                dataset_id=other_dataset.id,
+                dataset_given_id=other_dataset.given_id,
+            )
+            for slice_index in slice_indices:
+                datasets_by_slice[slice_index].append(dataset_summary)
 
-    return numerator / denominator
+            precomputed_assoc_table_path = os.path.join(
+                filestore_location, precomputed_assoc_table.filename
+            )
+            with profiled_region("in get_associations: read_cor_for_given_ids"):
+                correlation_df = packed_cor_tables.read_cor_for_given_ids(
+                    precomputed_assoc_table_path,
+                    slices_df["feature_given_id_0"].unique().tolist(),
+                )
 
+            # a slice's given id is repeated if it was requested more than once
+            dfs.append(
+                slices_df.merge(
+                    correlation_df[
+                        [
+                            "feature_given_id_0",
+                            "feature_given_id_1",
+                            "cor",
+                            "log10qvalue",
+                        ]
+                    ],
+                    on="feature_given_id_0",
+                ).assign(
+                    table_index=table_index,
+                    other_dimension_type=other_dimension_type,
+                    other_dataset_id=other_dataset.id,
+                    other_dataset_given_id=other_dataset.given_id,
+                )
+            )
 
-def _corr_with(reference: Union[pd.Series, pd.DataFrame], other: pd.DataFrame):
-    # using DataFrame.corrwith, but that method does a vectorized correlation calculation and we want to always correlate the same column with the columns in other.
-    # (ie: DataFrame.corrwith(a, b) computes [ cor(a[0], other[0]) , ... ,cor(a[i], other[i]) ]
-    # and we want to compute [cor(a, other[0]), ..., cor(a, other[i])] )
-    if isinstance(reference, pd.DataFrame):
-        assert len(reference.columns) == 1
-    left = reference.reindex(other.index)
+    columns = [
+        "slice_index",
+        "correlation",
+        "log10qvalue",
+        "other_dataset_id",
+        "other_dataset_given_id",
+        "other_dimension_given_id",
+        "other_dimension_label",
+    ]
+    if len(dfs) == 0:
+        return datasets_by_slice, pd.DataFrame({column: [] for column in columns})
+
+    df = pd.concat(dfs, ignore_index=True).rename(
+        columns={
+            "cor": "correlation",
+            "feature_given_id_1": "other_dimension_given_id",
+        }
+    )
+    # keep the order of each table's rows, but group them by slice
+    df["row_order"] = np.arange(len(df))
+    df = df.sort_values(["slice_index", "table_index", "row_order"])
+
+    # look up all labels with a single query per dimension type
+    labels = pd.Series(index=df.index, dtype=object)
+    for other_dimension_type, type_df in df.groupby(
+        "other_dimension_type", dropna=False
+    ):
+        given_ids = type_df["other_dimension_given_id"].unique().tolist()
+        if pd.isna(other_dimension_type):
+            other_dimension_type = None
+        with profiled_region("in get_associations: get labels"):
+            label_by_given_id = _get_labels_by_given_id(
+                db, other_dimension_type, given_ids
+            )
+        labels[type_df.index] = label_by_given_id.reindex(
+            type_df["other_dimension_given_id"]
+        ).to_numpy()
+
+        missing = type_df["other_dimension_given_id"][labels[type_df.index].isna()]
+        if len(missing) > 0:
+            log.warning(
+                f"Could not find {len(missing.unique())} {other_dimension_type} ids, such as {missing.iloc[0]}"
+            )
+    df["other_dimension_label"] = labels
+    df = df[df["other_dimension_label"].notna()]
 
-    # precision isn't so important here, so use float32 to make it faster
-    left_np = left.to_numpy("float32")
-    right_np = other.to_numpy("float32")
-    return pd.Series(np_cor(left_np, right_np), index=other.columns)
+    # if correlation is 1 then the qvalue can be 0 which results in log10 qvalue to be -inf
+    # if we see this, bound it at -1e100 to avoid json serialization error
+    log10qvalue = df["log10qvalue"].to_numpy(dtype="float64")
+    df["log10qvalue"] = np.where(np.isinf(log10qvalue), -1e100, log10qvalue)
+    df["correlation"] = df["correlation"].astype("float64")
 
-    # # duplicate left so we can compute the pairwise correlations
-    # dupped_cols = pd.concat([left] * len(other.columns), axis=1)
-    # dupped_cols.columns = other.columns
-    #
-    # return dupped_cols.corrwith(other)
+    return datasets_by_slice, df[columns].reset_index(drop=True)
 
 
-import time
+def _get_labels_by_given_id(
+    db: SessionWithUser, dimension_type_name: Optional[str], given_ids: List[str]
+) -> pd.Series:
+    """Returns the labels of given_ids (those which have one), indexed by given id, using a single query"""
+    if (
+        dimension_type_name in [None, "generic"]
+        or len(given_ids) <= MAX_LABEL_LOOKUP_IDS
+    ):
+        label_id_mapping_df = get_dimension_type_label_mapping_df(
+            db, dimension_type_name, given_ids=given_ids,
+        )
+    else:
+        label_id_mapping_df = get_dimension_type_label_mapping_df(
+            db, dimension_type_name
+        )
+    label_by_given_id = pd.Series(
+        label_id_mapping_df["label"].to_numpy(),
+        index=label_id_mapping_df["given_id"].to_numpy(),
+    )
+    return label_by_given_id[~label_by_given_id.index.duplicated()]
 
 
 def compute_associations(
@@ -193,15 +310,16 @@ def compute_associations(
     filestore_location: str,
     other_dataset: MatrixDataset,
     profile_slice_query: SliceQuery,
-) -> pd.Series:
+    limit: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Computes correlation between all features in `other_dataset` with the profile specified by `profile_slice_query`.
+    Returns a dataframe with the columns given_id, label, cor and log10qvalue. If limit is given, only the `limit`
+    features with the largest absolute correlation are returned (the q-values are still computed across all features).
+    """
     beginning = time.time()
-    """ Computes correlation between all features in `other_dataset` with the profile specified by `profile_slice_query` """
     resolved_slice = slice_service.resolve_slice_to_components(db, profile_slice_query)
 
-    log.warning("here")
-    print(
-        f"Calling get_dataset_feature_by_given_id(dataset_id={resolved_slice.dataset.id}, feature_given_id={resolved_slice.given_id}"
-    )
     feature = get_dataset_feature_by_given_id(
         db=db,
         dataset_id=resolved_slice.dataset.id,
@@ -221,58 +339,36 @@ def compute_associations(
         resolved_slice.dataset, [feature.index], filestore_location
     )
 
-    results: List[pd.Series] = []
-    time_spent_in_cor = 0.0
-
-    log.warning(
-        f"other_dataset={other_dataset.id} feature_type={other_dataset.feature_type_name}"
+    # smaller chunks than read_chunked_feature_data's default, so that reading one chunk overlaps with
+    # correlating the previous ones
+    correlations = correlation.correlate_with_chunks(
+        reference_profile.iloc[:, 0],
+        read_chunked_feature_data(
+            other_dataset, filestore_location, max_columns=COMPUTE_CHUNK_COLUMNS
+        ),
+        limit=limit,
+        # precision isn't so important here, so use float32 to make it faster
+        dtype=np.float32,
+        max_workers=COMPUTE_THREADS,
     )
-    start = time.time()
-    # Isn't there a better way to get this? I don't actually need the "index" column: just given_id and label.
-    # I think we should have a method for this.
-    query_results = list(
-        db.query(DatasetFeature)
-        .filter(DatasetFeature.dataset_id == other_dataset.id)
-        .with_entities(DatasetFeature.given_id, DatasetFeature.index)
-        .all()
+
+    label_by_given_id = _get_labels_by_given_id(
+        db, other_dataset.feature_type_name, correlations["given_id"].tolist()
     )
-    given_id_index_mapping = pd.DataFrame(
-        query_results,
-        columns=pd.Index(["given_id", "index"]),  # type: ignore[arg-type]
+    correlations["label"] = label_by_given_id.reindex(
+        correlations["given_id"]
+    ).to_numpy()
+    correlations = correlations[correlations["label"].notna()]
+
+    # if correlation is 1 then the qvalue can be 0 which results in log10 qvalue to be -inf
+    # if we see this, bound it at -1e100 to avoid json serialization error
+    with np.errstate(divide="ignore"):
+        log10qvalue = np.log10(correlations["qvalue"].to_numpy(dtype="float64"))
+    correlations["log10qvalue"] = np.where(
+        np.isneginf(log10qvalue), -1e100, log10qvalue
     )
 
-    if other_dataset.feature_type_name is None:
-        # this special case again: not having a feature_type_name means given_id == label. Should this go into get_dimension_type_labels_by_id?
-        given_id_index_mapping["label"] = given_id_index_mapping["given_id"]
-    else:
-        label_by_id = get_dimension_type_labels_by_id(
-            db, other_dataset.feature_type_name
-        )
-        given_id_index_mapping["label"] = [
-            label_by_id.get(x) for x in given_id_index_mapping["given_id"]
-        ]
-
-    given_id_index_mapping = given_id_index_mapping.set_index("index")
-    log.warning(f"time fetching labels {time.time() - start}")
-    print(given_id_index_mapping)
-
-    for other_profiles in read_chunked_feature_data(other_dataset, filestore_location):
-        log.warning("starting corr")
-        start = time.time()
-        cor_series = _corr_with(reference_profile, other_profiles)
-        # cor_series's index is given_id from other_profiles
-        time_spent_in_cor += time.time() - start
-        log.warning("ending corr")
-        assert len(cor_series) == len(other_profiles.columns)
-        results.append(cor_series)
-
-    log.warning(f"{time_spent_in_cor} seconds in corr")
-    concatted_result = pd.concat(results)
-    log.warning(f"{time.time() - beginning} seconds for whole call")
-    left = pd.DataFrame({"cor": concatted_result}, index=concatted_result.index)
-    with_ids = pd.merge(
-        left, given_id_index_mapping, left_index=True, right_on="given_id", how="inner"
+    log.info(
+        f"Computed {len(correlations)} associations with {other_dataset.id} in {time.time() - beginning} seconds"
     )
-    mask = ~pd.isna(with_ids["cor"])  # boolean Series
-    filtered = with_ids.loc[mask]
-    return filtered[["given_id", "label", "cor"]]
+    return correlations[["given_id", "label", "cor", "log10qvalue"]]
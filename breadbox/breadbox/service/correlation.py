@@ -0,0 +1,206 @@
+"""
+Pearson correlations between matrices which may contain missing values.
+
+Columns are grouped by which of their rows are missing (the same approach as fast_cor_with_missing in the
+preprocessing pipeline's correlation_with_qvalue.py) so that the correlations between each pair of
+groups are computed with a single matrix multiplication, instead of masking every column separately.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+def group_columns_by_mask(m: np.ndarray) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Groups the columns of m which have missing values in the same rows. Returns a list of
+    (mask of the rows with values, indices of the columns) pairs.
+    """
+    finite = np.isfinite(m)
+    if finite.all():
+        return [(np.ones(m.shape[0], dtype=bool), np.arange(m.shape[1]))]
+
+    # pack each column's mask into bytes so the columns can be grouped by np.unique
+    packed = np.ascontiguousarray(np.packbits(finite, axis=0).T)
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    _, first_columns, group_of_column = np.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    columns_by_group = np.split(
+        np.argsort(group_of_column, kind="stable"),
+        np.cumsum(np.bincount(group_of_column))[:-1],
+    )
+    return [
+        (finite[:, first_column], columns)
+        for first_column, columns in zip(first_columns, columns_by_group)
+    ]
+
+
+def _pearson(x: np.ndarray, y: np.ndarray, dtype) -> np.ndarray:
+    # each operand is copied once (as dtype) and centered in place
+    x = np.array(x, dtype=dtype)
+    x -= x.mean(axis=0)
+    y = np.array(y, dtype=dtype)
+    y -= y.mean(axis=0)
+
+    numerator = x.T @ y
+    denominator = np.sqrt(
+        np.outer(np.einsum("ij,ij->j", x, x), np.einsum("ij,ij->j", y, y))
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.clip(numerator / denominator, -1.0, 1.0)
+
+
+def cor_with_missing(
+    x: np.ndarray, y: np.ndarray, dtype=np.float64
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the pearson correlation between each column of x and each column of y, using the rows where
+    both have values. Returns the (x columns, y columns) matrices of correlations and of the number of rows
+    used for each. Correlations which can't be computed (ie: too few rows, or a constant column) are NaN.
+    dtype is the type used for the arithmetic: float32 is roughly twice as fast, at the cost of precision.
+    """
+    assert x.shape[0] == y.shape[0]
+    result = np.full((x.shape[1], y.shape[1]), np.nan)
+    sample_counts = np.zeros((x.shape[1], y.shape[1]), dtype=np.int64)
+
+    y_groups = group_columns_by_mask(y)
+    for x_mask, x_columns in group_columns_by_mask(x):
+        for y_mask, y_columns in y_groups:
+            combined_mask = x_mask & y_mask
+            sample_count = int(np.sum(combined_mask))
+            block = np.ix_(x_columns, y_columns)
+            sample_counts[block] = sample_count
+            if sample_count < 2:
+                continue
+            result[block] = _pearson(
+                x[np.ix_(combined_mask, x_columns)],
+                y[np.ix_(combined_mask, y_columns)],
+                dtype,
+            )
+
+    return result, sample_counts
+
+
+def cor_pvalues(cor: np.ndarray, sample_counts: np.ndarray) -> np.ndarray:
+    """
+    Two-sided p-values of pearson correlations computed from sample_counts pairs of values. NaN where
+    there are too few values (two or fewer) to compute one.
+    """
+    a = sample_counts / 2 - 1
+    with np.errstate(invalid="ignore"):
+        a = np.where(a > 0, a, np.nan)
+        p = 2 * stats.beta.cdf(-np.abs(cor), a, a, loc=-1, scale=2)
+    return np.clip(p, 0.0, 1.0)
+
+
+def fdr_qvalues(p: np.ndarray) -> np.ndarray:
+    """Benjamini-Hochberg q-values of p, ignoring NaNs"""
+    q = np.full(p.shape, np.nan)
+    valid = ~np.isnan(p)
+    if valid.any():
+        q[valid] = stats.false_discovery_control(p[valid])
+    return q
+
+
+@dataclass
+class _ChunkResult:
+    pvalues: np.ndarray
+    # the selected correlations of this chunk, and their positions within pvalues
+    given_ids: np.ndarray
+    cor: np.ndarray
+    positions: np.ndarray
+
+
+def _top_positions(cor: np.ndarray, limit: Optional[int]) -> np.ndarray:
+    if limit is None or len(cor) <= limit:
+        return np.arange(len(cor))
+    return np.argpartition(-np.abs(cor), limit - 1)[:limit]
+
+
+def _correlate_chunk(
+    reference: pd.Series, chunk: pd.DataFrame, limit: Optional[int], dtype
+) -> _ChunkResult:
+    x = reference.reindex(chunk.index).to_numpy(dtype="float64").reshape((-1, 1))
+    cor, sample_counts = cor_with_missing(x, chunk.to_numpy(dtype="float64"), dtype)
+    cor, sample_counts = cor[0], sample_counts[0]
+
+    has_cor = ~np.isnan(cor)
+    cor = cor[has_cor]
+    given_ids = chunk.columns.to_numpy()[has_cor]
+    pvalues = cor_pvalues(cor, sample_counts[has_cor])
+
+    positions = _top_positions(cor, limit)
+    return _ChunkResult(
+        pvalues=pvalues,
+        given_ids=given_ids[positions],
+        cor=cor[positions],
+        positions=positions,
+    )
+
+
+def correlate_with_chunks(
+    reference: pd.Series,
+    chunks: Iterable[pd.DataFrame],
+    limit: Optional[int] = None,
+    dtype=np.float64,
+    max_workers: int = 1,
+) -> pd.DataFrame:
+    """
+    Correlates reference with every column of the chunks (which are indexed by the same labels as
+    reference). Returns a dataframe with the columns given_id (the chunks' column names), cor and qvalue,
+    with a row per column which could be correlated. If limit is given, only the limit rows with the
+    largest absolute correlation are kept, but the q-values still account for all the correlations.
+
+    The chunks are correlated by a pool of max_workers threads while the next chunk is read from the
+    iterable. At most max_workers chunks are held in memory besides the one being read.
+    """
+    pvalues: List[np.ndarray] = []
+    selected: List[pd.DataFrame] = []
+    offset = 0
+
+    def add_result(result: _ChunkResult):
+        nonlocal offset, selected
+        pvalues.append(result.pvalues)
+        selected.append(
+            pd.DataFrame(
+                {
+                    "given_id": result.given_ids,
+                    "cor": result.cor,
+                    "position": result.positions + offset,
+                }
+            )
+        )
+        offset += len(result.pvalues)
+        if limit is not None and len(selected) > 1:
+            merged = pd.concat(selected, ignore_index=True)
+            selected = [merged.iloc[_top_positions(merged["cor"].to_numpy(), limit)]]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(
+                executor.submit(_correlate_chunk, reference, chunk, limit, dtype)
+            )
+            # results are merged in order so that the positions of the p-values line up
+            while len(pending) > max_workers:
+                add_result(pending.popleft().result())
+        while len(pending) > 0:
+            add_result(pending.popleft().result())
+
+    if len(selected) == 0:
+        return pd.DataFrame({"given_id": [], "cor": [], "qvalue": []})
+
+    df = pd.concat(selected, ignore_index=True)
+    qvalues = fdr_qvalues(np.concatenate(pvalues))
+    return pd.DataFrame(
+        {
+            "given_id": df["given_id"].to_numpy(),
+            "cor": df["cor"].to_numpy(),
+            "qvalue": qvalues[df["position"].to_numpy()],
+        }
+    )
@@ -1,7 +1,11 @@
 import json
 from breadbox.crud import dataset as dataset_crud
 from breadbox.io.data_validation import annotation_type_to_pandas_column_type
-from breadbox.io.filestore_crud import get_slice
+from breadbox.io.filestore_crud import (
+    MAX_STREAMED_BLOCK_IN_BYTES,
+    get_slice,
+    iter_slice_blocks,
+)
 from breadbox.schemas.dataset import (
     FeatureSampleIdentifier,
     MatrixDimensionsInfo,
@@ -46,7 +50,7 @@ from ..crud.dimension_types import (
 from ..crud import dimension_types as types_crud
 
 from ..service.search import populate_search_index_after_update
-from typing import Any, Dict, List, Literal, Optional, Type, Union
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, Type, Union
 from uuid import uuid4
 
 import pandas as pd
@@ -76,16 +80,15 @@ from breadbox.crud.dimension_ids import GivenIDLabelIndex
 log = logging.getLogger(__name__)
 
 
-def get_subsetted_matrix_dataset_df(
+def _resolve_matrix_dimensions(
     db: SessionWithUser,
     dataset: MatrixDataset,
     dimensions_info: MatrixDimensionsInfo,
-    filestore_location,
-    strict: bool = False,  # False default for backwards compatibility
+    strict: bool,
 ):
     """
-    Load a dataframe containing data for the specified dimensions.
-    If the dimensions are specified by label, then return a result indexed by labels
+    Look up the matrix indexes of the requested features and samples, returning a mapping of
+    index -> given_id and label for each.
     """
 
     def get_data_type(
@@ -195,6 +198,47 @@ def get_subsetted_matrix_dataset_df(
         if len(missing_samples) > 0:
             raise SampleNotFoundError(missing_samples_msg)
 
+    return feature_index_mapping_df, sample_index_mapping_df
+
+
+def _get_matrix_index_renames(
+    dimensions_info: MatrixDimensionsInfo,
+    feature_index_mapping_df: GivenIDLabelIndex,
+    sample_index_mapping_df: GivenIDLabelIndex,
+) -> Tuple[Dict[int, str], Dict[int, str]]:
+    # The slice read from the file has matrix indices as the feature and sample index. Map these to either given_ids or labels depending on which type of id was orignally passed in
+
+    def make_mapping(df: pd.DataFrame, from_col: str, to_col: str) -> Dict[int, str]:
+        return cast(Dict[int, str], dict(zip(df[from_col], df[to_col])))
+
+    if dimensions_info.feature_identifier == FeatureSampleIdentifier.label:
+        column_renames = make_mapping(feature_index_mapping_df, "index", "label")
+    else:
+        column_renames = make_mapping(feature_index_mapping_df, "index", "given_id")
+
+    if dimensions_info.sample_identifier == FeatureSampleIdentifier.label:
+        index_renames = make_mapping(sample_index_mapping_df, "index", "label")
+    else:
+        index_renames = make_mapping(sample_index_mapping_df, "index", "given_id")
+
+    return column_renames, index_renames
+
+
+def get_subsetted_matrix_dataset_df(
+    db: SessionWithUser,
+    dataset: MatrixDataset,
+    dimensions_info: MatrixDimensionsInfo,
+    filestore_location,
+    strict: bool = False,  # False default for backwards compatibility
+):
+    """
+    Load a dataframe containing data for the specified dimensions.
+    If the dimensions are specified by label, then return a result indexed by labels
+    """
+    feature_index_mapping_df, sample_index_mapping_df = _resolve_matrix_dimensions(
+        db, dataset, dimensions_info, strict
+    )
+
     # fetch data
     df = get_slice(
         dataset,
@@ -205,24 +249,10 @@ def get_subsetted_matrix_dataset_df(
         indices_as_index=True,
     )
 
-    # The resulting df has matrix indices as the feature and sample index. Map these to either given_ids or labels depending on which type of id was orignally passed in
-
-    def make_mapping(df: pd.DataFrame, from_col: str, to_col: str) -> Dict[str, str]:
-        return cast(
-            Dict[str, str], {row[from_col]: row[to_col] for _, row in df.iterrows()}
-        )
-
-    if dimensions_info.feature_identifier == FeatureSampleIdentifier.label:
-        df = df.rename(columns=make_mapping(feature_index_mapping_df, "index", "label"))
-    else:
-        df = df.rename(
-            columns=make_mapping(feature_index_mapping_df, "index", "given_id")
-        )
-
-    if dimensions_info.sample_identifier == FeatureSampleIdentifier.label:
-        df = df.rename(index=make_mapping(sample_index_mapping_df, "index", "label"))
-    else:
-        df = df.rename(index=make_mapping(sample_index_mapping_df, "index", "given_id"))
+    column_renames, index_renames = _get_matrix_index_renames(
+        dimensions_info, feature_index_mapping_df, sample_index_mapping_df
+    )
+    df = df.rename(columns=column_renames, index=index_renames)
 
     # now perform any aggregation requested
 
@@ -244,6 +274,49 @@ def get_subsetted_matrix_dataset_df(
     return df
 
 
+def iter_subsetted_matrix_dataset_df_blocks(
+    db: SessionWithUser,
+    dataset: MatrixDataset,
+    dimensions_info: MatrixDimensionsInfo,
+    filestore_location,
+    strict: bool = False,
+    max_block_bytes: int = MAX_STREAMED_BLOCK_IN_BYTES,
+) -> Iterator[pd.DataFrame]:
+    """
+    The same data as get_subsetted_matrix_dataset_df, but returned as blocks of features (columns) which each
+    use at most max_block_bytes, so that slices too large to hold in memory can be streamed. Aggregation needs
+    every feature at once, so isn't supported.
+
+    Features and samples are resolved (and any errors for missing ones are raised) before this returns.
+    """
+    assert dimensions_info.aggregate is None
+
+    feature_index_mapping_df, sample_index_mapping_df = _resolve_matrix_dimensions(
+        db, dataset, dimensions_info, strict
+    )
+    column_renames, index_renames = _get_matrix_index_renames(
+        dimensions_info, feature_index_mapping_df, sample_index_mapping_df
+    )
+
+    blocks = iter_slice_blocks(
+        dataset,
+        list(feature_index_mapping_df.index),
+        list(sample_index_mapping_df.index),
+        filestore_location,
+        axis="features",
+        max_block_bytes=max_block_bytes,
+        keep_nans=True,
+        indices_as_index=True,
+    )
+
+    def relabel_blocks():
+        for df in blocks:
+            df = df.rename(columns=column_renames, index=index_renames)
+            yield df.replace({np.nan: None})
+
+    return relabel_blocks()
+
+
 def _chunked_aggregate_matrix_df(
     df: pd.DataFrame, axis: int, agg_method, chunk_size_in_mb=10
 ):
@@ -602,6 +675,7 @@ def add_matrix_dataset(
         description=description,
         version=version,
         upload_date=get_current_datetime(),
+        storage_layout_version=dataset_in.storage_layout_version,
     )
     db.add(dataset)
     db.flush()
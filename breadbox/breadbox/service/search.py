@@ -1,12 +1,13 @@
+import json
 import logging
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Optional
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import insert
+from sqlalchemy import insert, literal_column, text
 
-from ..crud.metadata import cast_tabular_cell_value_type
-from ..crud import dimension_types as types_crud
+from ..crud import dataset as dataset_crud
 
 from breadbox.db.session import SessionWithUser
 from ..schemas.dataset import ColumnMetadata
@@ -25,28 +26,12 @@ from ..crud.dimension_types import get_dimension_type, get_dimension_type_metada
 log = logging.getLogger(__name__)
 
 
-@dataclass
-class PropertyValuePair:
-    property: str
-    value: str
-
-
 @dataclass
 class MetadataCacheEntry:
     properties_to_index_df: pd.DataFrame
     columns_metadata: Dict[str, ColumnMetadata]
-
-    def get_label_for_given_id(self, given_id):
-        try:
-            return self.properties_to_index_df.loc[given_id, "label"]
-        except KeyError:
-            return None
-
-    def get_properties_dict(self, given_id: str):
-        try:
-            return self.properties_to_index_df.loc[given_id].to_dict()
-        except KeyError:
-            return None
+    # computed on first use by get_property_value_pairs
+    property_value_pairs: Optional[pd.DataFrame] = None
 
 
 class MetadataCache:
@@ -83,10 +68,6 @@ class MetadataCache:
 
                 columns_metadata = dict(dimension_type.dataset.columns_metadata)
 
-            rows_by_index = {}
-            for record in properties_to_index_df.to_records():
-                rows_by_index[record.index] = record
-
             entry = MetadataCacheEntry(
                 properties_to_index_df=properties_to_index_df,
                 columns_metadata=columns_metadata,
@@ -114,13 +95,17 @@ def populate_search_index_after_update(
     db.flush()
 
 
-def _delete_search_index_records(db: SessionWithUser, dimension_type: DimensionType):
-    db.query(DimensionSearchIndex).filter(
-        DimensionSearchIndex.dimension_type_name == dimension_type.name
-    ).delete()
-
-    db.flush()
-    return True
+def rebuild_dimension_search_index_fts(db: SessionWithUser):
+    """
+    Reindex every record of the search index in dimension_search_index_fts. Only needed when the
+    rowids of dimension_search_index may have changed (ie: after a VACUUM), since the index is
+    otherwise maintained by triggers.
+    """
+    db.execute(
+        text(
+            "INSERT INTO dimension_search_index_fts(dimension_search_index_fts) VALUES ('rebuild')"
+        )
+    )
 
 
 def refresh_search_index_for_dimension_type(
@@ -130,6 +115,12 @@ def refresh_search_index_for_dimension_type(
     Populates search index for a single dimension type. If you need to regenerate the index because the
     dimension_type has changed, call `populate_search_index_after_update` instead of calling this
     directly.
+
+    Only the records of dimensions whose records have changed (including via a dimension they reference)
+    are deleted and rewritten, so a small edit to a large metadata table only writes a few rows.
+
+    The full-text index over the search index values (dimension_search_index_fts) is kept in sync
+    with the records written here by triggers, so it doesn't need to be updated separately.
     """
     log.info("refresh_search_index_for_dimension_type %s starting", dimension_type_name)
 
@@ -141,47 +132,129 @@ def refresh_search_index_for_dimension_type(
         assert user_has_access_to_group(
             dimension_type.dataset.group, db.user, write_access=True
         ), "Sign of user not having access to dataset needing to be indexed"
+        new_records = _get_search_index_records(
+            dimension_type_name, dimension_type.dataset.group_id, metadata_cache
+        )
+    else:
+        new_records = pd.DataFrame(columns=_SEARCH_INDEX_RECORD_COLUMNS)
+
+    existing_records = _get_existing_search_index_records(db, dimension_type_name)
+    changed_given_ids = _get_changed_given_ids(existing_records, new_records)
+
+    # clear out the previous records of any dimension which changed or no longer exists
+    stale_given_ids = [
+        x
+        for x in pd.unique(existing_records["dimension_given_id"])
+        if x in changed_given_ids
+    ]
+    for batch in _make_batches(stale_given_ids, batch_size=500):
+        db.query(DimensionSearchIndex).filter(
+            DimensionSearchIndex.dimension_type_name == dimension_type_name,
+            DimensionSearchIndex.dimension_given_id.in_(batch),
+        ).delete(synchronize_session=False)
+    db.flush()
 
-        # before creating records in the search index for this dimension_type, clear out any previously existing records
-        log.info("_delete_search_index_records start")
-        _delete_search_index_records(db, dimension_type)
-        log.info("_delete_search_index_records complete")
-
-    cache_entry = metadata_cache.get(dimension_type.name)
-
-    def row_generator():
-        for given_id in cache_entry.properties_to_index_df.index:
-            for record in get_property_value_pairs_for_given_id(
-                db=db,
-                dimension_type_name=dimension_type.name,
-                given_id=given_id,
-                metadata_cache=metadata_cache,
-            ):
-                label = cache_entry.get_label_for_given_id(given_id)
-                if label is None:
-                    # if we don't have a label, this given_id didn't exist
-                    # in metadata, so move on
-                    continue
-
-                # if given_id in cache_entry.dimension_id_by_given_id:
-                yield dict(
-                    property=record.property,
-                    value=record.value,
-                    group_id=dimension_type.dataset.group_id,
-                    dimension_type_name=dimension_type.name,
-                    dimension_given_id=given_id,
-                    label=label,
-                )
+    records_to_write = new_records[
+        new_records["dimension_given_id"].isin(changed_given_ids)
+    ].assign(dimension_type_name=dimension_type_name)
 
     dimension_search_index_row_count = 0
-    for batch in _make_batches(row_generator(), batch_size=1000):
+    for start in range(0, len(records_to_write), 1000):
+        batch = records_to_write.iloc[start : start + 1000].to_dict("records")
         db.execute(insert(DimensionSearchIndex), batch)
         dimension_search_index_row_count += len(batch)
-        f"Wrote batch of {len(batch)} search index records for {dimension_type_name}"
 
     log.info(
-        f"Finished writing all {(dimension_search_index_row_count)} search index records for {len(cache_entry.properties_to_index_df.index)} rows in {dimension_type_name}"
+        f"Rewrote the {dimension_search_index_row_count} search index records of {len(changed_given_ids)} changed dimensions ({len(stale_given_ids)} deleted or updated) out of {new_records['dimension_given_id'].nunique()} in {dimension_type_name}"
+    )
+
+
+_SEARCH_INDEX_RECORD_COLUMNS = [
+    "dimension_given_id",
+    "property",
+    "value",
+    "label",
+    "group_id",
+]
+
+
+def _get_search_index_records(
+    dimension_type_name: str, group_id: str, metadata_cache: MetadataCache
+) -> pd.DataFrame:
+    "Returns the records which should be in the search index for the dimension type, in the order they should be written"
+    properties_to_index_df = metadata_cache.get(
+        dimension_type_name
+    ).properties_to_index_df
+    if "label" in properties_to_index_df.columns:
+        labels = properties_to_index_df["label"].dropna()
+    else:
+        labels = pd.Series([], dtype=object)
+
+    # if we don't have a label, this given_id didn't exist in metadata, so there's nothing to index
+    pairs = get_property_value_pairs(dimension_type_name, metadata_cache)
+    records = pairs[pairs["dimension_given_id"].isin(labels.index)]
+    return records.assign(
+        label=labels.reindex(records["dimension_given_id"]).values, group_id=group_id,
+    )[_SEARCH_INDEX_RECORD_COLUMNS]
+
+
+def _get_existing_search_index_records(
+    db: SessionWithUser, dimension_type_name: str
+) -> pd.DataFrame:
+    query = (
+        db.query(DimensionSearchIndex)
+        .filter(DimensionSearchIndex.dimension_type_name == dimension_type_name)
+        .with_entities(
+            *[getattr(DimensionSearchIndex, x) for x in _SEARCH_INDEX_RECORD_COLUMNS]
+        )
+        # the order the records were written in, which is the order they're reported in
+        .order_by(literal_column("dimension_search_index.rowid"))
     )
+    return pd.read_sql(query.statement, query.session.connection())
+
+
+def _get_record_hashes(records: pd.DataFrame) -> pd.Series:
+    """
+    Hash the records of each dimension into a single value, which changes if any of its records change or
+    if they are reordered.
+    """
+    if len(records) == 0:
+        return pd.Series([], dtype=np.uint64)
+
+    records = records.reset_index(drop=True)
+    position = records.groupby("dimension_given_id", sort=False).cumcount()
+    row_hashes = pd.util.hash_pandas_object(
+        records[_SEARCH_INDEX_RECORD_COLUMNS[1:]]
+        .astype(object)
+        .where(records[_SEARCH_INDEX_RECORD_COLUMNS[1:]].notna(), None)
+        .assign(position=position),
+        index=False,
+    ).to_numpy()
+
+    # sum up the hashes per dimension (letting the sum wrap around)
+    codes, given_ids = pd.factorize(records["dimension_given_id"])
+    order = np.argsort(codes, kind="stable")
+    starts = np.searchsorted(codes[order], np.arange(len(given_ids)))
+    return pd.Series(np.add.reduceat(row_hashes[order], starts), index=given_ids)
+
+
+def _get_changed_given_ids(
+    existing_records: pd.DataFrame, new_records: pd.DataFrame
+) -> set:
+    "Returns the given IDs of dimensions which were added, removed or whose records are different"
+    existing_hashes = _get_record_hashes(existing_records)
+    new_hashes = _get_record_hashes(new_records)
+
+    changed_given_ids = set(
+        existing_hashes.index.symmetric_difference(new_hashes.index)
+    )
+    in_both = existing_hashes.index.intersection(new_hashes.index)
+    is_changed = (
+        existing_hashes.reindex(in_both).to_numpy()
+        != new_hashes.reindex(in_both).to_numpy()
+    )
+    changed_given_ids.update(in_both[is_changed])
+    return changed_given_ids
 
 
 def _make_batches(iterable, batch_size):
@@ -223,80 +296,119 @@ def _get_datatypes_referencing(db, dimension_type_name):
     return seen_names
 
 
-def get_property_value_pairs_for_given_id(
-    db, dimension_type_name: str, given_id: str, metadata_cache: MetadataCache
-) -> List[PropertyValuePair]:
-    dimension_search_index_rows = []
-
+def get_property_value_pairs(
+    dimension_type_name: str, metadata_cache: MetadataCache
+) -> pd.DataFrame:
+    """
+    Returns a dataframe with a row (dimension_given_id, property, value) for each value to be indexed for
+    every dimension of the given type. Values which are references to dimensions of another type are
+    replaced by the property/value pairs of the referenced dimension, with the property names prefixed
+    by the name of the column that referenced it (ie: "target.label").
+
+    Rows are ordered by given_id (in the order they're in the metadata), then by property (in the order
+    of properties_to_index), then by their position within a list. Computed a column at a time and
+    cached on the MetadataCache, since the pairs of a type are needed for every type that references it.
+    """
     md_entry = metadata_cache.get(dimension_type_name)
+    if md_entry.property_value_pairs is not None:
+        return md_entry.property_value_pairs
+
     properties_to_index_df = md_entry.properties_to_index_df
     columns_metadata = md_entry.columns_metadata
 
-    row = md_entry.get_properties_dict(given_id)
-    # if this ID is not specified, then just move on.
-    if row is not None:
-        # create one or more search index record for each column in properties_to_index_df
-        for property in properties_to_index_df.columns:
-            property_value = row[property]
-            if property not in columns_metadata:
-                continue
-            cm = columns_metadata[property]
-
-            # now, check to see if we have a single value or multiple
-            if property_value is None:
-                values = []
-            elif cm.col_type == AnnotationType.list_strings:
-                values = cast_tabular_cell_value_type(
-                    property_value, AnnotationType.list_strings
-                )
-                assert isinstance(values, list)
-            else:
-                values = [property_value]
-
-            # are these values references to a keys in a different table
-            if cm.references is not None:
-                for value in values:
-                    for search_index_record in get_property_value_pairs_for_given_id(
-                        db,
-                        dimension_type_name=cm.references,
-                        given_id=value,
-                        metadata_cache=metadata_cache,
-                    ):
-                        # prefix the property name before adding to the index with the name
-                        # of the relationship that we traversed to get it. (this let's us
-                        # distinguish those properties which have the same name. For example, for
-                        # a compound, we'll get "alias" which is an alternative name for the
-                        # compound and "target.alias" which is an alternative name for the gene targeted
-                        # by the compound)
-                        dimension_search_index_rows.append(
-                            PropertyValuePair(
-                                property=f"{property}.{search_index_record.property}",
-                                value=search_index_record.value,
-                            )
-                        )
-            else:
-                # if not, then just add a search index record for each value
-                for value in values:
-                    dimension_search_index_rows.append(
-                        PropertyValuePair(property=property, value=value,),
-                    )
-
-    return dimension_search_index_rows
-
-
-# TODO: replace
-def get_metadata_by_dataset(
-    db: SessionWithUser, dataset: Dataset, properties_to_index: List[str]
-) -> pd.DataFrame:
+    parts = []
+    for property_position, property in enumerate(properties_to_index_df.columns):
+        if property not in columns_metadata:
+            continue
+        cm = columns_metadata[property]
+
+        # indexed by the position of the given_id in properties_to_index_df
+        values = properties_to_index_df[property].reset_index(drop=True)
+        values = values[values.notna()]
+        if cm.col_type == AnnotationType.list_strings:
+            decoded = {x: json.loads(x) for x in pd.unique(values)}
+            values = values.map(decoded).explode()
+            values = values[values.notna()]
+        value_position = values.groupby(level=0, sort=False).cumcount().to_numpy()
+
+        part = pd.DataFrame(
+            {
+                "given_id_position": values.index.to_numpy(),
+                "property_position": property_position,
+                "value_position": value_position,
+                "value": values.astype(str).to_numpy(),
+            }
+        )
 
-    by_property = {}
+        if cm.references is not None:
+            # are these values references to a keys in a different table? If so, index the
+            # properties of the referenced dimensions. Prefix the property name before adding to the
+            # index with the name of the relationship that we traversed to get it. (this let's us
+            # distinguish those properties which have the same name. For example, for a compound,
+            # we'll get "alias" which is an alternative name for the compound and "target.alias"
+            # which is an alternative name for the gene targeted by the compound)
+            referenced_pairs = get_property_value_pairs(cm.references, metadata_cache)
+            part = part.merge(
+                referenced_pairs.assign(
+                    reference_position=np.arange(len(referenced_pairs))
+                ).rename(columns={"value": "referenced_value"}),
+                left_on="value",
+                right_on="dimension_given_id",
+            )
+            part = part.assign(
+                property=f"{property}." + part["property"],
+                value=part["referenced_value"],
+            )
+        else:
+            part = part.assign(property=property, reference_position=0)
+
+        parts.append(
+            part[
+                [
+                    "given_id_position",
+                    "property_position",
+                    "value_position",
+                    "reference_position",
+                    "property",
+                    "value",
+                ]
+            ]
+        )
 
-    index_type_name = dataset.index_type_name
-    for property in properties_to_index:
-        value_per_given_id = types_crud.get_dimension_type_metadata_col(
-            db, dimension_type_name=index_type_name, col_name=property
+    if len(parts) == 0:
+        pairs = pd.DataFrame(columns=["dimension_given_id", "property", "value"])
+    else:
+        combined = pd.concat(parts, ignore_index=True).sort_values(
+            [
+                "given_id_position",
+                "property_position",
+                "value_position",
+                "reference_position",
+            ],
+            kind="stable",
+        )
+        pairs = pd.DataFrame(
+            {
+                "dimension_given_id": properties_to_index_df.index.to_numpy()[
+                    combined["given_id_position"].to_numpy()
+                ],
+                "property": combined["property"].to_numpy(),
+                "value": combined["value"].to_numpy(),
+            }
         )
 
-        by_property[property] = pd.Series(value_per_given_id)
+    md_entry.property_value_pairs = pairs
+    return pairs
+
 
-    return pd.DataFrame(by_property)
+def get_metadata_by_dataset(
+    db: SessionWithUser, dataset: TabularDataset, properties_to_index: List[str]
+) -> pd.DataFrame:
+    # read all the indexed properties in one pass over the dataset's columnar file (or one query if the
+    # dataset doesn't have one yet) rather than a query per property
+    df = dataset_crud.get_subset_of_tabular_data_as_df(
+        db, dataset, properties_to_index, None
+    )
+    # keep the columns in the order the properties were listed, since that determines the order
+    # that matching properties are reported in
+    return df[[x for x in properties_to_index if x in df.columns]]
@@ -1,10 +1,10 @@
 from dataclasses import dataclass
-from typing import List, cast
+from typing import Dict, List, Tuple, cast
 from logging import getLogger
 
 import pandas as pd
 
-from breadbox.models.dataset import Dataset
+from breadbox.models.dataset import Dataset, MatrixDataset
 from breadbox.db.session import SessionWithUser
 import breadbox.crud.dataset as dataset_crud
 from breadbox.schemas.dataset import TabularDimensionsInfo
@@ -89,6 +89,72 @@ def resolve_slice_to_components(
     return ResolvedSliceIdentifiers(dataset=dataset, label=label, given_id=given_id)
 
 
+def resolve_slices_to_components(
+    db: SessionWithUser, slice_queries: List[SliceQuery]
+) -> List[ResolvedSliceIdentifiers]:
+    """
+    Resolves many slice queries at once. Equivalent to calling resolve_slice_to_components on each,
+    except that each dataset (and the labels of each of its matrix axes) is only loaded once.
+    """
+    datasets: Dict[str, Dataset] = {}
+    labels_by_id_by_axis: Dict[Tuple[str, str], Dict[str, str]] = {}
+    ids_by_label_by_axis: Dict[Tuple[str, str], Dict[str, str]] = {}
+
+    resolved_slices = []
+    for slice_query in slice_queries:
+        dataset_id = slice_query.dataset_id
+        if dataset_id not in datasets:
+            dataset = dataset_crud.get_dataset(db, db.user, dataset_id)
+            if dataset is None:
+                raise ResourceNotFoundError(f"Could not find dataset {dataset_id}")
+            datasets[dataset_id] = dataset
+        dataset = datasets[dataset_id]
+
+        if (
+            not isinstance(dataset, MatrixDataset)
+            or slice_query.identifier_type == "column"
+        ):
+            resolved_slices.append(resolve_slice_to_components(db, slice_query))
+            continue
+
+        axis, identifier_kind = slice_query.identifier_type.split("_")
+        key = (dataset_id, axis)
+        if key not in labels_by_id_by_axis:
+            if axis == "feature":
+                labels_by_id = metadata_service.get_matrix_dataset_feature_labels_by_id(
+                    db, db.user, dataset
+                )
+            else:
+                labels_by_id = metadata_service.get_matrix_dataset_sample_labels_by_id(
+                    db, db.user, dataset
+                )
+            labels_by_id_by_axis[key] = labels_by_id
+            ids_by_label_by_axis[key] = {
+                label: given_id for given_id, label in labels_by_id.items()
+            }
+
+        if identifier_kind == "id":
+            given_id = slice_query.identifier
+            label = labels_by_id_by_axis[key].get(given_id)
+            if label is None:
+                raise ResourceNotFoundError(
+                    f"Could not find {axis} {given_id} in dataset {dataset_id}"
+                )
+        else:
+            label = slice_query.identifier
+            given_id = ids_by_label_by_axis[key].get(label)
+            if given_id is None:
+                raise ResourceNotFoundError(
+                    f"Could not find {axis} with label {label} in dataset {dataset_id}"
+                )
+
+        resolved_slices.append(
+            ResolvedSliceIdentifiers(dataset=dataset, label=label, given_id=given_id)
+        )
+
+    return resolved_slices
+
+
 def _flatten_reindex_chain(leaf: SliceQuery) -> List[SliceQuery]:
     """
     Flatten the nested reindex_through chain into a list ordered [root, ..., leaf].
@@ -1,4 +1,9 @@
 from .schema import generate_simulated_schema
-from .query import execute_sql_in_virtual_db
+from .query import execute_sql_in_virtual_db, write_sql_query_result, SqlResultFormat
 
-ALL = ["generate_simulated_schema", "execute_sql_in_virtual_db"]
+ALL = [
+    "generate_simulated_schema",
+    "execute_sql_in_virtual_db",
+    "write_sql_query_result",
+    "SqlResultFormat",
+]
@@ -11,9 +11,11 @@ from typing import (
     Type,
     Sequence,
     Dict,
+    Optional,
+    Set,
+    Literal,
 )
 from breadbox.models.dataset import ValueType
-import json
 
 from breadbox.db.session import SessionWithUser
 from ...schemas.custom_http_exception import UserError
@@ -25,6 +27,7 @@ from ...schemas.dataset import (
 from ...crud import dataset as crud_dataset
 from ...crud import dimension_types as crud_dimension_types
 from ...crud import dimension_ids as crud_dimension_ids
+from ...crud.group import get_groups_with_visible_contents
 from ...models.dataset import (
     MatrixDataset,
     TabularDataset,
@@ -33,11 +36,15 @@ from ...models.dataset import (
 )
 import re
 import bisect
+import itertools
+import threading
+from collections import OrderedDict
 
 import apsw
 import apsw.ext
 from .schema import assign_names, SchemaNames
 from breadbox.utils.profiling import profiled_region
+from breadbox.utils.fork_safe import ForkSafe
 
 import sqlglot
 import sqlglot.errors
@@ -47,7 +54,13 @@ import io
 
 SQLiteValue = Any
 import logging
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ...io.filestore_crud import get_file_location, iter_slice_blocks
+from ...io.hdf5_utils import get_hdf5_file_matrix_size
 
 log = logging.getLogger(__name__)
 
@@ -63,6 +76,33 @@ def _create_schema_str(columns: Iterable[str]) -> str:
     return schema
 
 
+# sqlite doesn't tell BestIndex how many values an "IN (...)" constraint has, so assume a handful
+IN_CONSTRAINT_SIZE_ESTIMATE = 10
+
+# the number of rows in each batch when a virtual table's callable produces rows one at a time
+ROWS_PER_BATCH = 1024
+
+# Constraints passed to a virtual table's callable are a tuple of the values the column must be one of. An
+# equality constraint has one value, and an IN constraint has every value in the list.
+Constraints = Dict[str, Tuple[SQLiteValue, ...]]
+
+# Each virtual table's callable returns a sequence of batches of rows. A batch is a sequence of columns, each
+# holding that column's values for every row in the batch.
+Batch = Sequence[Sequence[SQLiteValue]]
+
+
+def rows_to_batches(rows: Iterable[Sequence[SQLiteValue]]) -> Iterator[Batch]:
+    "Convert a sequence of rows into batches for callables which naturally produce one row at a time"
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= ROWS_PER_BATCH:
+            yield list(zip(*batch))
+            batch = []
+    if len(batch) > 0:
+        yield list(zip(*batch))
+
+
 class Module:
     def __init__(
         self,
@@ -70,11 +110,15 @@ class Module:
         get_columns: Callable,
         parameters: tuple[str],
         repr_invalid: bool,
+        get_filterable_columns: Optional[Callable] = None,
+        estimate_cost: Optional[Callable] = None,
     ):
         self.get_columns = get_columns
         self.callable: Callable = callable
         self.repr_invalid = repr_invalid
         self.parameters = parameters
+        self.get_filterable_columns = get_filterable_columns
+        self.estimate_cost = estimate_cost
 
     def Create(self, db, modulename, dbname, tablename, *args):
         if len(args) > len(self.parameters):
@@ -90,62 +134,92 @@ class Module:
 
         param_values = dict(zip(self.parameters, [to_python(arg) for arg in args]))
         columns = list(self.get_columns(**param_values))
+        filterable_columns = set(columns)
+        if self.get_filterable_columns is not None:
+            filterable_columns = set(self.get_filterable_columns(**param_values))
+
+        def estimate_cost(constrained: Dict[str, int]):
+            if self.estimate_cost is None:
+                return _default_cost_estimate(constrained)
+            return self.estimate_cost(constrained, **param_values)
+
         schema = _create_schema_str(columns)
-        return schema, Table(self.callable, columns, param_values)  # type: ignore[return-value]
+        table = Table(
+            self.callable, columns, param_values, filterable_columns, estimate_cost
+        )
+        return schema, table  # type: ignore[return-value]
 
     Connect = Create
 
 
+def _default_cost_estimate(constrained: Dict[str, int]) -> Tuple[float, int]:
+    # Pretend that if we couldn't identify any column that we can index by, we'll need to fetch a huge amount so
+    # that this will be table to iterate through as a last resort.
+    if len(constrained) == 0:
+        return 1000000, 1000000
+    return 100, 100
+
+
 class Table:
     def __init__(
-        self, callable: Callable, columns: List[str], param_values: dict[str, Any]
+        self,
+        callable: Callable,
+        columns: List[str],
+        param_values: dict[str, Any],
+        filterable_columns: Set[str],
+        estimate_cost: Callable[[Dict[str, int]], Tuple[float, int]],
     ):
         self.callable = callable
         self.columns = columns
         self.param_values = param_values
+        self.filterable_columns = filterable_columns
+        self.estimate_cost = estimate_cost
 
-    def BestIndex(
-        self,
-        constraints: Sequence[tuple[int, int]],
-        orderbys: Sequence[tuple[int, int]],
-    ):
+    def BestIndexObject(self, index_info: apsw.IndexInfo) -> bool:
         """
-        Returns which "index" should be used to access the table efficiently given the following constraints and orderbys being applied.
-        If an equality constraint is being applied. May be called multiple times while sqlite evaluates different join orders. 
-        Our responsibility is to return a list (constraints_used) which describes how we would satisfy the specified constraints.
+        Describes how to access the table efficiently given the constraints being applied. May be called multiple
+        times while sqlite evaluates different join orders. Equality constraints (and IN constraints, which
+        are passed to Filter() as the set of all values in the list) on filterable columns are handed to the
+        callable. Anything else is left for sqlite to apply itself on the returned rows.
         """
+        # the number of values each constrained column will be filtered to
+        constrained: Dict[str, int] = {}
         idx_str: list[str] = []
-        constraints_used = []
-        for constrained_col_index, constrained_op in constraints:
+        for i in range(index_info.nConstraint):
+            if (
+                not index_info.get_aConstraint_usable(i)
+                or index_info.get_aConstraint_op(i) != apsw.SQLITE_INDEX_CONSTRAINT_EQ
+            ):
+                continue
+            constrained_col_index = index_info.get_aConstraint_iColumn(i)
+            if constrained_col_index < 0:
+                # constraint on rowid
+                continue
             constrained_column = self.columns[constrained_col_index]
-
             if (
-                constrained_op != apsw.SQLITE_INDEX_CONSTRAINT_EQ
-                or constrained_column in idx_str
+                constrained_column not in self.filterable_columns
+                or constrained_column in constrained
             ):
-                # this constraint is not one we're going to handle, so add "None" to indicate sqlite should
-                # apply this constraint itself on the returned data.
-                constraints_used.append(None)
                 continue
 
-            # This is the argument number for the constraintargs being passed into the Filter() function in cursor
-            # now, we can pass a number for each constraint, but we really want the column name. So, store the number
-            # as the index into an array of column names that will also be passed to the Filter() function.
-            constraints_used.append(len(idx_str))
+            # This is the (1-based) argument number for the value of the constraint passed into the Filter()
+            # function in cursor. We want the column name though, so store the column names in idx_str in the
+            # same order, which will also be passed to the Filter() function.
             idx_str.append(constrained_column)
+            index_info.set_aConstraintUsage_argvIndex(i, len(idx_str))
 
-        if len(idx_str) == 0:
-            # Approximately how many disk operations are needed to provide the results
-            # Pretend that if we couldn't identify any column that we can index by, we'll need to fetch
-            # a huge amount so that this will be table to iterate through as a last resort.
-            cost = 1000000
-        else:
-            # filtering by any column will be more expensive than free. Also, reports same cost for all columns. No
-            # attempt to model selectivity or anything like that. Could be a future enhancment
-            cost = 100
+            if index_info.get_aConstraintUsage_in(i):
+                # ask for all of the values in the list at once, instead of one Filter() call per value
+                index_info.set_aConstraintUsage_in(i, True)
+                constrained[constrained_column] = IN_CONSTRAINT_SIZE_ESTIMATE
+            else:
+                constrained[constrained_column] = 1
 
-        result = (tuple(constraints_used), 0, ",".join(idx_str), False, cost)
-        return result
+        cost, rows = self.estimate_cost(constrained)
+        index_info.idxStr = ",".join(idx_str)
+        index_info.estimatedCost = float(cost)
+        index_info.estimatedRows = max(1, int(rows))
+        return True
 
     def Open(self):
         return Cursor(self.callable, self.param_values)
@@ -159,47 +233,64 @@ class Table:
 class Cursor:
     def __init__(self, callable: Callable, param_values: dict[str, SQLiteValue]):
         self.param_values = param_values
-        self.iterating: Union[Iterator[SQLiteValue], None] = None
-        self.current_row: Any = None
+        self.batches: Union[Iterator[Batch], None] = None
+        self.current_batch: Union[Batch, None] = None
+        self.current_batch_length = 0
+        # position of the current row within the current batch
+        self.position = 0
+        self.rowid = 0
         self.callable = callable
 
     def Filter(self, idx_num: int, idx_str: str, args: tuple[SQLiteValue]) -> None:
-        params: dict[str, SQLiteValue] = self.param_values.copy()
+        self.Close()
+        params: dict[str, Any] = self.param_values.copy()
         if idx_str is not None and idx_str != "":
             column_names = idx_str.split(",")
             assert len(args) == len(
                 column_names
             ), "There should be the same number of values for equality constraints as there are for columns being constrained"
-            params.update(zip(column_names, args))
-        self.iterating = iter(self.callable(**params))
-        self.Next()
+            for column_name, arg in zip(column_names, args):
+                # IN constraints are passed in as a set of values
+                params[column_name] = tuple(arg) if isinstance(arg, set) else (arg,)
+        self.batches = iter(self.callable(**params))
+        self.rowid = 0
+        self._next_batch()
+
+    def _next_batch(self) -> None:
+        assert self.batches is not None
+        for batch in self.batches:
+            if len(batch[0]) > 0:
+                self.current_batch = batch
+                self.current_batch_length = len(batch[0])
+                self.position = 0
+                return
+        self.Close()
 
     def Eof(self) -> bool:
-        return self.iterating is None
+        return self.current_batch is None
 
     def Close(self) -> None:
-        if self.iterating:
-            if hasattr(self.iterating, "close"):
+        if self.batches:
+            if hasattr(self.batches, "close"):
                 # fmt: off
                 # pyright isn't smart enough to see we just checked for the attribute
-                self.iterating.close() # pyright: ignore
+                self.batches.close() # pyright: ignore
                 # fmt: on
-            self.iterating = None
+            self.batches = None
+        self.current_batch = None
 
     def Column(self, which: int) -> SQLiteValue:
-        v = self.current_row[which]
-        return v  # type: ignore[no-any-return]
+        assert self.current_batch is not None
+        return self.current_batch[which][self.position]
 
     def Next(self) -> None:
-        try:
-            self.current_row = next(self.iterating)  # type: ignore[arg-type]
-        except StopIteration:
-            if hasattr(self.iterating, "close"):
-                self.iterating.close()  # type: ignore[union-attr]
-            self.iterating = None
+        self.position += 1
+        self.rowid += 1
+        if self.position >= self.current_batch_length:
+            self._next_batch()
 
     def Rowid(self):
-        return id(self.current_row)
+        return self.rowid
 
 
 def make_virtual_module(
@@ -209,6 +300,8 @@ def make_virtual_module(
     get_columns: Callable,
     parameters: Tuple[str],
     *,
+    get_filterable_columns: Optional[Callable] = None,
+    estimate_cost: Optional[Callable] = None,
     eponymous: bool = True,
     eponymous_only: bool = False,
     repr_invalid: bool = False,
@@ -217,83 +310,189 @@ def make_virtual_module(
     Registers a read-only virtual table module with *db* based on
     *callable*.  Heavily based on `apsw.ext.make_virtual_module()`
 
-    If sqlite wants to filter table with an equality clause, function will
-    be called passing in the constraints as parameters
+    If sqlite wants to filter table with an equality or IN clause on one of the columns
+    returned by *get_filterable_columns* (by default, all columns), function will be
+    called passing in the constraints as parameters. *estimate_cost* is called with the
+    number of values each column will be filtered to, and returns the estimated cost
+    and number of rows of reading the table that way.
     """
 
-    mod = Module(callable, get_columns, parameters, repr_invalid,)
+    mod = Module(
+        callable,
+        get_columns,
+        parameters,
+        repr_invalid,
+        get_filterable_columns=get_filterable_columns,
+        estimate_cost=estimate_cost,
+    )
 
     # unregister any existing first
     db.create_module(name, None)
     db.create_module(
         name,
         mod,  # type: ignore[arg-type]
+        use_bestindex_object=True,
         eponymous=eponymous,
         eponymous_only=eponymous_only,
         read_only=True,
     )
 
 
-def add_matrix_dataset(connection, dataset: MatrixDataset, schema: SchemaNames):
+def get_virtual_table_statements(
+    dataset: Union[MatrixDataset, TabularDataset], schema: SchemaNames
+) -> Dict[str, str]:
+    "Returns the statement which creates each of the virtual tables for dataset, keyed by table name"
     table_name = schema.get_dataset_table_name(dataset.id)
-    connection.execute(
-        f"CREATE VIRTUAL TABLE \"{table_name}\" using query_matrix_dataset('{dataset.id}')"
-    )
-    connection.execute(
-        f"CREATE VIRTUAL TABLE \"{table_name}_sample\" using query_matrix_dataset_samples('{dataset.id}')"
-    )
-    connection.execute(
-        f"CREATE VIRTUAL TABLE \"{table_name}_feature\" using query_matrix_dataset_features('{dataset.id}')"
-    )
+    if isinstance(dataset, MatrixDataset):
+        return {
+            table_name: f"CREATE VIRTUAL TABLE \"{table_name}\" using query_matrix_dataset('{dataset.id}')",
+            f"{table_name}_sample": f"CREATE VIRTUAL TABLE \"{table_name}_sample\" using query_matrix_dataset_samples('{dataset.id}')",
+            f"{table_name}_feature": f"CREATE VIRTUAL TABLE \"{table_name}_feature\" using query_matrix_dataset_features('{dataset.id}')",
+        }
+    elif isinstance(dataset, TabularDataset):
+        return {
+            table_name: f"CREATE VIRTUAL TABLE \"{table_name}\" using query_tabular_dataset('{dataset.id}')"
+        }
+    else:
+        raise NotImplementedError(f"unknown: {dataset}")
 
 
-def add_tabular_dataset(connection, dataset: TabularDataset, schema: SchemaNames):
-    table_name = schema.get_dataset_table_name(dataset.id)
-    connection.execute(
-        f"CREATE VIRTUAL TABLE \"{table_name}\" using query_tabular_dataset('{dataset.id}')"
-    )
+# the size of each block of a matrix read while iterating through its cells. Every cell in a block becomes a row, which
+# uses far more memory than the block itself, so these are kept small
+MATRIX_BLOCK_BYTES = 1024 * 1024
 
+# rough cost of each call to Filter() on a matrix virtual table, which reads from the matrix's HDF5 file, in units
+# of rows returned
+MATRIX_READ_COST = 1000
 
-from .. import dataset as dataset_service
 
+def _get_cached_matrix_dataset(db, index_cache, dataset_id) -> MatrixDataset:
+    dataset_key = f"dataset:{dataset_id}"
+    if dataset_key not in index_cache:
+        matrix_dataset = crud_dataset.get_dataset(db, db.user, dataset_id)
+        index_cache[dataset_key] = matrix_dataset
+    else:
+        matrix_dataset = index_cache[dataset_key]
 
-def query_matrix_dataset(db, filestore_location, dataset_id, **constraints):
-    matrix_dataset = crud_dataset.get_dataset(db, db.user, dataset_id)
     assert isinstance(matrix_dataset, MatrixDataset)
+    return matrix_dataset
+
 
-    if "feature_id" in constraints:
-        # fetch values by feature
-        matrix_dimensions_info = MatrixDimensionsInfo(
-            feature_identifier=FeatureSampleIdentifier.id,
-            sample_identifier=FeatureSampleIdentifier.id,
-            features=[constraints["feature_id"]],
+def _get_cached_matrix_indexes(
+    db,
+    index_cache,
+    matrix_dataset: MatrixDataset,
+    axis: Union[Type[DatasetFeature], Type[DatasetSample]],
+) -> Tuple[Dict[str, int], np.ndarray]:
+    """
+    Returns the matrix index of each given_id along axis, and an array of the given_id at each matrix index (where
+    None indicates an index which has no given_id)
+    """
+    key = f"indexes:{axis.__name__}:{matrix_dataset.id}"
+    if key not in index_cache:
+        mapping_df = crud_dimension_ids._get_matrix_dataset_index_id_mapping_df(
+            db, matrix_dataset, axis
         )
-    elif "sample_id" in constraints:
-        # fetch values by sample
-        matrix_dimensions_info = MatrixDimensionsInfo(
-            feature_identifier=FeatureSampleIdentifier.id,
-            sample_identifier=FeatureSampleIdentifier.id,
-            samples=[constraints["sample_id"]],
+        index_by_given_id = dict(zip(mapping_df.given_id, mapping_df.index))
+        given_id_by_index = np.empty(
+            (mapping_df.index.max() + 1) if len(mapping_df) > 0 else 0, dtype=object
         )
-    else:
-        # return everything
-        matrix_dimensions_info = MatrixDimensionsInfo(
-            feature_identifier=FeatureSampleIdentifier.id,
-            sample_identifier=FeatureSampleIdentifier.id,
+        given_id_by_index[mapping_df.index.to_numpy()] = mapping_df.given_id.to_numpy()
+        index_cache[key] = (index_by_given_id, given_id_by_index)
+    return index_cache[key]
+
+
+def _get_cached_matrix_shape(
+    db, index_cache, filestore_location, dataset_id
+) -> Tuple[int, int]:
+    "Returns the number of (samples, features) in the matrix"
+    key = f"shape:{dataset_id}"
+    if key not in index_cache:
+        matrix_dataset = _get_cached_matrix_dataset(db, index_cache, dataset_id)
+        index_cache[key] = get_hdf5_file_matrix_size(
+            get_file_location(matrix_dataset, filestore_location)
         )
+    return index_cache[key]
+
+
+def _select_indexes(
+    index_by_given_id: Dict[str, int], given_ids: Optional[Tuple[SQLiteValue, ...]]
+) -> List[int]:
+    if given_ids is None:
+        return sorted(index_by_given_id.values())
+    return sorted(
+        {
+            index_by_given_id[given_id]
+            for given_id in given_ids
+            if given_id in index_by_given_id
+        }
+    )
+
+
+def _stored_list_strings_to_sqlite(values: np.ndarray) -> np.ndarray:
+    # list_strings values are stored as canonical json, which is also how they're returned to sqlite (which
+    # can't hold lists). Missing values are stored as empty strings.
+    codes, uniques = pd.factorize(values.ravel())
+    as_str = np.empty(len(uniques), dtype=object)
+    for i, value in enumerate(uniques):
+        as_str[i] = value.decode("utf8") if len(value) > 0 else None
+    return as_str[codes].reshape(values.shape)
+
+
+def query_matrix_dataset(
+    db, index_cache, filestore_location, dataset_id, **constraints: Constraints
+):
+    matrix_dataset = _get_cached_matrix_dataset(db, index_cache, dataset_id)
+    feature_index_by_id, feature_id_by_index = _get_cached_matrix_indexes(
+        db, index_cache, matrix_dataset, DatasetFeature
+    )
+    sample_index_by_id, sample_id_by_index = _get_cached_matrix_indexes(
+        db, index_cache, matrix_dataset, DatasetSample
+    )
 
-    df = dataset_service.get_subsetted_matrix_dataset_df(
-        db, matrix_dataset, matrix_dimensions_info, filestore_location,
+    feature_indexes = _select_indexes(
+        feature_index_by_id, constraints.get("feature_id")
+    )
+    sample_indexes = _select_indexes(sample_index_by_id, constraints.get("sample_id"))
+    if len(feature_indexes) == 0 or len(sample_indexes) == 0:
+        return
+
+    is_list_strings = matrix_dataset.value_type == ValueType.list_strings
+    blocks = iter_slice_blocks(
+        matrix_dataset,
+        feature_indexes,
+        sample_indexes,
+        filestore_location,
+        axis="features",
+        max_block_bytes=MATRIX_BLOCK_BYTES,
+        keep_nans=True,
+        indices_as_index=True,
+        decode=not is_list_strings,
     )
+    for df in blocks:
+        values = df.to_numpy()
+        if is_list_strings:
+            values = _stored_list_strings_to_sqlite(values)
+        sample_count, feature_count = values.shape
+        # values are in row-major order, so each sample's row is repeated once per feature.
+        # (NaNs are returned to sqlite as NULL)
+        yield (
+            np.repeat(sample_id_by_index[df.index.to_numpy()], feature_count).tolist(),
+            np.tile(feature_id_by_index[df.columns.to_numpy()], sample_count).tolist(),
+            values.ravel().tolist(),
+        )
 
-    # cannot retrun list of strings back to sqlite so convert them
-    if matrix_dataset.value_type == ValueType.list_strings:
-        df = df.map(json.dumps)
 
-    for sample_id in df.index:
-        for feature_id in df.columns:
-            value = df.loc[sample_id, feature_id]
-            yield (sample_id, feature_id, value)
+def estimate_query_matrix_dataset_cost(
+    db, index_cache, filestore_location, constrained: Dict[str, int], dataset_id
+):
+    sample_count, feature_count = _get_cached_matrix_shape(
+        db, index_cache, filestore_location, dataset_id
+    )
+    rows = constrained.get("sample_id", sample_count) * constrained.get(
+        "feature_id", feature_count
+    )
+    return MATRIX_READ_COST + rows, rows
 
 
 def _query_matrix_dataset_dimension(
@@ -331,13 +530,17 @@ def _query_matrix_dataset_dimension(
         return sorted(id_and_labels.keys())
 
 
-def query_matrix_dataset_samples(db, index_cache, dataset_id, **constraints):
+def query_matrix_dataset_samples(
+    db, index_cache, dataset_id, **constraints: Constraints
+):
     return _query_matrix_dataset_samples(
         db, index_cache, dataset_id, "sample_id", **constraints
     )
 
 
-def query_matrix_dataset_features(db, index_cache, dataset_id, **constraints):
+def query_matrix_dataset_features(
+    db, index_cache, dataset_id, **constraints: Constraints
+):
     return _query_matrix_dataset_samples(
         db, index_cache, dataset_id, "feature_id", **constraints
     )
@@ -348,18 +551,8 @@ def sorted_list_contains(haystack, needle):
     return i < len(haystack) and haystack[i] == needle
 
 
-def _query_matrix_dataset_samples(
-    db, index_cache, dataset_id, dim_id_type, **constraints
-):
-    log.info(f"Querying {dim_id_type} dimensions with constraints ({constraints})")
-    dataset_key = f"dataset:{dataset_id}"
-    if dataset_key not in index_cache:
-        matrix_dataset = crud_dataset.get_dataset(db, db.user, dataset_id)
-        index_cache[dataset_key] = matrix_dataset
-    else:
-        matrix_dataset = index_cache[dataset_key]
-
-    assert isinstance(matrix_dataset, MatrixDataset)
+def _get_cached_matrix_dimension_ids(db, index_cache, dataset_id, dim_id_type):
+    matrix_dataset = _get_cached_matrix_dataset(db, index_cache, dataset_id)
 
     samples_key = f"{dim_id_type}:{dataset_id}"
     if samples_key not in index_cache:
@@ -371,18 +564,38 @@ def _query_matrix_dataset_samples(
         index_cache[samples_key] = dim_ids
     else:
         dim_ids = index_cache[samples_key]
+    return dim_ids
+
+
+def _query_matrix_dataset_samples(
+    db, index_cache, dataset_id, dim_id_type, **constraints: Constraints
+):
+    log.info(f"Querying {dim_id_type} dimensions with constraints ({constraints})")
+    dim_ids = _get_cached_matrix_dimension_ids(db, index_cache, dataset_id, dim_id_type)
 
     if len(constraints) > 0:
         # if there's any constraint, we can assume it's on dim_id_type
-        dim_id = constraints[dim_id_type]
-        log.info(f"Searching for {dim_id} among {dim_ids}")
-        if sorted_list_contains(dim_ids, dim_id):
-            yield (dim_id,)
-        else:
-            pass
+        yield (
+            [
+                dim_id
+                for dim_id in constraints[dim_id_type]
+                if isinstance(dim_id, str) and sorted_list_contains(dim_ids, dim_id)
+            ],
+        )
     else:
-        for dim_id in dim_ids:
-            yield (dim_id,)
+        yield (dim_ids,)
+
+
+def estimate_query_matrix_dataset_samples_cost(
+    db, index_cache, dim_id_type, constrained: Dict[str, int], dataset_id
+):
+    if dim_id_type in constrained:
+        rows = constrained[dim_id_type]
+    else:
+        rows = len(
+            _get_cached_matrix_dimension_ids(db, index_cache, dataset_id, dim_id_type)
+        )
+    return rows, rows
 
 
 def _fix_continuous_column_types(
@@ -427,7 +640,17 @@ def _build_indexed_version_of_tabular_data(
     return by_key
 
 
-def query_tabular_dataset(db, index_cache, columns, dataset_id, **constraints):
+def query_tabular_dataset(
+    db, index_cache, columns, dataset_id, **constraints: Constraints
+):
+    return rows_to_batches(
+        _query_tabular_dataset_rows(db, index_cache, columns, dataset_id, **constraints)
+    )
+
+
+def _query_tabular_dataset_rows(
+    db, index_cache, columns, dataset_id, **constraints: Constraints
+):
     # not efficient, but first goal is something that works:
 
     try:
@@ -449,15 +672,15 @@ def query_tabular_dataset(db, index_cache, columns, dataset_id, **constraints):
                     db, dataset, constraint_columns, constraints
                 )
 
-            # extract out the records with this key
-            records_key = tuple(
-                [
+            # extract out the records with each combination of the values the columns are constrained to
+            recs = []
+            for records_key in itertools.product(
+                *[
                     constraints[constraint_column]
                     for constraint_column in constraint_columns
                 ]
-            )
-
-            recs = index_cache[index_key].get(records_key, [],)
+            ):
+                recs.extend(index_cache[index_key].get(records_key, [],))
         else:
             # if we weren't given a constraint, just fetch the whole table and return all the rows
             df = crud_dataset.get_subset_of_tabular_data_as_df(db, dataset, None, None)
@@ -473,75 +696,274 @@ def query_tabular_dataset(db, index_cache, columns, dataset_id, **constraints):
         raise
 
 
-def create_db_with_virtual_schema(db: SessionWithUser, filestore_location: str):
-    datasets = crud_dataset.get_datasets(db, db.user)
-    dim_types = crud_dimension_types.get_dimension_types(db)
-
-    columns_by_dataset_id = {}
-    for dataset in datasets:
-        if isinstance(dataset, TabularDataset):
-            column_names = []
-            for column_name, column_metadata in sorted(
-                dataset.columns_metadata.items()
-            ):
-                column_names.append(column_name)
-            columns_by_dataset_id[dataset.id] = column_names
+# the number of virtual databases (one per distinct set of groups whose datasets are visible) each process keeps
+MAX_CACHED_VIRTUAL_DBS = 8
 
-    schema = assign_names(datasets, dim_types)
 
-    connection = apsw.Connection(":memory:")
-
-    index_cache = {}
+class VirtualDBContext:
+    """
+    The state which the virtual table modules of a connection read each time they're called. A cached connection
+    outlives the session used by any one query, so the session is swapped in for the duration of each query.
+    """
 
+    def __init__(self, filestore_location: str):
+        self.db: Optional[SessionWithUser] = None
+        self.filestore_location = filestore_location
+        # derived from the catalog, so only valid as of catalog_version
+        self.index_cache: Dict[Any, Any] = {}
+        self.columns_by_dataset_id: Dict[str, List[str]] = {}
+        # the statement (and for tabular datasets, the columns) each existing virtual table was created with
+        self.tables: Dict[str, Tuple[str, Optional[Tuple[str, ...]]]] = {}
+        self.catalog_version: Optional[int] = None
+
+    def get_db(self) -> SessionWithUser:
+        assert self.db is not None, "virtual table used outside of a query"
+        return self.db
+
+    def end_query(self):
+        # the cached ORM objects belong to the query's session, which is about to be closed
+        for key in [
+            key
+            for key in self.index_cache
+            if isinstance(key, str) and key.startswith("dataset:")
+        ]:
+            del self.index_cache[key]
+        self.db = None
+
+
+def _register_virtual_modules(connection: apsw.Connection, context: VirtualDBContext):
     make_virtual_module(
         connection,
         "query_matrix_dataset",
-        lambda **args: query_matrix_dataset(db, filestore_location, **args),
+        lambda **args: query_matrix_dataset(
+            context.get_db(), context.index_cache, context.filestore_location, **args,
+        ),
         lambda **args: ("sample_id", "feature_id", "value"),
         ("dataset_id",),
+        get_filterable_columns=lambda **args: ("sample_id", "feature_id"),
+        estimate_cost=lambda constrained, **args: estimate_query_matrix_dataset_cost(
+            context.get_db(),
+            context.index_cache,
+            context.filestore_location,
+            constrained,
+            **args,
+        ),
     )
 
     make_virtual_module(
         connection,
         "query_matrix_dataset_samples",
-        lambda **args: query_matrix_dataset_samples(db, index_cache, **args),
+        lambda **args: query_matrix_dataset_samples(
+            context.get_db(), context.index_cache, **args
+        ),
         lambda **args: ("sample_id",),
         ("dataset_id",),
+        estimate_cost=lambda constrained, **args: estimate_query_matrix_dataset_samples_cost(
+            context.get_db(), context.index_cache, "sample_id", constrained, **args
+        ),
     )
 
     make_virtual_module(
         connection,
         "query_matrix_dataset_features",
-        lambda **args: query_matrix_dataset_features(db, index_cache, **args),
+        lambda **args: query_matrix_dataset_features(
+            context.get_db(), context.index_cache, **args
+        ),
         lambda **args: ("feature_id",),
         ("dataset_id",),
+        estimate_cost=lambda constrained, **args: estimate_query_matrix_dataset_samples_cost(
+            context.get_db(), context.index_cache, "feature_id", constrained, **args
+        ),
     )
 
     make_virtual_module(
         connection,
         "query_tabular_dataset",
         lambda dataset_id, **constraints: query_tabular_dataset(
-            db,
-            index_cache,
-            columns_by_dataset_id[dataset_id],
+            context.get_db(),
+            context.index_cache,
+            context.columns_by_dataset_id[dataset_id],
             dataset_id,
             **constraints,
         ),
-        lambda dataset_id: columns_by_dataset_id[dataset_id],
+        lambda dataset_id: context.columns_by_dataset_id[dataset_id],
         ("dataset_id",),
     )
 
+
+def _sync_virtual_tables(
+    connection: apsw.Connection, context: VirtualDBContext, catalog_version: int
+):
+    """
+    Bring the virtual tables in connection up to date with the datasets visible to the context's user, only
+    dropping and creating the tables which changed since the catalog_version they were created at.
+    """
+    db = context.get_db()
+    datasets = crud_dataset.get_datasets(db, db.user)
+    dim_types = crud_dimension_types.get_dimension_types(db)
+
+    columns_by_dataset_id = {}
     for dataset in datasets:
-        if isinstance(dataset, MatrixDataset):
-            add_matrix_dataset(connection, dataset, schema)
-        elif isinstance(dataset, TabularDataset):
-            add_tabular_dataset(connection, dataset, schema)
-        else:
-            raise NotImplementedError(f"unknown: {dataset}")
+        if isinstance(dataset, TabularDataset):
+            columns_by_dataset_id[dataset.id] = sorted(dataset.columns_metadata.keys())
+
+    schema = assign_names(datasets, dim_types)
+
+    tables: Dict[str, Tuple[str, Optional[Tuple[str, ...]]]] = {}
+    for dataset in datasets:
+        columns = columns_by_dataset_id.get(dataset.id)
+        for table_name, statement in get_virtual_table_statements(
+            dataset, schema
+        ).items():
+            tables[table_name] = (
+                statement,
+                None if columns is None else tuple(columns),
+            )
+
+    # anything cached about the data may be stale, so only the tables themselves are kept
+    context.index_cache.clear()
+    context.columns_by_dataset_id = columns_by_dataset_id
+
+    for table_name, table in list(context.tables.items()):
+        if tables.get(table_name) != table:
+            connection.execute(f'DROP TABLE "{table_name}"')
+            del context.tables[table_name]
+
+    for table_name, table in tables.items():
+        if table_name not in context.tables:
+            statement, _ = table
+            connection.execute(statement)
+            context.tables[table_name] = table
 
+    context.catalog_version = catalog_version
+
+
+def create_db_with_virtual_schema(db: SessionWithUser, filestore_location: str):
+    "Returns a new connection with a virtual table for each dataset visible to db.user"
+    context = VirtualDBContext(filestore_location)
+    context.db = db
+    connection = apsw.Connection(":memory:")
+    _register_virtual_modules(connection, context)
+    _sync_virtual_tables(connection, context, crud_dataset.get_catalog_version(db))
     return connection
 
 
+class CachedVirtualDB:
+    """
+    A connection with a virtual table for each dataset visible to some set of groups. Can only be used by one
+    query at a time, since every virtual table reads through the session of the query using it.
+    """
+
+    def __init__(self, filestore_location: str):
+        self.context = VirtualDBContext(filestore_location)
+        self.connection = apsw.Connection(":memory:")
+        _register_virtual_modules(self.connection, self.context)
+        self.lock = threading.Lock()
+        self.evicted = False
+
+    def close(self):
+        self.connection.close()
+
+
+class VirtualDBCache(ForkSafe):
+    """
+    An LRU cache of virtual databases, keyed by the groups whose datasets they include. Meant to be one per
+    (worker) process, so that small queries aren't dominated by declaring a virtual table for every dataset.
+
+    Each database remembers the catalog version its tables were created at, and only the tables for datasets which
+    were added, removed or changed since then are recreated. Its index cache is cleared whenever the catalog changes.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_VIRTUAL_DBS):
+        self.max_entries = max_entries
+        super().__init__()
+
+    def _reset(self):
+        self._entries: "OrderedDict[Tuple, CachedVirtualDB]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(
+        self, db: SessionWithUser, filestore_location: str
+    ) -> Tuple[apsw.Connection, Callable[[], None]]:
+        """
+        Returns a connection with a virtual table for each dataset visible to db.user, along with a function to
+        call once the query using it is done. If the cached connection is already being used by another query, a
+        new uncached connection is returned instead.
+        """
+        self._check_pid()
+        catalog_version = crud_dataset.get_catalog_version(db)
+        group_ids = frozenset(
+            group.id for group in get_groups_with_visible_contents(db, db.user)
+        )
+        key = (group_ids, filestore_location)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = CachedVirtualDB(filestore_location)
+                self._entries[key] = entry
+            else:
+                self._entries.move_to_end(key)
+            self._enforce_max_entries()
+
+            if not entry.lock.acquire(blocking=False):
+                entry = None
+
+        if entry is None:
+            connection = create_db_with_virtual_schema(db, filestore_location)
+            return connection, connection.close
+
+        entry.context.db = db
+        try:
+            if entry.context.catalog_version != catalog_version:
+                with profiled_region("sync virtual tables"):
+                    _sync_virtual_tables(
+                        entry.connection, entry.context, catalog_version
+                    )
+        except:
+            # the tables may be half updated, so make sure they're all recreated next time
+            entry.context.catalog_version = None
+            self._release(entry)
+            raise
+
+        return entry.connection, lambda: self._release(entry)
+
+    def _release(self, entry: CachedVirtualDB):
+        entry.context.end_query()
+        with self._lock:
+            entry.lock.release()
+            if entry.evicted:
+                entry.close()
+
+    def _enforce_max_entries(self):
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            entry.evicted = True
+            # a connection which is in use is closed when it's released
+            if entry.lock.acquire(blocking=False):
+                entry.close()
+
+    def clear(self):
+        self._check_pid()
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries = OrderedDict()
+            for entry in entries:
+                entry.evicted = True
+                if entry.lock.acquire(blocking=False):
+                    entry.close()
+
+
+_virtual_db_cache: Optional[VirtualDBCache] = None
+
+
+def get_virtual_db_cache() -> VirtualDBCache:
+    global _virtual_db_cache
+    if _virtual_db_cache is None:
+        _virtual_db_cache = VirtualDBCache()
+    return _virtual_db_cache
+
+
 def assert_single_select(sql: str):
     try:
         parsed = sqlglot.parse(sql, dialect="sqlite")
@@ -593,37 +1015,197 @@ def stream_cursor_as_csv(column_names, cursor, cleanup_callback):
         cleanup_callback()
 
 
-def execute_sql_in_virtual_db(
+SqlResultFormat = Literal["csv", "parquet", "arrow-ipc"]
+
+# the number of result rows converted into each arrow record batch (and so each parquet row group)
+ROWS_PER_RECORD_BATCH = 64 * 1024
+
+# columns which are null in every one of the first this many rows are written as strings
+MAX_ROWS_FOR_TYPE_INFERENCE = 1024 * 1024
+
+
+def _open_sql_query_cursor(
     db: SessionWithUser, filestore_location: str, sql_statement: str
-):
+) -> Tuple[List[str], apsw.Cursor, Callable[[], None]]:
+    """
+    Starts executing sql_statement, returning the names of the result columns, the cursor to read the rows from and
+    a function to call once done with the cursor.
+    """
     with profiled_region("execute_sql_in_virtual_db"):
         assert_single_select(sql_statement)
 
         with profiled_region("create_db_with_virtual_schema"):
-            virtual_db_connection = create_db_with_virtual_schema(
+            virtual_db_connection, release = get_virtual_db_cache().acquire(
                 db, filestore_location
             )
+
+        try:
             cursor = virtual_db_connection.cursor()
 
-        with profiled_region(f"execute statement"):
-            try:
-                cursor.execute(sql_statement)
-            except apsw.SQLError as ex:
-                raise UserError(str(ex))
-
-        # get the column names by using query_info. Alternatively we could probably get column names
-        # by using the strategy at https://github.com/rogerbinns/apsw/blob/7a9a4b695a2ef038514d2dc4e0b95e44111132ac/apsw/ext.py#L1859
-        # The naive approach of running the query and using cursor.description after the fact throws an exception
-        # `apsw.ExecutionCompleteError: Can't get description for statements that have completed execution` if the query results
-        # in no rows.
-        query_info = apsw.ext.query_info(virtual_db_connection, sql_statement)
-        col_names = [col_name for col_name, _ in query_info.description]
-        log.warning(f"got cursor names: {col_names}")
+            with profiled_region(f"execute statement"):
+                try:
+                    cursor.execute(sql_statement)
+                except apsw.SQLError as ex:
+                    raise UserError(str(ex))
+
+            # get the column names by using query_info. Alternatively we could probably get column names
+            # by using the strategy at https://github.com/rogerbinns/apsw/blob/7a9a4b695a2ef038514d2dc4e0b95e44111132ac/apsw/ext.py#L1859
+            # The naive approach of running the query and using cursor.description after the fact throws an exception
+            # `apsw.ExecutionCompleteError: Can't get description for statements that have completed execution` if the query results
+            # in no rows.
+            query_info = apsw.ext.query_info(virtual_db_connection, sql_statement)
+            col_names = [col_name for col_name, _ in query_info.description]
+            log.warning(f"got cursor names: {col_names}")
+        except:
+            release()
+            raise
 
         def cleanup_callback():
-            # this might all automatically get cleaned up by the GC, but let's clean it up like we're supposed to
-            # just in case
+            # the connection may be cached, so only the cursor is closed. Releasing the connection lets the next
+            # query use it.
             cursor.close()
-            virtual_db_connection.close()
+            release()
+
+    return col_names, cursor, cleanup_callback
 
+
+def execute_sql_in_virtual_db(
+    db: SessionWithUser, filestore_location: str, sql_statement: str
+):
+    col_names, cursor, cleanup_callback = _open_sql_query_cursor(
+        db, filestore_location, sql_statement
+    )
     return stream_cursor_as_csv(col_names, cursor, cleanup_callback)
+
+
+def _infer_arrow_type(values: Sequence[SQLiteValue]) -> Optional[pa.DataType]:
+    "Returns the type of the given column values, or None if they're all null"
+    try:
+        arrow_type = pa.array(values).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # sqlite columns can hold a mix of types, in which case they're written as text (as they would be in csv)
+        return pa.string()
+    if pa.types.is_null(arrow_type):
+        return None
+    return arrow_type
+
+
+def _to_arrow_array(
+    column_name: str, values: Sequence[SQLiteValue], arrow_type: pa.DataType
+) -> pa.Array:
+    if pa.types.is_string(arrow_type):
+        try:
+            return pa.array(values, type=arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # some of the values aren't strings
+            return pa.array(
+                [
+                    value if value is None or isinstance(value, str) else str(value)
+                    for value in values
+                ],
+                type=arrow_type,
+            )
+
+    mixed_types_error = UserError(
+        f"Column {column_name} has values which are not all of type {arrow_type}. Use CAST to give it a single type."
+    )
+    # arrow would silently truncate floats in an integer column
+    if pa.types.is_integer(arrow_type) and not all(
+        value is None or isinstance(value, int) for value in values
+    ):
+        raise mixed_types_error
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        raise mixed_types_error
+
+
+def cursor_to_record_batches(
+    column_names: List[str],
+    cursor: apsw.Cursor,
+    rows_per_batch: int = ROWS_PER_RECORD_BATCH,
+) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    """
+    Reads rows from the cursor rows_per_batch at a time, converting each chunk into an arrow record batch. The type of
+    each column is inferred from the first rows (where it isn't null), and every batch is converted to that type.
+    """
+
+    def read_chunks() -> Iterator[List[List[SQLiteValue]]]:
+        while True:
+            rows = list(itertools.islice(cursor, rows_per_batch))
+            if len(rows) == 0:
+                return
+            # transpose the rows into columns. (zip(*rows) is several times slower with this many rows)
+            yield [[row[i] for row in rows] for i in range(len(column_names))]
+
+    chunks = read_chunks()
+
+    # read ahead until every column's type is known
+    column_types: List[Optional[pa.DataType]] = [None] * len(column_names)
+    pending = []
+    pending_rows = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        pending_rows += len(chunk[0])
+        for i, values in enumerate(chunk):
+            if column_types[i] is None:
+                column_types[i] = _infer_arrow_type(values)
+        if (
+            all(arrow_type is not None for arrow_type in column_types)
+            or pending_rows >= MAX_ROWS_FOR_TYPE_INFERENCE
+        ):
+            break
+
+    schema = pa.schema(
+        [
+            pa.field(column_name, pa.string() if arrow_type is None else arrow_type)
+            for column_name, arrow_type in zip(column_names, column_types)
+        ]
+    )
+
+    def to_record_batches():
+        for chunk in itertools.chain(pending, chunks):
+            yield pa.RecordBatch.from_arrays(
+                [
+                    _to_arrow_array(field.name, values, field.type)
+                    for field, values in zip(schema, chunk)
+                ],
+                schema=schema,
+            )
+
+    return schema, to_record_batches()
+
+
+def write_sql_query_result(
+    db: SessionWithUser,
+    filestore_location: str,
+    sql_statement: str,
+    output_filename: str,
+    result_format: SqlResultFormat = "csv",
+):
+    "Executes sql_statement, writing the results to output_filename as the given format"
+    if result_format == "csv":
+        output = execute_sql_in_virtual_db(db, filestore_location, sql_statement)
+        with open(output_filename, "wt") as fd:
+            for line in output:
+                fd.write(line)
+        return
+
+    col_names, cursor, cleanup_callback = _open_sql_query_cursor(
+        db, filestore_location, sql_statement
+    )
+    try:
+        with profiled_region(f"write results as {result_format}"):
+            schema, record_batches = cursor_to_record_batches(col_names, cursor)
+            if result_format == "parquet":
+                with pq.ParquetWriter(output_filename, schema) as writer:
+                    for record_batch in record_batches:
+                        writer.write_batch(record_batch)
+            else:
+                assert result_format == "arrow-ipc"
+                with pa.OSFile(output_filename, "wb") as sink:
+                    with pa.ipc.new_stream(sink, schema) as writer:
+                        for record_batch in record_batches:
+                            writer.write_batch(record_batch)
+    finally:
+        cleanup_callback()
@@ -2,7 +2,7 @@ import datetime
 import hashlib
 import os
 import uuid
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from fastapi import HTTPException
 from itsdangerous.url_safe import URLSafeSerializer
@@ -41,6 +41,7 @@ def _concatenate_files(source_filenames, dest_filename, expected_md5: Optional[s
             raise HTTPException(
                 400, f"Expected md5 hash {expected_md5} but got {computed_hash}"
             )
+    return computed_hash
 
 
 def construct_file_from_ids(
@@ -50,6 +51,19 @@ def construct_file_from_ids(
     compute_results_location: str,
 ):
     "construct a new file from a list of file_ids (signed filepaths) and return the path to that file"
+    dest_filename, _ = construct_file_and_md5_from_ids(
+        file_ids, expected_md5, serializer, compute_results_location
+    )
+    return dest_filename
+
+
+def construct_file_and_md5_from_ids(
+    file_ids: List[str],
+    expected_md5: Optional[str],
+    serializer: URLSafeSerializer,
+    compute_results_location: str,
+) -> Tuple[str, str]:
+    "like construct_file_from_ids, but also returns the md5 hash of the file's contents"
     source_filenames = []
     for file_id in file_ids:
         filename = serializer.loads(file_id)
@@ -62,6 +76,6 @@ def construct_file_from_ids(
     dest_filename = os.path.join(compute_results_location, _get_temp_filename())
     _ensure_parent_dir_exists(dest_filename)
 
-    _concatenate_files(source_filenames, dest_filename, expected_md5)
+    md5 = _concatenate_files(source_filenames, dest_filename, expected_md5)
 
-    return dest_filename
+    return dest_filename, md5
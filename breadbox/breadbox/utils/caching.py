@@ -3,6 +3,7 @@ from aiocache import Cache, BaseCache
 from aiocache.serializers import PickleSerializer
 import json
 import hashlib
+import inspect
 from aiocache.backends.redis import RedisCache
 
 from breadbox.db.session import SessionWithUser
@@ -68,6 +69,9 @@ class CachingCaller:
         where caching is needed, and cases where it's not. This is technically unnecessary, but it increases the
         test coverage when unit tests run and I worry about a non-json-serializeable value being passed in depends_on
         and not catching that in a test.
+
+        `function` may return an awaitable (ie: a blocking function wrapped in run_in_threadpool), in which case it's
+        only awaited on a cache miss.
         """
 
         if cache_key is None:
@@ -87,6 +91,8 @@ class CachingCaller:
 
         if value is None:
             value = function()
+            if inspect.isawaitable(value):
+                value = await value
 
             if self.cache is not None:
                 await self.cache.set(cache_key, value, ttl=ttl)
@@ -0,0 +1,23 @@
+import os
+
+
+class ForkSafe:
+    """
+    Base class for per-process caches holding things which can't be shared with a forked child, such as open
+    files, database connections and locks. Subclasses create that state in _reset() and call _check_pid()
+    before using it, so a child process starts over with its own instead of using its parent's.
+    """
+
+    def __init__(self):
+        self._pid = os.getpid()
+        self._reset()
+
+    def _reset(self):
+        raise NotImplementedError()
+
+    def _check_pid(self):
+        # state created before a fork (ie: by celery's prefork pool) must not be used by the child
+        pid = os.getpid()
+        if self._pid != pid:
+            self._reset()
+            self._pid = pid
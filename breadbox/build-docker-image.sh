@@ -25,6 +25,8 @@ yarn --cwd frontend "build:elara"
 yarn --cwd frontend "build:embed"
 
 # Build Docker image
+# packed-cor-tables is a path dependency of breadbox, so it's passed as an additional build context
 docker build \
+ --build-context packed-cor-tables=packed-cor-tables \
  breadbox \
  -t "$IMAGE_TAG" \
@@ -20,7 +20,7 @@ from breadbox.models.dataset import ValueType
 from breadbox.compute import analysis_tasks
 from breadbox.compute.analysis_tasks import get_feature_data_slice_values
 from breadbox.celery_task import utils
-from breadbox.crud.dataset import get_dataset
+from breadbox.crud.dataset import delete_dataset, get_dataset
 from tests import factories
 
 
@@ -881,3 +881,92 @@ def test_parameter_validation(
         "Can only perform analysis with data slice with value_type=continuous"
         in r.json()["detail"]
     )
+
+
+def test_repeated_analysis_uses_stored_result(
+    tmpdir,
+    monkeypatch,
+    celery_app,
+    celery_worker,
+    minimal_db: SessionWithUser,
+    client: TestClient,
+    settings,
+):
+    @contextmanager
+    def mock_db_context(user, **kwargs):
+        yield minimal_db
+
+    monkeypatch.setattr(utils, "check_celery", lambda: True)
+    monkeypatch.setattr(analysis_tasks, "get_settings", lambda: settings)
+    monkeypatch.setattr(analysis_tasks, "db_context", mock_db_context)
+
+    monkeypatch.setattr(
+        analysis_tasks,
+        "run_custom_analysis",
+        celery_app.task(bind=True)(run_custom_analysis),
+    )
+
+    # count how many times the analysis actually runs
+    task_calls = []
+    run_analysis = analysis_tasks.analysis_tasks_interface.run_custom_analysis
+
+    def counting_run_analysis(task_id, **kwargs):
+        task_calls.append(kwargs)
+        # the task is called directly, so give each run its own result directory
+        return run_analysis(f"{task_id}-{len(task_calls)}", **kwargs)
+
+    monkeypatch.setattr(
+        analysis_tasks.analysis_tasks_interface,
+        "run_custom_analysis",
+        counting_run_analysis,
+    )
+
+    cell_lines = ["ACH-0000{}".format(x) for x in range(10)]
+    (dataset_id, query_dataset_id, query_feature_id, _,) = TestData.setup_db_objects(
+        tmpdir, minimal_db, settings, cell_lines, list(range(10))
+    )
+
+    user = settings.admin_users[0]
+    headers = {"X-Forwarded-User": user}
+    data = {
+        "analysisType": "pearson",
+        "datasetId": dataset_id,
+        "queryFeatureId": query_feature_id,
+        "queryDatasetId": query_dataset_id,
+        "queryCellLines": cell_lines,
+    }
+
+    def submit(cell_lines):
+        r = client.post(
+            "/compute/compute_univariate_associations",
+            json=dict(data, queryCellLines=cell_lines),
+            headers=headers,
+        )
+        minimal_db.reset_user(user)
+        assert r.status_code == 200, r.content
+        result = r.json()
+        assert result["state"] == "SUCCESS", result
+        return result["result"]
+
+    first = submit(cell_lines)
+    assert len(task_calls) == 1
+    assert len(first["data"]) == 3
+
+    # the same analysis (even with the cell lines in a different order) returns the stored result
+    second = submit(list(reversed(cell_lines)))
+    assert len(task_calls) == 1
+    assert second == first
+
+    # but a different set of cell lines is run again
+    submit(cell_lines[:8])
+    assert len(task_calls) == 2
+
+    # as is the analysis after the cell line group referenced by its result was deleted
+    filter_dataset_id, _ = _get_dataset_id_from_bb_slice_id(first["filterSliceId"])
+    filter_dataset = get_dataset(minimal_db, user, filter_dataset_id)
+    delete_dataset(minimal_db, user, filter_dataset, settings.filestore_location)
+    minimal_db.flush()
+    third = submit(cell_lines)
+    assert len(task_calls) == 3
+    assert third["data"] == first["data"]
+    assert third["filterSliceId"] != first["filterSliceId"]
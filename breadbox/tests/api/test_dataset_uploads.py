@@ -1,12 +1,20 @@
 import io
+import os
 from datetime import datetime
 
+import h5py
 from fastapi.testclient import TestClient
 
 from breadbox.db.session import SessionWithUser, SessionLocalWithUser
 from breadbox.schemas.dataset import AddDatasetResponse
 from breadbox.compute import dataset_uploads_tasks
 from breadbox.celery_task import utils
+from breadbox.io import filestore_crud
+from breadbox.io.hdf5_utils import (
+    CHUNKED_LAYOUT_VERSION,
+    ROW_CHUNKED_DATASET,
+    HDF5StorageOptions,
+)
 from breadbox.models.dataset import TabularDataset, TabularCell, TabularColumn, Dataset
 from sqlalchemy import and_
 from datetime import timedelta
@@ -32,6 +40,12 @@ from breadbox.crud import dataset as dataset_crud
 from breadbox.service import dataset as dataset_service
 
 
+def _find_blob_relative_path(filestore_location):
+    (prefix,) = os.listdir(os.path.join(filestore_location, "blobs"))
+    (key,) = os.listdir(os.path.join(filestore_location, "blobs", prefix))
+    return prefix, key
+
+
 class TestPost:
     def test_upload_data_as_parquet(
         self,
@@ -87,6 +101,161 @@ class TestPost:
             "B": {"ACH-1": 0.3, "ACH-2": 0.4},
         }
 
+    def test_matrix_upload_default_storage_layout(
+        self,
+        client: TestClient,
+        minimal_db: SessionWithUser,
+        private_group: Dict,
+        mock_celery,
+        settings,
+    ):
+        # by default, matrices are stored so that reading by sample is as fast as reading by feature
+        user = "someone@private-group.com"
+        file_ids, expected_md5 = upload_and_get_file_ids(
+            client, factories.continuous_matrix_csv_file()
+        )
+        response = client.post(
+            "/dataset-v2/",
+            json={
+                "format": "matrix",
+                "name": "a dataset",
+                "units": "a unit",
+                "feature_type": "generic",
+                "sample_type": "depmap_model",
+                "data_type": "User upload",
+                "file_ids": file_ids,
+                "dataset_md5": expected_md5,
+                "is_transient": False,
+                "group_id": private_group["id"],
+                "value_type": "continuous",
+                "allowed_values": None,
+            },
+            headers={"X-Forwarded-User": user},
+        )
+        assert_status_ok(response)
+        assert response.json()["state"] == "SUCCESS"
+        dataset_id = response.json()["result"]["datasetId"]
+
+        dataset = dataset_crud.get_dataset(minimal_db, user, dataset_id)
+        assert dataset.storage_layout_version == CHUNKED_LAYOUT_VERSION
+
+        path = os.path.join(settings.filestore_location, dataset_id, "data.hdf5")
+        with h5py.File(path, "r") as f:
+            assert f["data"].compression == "lzf"
+            assert f[ROW_CHUNKED_DATASET].compression == "lzf"
+
+    def test_reupload_of_identical_matrix_reuses_file(
+        self,
+        client: TestClient,
+        minimal_db: SessionWithUser,
+        private_group: Dict,
+        mock_celery,
+        monkeypatch,
+        settings,
+    ):
+        user = "someone@private-group.com"
+        headers = {"X-Forwarded-User": user}
+
+        validations = []
+        read_and_validate_matrix_df = dataset_uploads_tasks.read_and_validate_matrix_df
+
+        def counting_read_and_validate_matrix_df(*args, **kwargs):
+            validations.append(args)
+            return read_and_validate_matrix_df(*args, **kwargs)
+
+        monkeypatch.setattr(
+            dataset_uploads_tasks,
+            "read_and_validate_matrix_df",
+            counting_read_and_validate_matrix_df,
+        )
+
+        def upload():
+            file_ids, expected_md5 = upload_and_get_file_ids(
+                client, factories.continuous_matrix_csv_file()
+            )
+            response = client.post(
+                "/dataset-v2/",
+                json={
+                    "format": "matrix",
+                    "name": "a dataset",
+                    "units": "a unit",
+                    "feature_type": "generic",
+                    "sample_type": "depmap_model",
+                    "data_type": "User upload",
+                    "file_ids": file_ids,
+                    "dataset_md5": expected_md5,
+                    "is_transient": False,
+                    "group_id": private_group["id"],
+                    "value_type": "continuous",
+                    "allowed_values": None,
+                },
+                headers=headers,
+            )
+            assert_status_ok(response)
+            assert response.json()["state"] == "SUCCESS"
+            return response.json()["result"]["datasetId"]
+
+        def get_data_file(dataset_id):
+            return os.path.join(settings.filestore_location, dataset_id, "data.hdf5")
+
+        first_id = upload()
+        second_id = upload()
+
+        # the second upload wasn't validated, and shares the first's file
+        assert len(validations) == 1
+        assert os.path.samefile(get_data_file(first_id), get_data_file(second_id))
+
+        def read(dataset_id):
+            response = client.post(
+                f"/datasets/matrix/{dataset_id}",
+                json={"features": ["A"], "feature_identifier": "id"},
+                headers=headers,
+            )
+            assert_status_ok(response)
+            return response.json()
+
+        assert read(first_id) == read(second_id)
+
+        # the stored file is kept until the last dataset using it is deleted
+        blob_path = os.path.join(
+            settings.filestore_location,
+            "blobs",
+            *_find_blob_relative_path(settings.filestore_location),
+        )
+        assert_status_ok(client.delete(f"/datasets/{first_id}", headers=headers))
+        assert os.path.exists(blob_path)
+        assert read(second_id) is not None
+        assert_status_ok(client.delete(f"/datasets/{second_id}", headers=headers))
+        assert not os.path.exists(blob_path)
+
+        def assert_no_blobs():
+            for _, _, files in os.walk(
+                os.path.join(settings.filestore_location, "blobs")
+            ):
+                assert files == []
+
+        # rewriting a dataset's file replaces the linked file, so it stops using the blob, and deleting
+        # the datasets still deletes the blob
+        storage = HDF5StorageOptions(compression="lzf", row_chunked_copy=False)
+        first_id = upload()
+        second_id = upload()
+        filestore_crud.rewrite_dataset_file_layout(
+            first_id, settings.filestore_location, storage
+        )
+        assert not os.path.samefile(get_data_file(first_id), get_data_file(second_id))
+        assert read(first_id) == read(second_id)
+        assert_status_ok(client.delete(f"/datasets/{second_id}", headers=headers))
+        assert_status_ok(client.delete(f"/datasets/{first_id}", headers=headers))
+        assert_no_blobs()
+
+        # including when it was the only dataset using the blob
+        only_id = upload()
+        filestore_crud.rewrite_dataset_file_layout(
+            only_id, settings.filestore_location, storage
+        )
+        assert_status_ok(client.delete(f"/datasets/{only_id}", headers=headers))
+        assert_no_blobs()
+
     def test_dataset_given_id_validation(
         self,
         client: TestClient,
@@ -893,6 +893,127 @@ class TestGet:
         assert results[2]["id"] == "ABC10Z2"
         assert results[2]["label"] == "ABC10Z2"
 
+    def test_get_dimensions_ranked_by_relevance(
+        self, client, settings, public_group, minimal_db
+    ):
+        admin_headers = {"X-Forwarded-Email": settings.admin_users[0]}
+
+        gene_feature_type_response = client.post(
+            "/types/feature",
+            data={
+                "name": "gene",
+                "id_column": "entrez_id",
+                "properties_to_index": ["label", "entrez_id", "aliases"],
+                "annotation_type_mapping": json.dumps(
+                    {
+                        "annotation_type_mapping": {
+                            "label": "text",
+                            "entrez_id": "text",
+                            "aliases": "list_strings",
+                        }
+                    }
+                ),
+            },
+            files={
+                "metadata_file": (
+                    "gene_metadata",
+                    factories.tabular_csv_data_file(
+                        cols=["label", "entrez_id", "aliases"],
+                        row_values=[
+                            ["KRAS", "3845", '["C-K-RAS"]'],
+                            ["KRASP1", "3846", '["KRAS1P"]'],
+                            ["NRAS", "4893", '["KRAS"]'],
+                            ["HKRAS", "9999", '["H"]'],
+                        ],
+                    ),
+                    "text/csv",
+                )
+            },
+            headers=admin_headers,
+        )
+        assert_status_ok(gene_feature_type_response)
+
+        compound_feature_type_response = client.post(
+            "/types/feature",
+            data={
+                "name": "compound",
+                "id_column": "compound_id",
+                "properties_to_index": ["compound_id", "label", "target"],
+                "annotation_type_mapping": json.dumps(
+                    {
+                        "annotation_type_mapping": {
+                            "label": "text",
+                            "compound_id": "text",
+                            "target": "list_strings",
+                        }
+                    }
+                ),
+                "id_mapping": json.dumps(
+                    {"id_mapping": {"reference_column_mappings": {"target": "gene"}}}
+                ),
+            },
+            files={
+                "metadata_file": (
+                    "compound_metadata",
+                    factories.tabular_csv_data_file(
+                        cols=["compound_id", "label", "target"],
+                        row_values=[
+                            ["C1", "sotorasib", '["3845"]'],
+                            ["C2", "AKRAS-1", '["9999"]'],
+                        ],
+                    ),
+                    "text/csv",
+                )
+            },
+            headers=admin_headers,
+        )
+        assert_status_ok(compound_feature_type_response)
+
+        # an exact match on a label comes first, then an exact match on another property (ie: an alias),
+        # then an exact match on a property of a referenced dimension (ie: target.label), and only then
+        # dimensions where the term is a prefix and finally where it's a substring
+        dimensions_response = client.get(
+            "/datasets/dimensions/?limit=100&substring=kras"
+        )
+        assert_status_ok(dimensions_response)
+        assert [(x["type_name"], x["id"]) for x in dimensions_response.json()] == [
+            ("gene", "3845"),
+            ("gene", "4893"),
+            ("compound", "C1"),
+            ("gene", "3846"),
+            ("compound", "C2"),
+            ("gene", "9999"),
+        ]
+
+        # every term has to match one of the dimension's entries
+        dimensions_response = client.get(
+            "/datasets/dimensions/?limit=100&substring=KRAS&substring=NRAS"
+        )
+        assert_status_ok(dimensions_response)
+        assert [(x["type_name"], x["id"]) for x in dimensions_response.json()] == [
+            ("gene", "4893"),
+        ]
+
+        # the limit applies to the ranked dimensions, not to the index entries
+        dimensions_response = client.get("/datasets/dimensions/?limit=2&prefix=KRAS")
+        assert_status_ok(dimensions_response)
+        assert dimensions_response.json() == [
+            {
+                "type_name": "gene",
+                "id": "3845",
+                "label": "KRAS",
+                "referenced_by": None,
+                "matching_properties": [{"property": "label", "value": "KRAS"}],
+            },
+            {
+                "type_name": "gene",
+                "id": "4893",
+                "label": "NRAS",
+                "referenced_by": None,
+                "matching_properties": [{"property": "aliases", "value": "KRAS"}],
+            },
+        ]
+
     def test_get_dimensions(
         self, minimal_db, client: TestClient, settings, public_group
     ):
@@ -1,13 +1,17 @@
 import numpy as np
 import pandas as pd
+import pytest
 from ..utils import assert_status_ok, assert_status_not_ok
 
 from fastapi.testclient import TestClient
 
 from breadbox.compute.analysis_tasks import get_features_info_and_dataset
 from breadbox.compute.download_tasks import (
+    _handle_df_nas,
     get_merged_processed_df,
     get_processed_df,
+    get_processed_df_blocks,
+    write_export_blocks,
 )
 from breadbox.compute.download_tasks import (
     get_feature_and_sample_indices_per_merged_dataset,
@@ -94,6 +98,99 @@ def test_get_processed_df(minimal_db, settings):
     assert recorded_progress == [18, 36, 54, 72, 90]
 
 
+@pytest.mark.parametrize(
+    "drop_nas,sample_ids",
+    [
+        (False, None),
+        (True, None),
+        (False, ["cell_line_8", "not_in_dataset", "cell_line_1"]),
+        (True, ["cell_line_8", "not_in_dataset", "cell_line_1", "cell_line_2"]),
+    ],
+)
+def test_get_processed_df_blocks(minimal_db, settings, tmpdir, drop_nas, sample_ids):
+    features = ["feature_" + str(i) for i in range(9)]
+    samples = ["cell_line_" + str(i) for i in range(9)]
+    data = np.array(
+        [[j + i / 10 for j in range(len(features))] for i in range(len(samples))]
+    )
+    # an empty column and row, which are dropped when drop_nas is set
+    data[:, 4] = np.nan
+    data[2, :] = np.nan
+    data[5, 6] = np.nan
+
+    admin_user = settings.admin_users[0]
+    factories.feature_type(minimal_db, admin_user, "gene")
+    created_dataset = _create_dataset(
+        db=minimal_db, settings=settings, features=features, samples=samples, data=data,
+    )
+
+    user = settings.default_user
+    minimal_db.reset_user(user)
+    feature_indices, dataset = get_features_info_and_dataset(
+        db=minimal_db, user=user, dataset_id=created_dataset.id,
+    )
+    sample_indices = _get_all_sample_indices(
+        db=minimal_db, user=user, dataset=dataset, given_ids=sample_ids
+    )
+
+    # what export_dataset used to write
+    expected_df = get_processed_df(
+        db=minimal_db,
+        dataset=dataset,
+        filestore_location=settings.filestore_location,
+        feature_indices=feature_indices.index.to_list(),
+        sample_indices=sample_indices,
+        progress_callback=lambda _: None,
+        user=user,
+    )
+    expected_df, expected_nas_dropped = _handle_df_nas(
+        drop_nas, expected_df, expected_df.columns.values.tolist(), sample_ids
+    )
+    expected_path = str(tmpdir.join("expected.csv"))
+    expected_df.to_csv(expected_path, index=True, header=True)
+
+    recorded_progress = []
+
+    def get_blocks():
+        return get_processed_df_blocks(
+            db=minimal_db,
+            dataset=dataset,
+            filestore_location=settings.filestore_location,
+            feature_indices=feature_indices.index.to_list(),
+            sample_indices=sample_indices,
+            sample_ids=sample_ids,
+            drop_nas=drop_nas,
+            add_metadata=False,
+            progress_callback=recorded_progress.append,
+            user=user,
+            # at most two rows per block
+            max_block_bytes=2 * len(features) * 8,
+        )
+
+    nas_dropped, blocks = get_blocks()
+    assert nas_dropped == expected_nas_dropped
+    csv_path = str(tmpdir.join("export.csv"))
+    write_export_blocks(blocks, csv_path, "csv")
+    with open(csv_path) as fd, open(expected_path) as expected_fd:
+        assert fd.read() == expected_fd.read()
+    assert recorded_progress[-1] == 90
+    assert recorded_progress == sorted(recorded_progress)
+
+    expected_df = pd.read_csv(expected_path, index_col=0)
+
+    parquet_path = str(tmpdir.join("export.parquet"))
+    write_export_blocks(get_blocks()[1], parquet_path, "parquet")
+    assert_frame_equal(
+        pd.read_parquet(parquet_path), expected_df, check_names=False,
+    )
+
+    json_path = str(tmpdir.join("export.json"))
+    write_export_blocks(get_blocks()[1], json_path, "json")
+    assert_frame_equal(
+        pd.read_json(json_path, orient="index"), expected_df, check_names=False,
+    )
+
+
 def _get_expected_merged_process_df_variables(minimal_db, settings):
     features = ["feature_" + str(i) for i in range(9)]
     samples = ["cell_line_" + str(i) for i in range(9)]
@@ -0,0 +1,129 @@
+import json
+import random
+import string
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests import factories
+from ..utils import assert_status_ok
+
+
+def _make_symbol():
+    letters = "".join(random.choices(string.ascii_uppercase, k=random.randint(2, 5)))
+    return letters + str(random.randint(1, 20))
+
+
+@pytest.mark.skip("Only useful for benchmarking searches of the dimension search index")
+def test_search_performance(minimal_db, client: TestClient, settings, public_group):
+    # an index roughly the shape of the portal's: genes with a couple of aliases each and
+    # compounds with aliases and one or two gene targets (which adds the target's
+    # properties to the compound's entries)
+    gene_count = 20000
+    compound_count = 20000
+    random.seed(0)
+
+    admin_headers = {"X-Forwarded-Email": settings.admin_users[0]}
+
+    gene_symbols = [f"{_make_symbol()}_{i}" for i in range(gene_count)]
+    gene_feature_type_response = client.post(
+        "/types/feature",
+        data={
+            "name": "gene",
+            "id_column": "entrez_id",
+            "properties_to_index": ["label", "entrez_id", "aliases"],
+            "annotation_type_mapping": json.dumps(
+                {
+                    "annotation_type_mapping": {
+                        "label": "text",
+                        "entrez_id": "text",
+                        "aliases": "list_strings",
+                    }
+                }
+            ),
+        },
+        files={
+            "metadata_file": (
+                "gene_metadata",
+                factories.tabular_csv_data_file(
+                    cols=["label", "entrez_id", "aliases"],
+                    row_values=[
+                        [
+                            symbol,
+                            str(1000 + i),
+                            json.dumps([_make_symbol(), _make_symbol()]),
+                        ]
+                        for i, symbol in enumerate(gene_symbols)
+                    ],
+                ),
+                "text/csv",
+            )
+        },
+        headers=admin_headers,
+    )
+    assert_status_ok(gene_feature_type_response)
+
+    compound_feature_type_response = client.post(
+        "/types/feature",
+        data={
+            "name": "compound",
+            "id_column": "compound_id",
+            "properties_to_index": ["compound_id", "label", "aliases", "target"],
+            "annotation_type_mapping": json.dumps(
+                {
+                    "annotation_type_mapping": {
+                        "label": "text",
+                        "compound_id": "text",
+                        "aliases": "list_strings",
+                        "target": "list_strings",
+                    }
+                }
+            ),
+            "id_mapping": json.dumps(
+                {"id_mapping": {"reference_column_mappings": {"target": "gene"}}}
+            ),
+        },
+        files={
+            "metadata_file": (
+                "compound_metadata",
+                factories.tabular_csv_data_file(
+                    cols=["compound_id", "label", "aliases", "target"],
+                    row_values=[
+                        [
+                            f"BRD-K{i:08d}",
+                            f"compound-{_make_symbol().lower()}-{i}",
+                            json.dumps([f"{_make_symbol()}-{i}"]),
+                            json.dumps(
+                                [
+                                    str(1000 + random.randrange(gene_count))
+                                    for _ in range(random.randint(1, 2))
+                                ]
+                            ),
+                        ]
+                        for i in range(compound_count)
+                    ],
+                ),
+                "text/csv",
+            )
+        },
+        headers=admin_headers,
+    )
+    assert_status_ok(compound_feature_type_response)
+
+    searches = {
+        "exact gene symbol": f"substring={gene_symbols[100]}",
+        "common substring": "substring=RAS",
+        "rare substring": f"substring={gene_symbols[200][1:-1]}",
+        "two character substring": "substring=KR",
+        "compound id": "substring=BRD-K0001",
+        "prefix, with referenced_by": "prefix=comp&include_referenced_by=T",
+        "no terms": "",
+    }
+    for label, params in searches.items():
+        start = time.perf_counter()
+        for _ in range(10):
+            response = client.get(f"/datasets/dimensions/?limit=100&{params}")
+            assert_status_ok(response)
+        elapsed = (time.perf_counter() - start) / 10
+        print(f"{label}: {len(response.json())} results in {elapsed * 1000:.1f} ms")
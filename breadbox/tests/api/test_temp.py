@@ -1,9 +1,15 @@
+from aiocache import Cache
+from aiocache.serializers import PickleSerializer
 import numpy as np
 import pandas as pd
 from ..utils import assert_status_ok, assert_status_not_ok
 
+from breadbox.api.dependencies import get_cache
+from breadbox.crud import dataset as dataset_crud
 from breadbox.db.session import SessionWithUser
 from breadbox.models.dataset import AnnotationType
+from breadbox.service import slice as slice_service
+from breadbox.utils.caching import CachingCaller
 from fastapi.testclient import TestClient
 from tests import factories
 
@@ -462,6 +468,99 @@ class TestPost:
         assert_status_not_ok(response)
         assert response.status_code == 404
 
+    def test_evaluate_context_is_cached(
+        self,
+        client: TestClient,
+        minimal_db: SessionWithUser,
+        public_group,
+        settings,
+        monkeypatch,
+    ):
+        admin_user = settings.admin_users[0]
+        factories.add_dimension_type(
+            minimal_db,
+            settings,
+            user=admin_user,
+            name="some_sample_type",
+            display_name="Sample With Metadata",
+            id_column="ID",
+            annotation_type_mapping={
+                "ID": AnnotationType.text,
+                "label": AnnotationType.text,
+            },
+            axis="sample",
+            metadata_df=pd.DataFrame(
+                {
+                    "ID": ["sampleID1", "sampleID2", "sampleID3"],
+                    "label": ["sampleLabel1", "sampleLabel2", "sampleLabel3"],
+                }
+            ),
+        )
+
+        def create_dataset(values):
+            return factories.matrix_dataset(
+                minimal_db,
+                settings,
+                feature_type=None,
+                sample_type="some_sample_type",
+                data_file=factories.matrix_csv_data_file_with_values(
+                    feature_ids=["featureID1"],
+                    sample_ids=["sampleID1", "sampleID2", "sampleID3"],
+                    values=np.array(values),
+                ),
+                given_id="dataset_123",
+            )
+
+        dataset = create_dataset([[1], [4], [7]])
+
+        cache = CachingCaller(Cache.MEMORY(serializer=PickleSerializer()), ttl=100)
+        client.app.dependency_overrides[get_cache] = lambda: cache
+
+        slice_loads = []
+        get_slice_data = slice_service.get_slice_data
+
+        def get_slice_data_spy(db, filestore_location, slice_query):
+            slice_loads.append(slice_query)
+            return get_slice_data(db, filestore_location, slice_query)
+
+        monkeypatch.setattr(slice_service, "get_slice_data", get_slice_data_spy)
+
+        def evaluate(user):
+            response = client.post(
+                "/temp/context",
+                json={
+                    "dimension_type": "some_sample_type",
+                    "expr": {">": [{"var": "x"}, 2.1]},
+                    "vars": {
+                        "x": {
+                            "dataset_id": "dataset_123",
+                            "identifier": "featureID1",
+                            "identifier_type": "feature_id",
+                        }
+                    },
+                },
+                headers={"X-Forwarded-User": user},
+            )
+            assert_status_ok(response)
+            return response.json()["ids"]
+
+        assert evaluate("some-public-user") == ["sampleID2", "sampleID3"]
+        assert len(slice_loads) == 1
+
+        # the result only depends on public data, so is shared between users
+        assert evaluate("another-public-user") == ["sampleID2", "sampleID3"]
+        assert len(slice_loads) == 1
+
+        # replacing the dataset the context references invalidates the result
+        minimal_db.reset_user(admin_user)
+        dataset_crud.delete_dataset(
+            minimal_db, admin_user, dataset, settings.filestore_location
+        )
+        minimal_db.flush()
+        create_dataset([[1], [1], [7]])
+        assert evaluate("some-public-user") == ["sampleID3"]
+        assert len(slice_loads) == 2
+
 
 def test_cas_operations(client: TestClient, settings):
     # make sure we handle missing keys with a 404
@@ -11,6 +11,7 @@ from glob import glob
 
 import pytest
 import packed_cor_tables
+from scipy import stats
 
 
 def test_compute_associations_for_slice(
@@ -57,7 +58,9 @@ def test_compute_associations_for_slice(
 
     assert_status_ok(response)
     body = response.json()
-    assert set(body.keys()) == {"label", "given_id", "cor"}
+    assert set(body.keys()) == {"label", "given_id", "cor", "log10qvalue"}
+    # two samples are too few to compute a q-value
+    assert body["log10qvalue"] == [None, None, None]
 
     # Results should be sorted by cor ascending
     assert body["cor"] == sorted(body["cor"])
@@ -71,11 +74,95 @@ def test_compute_associations_for_slice(
     assert result["feat_b"] == pytest.approx(-1.0)
 
 
+def test_compute_associations_with_missing_values_and_limit(
+    client: TestClient, minimal_db: SessionWithUser, settings
+):
+    rng = np.random.default_rng(0)
+    sample_count = 20
+    feature_count = 50
+    values = rng.normal(size=(sample_count, feature_count))
+    # give some features missing values, in a few different patterns
+    values[:5, 10:20] = np.nan
+    values[3:8, 20:25] = np.nan
+    values[2, 0] = np.nan
+    data_file = factories.matrix_csv_data_file_with_values(
+        feature_ids=[f"feat_{i}" for i in range(feature_count)],
+        sample_ids=[f"ACH-{i}" for i in range(sample_count)],
+        values=values,
+    )
+    dataset = factories.matrix_dataset(
+        minimal_db,
+        settings,
+        feature_type=None,
+        sample_type="depmap_model",
+        data_file=data_file,
+    )
+    minimal_db.commit()
+
+    df = pd.DataFrame(values, columns=[f"feat_{i}" for i in range(feature_count)])
+    expected_cor = df.corrwith(df["feat_0"])
+    expected_n = df.notna().mul(df["feat_0"].notna(), axis=0).sum()
+    expected_p = 2 * stats.beta(
+        expected_n / 2 - 1, expected_n / 2 - 1, loc=-1, scale=2
+    ).cdf(-expected_cor.abs().clip(upper=1))
+    expected_log10q = pd.Series(
+        np.log10(stats.false_discovery_control(expected_p)), index=df.columns
+    )
+
+    def compute(limit=None):
+        response = client.post(
+            "/temp/associations/compute",
+            json={
+                "dataset_id": dataset.id,
+                "slice_query": {
+                    "identifier_type": "feature_id",
+                    "dataset_id": dataset.id,
+                    "identifier": "feat_0",
+                },
+                "limit": limit,
+            },
+        )
+        assert_status_ok(response)
+        return response.json()
+
+    body = compute()
+    assert len(body["given_id"]) == feature_count
+    assert body["cor"] == sorted(body["cor"])
+    for given_id, cor, log10qvalue in zip(
+        body["given_id"], body["cor"], body["log10qvalue"]
+    ):
+        assert cor == pytest.approx(expected_cor[given_id], abs=1e-5)
+        if given_id == "feat_0":
+            # q = 0, which gets bounded
+            assert log10qvalue == -1e100
+        else:
+            assert log10qvalue == pytest.approx(expected_log10q[given_id], abs=1e-4)
+
+    # with a limit, only the strongest correlations are returned, but the q-values are the same
+    body = compute(limit=5)
+    expected_top = expected_cor.abs().sort_values(ascending=False).index[:5]
+    assert set(body["given_id"]) == set(expected_top)
+    assert body["cor"] == sorted(body["cor"])
+    for given_id, log10qvalue in zip(body["given_id"], body["log10qvalue"]):
+        if given_id != "feat_0":
+            assert log10qvalue == pytest.approx(expected_log10q[given_id], abs=1e-4)
+
+
+@pytest.mark.parametrize(
+    "write_cor_df",
+    [packed_cor_tables.write_cor_df, packed_cor_tables.write_cor_df_v2],
+    ids=["v1", "v2"],
+)
 def test_associations(
-    client: TestClient, minimal_db: SessionWithUser, public_group, settings, tmpdir
+    client: TestClient,
+    minimal_db: SessionWithUser,
+    public_group,
+    settings,
+    tmpdir,
+    write_cor_df,
 ):
     def get_assoc_table_file_count():
-        return len(glob(f"{settings.filestore_location}/associations/*.sqlite3"))
+        return len(glob(f"{settings.filestore_location}/associations/*"))
 
     def create_dim_type(axis: Literal["feature", "sample"], count: int):
         # Define label metadata for our features
@@ -119,7 +206,7 @@ def test_associations(
 
     assoc_table_1 = str(tmpdir.join("assoc.sqlite3"))
 
-    packed_cor_tables.write_cor_df(
+    write_cor_df(
         pd.DataFrame(
             {
                 "dim_0": [0, 0],
@@ -189,8 +276,10 @@ def test_associations(
     response_content = response.json()
     assoc_id = response_content.get("id")
 
-    # make sure the file is in the right place
+    # make sure the file is in the right place, and was converted to version 2 of the format
     assert get_assoc_table_file_count() == 1
+    (stored_table,) = glob(f"{settings.filestore_location}/associations/*")
+    assert packed_cor_tables.get_format_version(stored_table) == 2
 
     # make sure we can see it
     response = client.get("/temp/associations", headers={"X-Forwarded-User": "anon"},)
@@ -230,6 +319,73 @@ def test_associations(
     assert fa2["other_dataset_id"] == dataset_2.id
     assert fa2["correlation"] == pytest.approx(0.2)
 
+    # query several slices at once: feature1 has no associations, and feature0 is requested twice
+    response = client.post(
+        "/temp/associations/query-slices",
+        json={
+            "slice_queries": [
+                {
+                    "identifier_type": "feature_id",
+                    "dataset_id": dataset_1.id,
+                    "identifier": "feature0",
+                },
+                {
+                    "identifier_type": "feature_id",
+                    "dataset_id": dataset_1.id,
+                    "identifier": "feature1",
+                },
+                {
+                    "identifier_type": "feature_label",
+                    "dataset_id": dataset_1.id,
+                    "identifier": "feature0",
+                },
+            ]
+        },
+        headers={"X-Forwarded-User": "anon"},
+    )
+
+    assert_status_ok(response)
+    response_content = response.json()
+    assert [
+        (x["dimension_given_id"], len(x["associated_datasets"]))
+        for x in response_content["slices"]
+    ] == [("feature0", 1), ("feature1", 1), ("feature0", 1)]
+    associations = response_content["associations"]
+    assert associations["slice_index"] == [0, 0, 2, 2]
+    assert associations["other_dimension_given_id"] == [
+        "feature0",
+        "feature1",
+        "feature0",
+        "feature1",
+    ]
+    assert (
+        associations["other_dimension_label"]
+        == associations["other_dimension_given_id"]
+    )
+    assert associations["other_dataset_id"] == [dataset_2.id] * 4
+    assert associations["correlation"] == pytest.approx([0.1, 0.2, 0.1, 0.2])
+    assert associations["log10qvalue"] == pytest.approx([-12.5, -10.1, -12.5, -10.1])
+
+    # restricting to other datasets finds nothing
+    response = client.post(
+        "/temp/associations/query-slices",
+        json={
+            "slice_queries": [
+                {
+                    "identifier_type": "feature_id",
+                    "dataset_id": dataset_1.id,
+                    "identifier": "feature0",
+                }
+            ],
+            "association_datasets": [dataset_1.id],
+        },
+        headers={"X-Forwarded-User": "anon"},
+    )
+    assert_status_ok(response)
+    response_content = response.json()
+    assert response_content["slices"][0]["associated_datasets"] == []
+    assert response_content["associations"]["slice_index"] == []
+
     # # query feature 0 in dataset 2 (this one only has one correlation stored)
     # response = client.post(
     #     "/temp/associations/query-slice",
@@ -275,3 +431,24 @@ def test_associations(
 
     # make sure the file is gone too
     assert get_assoc_table_file_count() == 0
+
+
+def test_upload_invalid_association_table(
+    client: TestClient, minimal_db: SessionWithUser, settings
+):
+    file_ids, expected_md5 = upload_and_get_file_ids(
+        client, data=b"not an association table"
+    )
+    response = client.post(
+        "/temp/associations",
+        json={
+            "dataset_1_id": "dataset_1",
+            "dataset_2_id": "dataset_2",
+            "axis": "feature",
+            "file_ids": file_ids,
+            "md5": expected_md5,
+        },
+        headers={"X-Forwarded-User": settings.admin_users[0]},
+    )
+    assert response.status_code == 400
+    assert glob(f"{settings.filestore_location}/associations/*") == []
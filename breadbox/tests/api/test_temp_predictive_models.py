@@ -327,6 +327,89 @@ def test_query_nonexistent_feature(
     assert len(data["model_fits"]) == 0
 
 
+def test_query_many_features(
+    client: TestClient, minimal_db: SessionWithUser, settings, tmpdir
+):
+    """Test querying for several features at once, including one with fewer top features"""
+    admin_user = settings.admin_users[0]
+    admin_headers = {"X-Forwarded-User": admin_user}
+
+    # Create the gene dimension type
+    _create_gene_dimension_type(minimal_db, settings)
+
+    # Create test datasets
+    actuals_dataset = _create_test_matrix_dataset(
+        minimal_db, settings, feature_ids=["SOX10", "BRAF", "KRAS"]
+    )
+    predictions_dataset = _create_test_matrix_dataset(
+        minimal_db, settings, feature_ids=["pred_SOX10", "pred_BRAF", "pred2_SOX10"]
+    )
+    minimal_db.commit()
+
+    # Create a config
+    response = client.post(
+        "/temp/predictive_models/configs/gene",
+        json={
+            "configs": [
+                {
+                    "model_config_name": "dna",
+                    "model_config_description": "DNA-based predictive features",
+                }
+            ]
+        },
+        headers=admin_headers,
+    )
+    assert_status_ok(response)
+
+    # Create parquet file where BRAF only has one top feature
+    parquet_path = _create_test_parquet(
+        tmpdir, ["SOX10", "BRAF"], predictions_dataset.id
+    )
+    df = pd.read_parquet(parquet_path)
+    df.loc[df["actuals_feature_given_id"] == "BRAF", "feature_2_given_id"] = None
+    df.to_parquet(parquet_path)
+
+    # Upload and load
+    file_ids, md5 = upload_and_get_file_ids(client, filename=parquet_path)
+    response = client.post(
+        f"/temp/predictive_models/config/gene/dna/{actuals_dataset.id}",
+        json={
+            "file_ids": file_ids,
+            "md5": md5,
+            "etag": "dummy-etag",
+            "predictions_dataset_id": predictions_dataset.id,
+        },
+        headers=admin_headers,
+    )
+    assert_status_ok(response)
+
+    response = client.post(
+        f"/temp/predictive_models/features/{actuals_dataset.id}",
+        json={"feature_given_ids": ["KRAS", "SOX10", "BRAF"]},
+        headers=admin_headers,
+    )
+    assert_status_ok(response)
+    data = response.json()
+
+    # Results are in the order requested
+    assert [x["actuals_feature_given_id"] for x in data] == ["KRAS", "SOX10", "BRAF"]
+    assert data[0]["model_fits"] == []
+    assert [
+        x["feature_given_id"] for x in data[1]["model_fits"][0]["top_features"]
+    ] == ["pred_SOX10", "pred2_SOX10"]
+    assert [
+        x["feature_given_id"] for x in data[2]["model_fits"][0]["top_features"]
+    ] == ["pred_BRAF"]
+
+    # The single feature query returns the same result
+    response = client.get(
+        f"/temp/predictive_models/feature/{actuals_dataset.id}/BRAF",
+        headers=admin_headers,
+    )
+    assert_status_ok(response)
+    assert response.json() == data[2]
+
+
 def test_delete_results(
     client: TestClient, minimal_db: SessionWithUser, settings, tmpdir
 ):
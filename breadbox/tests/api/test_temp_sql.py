@@ -7,6 +7,7 @@ import pandas as pd
 from fastapi.testclient import TestClient
 from breadbox.models.dataset import ValueType
 import pytest
+import pyarrow as pa
 
 
 def _assert_sql_result_eq(client, sql, expected_result, expected_status_code=200):
@@ -250,6 +251,280 @@ def test_matrix_query(
     )
 
 
+def test_matrix_query_pushes_down_in_constraints(
+    minimal_db: SessionWithUser,
+    settings,
+    client: TestClient,
+    mock_run_time_bounded_celery_task,
+    monkeypatch,
+):
+    from breadbox.service.sql import query as sql_query
+
+    sample_ids = ["s1", "s2", "s3"]
+    factories.sample_type(
+        minimal_db, minimal_db.user, "simple_sample_type", given_ids=sample_ids
+    )
+    factories.matrix_dataset(
+        minimal_db,
+        settings,
+        sample_type="simple_sample_type",
+        feature_type=None,
+        data_file=factories.matrix_csv_data_file_with_values(
+            feature_ids=["A", "B", "C"],
+            sample_ids=sample_ids,
+            values=[[1, 2, None], [4, 5, 6], [7, 8, 9]],
+        ),
+        dataset_name="simple_matrix",
+    )
+
+    # record the constraints each read of the matrix was given
+    filter_calls = []
+    original_query_matrix_dataset = sql_query.query_matrix_dataset
+
+    def recording_query_matrix_dataset(*args, **constraints):
+        filter_calls.append(constraints)
+        return original_query_matrix_dataset(*args, **constraints)
+
+    monkeypatch.setattr(
+        sql_query, "query_matrix_dataset", recording_query_matrix_dataset
+    )
+
+    _assert_sql_result_eq(
+        client,
+        "select sample_id, feature_id, value from simple_matrix where feature_id in ('A', 'C', 'missing') and sample_id in ('s1', 's3') order by sample_id, feature_id",
+        "sample_id,feature_id,value\r\ns1,A,1.0\r\ns1,C,\r\ns3,A,7.0\r\ns3,C,9.0\r\n",
+    )
+    # both IN lists were handled by a single read
+    assert len(filter_calls) == 1
+    assert sorted(filter_calls[0]["feature_id"]) == ["A", "C", "missing"]
+    assert sorted(filter_calls[0]["sample_id"]) == ["s1", "s3"]
+
+    # constraints on the value are left for sqlite to apply
+    filter_calls.clear()
+    _assert_sql_result_eq(
+        client,
+        "select sample_id, feature_id from simple_matrix where value > 7 order by value",
+        "sample_id,feature_id\r\ns3,B\r\ns3,C\r\n",
+    )
+    assert filter_calls == [{"dataset_id": filter_calls[0]["dataset_id"]}]
+
+    _assert_sql_result_eq(
+        client,
+        "select count(1) n, sum(m.value) total from simple_matrix_sample s join simple_matrix m on m.sample_id = s.sample_id where s.sample_id in ('s1', 's2') and m.feature_id = 'B'",
+        "n,total\r\n2,7.0\r\n",
+    )
+
+    _assert_sql_result_eq(
+        client,
+        "select count(1) n from simple_matrix_feature where feature_id in ('A', 'B', 'missing')",
+        "n\r\n2\r\n",
+    )
+
+
+def test_virtual_schema_is_cached_until_catalog_changes(
+    minimal_db: SessionWithUser,
+    settings,
+    client: TestClient,
+    mock_run_time_bounded_celery_task,
+    monkeypatch,
+):
+    from breadbox.crud import dataset as crud_dataset
+    from breadbox.service.sql import query as sql_query
+
+    # record which tables get created each time the virtual tables are brought up to date
+    synced_tables = []
+    original_sync_virtual_tables = sql_query._sync_virtual_tables
+
+    def recording_sync_virtual_tables(connection, context, catalog_version):
+        before = set(context.tables)
+        original_sync_virtual_tables(connection, context, catalog_version)
+        synced_tables.append(sorted(set(context.tables) - before))
+
+    monkeypatch.setattr(
+        sql_query, "_sync_virtual_tables", recording_sync_virtual_tables
+    )
+
+    sample_ids = ["s1", "s2"]
+    factories.sample_type(
+        minimal_db, minimal_db.user, "simple_sample_type", given_ids=sample_ids
+    )
+
+    def create_matrix(name):
+        # each request resets the session's user, so set it back to the admin's
+        minimal_db.reset_user(settings.admin_users[0])
+        return factories.matrix_dataset(
+            minimal_db,
+            settings,
+            sample_type="simple_sample_type",
+            feature_type=None,
+            data_file=factories.matrix_csv_data_file_with_values(
+                feature_ids=["A", "B"], sample_ids=sample_ids, values=[[1, 2], [3, 4]],
+            ),
+            dataset_name=name,
+            given_id=name,
+        )
+
+    matrix1 = create_matrix("matrix1")
+    version = crud_dataset.get_catalog_version(minimal_db)
+
+    _assert_sql_result_eq(
+        client, "select sum(value) total from matrix1", "total\r\n10.0\r\n"
+    )
+    _assert_sql_result_eq(client, "select count(1) n from matrix1_sample", "n\r\n2\r\n")
+    # the second query reused the tables created by the first
+    assert len(synced_tables) == 1
+    assert {"matrix1", "matrix1_feature", "matrix1_sample"} <= set(synced_tables[0])
+
+    # adding a dataset only creates the tables for that dataset
+    create_matrix("matrix2")
+    assert crud_dataset.get_catalog_version(minimal_db) > version
+    _assert_sql_result_eq(
+        client, "select sum(value) total from matrix2", "total\r\n10.0\r\n"
+    )
+    assert synced_tables[1:] == [["matrix2", "matrix2_feature", "matrix2_sample"]]
+
+    # and deleting one drops its tables
+    minimal_db.reset_user(settings.admin_users[0])
+    crud_dataset.delete_dataset(
+        minimal_db, settings.admin_users[0], matrix1, settings.filestore_location
+    )
+    minimal_db.flush()
+    _assert_sql_result_eq(
+        client,
+        "select sum(value) total from matrix1",
+        lambda text: "no such table: matrix1" in text,
+        expected_status_code=400,
+    )
+    _assert_sql_result_eq(
+        client, "select sum(value) total from matrix2", "total\r\n10.0\r\n"
+    )
+    assert synced_tables[2:] == [[]]
+
+
+def test_catalog_version_only_changes_with_the_sql_schema(
+    minimal_db: SessionWithUser, settings
+):
+    from breadbox.crud import dataset as crud_dataset
+    from breadbox.models.dataset import Dataset, MatrixDataset
+
+    dataset = factories.matrix_dataset(minimal_db, settings)
+    minimal_db.flush()
+    version = crud_dataset.get_catalog_version(minimal_db)
+
+    # edits which the SQL endpoint can't see leave the cached virtual tables alone
+    dataset.description = "new description"
+    dataset.priority = 3
+    minimal_db.flush()
+    minimal_db.query(MatrixDataset).filter(MatrixDataset.id == dataset.id).update(
+        {MatrixDataset.storage_layout_version: dataset.storage_layout_version}
+    )
+    assert crud_dataset.get_catalog_version(minimal_db) == version
+
+    # but renaming a dataset renames its tables
+    dataset.name = "renamed"
+    minimal_db.flush()
+    assert crud_dataset.get_catalog_version(minimal_db) > version
+
+    version = crud_dataset.get_catalog_version(minimal_db)
+    minimal_db.query(Dataset).filter(Dataset.id == dataset.id).update(
+        {Dataset.name: "renamed again"}
+    )
+    assert crud_dataset.get_catalog_version(minimal_db) > version
+
+
+@pytest.mark.parametrize("result_format", ["parquet", "arrow-ipc"])
+def test_query_result_formats(
+    minimal_db: SessionWithUser,
+    settings,
+    client: TestClient,
+    mock_run_time_bounded_celery_task,
+    result_format,
+):
+    import io
+
+    sample_ids = ["s1", "s2", "s3"]
+    factories.sample_type(
+        minimal_db, minimal_db.user, "simple_sample_type", given_ids=sample_ids
+    )
+    factories.matrix_dataset(
+        minimal_db,
+        settings,
+        sample_type="simple_sample_type",
+        feature_type=None,
+        data_file=factories.matrix_csv_data_file_with_values(
+            feature_ids=["A", "B"],
+            sample_ids=sample_ids,
+            values=[[1, 2], [3, None], [5, 6]],
+        ),
+        dataset_name="simple_matrix",
+    )
+
+    sql = "select sample_id, feature_id, value, length(sample_id) n from simple_matrix order by sample_id, feature_id"
+
+    def query(result_format):
+        response = client.post(
+            "/temp/sql/query",
+            json={"sql": sql, "format": result_format},
+            headers={"X-Forwarded-User": "anonymous"},
+        )
+        assert response.status_code == 200
+        return response
+
+    expected = pd.read_csv(io.StringIO(query("csv").text))
+
+    response = query(result_format)
+    if result_format == "parquet":
+        assert response.headers["content-type"] == "application/vnd.apache.parquet"
+        result = pd.read_parquet(io.BytesIO(response.content))
+    else:
+        assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+        result = pa.ipc.open_stream(response.content).read_pandas()
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert result["value"].isna().tolist() == [False, False, False, True, False, False]
+
+
+def test_cursor_to_record_batches():
+    import apsw
+    from breadbox.service.sql.query import cursor_to_record_batches
+    from breadbox.schemas.custom_http_exception import UserError
+
+    connection = apsw.Connection(":memory:")
+    connection.execute("create table t (i, x, mixed, empty)")
+    connection.execute(
+        "insert into t values (1, null, 'a', null), (2, 1.5, 2, null), (3, 2, null, null)"
+    )
+
+    schema, batches = cursor_to_record_batches(
+        ["i", "x", "mixed", "empty"],
+        connection.execute("select * from t order by i"),
+        rows_per_batch=2,
+    )
+    # types are inferred from the first values which aren't null, reading ahead if needed
+    assert schema.types == [pa.int64(), pa.float64(), pa.string(), pa.string()]
+    table = pa.Table.from_batches(list(batches), schema=schema)
+    assert table.to_pydict() == {
+        "i": [1, 2, 3],
+        "x": [None, 1.5, 2.0],
+        "mixed": ["a", "2", None],
+        "empty": [None, None, None],
+    }
+
+    # no rows at all
+    schema, batches = cursor_to_record_batches(
+        ["i"], connection.execute("select i from t where i > 5")
+    )
+    assert list(batches) == []
+
+    # an integer column can't hold the floats in a later batch
+    connection.execute("insert into t values (4.5, null, null, null)")
+    schema, batches = cursor_to_record_batches(
+        ["i"], connection.execute("select i from t order by i"), rows_per_batch=2
+    )
+    with pytest.raises(UserError):
+        list(batches)
+
+
 def assert_schema_is_valid(client):
     response = client.get(
         "/temp/sql/schema", headers={"X-Forwarded-User": "anonymous"},
@@ -363,3 +638,50 @@ def test_tabular_query(
         "select ID from annot1_metadata where ID = '1' union select ID from annot1_metadata where ID = '2' order by ID",
         "ID\r\n1\r\n2\r\n",
     )
+
+
+@pytest.mark.skip("Only useful for measuring query latency")
+def test_matrix_query_latency(
+    minimal_db: SessionWithUser,
+    settings,
+    client: TestClient,
+    mock_run_time_bounded_celery_task,
+):
+    import time
+    import numpy as np
+
+    sample_ids = [f"s{i}" for i in range(500)]
+    feature_ids = [f"f{i}" for i in range(4000)]
+    factories.sample_type(
+        minimal_db, minimal_db.user, "simple_sample_type", given_ids=sample_ids
+    )
+    factories.matrix_dataset(
+        minimal_db,
+        settings,
+        sample_type="simple_sample_type",
+        feature_type=None,
+        data_file=factories.matrix_csv_data_file_with_values(
+            feature_ids=feature_ids,
+            sample_ids=sample_ids,
+            values=np.random.rand(len(sample_ids), len(feature_ids)),
+        ),
+        dataset_name="big_matrix",
+    )
+
+    some_features = ", ".join(f"'{x}'" for x in feature_ids[::400])
+    some_samples = ", ".join(f"'{x}'" for x in sample_ids[::50])
+    queries = {
+        "10 features": f"select count(1) n from big_matrix where feature_id in ({some_features})",
+        "10 features x 10 samples": f"select count(1) n from big_matrix where feature_id in ({some_features}) and sample_id in ({some_samples})",
+        "one feature joined to samples": f"select count(1) n from big_matrix_sample s join big_matrix m on m.sample_id = s.sample_id where s.sample_id in ({some_samples}) and m.feature_id = 'f1'",
+        "every cell": "select sum(value) n from big_matrix",
+    }
+    for label, sql in queries.items():
+        start = time.perf_counter()
+        response = client.post(
+            "/temp/sql/query",
+            json={"sql": sql},
+            headers={"X-Forwarded-User": "anonymous"},
+        )
+        assert response.status_code == 200
+        print(f"{label}: {time.perf_counter() - start:.3f} s ({response.text!r})")
@@ -42,3 +42,22 @@ def test_caching_caller():
         assert await cc.memoize(_increment) == 1
 
     asyncio.run(body())
+
+
+def test_caching_caller_awaits_awaitable_results():
+    async def body():
+        cc = CachingCaller(Cache.MEMORY(serializer=PickleSerializer()), ttl=100)
+
+        call_count = 0
+
+        async def _increment():
+            nonlocal call_count
+            call_count += 1
+            return call_count
+
+        assert await cc.memoize(lambda: _increment()) == 1
+        assert await cc.memoize(lambda: _increment()) == 1
+        assert await cc.memoize(lambda: _increment(), depends_on=[1]) == 2
+        assert call_count == 2
+
+    asyncio.run(body())
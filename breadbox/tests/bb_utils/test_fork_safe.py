@@ -0,0 +1,33 @@
+import os
+
+from breadbox.utils.fork_safe import ForkSafe
+
+
+class _Counter(ForkSafe):
+    def __init__(self):
+        self.resets = 0
+        super().__init__()
+
+    def _reset(self):
+        self.resets += 1
+        self.values = []
+
+
+def test_fork_safe_resets_state_in_child_process(monkeypatch):
+    counter = _Counter()
+    counter.values.append(1)
+    counter._check_pid()
+    assert counter.values == [1]
+    assert counter.resets == 1
+
+    # pretend this is now the child of a fork
+    child_pid = os.getpid() + 1
+    monkeypatch.setattr(os, "getpid", lambda: child_pid)
+    counter._check_pid()
+    assert counter.values == []
+    assert counter.resets == 2
+
+    counter.values.append(2)
+    counter._check_pid()
+    assert counter.values == [2]
+    assert counter.resets == 2
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+from breadbox.compute.analysis_result_cache import AnalysisResultCache, get_cache_key
+
+
+def _get_key(**kwargs):
+    parameters = dict(
+        analysis_type="pearson",
+        dataset_versions={"dataset": ["d1", "2024-01-01", None]},
+        query_feature_id=None,
+        depmap_model_ids=["ACH-2", "ACH-1", "ACH-3"],
+        query_values=[2.0, 1.0, 3.0],
+        vector_is_dependent=None,
+    )
+    parameters.update(kwargs)
+    return get_cache_key(**parameters)
+
+
+def test_get_cache_key():
+    key = _get_key()
+    # the order of the cell lines doesn't matter
+    assert key == _get_key(
+        depmap_model_ids=["ACH-1", "ACH-2", "ACH-3"], query_values=[1.0, 2.0, 3.0]
+    )
+    # but which cell line has which value does
+    assert key != _get_key(
+        depmap_model_ids=["ACH-1", "ACH-2", "ACH-3"], query_values=[2.0, 1.0, 3.0]
+    )
+    assert key != _get_key(analysis_type="association", vector_is_dependent=True)
+    assert key != _get_key(dataset_versions={"dataset": ["d1", "2024-02-01", None]})
+
+
+def _put(cache, tmpdir, key, data):
+    data_path = str(tmpdir.join(f"{key}.json"))
+    with open(data_path, "wt") as fd:
+        json.dump(data, fd)
+    cache.put(key, {"taskId": key, "data_json_file_path": data_path})
+
+
+def test_result_cache(tmpdir):
+    cache = AnalysisResultCache(str(tmpdir.join("cache")), max_bytes=1000)
+    assert cache.get("aa01") is None
+
+    _put(cache, tmpdir, "aa01", [{"label": "A", "Cor": 0.5}])
+    assert cache.get("aa01") == {
+        "taskId": "aa01",
+        "data": [{"label": "A", "Cor": 0.5}],
+    }
+
+    cache.discard("aa01")
+    assert cache.get("aa01") is None
+
+
+def test_result_cache_evicts_least_recently_used(tmpdir):
+    # each entry takes ~250 bytes, so only 3 fit
+    cache = AnalysisResultCache(str(tmpdir.join("cache")), max_bytes=800)
+    data = [{"label": "x" * 200}]
+
+    for key in ["aa01", "bb02", "cc03"]:
+        _put(cache, tmpdir, key, data)
+        # make sure each is used at a distinct time
+        time.sleep(0.01)
+    assert cache.get("aa01") is not None
+    time.sleep(0.01)
+
+    _put(cache, tmpdir, "dd04", data)
+    assert cache.get("bb02") is None
+    for key in ["aa01", "cc03", "dd04"]:
+        assert cache.get(key) is not None
+
+    # no temporary directories are left behind
+    assert not any(
+        name.startswith(".tmp-") for name in os.listdir(str(tmpdir.join("cache")))
+    )
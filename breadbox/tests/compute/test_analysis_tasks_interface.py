@@ -1,7 +1,13 @@
 from typing import List
 import os
+import threading
+import time
+
+import h5py
 import numpy as np
+import pytest
 
+from breadbox.io.hdf5_utils import read_hdf5_values
 from breadbox.depmap_compute_embed.analysis_tasks_interface import (
     FeaturesExtDataFrame,
     CustomAnalysisCallbacks,
@@ -200,3 +206,123 @@ def test_run_pearson_consistency():
     assert sorted(one_batch_df.columns) == sorted(
         ["Cor", "PValue", "QValue", "given_id", "label", "vectorId", "numCellLines"]
     )
+
+
+def test_pipelined_batches_match_serial():
+    # running batches on several threads (while the next ones are read) gives the same results as
+    # running them one after the other, and progress is only reported from the calling thread
+    ensure_datafiles_exist()
+
+    features_df = FeaturesExtDataFrame(pd.read_csv(features_path, index_col=0))
+    dataset_df = pd.read_csv(dataset_path)
+    value_query_vector = list(pd.read_csv(query_vector_path).iloc[:, 0])
+
+    progress = []
+
+    class RecordingCallbacks(MockCustomAnalysisCallbacks):
+        def update_message(
+            self,
+            message=None,
+            start_time=None,
+            max_time: int = 45,
+            percent_complete=None,
+        ):
+            progress.append((threading.current_thread(), percent_complete))
+
+    callbacks = RecordingCallbacks(dataset_df.values)
+
+    serial_df = run_pearson_correlations(
+        callbacks, value_query_vector, features_df, features_per_batch=5,
+    )
+    progress.clear()
+    pipelined_df = run_pearson_correlations(
+        callbacks, value_query_vector, features_df, features_per_batch=5, max_workers=3,
+    )
+    pd.testing.assert_frame_equal(serial_df, pipelined_df)
+
+    assert all(thread is threading.current_thread() for thread, _ in progress)
+    percents = [percent for _, percent in progress if percent is not None]
+    assert len(percents) == 10  # one per batch
+    assert percents == sorted(percents)
+
+    serial_df = run_linear_model_fits(
+        callbacks, value_query_vector, features_df, True, features_per_batch=5,
+    )
+    pipelined_df = run_linear_model_fits(
+        callbacks,
+        value_query_vector,
+        features_df,
+        True,
+        features_per_batch=5,
+        max_workers=3,
+    )
+    pd.testing.assert_frame_equal(serial_df, pipelined_df)
+
+
+@pytest.mark.skip(
+    "Only useful for benchmarking custom_analysis_compute_threads on a given machine"
+)
+def test_pipelined_batches_performance(tmpdir):
+    # a matrix roughly the size of a genome-wide CRISPR screen, read from an HDF5 file in batches of
+    # ~10MB (the same as the custom analysis task does) while the batches are computed
+    sample_count = 1100
+    feature_count = 18000
+    rng = np.random.default_rng(0)
+
+    path = str(tmpdir.join("data.hdf5"))
+    with h5py.File(path, "w") as f:
+        f["data"] = rng.normal(size=(sample_count, feature_count))
+        f["dim_0"] = [f"sample_{i}".encode("utf-8") for i in range(sample_count)]
+        f["dim_1"] = [f"feature_{i}".encode("utf-8") for i in range(feature_count)]
+
+    features_df = FeaturesExtDataFrame(
+        pd.DataFrame(
+            {
+                "given_id": [f"feature_{i}" for i in range(feature_count)],
+                "label": [f"feature_{i} label" for i in range(feature_count)],
+                "slice_id": [f"slice/feature_{i}" for i in range(feature_count)],
+            }
+        )
+    )
+    value_query_vector = [1] * 60 + [0] * (sample_count - 60)
+    sample_indexes = list(range(sample_count))
+    features_per_batch = 10 * 1024 ** 2 // (sample_count * 8)
+
+    class HDF5Callbacks(MockCustomAnalysisCallbacks):
+        def get_dataset_df(self, feature_matrix_indices: List[int]) -> np.ndarray:
+            return read_hdf5_values(path, list(feature_matrix_indices), sample_indexes)
+
+    callbacks = HDF5Callbacks(None)
+
+    analyses = {
+        "pearson": lambda max_workers: run_pearson_correlations(
+            callbacks,
+            value_query_vector,
+            features_df,
+            features_per_batch=features_per_batch,
+            max_workers=max_workers,
+        ),
+        "linear model": lambda max_workers: run_linear_model_fits(
+            callbacks,
+            value_query_vector,
+            features_df,
+            True,
+            features_per_batch=features_per_batch,
+            max_workers=max_workers,
+        ),
+    }
+
+    for name, run in analyses.items():
+        elapsed_by_max_workers = {}
+        for max_workers in [1, 2, 4]:
+            run(max_workers)  # warm up the page cache
+            start = time.perf_counter()
+            run(max_workers)
+            elapsed_by_max_workers[max_workers] = time.perf_counter() - start
+        print(
+            f"{name}: "
+            + ", ".join(
+                f"{max_workers} threads: {elapsed:.3} sec"
+                for max_workers, elapsed in elapsed_by_max_workers.items()
+            )
+        )
@@ -13,6 +13,7 @@ from breadbox.models.dataset import (
     DatasetSample,
     TabularColumn,
     Dataset,
+    MatrixDataset,
 )
 from breadbox.schemas.dataset import (
     MatrixDatasetParams,
@@ -22,6 +23,12 @@ from breadbox.schemas.dataset import (
 )
 from breadbox.schemas.custom_http_exception import FileValidationError
 from breadbox.compute.dataset_uploads_tasks import dataset_upload
+from breadbox.io.filestore_crud import get_file_location
+from breadbox.io.hdf5_utils import (
+    CHUNKED_LAYOUT_VERSION,
+    get_hdf5_file_layout_version,
+    read_hdf5_file,
+)
 
 from tests import factories
 
@@ -124,6 +131,49 @@ def test_matrix_dataset_uploads(
     assert len(samples) == 2  # Number of samples should be 2
 
 
+def test_matrix_dataset_upload_storage_layout(
+    client: TestClient, minimal_db: SessionWithUser, private_group: Dict, settings
+):
+    file = factories.continuous_matrix_csv_file()
+    response = client.post(
+        "/uploads/file", files={"file": ("filename", file.read(), "text/csv")},
+    )
+    assert response.status_code == 200
+
+    matrix_params = MatrixDatasetParams(
+        format="matrix",
+        name="a dataset",
+        units="a unit",
+        feature_type="generic",
+        sample_type="depmap_model",
+        data_type="User upload",
+        file_ids=[response.json()["file_id"]],
+        dataset_md5="820882fc8dc0df48728c74db24c64fa1",
+        is_transient=False,
+        group_id=private_group["id"],
+        value_type=ValueType.continuous,
+        allowed_values=None,
+        dataset_metadata=None,
+        row_chunked_copy=True,
+        store_as_float32=True,
+        **_default_params
+    )
+    result = dataset_upload(minimal_db, matrix_params, settings.admin_users[0])
+
+    dataset = (
+        minimal_db.query(MatrixDataset)
+        .filter(MatrixDataset.id == result.datasetId)
+        .one_or_none()
+    )
+    assert dataset is not None
+    assert dataset.storage_layout_version == CHUNKED_LAYOUT_VERSION
+
+    path = get_file_location(dataset, settings.filestore_location)
+    assert get_hdf5_file_layout_version(path) == CHUNKED_LAYOUT_VERSION
+    df = read_hdf5_file(path, sample_indexes=[1])
+    assert df.to_dict("records") == [{"A": 3.0, "B": 4.0, "C": 5.0}]
+
+
 def test_tabular_uploads(
     client: TestClient, minimal_db: SessionWithUser, private_group: Dict, settings
 ):
@@ -1,9 +1,12 @@
 import uuid
 from contextlib import contextmanager
 import copy
+import importlib.util
 import os
 
 import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import Session, sessionmaker
@@ -173,6 +176,18 @@ def private_group(client: TestClient, settings: Settings):
     return private_group
 
 
+def _run_migration(db: SessionWithUser, filename: str):
+    "Applies one alembic migration's upgrade() to the test database"
+    path = os.path.join(
+        os.path.dirname(__file__), "..", "alembic", "versions", filename
+    )
+    spec = importlib.util.spec_from_file_location(filename[: -len(".py")], path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with Operations.context(MigrationContext.configure(db.connection())):
+        migration.upgrade()
+
+
 @pytest.fixture(scope="function")
 def minimal_db(db: SessionWithUser, settings: Settings, public_group, transient_group):
     "A database which has the public group and one feature type and one sample type defined"
@@ -198,6 +213,10 @@ def minimal_db(db: SessionWithUser, settings: Settings, public_group, transient_
     """
         )
     )
+    db.execute(text("DROP TABLE IF EXISTS dimension_search_index_fts;"))
+    # the trigram index over dimension_search_index and the triggers keeping it in sync are created
+    # by the migration itself, so the tests run against the same DDL as a real database
+    _run_migration(db, "4c8e1f2d7a3b_add_dimension_search_index_fts.py")
 
     add_data_type(db, "User upload")
     add_dimension_type(
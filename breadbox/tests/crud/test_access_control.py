@@ -1,7 +1,11 @@
 from breadbox.db.session import SessionWithUser
+from breadbox.crud import access_control
 from breadbox.crud.access_control import (
     PUBLIC_GROUP_ID,
     TRANSIENT_GROUP_ID,
+    AccessControlCache,
+    get_access_control_cache,
+    resolve_group_access,
     user_has_access_to_group,
     user_can_view_group_contents,
 )
@@ -112,3 +116,107 @@ def test_user_can_view_group_contents(minimal_db: SessionWithUser, settings: Set
     assert user_can_view_group_contents(public_group, admin_user)
     assert user_can_view_group_contents(public_group, private_group_user)
     assert user_can_view_group_contents(public_group, unknown_user)
+
+
+def test_resolve_group_access(minimal_db: SessionWithUser, settings: Settings):
+    """
+    Test that the groups resolved with a single query are the same as the ones
+    user_has_access_to_group allows
+    """
+    admin_user = settings.admin_users[0]
+    users = [
+        admin_user,
+        "writer@imawriter.org",
+        "other-person@foobar.com",
+        "other-person@FOOBAR.com",
+        "NoAccessHere",
+        "similar_email@foobar_com",
+    ]
+
+    private_group = add_group(
+        minimal_db, admin_user, group_in=GroupIn(name="private_group")
+    )
+    add_group_entry(
+        minimal_db,
+        admin_user,
+        private_group,
+        GroupEntryIn(
+            email="writer@imawriter.org",
+            access_type=AccessType.write,
+            exact_match=True,
+        ),
+    )
+    add_group_entry(
+        minimal_db,
+        admin_user,
+        private_group,
+        GroupEntryIn(
+            email="@foobar.com", access_type=AccessType.read, exact_match=False
+        ),
+    )
+    # an exact match entry must not match as a suffix
+    add_group_entry(
+        minimal_db,
+        admin_user,
+        add_group(minimal_db, admin_user, group_in=GroupIn(name="exact_group")),
+        GroupEntryIn(email="Here", access_type=AccessType.owner, exact_match=True),
+    )
+
+    groups = [
+        get_group(minimal_db, admin_user, group_id)
+        for group_id in access_control.get_read_access_group_ids(
+            minimal_db, admin_user, use_cache=False
+        )
+    ]
+    assert len(groups) == 4
+
+    for user in users:
+        access = resolve_group_access(minimal_db, user)
+        assert access.read_group_ids == {
+            group.id for group in groups if user_has_access_to_group(group, user)
+        }, user
+        assert access.write_group_ids == {
+            group.id
+            for group in groups
+            if user_has_access_to_group(group, user, write_access=True)
+        }, user
+
+
+def test_access_control_cache(
+    minimal_db: SessionWithUser, settings: Settings, monkeypatch
+):
+    """Test that cached groups are reused, and that changing group entries clears them"""
+    monkeypatch.setattr(
+        access_control, "_access_control_cache", AccessControlCache(ttl_seconds=60)
+    )
+    cache = get_access_control_cache()
+    admin_user = settings.admin_users[0]
+    user = "someone@example.com"
+
+    assert cache.get(minimal_db, user).read_group_ids == {
+        PUBLIC_GROUP_ID,
+        TRANSIENT_GROUP_ID,
+    }
+    cache.get(minimal_db, user)
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+    private_group = add_group(
+        minimal_db, admin_user, group_in=GroupIn(name="private_group")
+    )
+    group_entry = add_group_entry(
+        minimal_db,
+        admin_user,
+        private_group,
+        GroupEntryIn(email=user, access_type=AccessType.write, exact_match=True),
+    )
+    assert cache.get(minimal_db, user).write_group_ids == {private_group.id}
+
+    # removed with a bulk delete, which doesn't go through the session's flush
+    delete_group_entry(minimal_db, admin_user, group_entry_id=group_entry.id)
+    assert cache.get(minimal_db, user).write_group_ids == set()
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["hit_rate"] == 0.25
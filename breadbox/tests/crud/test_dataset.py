@@ -358,3 +358,79 @@ def test_get_unique_dimension_ids_from_datasets(minimal_db, settings):
     )
 
     assert dimensions_set == set(["F1", "F2", "F3", "F4"])
+
+
+def test_tabular_columnar_file_matches_cells(minimal_db, settings):
+    """
+    The columnar copy of a tabular dataset should return the same data as the TabularCell rows,
+    both for whole-table reads and for projected/filtered reads.
+    """
+    import os
+    from breadbox.crud.dataset import (
+        get_subset_of_tabular_data_as_df,
+        _get_subset_of_tabular_data_from_cells,
+        write_tabular_dataset_file_from_cells,
+    )
+    from breadbox.io.filestore_crud import (
+        TABULAR_DATA_FILE,
+        get_file_location,
+        has_tabular_dataset_file,
+    )
+
+    tabular_dataset = factories.tabular_dataset(
+        minimal_db,
+        settings,
+        data_df=pd.DataFrame(
+            {
+                "depmap_id": ["ACH-2", "ACH-1", "ACH-3"],
+                "attr": ["b", None, "c"],
+                "num": [2.5, 1.0, np.nan],
+            }
+        ),
+        columns_metadata={
+            "depmap_id": ColumnMetadata(col_type=AnnotationType.text),
+            "attr": ColumnMetadata(col_type=AnnotationType.categorical),
+            "num": ColumnMetadata(units="x", col_type=AnnotationType.continuous),
+        },
+    )
+    assert has_tabular_dataset_file(tabular_dataset.id, settings.filestore_location)
+
+    for column_names, index_given_ids in [
+        (None, None),
+        (["num"], None),
+        (None, ["ACH-3", "ACH-1", "ACH-missing"]),
+        (["attr", "missing-column"], ["ACH-2"]),
+    ]:
+        from_file = get_subset_of_tabular_data_as_df(
+            minimal_db, tabular_dataset, column_names, index_given_ids
+        )
+        from_cells = _get_subset_of_tabular_data_from_cells(
+            minimal_db, tabular_dataset, column_names, index_given_ids
+        )
+        pd.testing.assert_frame_equal(from_file, from_cells)
+
+    # nothing matching should be empty, just like the pivot of no cells
+    assert get_subset_of_tabular_data_as_df(
+        minimal_db, tabular_dataset, None, ["ACH-missing"]
+    ).empty
+
+    # datasets without a columnar file fall back to the cells, and the migration rebuilds the file
+    path = get_file_location(
+        tabular_dataset.id, settings.filestore_location, TABULAR_DATA_FILE
+    )
+    os.unlink(path)
+    expected = _get_subset_of_tabular_data_from_cells(
+        minimal_db, tabular_dataset, None, None
+    )
+    pd.testing.assert_frame_equal(
+        get_subset_of_tabular_data_as_df(minimal_db, tabular_dataset, None, None),
+        expected,
+    )
+    write_tabular_dataset_file_from_cells(
+        minimal_db, tabular_dataset, settings.filestore_location
+    )
+    assert os.path.exists(path)
+    pd.testing.assert_frame_equal(
+        get_subset_of_tabular_data_as_df(minimal_db, tabular_dataset, None, None),
+        expected,
+    )
@@ -0,0 +1,99 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from breadbox.config import Settings
+from breadbox.db.session import SessionLocalWithUser, SessionWithUser, get_engine
+from breadbox.models.dataset import MatrixDataset
+
+from tests import factories
+
+
+def test_sessions_share_one_engine(minimal_db: SessionWithUser, settings: Settings):
+    factories.matrix_dataset(minimal_db, settings)
+    minimal_db.commit()
+
+    admin_user = settings.admin_users[0]
+    first = SessionLocalWithUser(admin_user)
+    second = SessionLocalWithUser("some-other-user")
+    try:
+        assert first.get_bind() is second.get_bind()
+        assert first.get_bind() is get_engine()
+
+        # each session still filters by its own user's groups
+        assert first.user == admin_user
+        assert second.user == "some-other-user"
+        assert len(first.query(MatrixDataset).all()) == 1
+
+        # and the anonymous session is drawn from the same pool
+        anonymous = first.create_session_for_anonymous_user()
+        assert anonymous.get_bind() is get_engine()
+        anonymous.close()
+    finally:
+        first.close()
+        second.close()
+
+
+def _per_request_engine_session(settings: Settings, user: str) -> SessionWithUser:
+    # what SessionLocalWithUser used to do: a new engine (and pool) per request
+    engine = create_engine(
+        settings.sqlalchemy_database_url,
+        connect_args={"check_same_thread": False},
+        future=True,
+    )
+    session_maker = sessionmaker(
+        autoflush=False, bind=engine, class_=SessionWithUser, future=True
+    )
+    session = session_maker()
+    session.set_user(user, session_maker)
+    return session
+
+
+def _simulated_request(make_session, user):
+    start = time.perf_counter()
+    db = make_session(user)
+    try:
+        db.query(MatrixDataset).all()
+    finally:
+        db.close()
+    return time.perf_counter() - start
+
+
+def _benchmark_concurrent_requests(label, make_session, user, threads, requests):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        timings = list(
+            executor.map(
+                lambda _: _simulated_request(make_session, user), range(requests)
+            )
+        )
+    print(
+        f"{label}: mean {np.mean(timings) * 1000:.3} ms, p95 {np.percentile(timings, 95) * 1000:.3} ms ({requests} requests over {threads} threads)"
+    )
+
+
+@pytest.mark.skip("Only useful for measuring request latency")
+def test_engine_pool_latency(minimal_db: SessionWithUser, settings: Settings):
+    for _ in range(50):
+        factories.matrix_dataset(minimal_db, settings)
+    minimal_db.commit()
+
+    user = settings.admin_users[0]
+    for threads in [1, 8, 32]:
+        _benchmark_concurrent_requests(
+            f"engine per request, {threads} threads",
+            lambda user: _per_request_engine_session(settings, user),
+            user,
+            threads,
+            500,
+        )
+        _benchmark_concurrent_requests(
+            f"pooled engine, {threads} threads",
+            SessionLocalWithUser,
+            user,
+            threads,
+            500,
+        )
@@ -1,5 +1,14 @@
+import random
+
+import numpy as np
 import pandas as pd
-from breadbox.depmap_compute_embed.context import ContextEvaluator
+import pytest
+
+from breadbox.depmap_compute_embed.context import (
+    ContextEvaluator,
+    _MaskEvaluation,
+    _Unvectorizable,
+)
 from breadbox.depmap_compute_embed.slice import SliceQuery
 
 # Our ContextEvaluator makes heavy use of an extension to the 3rd party library: json_logic
@@ -928,3 +937,181 @@ def test_in_context_with_scalar_var():
     result = evaluator.evaluate()
 
     assert result.ids == ["SCREEN_BREAST"]
+
+
+# Differential tests: evaluate() compiles expressions to masks, which must
+# select exactly the ids that evaluating JsonLogic one id at a time does.
+
+_DIFFERENTIAL_IDS = [f"ID_{i}" for i in range(60)]
+
+_DIFFERENTIAL_VAR_VALUES = {
+    # values of mixed types, since "==" compares them differently to strings
+    "cat": ["a", "b", "c", None, [], 1, True, "1", 1.0, "True"],
+    "num": [1.5, -2, 0, 0.0, -0.0, 3, 1e20, np.nan, None, 2.5, False, True],
+    # only numbers, which are compared as floats
+    "score": [1.5, -2, 0, 0.0, -0.0, 3, 1e20, np.nan, None, 2.5, 1.0],
+    # integers which can't be compared exactly as floats
+    "big": [2 ** 60, 2 ** 60 + 1, 1.0, None],
+    "lst": [["a"], ["a", "b"], ["ID_1", "ID_7"], [], None, ["c"]],
+    "flag": [True, False, None],
+}
+
+_DIFFERENTIAL_LITERALS = [
+    "a",
+    "b",
+    "1",
+    "abc",
+    "0.0",
+    "-0.0",
+    1,
+    1.0,
+    0,
+    -0.0,
+    2.5,
+    1e20,
+    2 ** 60 + 1,
+    True,
+    False,
+    None,
+    np.nan,
+    ["a", "b"],
+    ["ID_1", "ID_3", "ID_7", "a", 1],
+    [],
+]
+
+
+def _make_differential_slice_data(rng: random.Random) -> dict:
+    slice_data = {}
+    for var_name, choices in _DIFFERENTIAL_VAR_VALUES.items():
+        # some ids are missing from each slice
+        ids = [x for x in _DIFFERENTIAL_IDS if rng.random() < 0.85]
+        slice_data[var_name] = pd.Series(
+            {x: rng.choice(choices) for x in ids}, dtype=object
+        )
+    return slice_data
+
+
+def _random_operand(rng: random.Random):
+    if rng.random() < 0.6:
+        return {"var": rng.choice(list(_DIFFERENTIAL_VAR_VALUES) + ["given_id"])}
+    return rng.choice(_DIFFERENTIAL_LITERALS)
+
+
+def _random_expr(rng: random.Random, depth: int = 0):
+    if depth > 0 and rng.random() < 0.05:
+        return _random_operand(rng)
+    if depth < 3 and rng.random() < 0.4:
+        op = rng.choice(["and", "or", "!", "complement", "if"])
+        if op in ("!", "complement"):
+            return {op: _random_expr(rng, depth + 1)}
+        if op == "if":
+            # not vectorized, so evaluated one id at a time
+            return {op: [_random_expr(rng, depth + 1), True, False]}
+        return {op: [_random_expr(rng, depth + 1) for _ in range(rng.randint(0, 3))]}
+
+    op = rng.choice(
+        ["==", "!=", "<", ">", "<=", ">=", "in", "!in", "in_context"]
+        + ["!in_context", "has_any", "!has_any", "is_null", "not_null", "!!", "cat"]
+    )
+    if op in ("is_null", "not_null", "!!"):
+        return {op: [_random_operand(rng)]}
+    if op == "in_context" and rng.random() < 0.3:
+        return {op: [_random_operand(rng), {"context": "inner"}]}
+    return {op: [_random_operand(rng), _random_operand(rng)]}
+
+
+def _evaluate_or_error(f):
+    try:
+        return f()
+    except ValueError as e:
+        return f"error: {e}"
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_vectorized_evaluation_matches_per_id_evaluation(seed):
+    rng = random.Random(seed)
+    slice_data = _make_differential_slice_data(rng)
+
+    def get_slice_data(q):
+        return slice_data[q.identifier]
+
+    def get_labels(dim_type):
+        return {x: x.lower() for x in _DIFFERENTIAL_IDS}
+
+    vectorized_count = 0
+    for _ in range(200):
+        context = {
+            "dimension_type": "dummy",
+            "expr": _random_expr(rng),
+            "vars": {
+                var_name: {
+                    "dataset_id": "dummy",
+                    "identifier": var_name,
+                    "identifier_type": "column",
+                }
+                for var_name in _DIFFERENTIAL_VAR_VALUES
+            },
+            "contexts": {
+                "inner": {
+                    "dimension_type": "dummy",
+                    "expr": _random_expr(rng),
+                    "vars": {
+                        "cat": {
+                            "dataset_id": "dummy",
+                            "identifier": "cat",
+                            "identifier_type": "column",
+                        },
+                        "num": {
+                            "dataset_id": "dummy",
+                            "identifier": "num",
+                            "identifier_type": "column",
+                        },
+                    },
+                }
+            },
+        }
+        try:
+            evaluator = ContextEvaluator(context, get_slice_data, get_labels)
+        except (LookupError, ValueError):
+            # ie: the inner context references a var it doesn't define
+            continue
+
+        expected = _evaluate_or_error(
+            lambda: [x for x in _DIFFERENTIAL_IDS if evaluator._is_match(x)]
+        )
+        actual = _evaluate_or_error(lambda: evaluator.evaluate().ids)
+        assert actual == expected, context["expr"]
+
+        try:
+            _MaskEvaluation(_DIFFERENTIAL_IDS, evaluator.slice_data).evaluate(
+                evaluator.expr
+            )
+            vectorized_count += 1
+        except _Unvectorizable:
+            pass
+
+    # many of the random expressions raise errors (ie: comparing strings to
+    # numbers) or use unsupported operators, but plenty should be vectorized
+    assert vectorized_count > 50
+
+
+def test_unsupported_expressions_are_not_vectorized():
+    slice_data = {"x": {"A": 1.5, "B": None}, "y": {"A": 2.0, "B": 1.0}}
+
+    def is_vectorized(expr):
+        try:
+            _MaskEvaluation(["A", "B", "C"], slice_data).evaluate(expr)
+        except _Unvectorizable:
+            return False
+        return True
+
+    assert is_vectorized({"and": [{">": [{"var": "x"}, 1]}, {"is_null": {"var": "y"}}]})
+    assert is_vectorized({"in_context": [{"var": "given_id"}, ["A", "C"]]})
+    # operators which aren't vectorized
+    assert not is_vectorized({"if": [{"var": "x"}, True, False]})
+    # comparing two vars
+    assert not is_vectorized({"<": [{"var": "x"}, {"var": "y"}]})
+    # "and" would return one of the var's values rather than a bool
+    assert not is_vectorized({"and": [{"var": "x"}, True]})
+    # errors are raised when evaluating one id at a time, with the offending id
+    assert not is_vectorized({"<": [{"var": "x"}, "a"]})
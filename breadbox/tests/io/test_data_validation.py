@@ -141,6 +141,35 @@ def test_read_and_validate_matrix_df_helper_incorrect_typing(tmpdir):
         )
 
 
+def test_read_and_validate_matrix_csv_in_blocks(tmpdir, monkeypatch):
+    from breadbox.io import parquet_utils
+
+    # parse in tiny blocks, and write a row group per block, to make sure the blocks are reassembled in order
+    monkeypatch.setattr(parquet_utils, "CSV_BLOCK_SIZE", 64)
+    monkeypatch.setattr(parquet_utils, "MATRIX_ROW_GROUP_BYTES", 1)
+
+    expected = pd.DataFrame(
+        {"C1": [float(i) for i in range(50)], "C2": [None] * 49 + [1.5]},
+        index=[f"ACH-{i}" for i in range(50)],
+    )
+    df = read_and_validate_matrix_df_helper(
+        _to_csv(tmpdir, expected), ValueType.continuous, None, "csv",
+    )
+    assert df.index.to_list() == expected.index.to_list()
+    pd.testing.assert_frame_equal(
+        df, expected, check_index_type=False, check_names=False
+    )
+
+
+def test_read_and_validate_matrix_csv_duplicate_columns(tmpdir):
+    filename = str(tmpdir.join("dup.csv"))
+    with open(filename, "wt") as fd:
+        fd.write(",C1,C1\nA,1,2\n")
+
+    with pytest.raises(FileValidationError):
+        read_and_validate_matrix_df_helper(filename, ValueType.continuous, None, "csv")
+
+
 def test_validate_tabular_df_schema(tmpdir):
     """Checks that _validate_tabular_df_schema coerces column values to the dtype implied
     by each column's declared AnnotationType (text, continuous, categorical, list_strings)
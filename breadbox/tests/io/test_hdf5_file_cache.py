@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from breadbox.io.data_validation import PandasDataFrameWrapper
+from breadbox.io.hdf5_file_cache import HDF5FileCache
+from breadbox.io.hdf5_utils import write_hdf5_file
+
+
+def _write(path, df):
+    write_hdf5_file(path, PandasDataFrameWrapper(df), "float", lambda x: x)
+
+
+def _make_df(rows, cols, value=None):
+    data = (
+        np.random.uniform(size=(rows, cols))
+        if value is None
+        else np.full((rows, cols), value)
+    )
+    return pd.DataFrame(
+        data,
+        index=[f"Row-{i}" for i in range(rows)],
+        columns=[f"Col-{i}" for i in range(cols)],
+    )
+
+
+def test_file_is_opened_once_and_labels_decoded_once(tmpdir):
+    path = str(tmpdir.join("data.hdf5"))
+    _write(path, _make_df(10, 5))
+
+    cache = HDF5FileCache()
+    with cache.open(path) as first:
+        labels = first.get_labels("features")
+        assert list(labels) == [f"Col-{i}" for i in range(5)]
+
+    with cache.open(path) as second:
+        assert second is first
+        assert second.get_labels("features") is labels
+
+
+def test_rewritten_file_is_reopened(tmpdir):
+    path = str(tmpdir.join("data.hdf5"))
+    _write(path, _make_df(10, 5, value=1.0))
+
+    cache = HDF5FileCache()
+    with cache.open(path) as first:
+        assert first.get_dataset("data")[0, 0] == 1.0
+
+    # replace the file the way a rewrite would (write elsewhere and rename over the original)
+    tmp_path = str(tmpdir.join("tmp.hdf5"))
+    _write(tmp_path, _make_df(10, 7, value=2.0))
+    os.replace(tmp_path, path)
+    with cache.open(path) as second:
+        assert second is not first
+        assert second.get_dataset("data")[0, 0] == 2.0
+        assert len(second.get_labels("features")) == 7
+
+
+def test_lru_eviction_respects_byte_budget_and_leases(tmpdir):
+    paths = []
+    for i in range(3):
+        path = str(tmpdir.join(f"data{i}.hdf5"))
+        _write(path, _make_df(10, 5))
+        paths.append(path)
+
+    # budget is only large enough for a single file's chunk cache
+    cache = HDF5FileCache(max_bytes=1500, chunk_cache_bytes=1000)
+
+    with cache.open(paths[0]) as first:
+        # opening a second file evicts the first, but it stays usable until released
+        with cache.open(paths[1]):
+            pass
+        assert first.evicted
+        assert first.get_dataset("data").shape == (10, 5)
+    assert not first.file
+
+    with cache.open(paths[2]):
+        pass
+    assert list(cache._files) == [paths[2]]
+
+
+def test_read_hdf5_file_uses_cached_labels(tmpdir):
+    from breadbox.io.hdf5_utils import read_hdf5_file
+
+    path = str(tmpdir.join("data.hdf5"))
+    df = _make_df(20, 10)
+    _write(path, df)
+
+    assert_frame_equal(read_hdf5_file(path, feature_indexes=[1, 3]), df.iloc[:, [1, 3]])
+    assert_frame_equal(read_hdf5_file(path, sample_indexes=[0, 5]), df.iloc[[0, 5], :])
+    assert_frame_equal(
+        read_hdf5_file(path, feature_indexes=[2], sample_indexes=[4, 8]),
+        df.iloc[[4, 8], [2]],
+    )
+    os.unlink(path)
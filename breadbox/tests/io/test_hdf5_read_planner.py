@@ -0,0 +1,192 @@
+import random
+
+import h5py
+import numpy as np
+import pytest
+
+from breadbox.io.hdf5_read_planner import coalesce_runs, plan_read, read_subset
+from breadbox.io.hdf5_utils import HDF5StorageOptions, write_hdf5_file
+from breadbox.schemas.dataframe_wrapper import PandasDataFrameWrapper
+
+from tests.io.test_hdf5_storage_layout import LAYOUTS, benchmark, create_sample_data
+
+
+def test_coalesce_runs():
+    assert coalesce_runs(np.array([], dtype=int)) == []
+    assert coalesce_runs(np.array([3])) == [(3, 4)]
+    assert coalesce_runs(np.array([1, 2, 3, 7, 8, 20])) == [(1, 4), (7, 9), (20, 21)]
+    # gaps of up to max_gap unselected indexes are absorbed into one run
+    assert coalesce_runs(np.array([1, 2, 3, 7, 8, 20]), max_gap=3) == [
+        (1, 9),
+        (20, 21),
+    ]
+
+
+def test_plan_follows_chunk_layout(tmpdir):
+    df = create_sample_data(40, 3000)
+    path = str(tmpdir.join("dual"))
+    write_hdf5_file(
+        path,
+        PandasDataFrameWrapper(df),
+        "float",
+        lambda x: x,
+        storage=HDF5StorageOptions(row_chunked_copy=True),
+    )
+    rows = np.array([1, 2, 30])
+    cols = np.array([5, 6, 7, 2000])
+    with h5py.File(path, "r") as f:
+        by_col = plan_read(f["data"], rows, cols)
+        # chunks of "data" are thin along columns, so reads are made one run of columns at a time
+        assert by_col.outer_axis == 1
+        assert by_col.batches == [[(5, 8), (2000, 2001)]]
+        assert (by_col.inner_start, by_col.inner_stop) == (1, 31)
+
+        by_row = plan_read(f["data_by_row"], rows, cols)
+        assert by_row.outer_axis == 0
+
+
+def _make_selection(kind: str, length: int, size: int):
+    if kind == "none":
+        return None
+    if kind == "scattered":
+        return sorted(random.sample(range(length), size))
+    if kind == "clustered":
+        start = random.randrange(0, length - size)
+        # a few contiguous runs close together
+        return sorted(
+            set(range(start, start + size // 2))
+            | set(range(length - size // 2, length))
+        )
+    assert kind == "full"
+    return list(range(length))
+
+
+SELECTION_KINDS = ["none", "scattered", "clustered", "full"]
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_read_subset_matches_numpy(tmpdir, layout):
+    random.seed(0)
+    df = create_sample_data(60, 500)
+    df.iloc[2, 3] = np.nan
+    path = str(tmpdir.join(layout))
+    write_hdf5_file(
+        path, PandasDataFrameWrapper(df), "float", lambda x: x, storage=LAYOUTS[layout],
+    )
+    expected = df.values
+    if LAYOUTS[layout] is not None and LAYOUTS[layout].float32:
+        expected = expected.astype(np.float32).astype(np.float64)
+
+    with h5py.File(path, "r") as f:
+        for f_data in [f[name] for name in ["data", "data_by_row"] if name in f]:
+            for row_kind in SELECTION_KINDS:
+                for col_kind in SELECTION_KINDS:
+                    rows = _make_selection(row_kind, 60, 10)
+                    cols = _make_selection(col_kind, 500, 40)
+                    result = read_subset(f_data, rows, cols)
+                    assert result.dtype == np.float64
+                    np.testing.assert_array_equal(
+                        result,
+                        expected[np.arange(60) if rows is None else rows, :][
+                            :, np.arange(500) if cols is None else cols
+                        ],
+                    )
+
+
+def test_read_subset_strings_and_empty(tmpdir):
+    import pandas as pd
+
+    df = pd.DataFrame(
+        {"A": ['["x"]', None, "[]"], "B": [None, '["y", "z"]', None]},
+        index=["r1", "r2", "r3"],
+    )
+    path = str(tmpdir.join("strings"))
+    write_hdf5_file(
+        path,
+        PandasDataFrameWrapper(df),
+        "str",
+        lambda x: x,
+        storage=HDF5StorageOptions(),
+    )
+    with h5py.File(path, "r") as f:
+        result = read_subset(f["data"], [1, 2], [1])
+        assert result.tolist() == [[b'["y", "z"]'], [b""]]
+        assert read_subset(f["data"], [], [0, 1]).shape == (0, 2)
+
+
+def _naive_read(f_data, rows, cols):
+    # what read_hdf5_file used to do: subset one axis and then the other
+    if rows is not None and cols is not None:
+        if len(cols) < len(rows):
+            return f_data[:, cols][rows, :]
+        return f_data[rows, :][:, cols]
+    if cols is not None:
+        return f_data[:, cols]
+    if rows is not None:
+        return f_data[rows]
+    return f_data[()]
+
+
+def perf_test(dest_dir, rows, columns):
+    import os
+
+    os.makedirs(dest_dir, exist_ok=True)
+    df = create_sample_data(rows, columns)
+    selections = {
+        "1 scattered feature": lambda: (None, _make_selection("scattered", columns, 1)),
+        "100 scattered features": lambda: (
+            None,
+            _make_selection("scattered", columns, 100),
+        ),
+        "100 clustered features": lambda: (
+            None,
+            _make_selection("clustered", columns, 100),
+        ),
+        "10 scattered samples": lambda: (_make_selection("scattered", rows, 10), None),
+        "100 scattered features x 100 scattered samples": lambda: (
+            _make_selection("scattered", rows, 100),
+            _make_selection("scattered", columns, 100),
+        ),
+        "1000 clustered features x 500 clustered samples": lambda: (
+            _make_selection("clustered", rows, 500),
+            _make_selection("clustered", columns, 1000),
+        ),
+        "all samples x all features": lambda: (
+            _make_selection("full", rows, rows),
+            _make_selection("full", columns, columns),
+        ),
+    }
+
+    for layout, storage in LAYOUTS.items():
+        path = f"{dest_dir}/{layout}"
+        write_hdf5_file(
+            path,
+            PandasDataFrameWrapper(df),
+            hdf5_dtype="float",
+            map_values=lambda df: df,
+            storage=storage,
+        )
+        with h5py.File(path, "r") as f:
+            f_data = f["data"]
+            for label, make_selection in selections.items():
+                benchmark(
+                    f"layout={layout}: {label}: naive",
+                    lambda: _naive_read(f_data, *make_selection()),
+                )
+                benchmark(
+                    f"layout={layout}: {label}: planned",
+                    lambda: read_subset(f_data, *make_selection()),
+                )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("cols", type=int)
+
+    args = parser.parse_args()
+
+    perf_test(args.dir, args.rows, args.cols)
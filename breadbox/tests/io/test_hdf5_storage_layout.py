@@ -0,0 +1,240 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from breadbox.schemas.dataframe_wrapper import PandasDataFrameWrapper
+from breadbox.io.hdf5_utils import (
+    write_hdf5_file,
+    read_hdf5_file,
+    rewrite_hdf5_file_layout,
+    get_hdf5_file_layout_version,
+    HDF5StorageOptions,
+    CHUNKED_LAYOUT_VERSION,
+    CONTIGUOUS_LAYOUT_VERSION,
+    ROW_CHUNKED_DATASET,
+)
+import pytest
+import h5py
+from pandas.testing import assert_frame_equal
+
+TEST_COLUMN_COUNT = 20
+
+# None is the original contiguous layout
+LAYOUTS = {
+    "contiguous": None,
+    "chunked": HDF5StorageOptions(),
+    "chunked_lzf_with_row_copy": HDF5StorageOptions(
+        compression="lzf", row_chunked_copy=True
+    ),
+    "chunked_uncompressed_float32": HDF5StorageOptions(compression=None, float32=True),
+}
+
+READ_PARAMS = [
+    dict(feature_indexes=None, sample_indexes=None),
+    dict(feature_indexes=[1, 2, 5, 6], sample_indexes=None),
+    dict(feature_indexes=None, sample_indexes=[1, 2, 5, 6]),
+    dict(feature_indexes=[2, 4], sample_indexes=[1, 2, 5, 6]),
+    dict(feature_indexes=[1, 2, 5, 6], sample_indexes=[2, 4]),
+]
+
+
+def create_sample_data(row_length: int, col_length: int):
+    cols = [f"Col-{i}" for i in range(col_length)]
+    rows = [f"Row-{i}" for i in range(row_length)]
+    data = np.random.uniform(0.0, 10.0, size=(row_length, col_length))
+    test_df = pd.DataFrame(data, columns=pd.Index(cols), index=pd.Index(rows))
+    return test_df
+
+
+@pytest.mark.parametrize("layout", list(LAYOUTS))
+def test_hdf5_layout_correctness(tmpdir, layout):
+    # every layout should yield the same results as the contiguous layout
+    expected_df = create_sample_data(100, 200)
+    expected_df.iloc[3, 7] = np.nan
+    ref_path = str(tmpdir.join("ref"))
+    write_hdf5_file(ref_path, PandasDataFrameWrapper(expected_df), "float", lambda x: x)
+
+    path = str(tmpdir.join(layout))
+    storage = LAYOUTS[layout]
+    write_hdf5_file(
+        path, PandasDataFrameWrapper(expected_df), "float", lambda x: x, storage=storage
+    )
+
+    rtol = 1e-6 if storage is not None and storage.float32 else 0
+    for params in READ_PARAMS:
+        expected = read_hdf5_file(ref_path, keep_nans=True, **params)
+        df = read_hdf5_file(path, keep_nans=True, **params)
+        assert df.dtypes.unique().tolist() == [np.float64]
+        assert_frame_equal(df, expected, rtol=rtol, atol=0, check_exact=rtol == 0)
+
+
+def test_chunked_layout_file_structure(tmpdir):
+    df = create_sample_data(50, 5000)
+    path = str(tmpdir.join("dual"))
+    write_hdf5_file(
+        path,
+        PandasDataFrameWrapper(df),
+        "float",
+        lambda x: x,
+        storage=HDF5StorageOptions(row_chunked_copy=True),
+    )
+
+    assert get_hdf5_file_layout_version(path) == CHUNKED_LAYOUT_VERSION
+    with h5py.File(path, "r") as f:
+        by_col = f["data"]
+        by_row = f[ROW_CHUNKED_DATASET]
+        assert by_col.compression == "gzip"
+        # a single feature spans all samples in a chunk, while a single sample spans many features
+        assert by_col.chunks[0] == 50 and by_col.chunks[1] < 5000
+        assert by_row.chunks[0] < 50 and by_row.chunks[1] == 5000
+        assert np.array_equal(by_col[()], by_row[()])
+
+
+def test_chunked_layout_list_strings(tmpdir):
+    df = pd.DataFrame(
+        {"A": ['["x", "y"]', None, "[]"], "B": [None, None, '["z"]']},
+        index=["r1", "r2", "r3"],
+    )
+    path = str(tmpdir.join("strings"))
+    write_hdf5_file(
+        path,
+        PandasDataFrameWrapper(df),
+        "str",
+        lambda x: x,
+        storage=HDF5StorageOptions(row_chunked_copy=True, float32=True),
+    )
+    with h5py.File(path, "r") as f:
+        assert h5py.check_string_dtype(f["data"].dtype) is not None
+        assert f[ROW_CHUNKED_DATASET].asstr()[1, 1] == ""
+        assert f["data"].asstr()[0, 0] == '["x", "y"]'
+
+
+def test_sparse_matrix_only_stores_chunks_with_values(tmpdir):
+    df = pd.DataFrame(
+        np.nan,
+        columns=pd.Index([f"Col-{i}" for i in range(2000)]),
+        index=pd.Index([f"Row-{i}" for i in range(100)]),
+    )
+    df.iloc[5, 3] = 1.0
+    df.iloc[70, 1500] = 2.0
+    path = str(tmpdir.join("sparse"))
+    # sparse matrices are stored in chunks even if no storage options are given
+    write_hdf5_file(path, PandasDataFrameWrapper(df), "float", lambda x: x)
+
+    assert get_hdf5_file_layout_version(path) == CHUNKED_LAYOUT_VERSION
+    with h5py.File(path, "r") as f:
+        assert f["data"].id.get_num_chunks() == 2
+
+    assert_frame_equal(read_hdf5_file(path, keep_nans=True), df, check_names=False)
+    assert read_hdf5_file(path, feature_indexes=[1500], sample_indexes=[70]).iloc[
+        0, 0
+    ] == pytest.approx(2.0)
+
+
+def test_rewrite_hdf5_file_layout(tmpdir):
+    df = create_sample_data(30, 40)
+    path = str(tmpdir.join("data.hdf5"))
+    write_hdf5_file(path, PandasDataFrameWrapper(df), "float", lambda x: x)
+    assert get_hdf5_file_layout_version(path) == CONTIGUOUS_LAYOUT_VERSION
+    before = read_hdf5_file(path, keep_nans=True)
+
+    rewrite_hdf5_file_layout(path, HDF5StorageOptions(row_chunked_copy=True))
+
+    assert get_hdf5_file_layout_version(path) == CHUNKED_LAYOUT_VERSION
+    assert_frame_equal(read_hdf5_file(path, keep_nans=True), before)
+    assert_frame_equal(
+        read_hdf5_file(path, sample_indexes=[3], keep_nans=True), before.iloc[[3], :],
+    )
+    # no temp files left behind
+    assert sorted(x.basename for x in tmpdir.listdir()) == ["data.hdf5"]
+
+
+def test_storage_options_validation():
+    with pytest.raises(ValueError):
+        HDF5StorageOptions(layout_version=CONTIGUOUS_LAYOUT_VERSION, float32=True)
+    with pytest.raises(ValueError):
+        HDF5StorageOptions(layout_version=3)
+
+
+def benchmark(label, callback, min_iterations=3, min_time=1):
+    # first call once to warm up the cache
+    print(f"Starting benchmark of {label}")
+    callback()
+    timings = []
+    iteration = 0
+    total_elapsed = 0
+    while True:
+        start = time.perf_counter()
+        callback()
+        end = time.perf_counter()
+        elapsed = end - start
+        total_elapsed += elapsed
+        timings.append(elapsed)
+        iteration += 1
+        if iteration >= min_iterations and total_elapsed >= min_time:
+            break
+
+    print(
+        f"{label}: mean {np.mean(timings):.4} sec std {np.std(timings):.4} ({iteration} iterations)"
+    )
+
+
+import random
+import os
+import datetime
+
+
+def perf_test(dest_dir, rows, columns):
+    os.makedirs(dest_dir, exist_ok=True)
+
+    expected_df = create_sample_data(rows, columns)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    for layout, storage in LAYOUTS.items():
+        path = f"{dest_dir}/{layout}-{timestamp}"
+        print(f"Creating {path}")
+        start = time.perf_counter()
+        write_hdf5_file(
+            path,
+            PandasDataFrameWrapper(expected_df),
+            hdf5_dtype="float",
+            map_values=lambda df: df,
+            storage=storage,
+        )
+        print(
+            f"layout={layout}: wrote in {time.perf_counter() - start:.4} sec, {os.path.getsize(path) / 1024 / 1024:.4} MB"
+        )
+
+        for sample_size in [1, 5, 100]:
+            benchmark(
+                f"layout={layout}: read {sample_size} columns",
+                lambda: read_hdf5_file(
+                    path,
+                    feature_indexes=sorted(random.sample(range(columns), sample_size)),
+                    sample_indexes=None,
+                    keep_nans=True,
+                ),
+            )
+
+            benchmark(
+                f"layout={layout}: read {sample_size} row",
+                lambda: read_hdf5_file(
+                    path,
+                    feature_indexes=None,
+                    sample_indexes=sorted(random.sample(range(rows), sample_size)),
+                    keep_nans=True,
+                ),
+            )
+
+
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("cols", type=int)
+
+    args = parser.parse_args()
+
+    perf_test(args.dir, args.rows, args.cols)
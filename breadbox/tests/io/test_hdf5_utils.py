@@ -1,4 +1,6 @@
 # type: ignore
+import io
+
 import numpy as np
 import pandas as pd
 from breadbox.schemas.dataframe_wrapper import (
@@ -7,7 +9,9 @@ from breadbox.schemas.dataframe_wrapper import (
     HDF5DataFrameWrapper,
 )
 from breadbox.schemas.custom_http_exception import LargeDatasetReadError
-from breadbox.io.hdf5_utils import write_hdf5_file, read_hdf5_file
+from breadbox.io.hdf5_utils import write_hdf5_file, read_hdf5_file, read_hdf5_values
+from breadbox.io.data_validation import _read_csv
+from breadbox.schemas.dataset import ValueType
 import pytest
 import h5py
 
@@ -193,6 +197,44 @@ def test_write_parquet_nulls_to_hdf5(tmpdir):
         assert len(columns) == len(expeted_columns)
 
 
+@pytest.mark.parametrize("sparse", [True, False])
+def test_write_csv_upload_to_hdf5_detects_sparsity(tmpdir, sparse):
+    # uploaded CSVs are parsed into a parquet file, so sparse ones need to be detected from its columns
+    cols = [f"Col-{i}" for i in range(300)]
+    rows = [f"Row-{i}" for i in range(300)]
+    if sparse:
+        data = np.full((len(rows), len(cols)), np.nan)
+        for i in range(6):
+            data[i * 50, i * 40] = i + 1
+    else:
+        data = np.round(np.random.uniform(0.0, 10.0, size=(len(rows), len(cols))), 6)
+    df = pd.DataFrame(data, columns=cols, index=rows)
+
+    wrapper = _read_csv(
+        io.BytesIO(df.to_csv().encode("utf8")), ValueType.continuous, str(tmpdir)
+    )
+    assert isinstance(wrapper, ParquetDataFrameWrapper)
+
+    output_h5 = str(tmpdir.join("output.h5"))
+    write_hdf5_file(
+        path=output_h5,
+        df_wrapper=wrapper,
+        map_values=lambda x: x,
+        hdf5_dtype="float",
+        batch_size=100,
+    )
+
+    with h5py.File(output_h5, "r") as f:
+        data_dataset = f["data"]
+        if sparse:
+            # stored in compressed chunks which are mostly missing values, rather than as 720,000 bytes
+            assert data_dataset.chunks is not None
+            assert data_dataset.id.get_storage_size() < 100000
+        else:
+            assert data_dataset.chunks is None
+        np.testing.assert_array_equal(data_dataset[:], data)
+
+
 def create_mock_hdf5(path, num_samples, num_features):
     with h5py.File(path, "w") as f:
         data = np.random.rand(num_samples, num_features)
@@ -219,3 +261,18 @@ def test_large_read_raises_exception(monkeypatch, tmpdir):
 
     with pytest.raises(LargeDatasetReadError):
         read_hdf5_file(path)
+
+
+def test_read_hdf5_values(tmpdir):
+    path = str(tmpdir.join("test.hdf5"))
+    create_mock_hdf5(path, num_samples=10, num_features=8)
+    with h5py.File(path, "a") as f:
+        f["data"][2, 3] = np.nan
+
+    values = read_hdf5_values(path, [1, 3, 4], [0, 2, 9])
+    expected = read_hdf5_file(
+        path, feature_indexes=[1, 3, 4], sample_indexes=[0, 2, 9], keep_nans=True
+    )
+    assert values.dtype == np.float64
+    np.testing.assert_array_equal(values, expected.values)
+    assert np.isnan(values[1, 1])
@@ -0,0 +1,130 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from breadbox.io.filestore_crud import get_df_by_value_type
+from breadbox.io.hdf5_value_mapping import (
+    ListStringsDecoder,
+    get_decoder_function,
+    get_encoder_function,
+)
+from breadbox.schemas.dataset import ValueType
+
+
+def _per_cell_categorical_decode(df: pd.DataFrame, allowed_values):
+    # how categorical values used to be decoded
+    allowed_values_ = allowed_values + [None]
+    return df.astype(int).map(lambda x: allowed_values_[x])
+
+
+def _per_cell_list_strings_decode(df: pd.DataFrame):
+    # how list_strings values used to be decoded
+    return df.map(lambda x: json.loads(x) if len(x) != 0 else None)
+
+
+def test_decode_categorical():
+    allowed_values = ["a", "b", "c"]
+    df = pd.DataFrame(
+        {"X": ["a", None, "C"], "Y": ["b", "b", None]}, index=["r1", "r2", "r3"]
+    )
+    encoded = get_encoder_function(ValueType.categorical, allowed_values)(df)
+    # the values read from the HDF5 file are floats
+    encoded = encoded.astype(float)
+
+    decoded = get_decoder_function(ValueType.categorical, allowed_values)(encoded)
+    assert_frame_equal(decoded, _per_cell_categorical_decode(encoded, allowed_values))
+    assert decoded.values.tolist() == [["a", "b"], [None, "b"], ["c", None]]
+
+    # decoding through filestore_crud must not change the dataset's allowed values
+    decoded = get_df_by_value_type(
+        encoded, ValueType.categorical, allowed_values, "dataset-id"
+    )
+    assert decoded.values.tolist() == [["a", "b"], [None, "b"], ["c", None]]
+    assert allowed_values == ["a", "b", "c"]
+
+
+def test_decode_list_strings():
+    df = pd.DataFrame(
+        {"X": [b'["a"]', b"", b'["a", "b"]'], "Y": [b"", b'["a"]', b"[]"]},
+        index=["r1", "r2", "r3"],
+    )
+    decoder = ListStringsDecoder()
+    decoded = decoder(df)
+    assert_frame_equal(decoded, _per_cell_list_strings_decode(df))
+
+    # values are only parsed once, even across calls
+    assert len(decoder._parsed) == 4
+    decoder(df.iloc[:2])
+    assert len(decoder._parsed) == 4
+
+    # missing values are left as NA
+    with_missing = pd.DataFrame({"X": ['["x"]', None]}, index=["r1", "r2"])
+    assert decoder(with_missing)["X"].tolist() == [["x"], pd.NA]
+
+
+def test_decoders_are_shared_per_dataset():
+    first = get_decoder_function(ValueType.list_strings, None, "dataset-1")
+    assert get_decoder_function(ValueType.list_strings, None, "dataset-1") is first
+    assert get_decoder_function(ValueType.list_strings, None, "dataset-2") is not first
+    assert get_decoder_function(ValueType.continuous, None, "dataset-1") is None
+
+    categorical = get_decoder_function(ValueType.categorical, ["a", "b"], "dataset-3")
+    assert (
+        get_decoder_function(ValueType.categorical, ["a", "b"], "dataset-3")
+        is categorical
+    )
+    # a change to the allowed values gets a new decoder
+    assert (
+        get_decoder_function(ValueType.categorical, ["a", "b", "c"], "dataset-3")
+        is not categorical
+    )
+
+
+def perf_test(rows, columns):
+    np.random.seed(0)
+    allowed_values = ["True", "False"]
+    categorical_df = pd.DataFrame(
+        np.random.randint(0, 3, size=(rows, columns)).astype(float)
+    )
+    distinct = np.array(
+        [b"", b'["missense"]', b'["nonsense"]', b'["missense", "silent"]'],
+        dtype=object,
+    )
+    list_strings_df = pd.DataFrame(
+        distinct[np.random.choice(4, size=(rows, columns), p=[0.9, 0.05, 0.03, 0.02])]
+    )
+
+    def benchmark(label, f):
+        start = time.perf_counter()
+        f()
+        print(f"{label}: {time.perf_counter() - start:.3f} s")
+
+    benchmark(
+        "categorical, per cell",
+        lambda: _per_cell_categorical_decode(categorical_df, allowed_values),
+    )
+    benchmark(
+        "categorical, vectorized",
+        lambda: get_decoder_function(ValueType.categorical, allowed_values)(
+            categorical_df
+        ),
+    )
+    benchmark(
+        "list_strings, per cell", lambda: _per_cell_list_strings_decode(list_strings_df)
+    )
+    benchmark("list_strings, vectorized", lambda: ListStringsDecoder()(list_strings_df))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int)
+    parser.add_argument("cols", type=int)
+
+    args = parser.parse_args()
+
+    perf_test(args.rows, args.cols)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from breadbox.service.correlation import (
+    cor_with_missing,
+    correlate_with_chunks,
+    group_columns_by_mask,
+)
+
+
+def _random_matrix_with_holes(rng, rows, columns):
+    m = rng.normal(size=(rows, columns))
+    m[rng.random(size=m.shape) < 0.05] = np.nan
+    # a few columns share the same holes
+    m[:3, :5] = np.nan
+    return m
+
+
+def test_group_columns_by_mask():
+    m = np.array(
+        [[1.0, np.nan, 3.0, np.nan], [1.0, 2.0, np.nan, 4.0], [1.0, 2.0, 3.0, 4.0]]
+    )
+    groups = sorted(
+        (columns.tolist(), mask.tolist()) for mask, columns in group_columns_by_mask(m)
+    )
+    assert groups == [
+        ([0], [True, True, True]),
+        ([1, 3], [False, True, True]),
+        ([2], [True, False, True]),
+    ]
+
+
+def test_cor_with_missing_matches_pandas():
+    rng = np.random.default_rng(0)
+    x = _random_matrix_with_holes(rng, 40, 4)
+    y = _random_matrix_with_holes(rng, 40, 30)
+    # a constant column can't be correlated
+    y[:, 7] = 1.0
+
+    cor, sample_counts = cor_with_missing(x, y)
+
+    y_df = pd.DataFrame(y)
+    for i in range(x.shape[1]):
+        x_col = pd.Series(x[:, i])
+        expected = y_df.corrwith(x_col).to_numpy()
+        assert np.allclose(cor[i], expected, equal_nan=True)
+        expected_counts = y_df.notna().mul(x_col.notna(), axis=0).sum().to_numpy()
+        assert (sample_counts[i] == expected_counts).all()
+
+    cor_32, _ = cor_with_missing(x, y, dtype=np.float32)
+    assert np.allclose(cor_32, cor, atol=1e-5, equal_nan=True)
+
+
+@pytest.mark.parametrize("limit", [None, 7])
+def test_correlate_with_chunks_matches_single_chunk(limit):
+    rng = np.random.default_rng(1)
+    index = [f"sample{i}" for i in range(30)]
+    m = pd.DataFrame(
+        _random_matrix_with_holes(rng, 30, 100),
+        index=index,
+        columns=[f"feature{i}" for i in range(100)],
+    )
+    reference = pd.Series(rng.normal(size=30), index=index)
+
+    expected = correlate_with_chunks(reference, [m])
+    chunks = [m.iloc[:, i : i + 15] for i in range(0, 100, 15)]
+    # the chunks are in a different order than reference
+    actual = correlate_with_chunks(
+        reference.iloc[::-1], iter(chunks), limit=limit, max_workers=3
+    )
+
+    if limit is not None:
+        expected = expected.iloc[
+            expected["cor"].abs().sort_values(ascending=False).index[:limit]
+        ]
+    pd.testing.assert_frame_equal(
+        actual.sort_values("given_id").reset_index(drop=True),
+        expected.sort_values("given_id").reset_index(drop=True),
+    )
@@ -206,3 +206,72 @@ def test_aggregate_matrix_chunking_df():
         )
         # fmt: on
         assert_frame_equal(agg_df, expected_df)
+
+
+def test_streamed_matrix_blocks_match_whole_slice(minimal_db, settings):
+    from breadbox.api.datasets import _stream_columns_as_json
+    from breadbox.schemas.dataset import MatrixDimensionsInfo
+    from breadbox.service.dataset import (
+        get_subsetted_matrix_dataset_df,
+        iter_subsetted_matrix_dataset_df_blocks,
+    )
+    from tests import factories
+
+    features = [f"F{i}" for i in range(7)]
+    samples = [f"S{i}" for i in range(5)]
+    values = np.arange(len(samples) * len(features), dtype=float).reshape(
+        len(samples), len(features)
+    )
+    values[1, 2] = np.nan
+    factories.sample_type(
+        minimal_db, settings.admin_users[0], "model", given_ids=samples
+    )
+    dataset = factories.matrix_dataset(
+        minimal_db,
+        settings,
+        feature_type=None,
+        sample_type="model",
+        data_file=factories.matrix_csv_data_file_with_values(
+            feature_ids=features, sample_ids=samples, values=values
+        ),
+    )
+
+    for dimensions_info in [
+        MatrixDimensionsInfo(),
+        MatrixDimensionsInfo(
+            features=["F6", "F0", "F3", "MISSING"],
+            feature_identifier="id",
+            samples=["S4", "S1"],
+            sample_identifier="id",
+        ),
+    ]:
+        expected = get_subsetted_matrix_dataset_df(
+            minimal_db, dataset, dimensions_info, settings.filestore_location
+        )
+        # blocks of at most 5 values
+        blocks = list(
+            iter_subsetted_matrix_dataset_df_blocks(
+                minimal_db,
+                dataset,
+                dimensions_info,
+                settings.filestore_location,
+                max_block_bytes=40,
+            )
+        )
+        assert len(expected) > 0
+        assert len(blocks) > 1
+        assert all(block.size <= 5 for block in blocks)
+        assert_frame_equal(pd.concat(blocks, axis=1), expected, check_dtype=False)
+
+        streamed = "".join(
+            _stream_columns_as_json(
+                iter_subsetted_matrix_dataset_df_blocks(
+                    minimal_db,
+                    dataset,
+                    dimensions_info,
+                    settings.filestore_location,
+                    max_block_bytes=40,
+                )
+            )
+        )
+        assert streamed == expected.to_json()
@@ -0,0 +1,285 @@
+import json
+import random
+import time
+
+import pandas as pd
+from fastapi.testclient import TestClient
+
+from breadbox.models.dataset import AnnotationType, DimensionSearchIndex
+from breadbox.schemas.dataset import ColumnMetadata
+from breadbox.service.search import (
+    MetadataCache,
+    MetadataCacheEntry,
+    _get_changed_given_ids,
+    get_property_value_pairs,
+)
+from tests import factories
+from tests.utils import assert_status_ok
+
+
+def test_get_property_value_pairs():
+    metadata_cache = MetadataCache(None)  # pyright: ignore
+    metadata_cache.cache["gene"] = MetadataCacheEntry(
+        properties_to_index_df=pd.DataFrame(
+            {"label": ["KRAS", "NRAS"], "aliases": ['["K1", "K2"]', None]},
+            index=["3845", "4893"],
+        ),
+        columns_metadata={
+            "label": ColumnMetadata(col_type=AnnotationType.text),
+            "aliases": ColumnMetadata(col_type=AnnotationType.list_strings),
+        },
+    )
+    metadata_cache.cache["compound"] = MetadataCacheEntry(
+        properties_to_index_df=pd.DataFrame(
+            {
+                "label": ["sotorasib", "other", "no-target"],
+                "target": ['["4893", "3845"]', '["9999"]', None],
+                "not_indexed": ["x", "y", "z"],
+            },
+            index=["C1", "C2", "C3"],
+        ),
+        columns_metadata={
+            "label": ColumnMetadata(col_type=AnnotationType.text),
+            "target": ColumnMetadata(
+                col_type=AnnotationType.list_strings, references="gene"
+            ),
+        },
+    )
+
+    pairs = get_property_value_pairs("compound", metadata_cache)
+    # ordered by dimension, then property, then position within the list (and within the referenced
+    # dimension's pairs). References to unknown dimensions and unindexed columns are dropped.
+    assert pairs.values.tolist() == [
+        ["C1", "label", "sotorasib"],
+        ["C1", "target.label", "NRAS"],
+        ["C1", "target.label", "KRAS"],
+        ["C1", "target.aliases", "K1"],
+        ["C1", "target.aliases", "K2"],
+        ["C2", "label", "other"],
+        ["C3", "label", "no-target"],
+    ]
+    # the pairs of each type are only computed once
+    assert get_property_value_pairs("compound", metadata_cache) is pairs
+    assert metadata_cache.cache["gene"].property_value_pairs is not None
+
+
+def _get_search_index_ids(db):
+    return {
+        (x.dimension_type_name, x.dimension_given_id, x.property, x.value): x.id
+        for x in db.query(DimensionSearchIndex).all()
+    }
+
+
+def _post_gene_metadata(client, headers, row_values, method="post"):
+    files = {
+        "metadata_file": (
+            "gene_metadata",
+            factories.tabular_csv_data_file(
+                cols=["label", "entrez_id", "aliases"], row_values=row_values,
+            ),
+            "text/csv",
+        )
+    }
+    annotation_type_mapping = json.dumps(
+        {
+            "annotation_type_mapping": {
+                "label": "text",
+                "entrez_id": "text",
+                "aliases": "list_strings",
+            }
+        }
+    )
+    if method == "post":
+        return client.post(
+            "/types/feature",
+            data={
+                "name": "gene",
+                "id_column": "entrez_id",
+                "properties_to_index": ["label", "entrez_id", "aliases"],
+                "annotation_type_mapping": annotation_type_mapping,
+            },
+            files=files,
+            headers=headers,
+        )
+    return client.patch(
+        "/types/feature/gene/metadata",
+        data={"name": "gene", "annotation_type_mapping": annotation_type_mapping},
+        files=files,
+        headers=headers,
+    )
+
+
+def test_refresh_only_rewrites_changed_dimensions(
+    client: TestClient, minimal_db, settings, public_group
+):
+    admin_headers = {"X-Forwarded-Email": settings.admin_users[0]}
+
+    response = _post_gene_metadata(
+        client,
+        admin_headers,
+        [
+            ["KRAS", "3845", '["K1"]'],
+            ["NRAS", "4893", '["N1"]'],
+            ["HRAS", "3265", '["H1"]'],
+        ],
+    )
+    assert_status_ok(response)
+
+    response = client.post(
+        "/types/feature",
+        data={
+            "name": "compound",
+            "id_column": "compound_id",
+            "properties_to_index": ["compound_id", "label", "target"],
+            "annotation_type_mapping": json.dumps(
+                {
+                    "annotation_type_mapping": {
+                        "label": "text",
+                        "compound_id": "text",
+                        "target": "list_strings",
+                    }
+                }
+            ),
+            "id_mapping": json.dumps(
+                {"id_mapping": {"reference_column_mappings": {"target": "gene"}}}
+            ),
+        },
+        files={
+            "metadata_file": (
+                "compound_metadata",
+                factories.tabular_csv_data_file(
+                    cols=["compound_id", "label", "target"],
+                    row_values=[
+                        ["C1", "sotorasib", '["3845"]'],
+                        ["C2", "other", '["4893"]'],
+                    ],
+                ),
+                "text/csv",
+            )
+        },
+        headers=admin_headers,
+    )
+    assert_status_ok(response)
+
+    ids_before = _get_search_index_ids(minimal_db)
+
+    # change KRAS's alias and drop HRAS
+    response = _post_gene_metadata(
+        client,
+        admin_headers,
+        [["KRAS", "3845", '["K2"]'], ["NRAS", "4893", '["N1"]']],
+        method="patch",
+    )
+    assert_status_ok(response)
+    minimal_db.reset_user(settings.admin_users[0])
+
+    ids_after = _get_search_index_ids(minimal_db)
+    assert set(ids_after) == {
+        ("gene", "3845", "label", "KRAS"),
+        ("gene", "3845", "entrez_id", "3845"),
+        ("gene", "3845", "aliases", "K2"),
+        ("gene", "4893", "label", "NRAS"),
+        ("gene", "4893", "entrez_id", "4893"),
+        ("gene", "4893", "aliases", "N1"),
+        ("compound", "C1", "compound_id", "C1"),
+        ("compound", "C1", "label", "sotorasib"),
+        ("compound", "C1", "target.label", "KRAS"),
+        ("compound", "C1", "target.entrez_id", "3845"),
+        ("compound", "C1", "target.aliases", "K2"),
+        ("compound", "C2", "compound_id", "C2"),
+        ("compound", "C2", "label", "other"),
+        ("compound", "C2", "target.label", "NRAS"),
+        ("compound", "C2", "target.entrez_id", "4893"),
+        ("compound", "C2", "target.aliases", "N1"),
+    }
+
+    # the records of dimensions which didn't change (directly, or through a reference) were left alone
+    unchanged = [key for key in ids_after if key[1] in ("4893", "C2")]
+    assert len(unchanged) == 8
+    for key in unchanged:
+        assert ids_after[key] == ids_before[key]
+    # and the others were rewritten
+    assert (
+        ids_after[("gene", "3845", "label", "KRAS")]
+        != ids_before[("gene", "3845", "label", "KRAS")]
+    )
+    assert (
+        ids_after[("compound", "C1", "label", "sotorasib")]
+        != ids_before[("compound", "C1", "label", "sotorasib")]
+    )
+
+
+def perf_test(gene_count, compound_count):
+    # times regenerating the records of a gene+compound index after editing one gene's aliases
+    random.seed(0)
+    genes = [str(1000 + i) for i in range(gene_count)]
+    gene_columns_metadata = {
+        "label": ColumnMetadata(col_type=AnnotationType.text),
+        "entrez_id": ColumnMetadata(col_type=AnnotationType.text),
+        "aliases": ColumnMetadata(col_type=AnnotationType.list_strings),
+    }
+    compounds = [f"C{i}" for i in range(compound_count)]
+    compound_df = pd.DataFrame(
+        {
+            "compound_id": compounds,
+            "label": [f"compound-{i}" for i in range(compound_count)],
+            "target": [
+                json.dumps(random.sample(genes, random.randint(1, 2)))
+                for _ in range(compound_count)
+            ],
+        },
+        index=compounds,
+    )
+    compound_columns_metadata = {
+        "compound_id": ColumnMetadata(col_type=AnnotationType.text),
+        "label": ColumnMetadata(col_type=AnnotationType.text),
+        "target": ColumnMetadata(
+            col_type=AnnotationType.list_strings, references="gene"
+        ),
+    }
+
+    def get_pairs(edited_gene):
+        gene_df = pd.DataFrame(
+            {
+                "label": [f"G{i}" for i in range(gene_count)],
+                "entrez_id": genes,
+                "aliases": [
+                    json.dumps([f"A{i}" + ("x" if i == edited_gene else "")])
+                    for i in range(gene_count)
+                ],
+            },
+            index=genes,
+        )
+        metadata_cache = MetadataCache(None)  # pyright: ignore
+        metadata_cache.cache["gene"] = MetadataCacheEntry(
+            gene_df, gene_columns_metadata
+        )
+        metadata_cache.cache["compound"] = MetadataCacheEntry(
+            compound_df, compound_columns_metadata
+        )
+        return get_property_value_pairs("compound", metadata_cache)
+
+    start = time.perf_counter()
+    before = get_pairs(-1)
+    print(f"{len(before)} compound pairs in {time.perf_counter() - start:.3f} s")
+
+    after = get_pairs(5)
+    start = time.perf_counter()
+    changed = _get_changed_given_ids(
+        before.assign(label="", group_id=""), after.assign(label="", group_id="")
+    )
+    print(
+        f"{len(changed)} changed compounds found in {time.perf_counter() - start:.3f} s"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("genes", type=int)
+    parser.add_argument("compounds", type=int)
+
+    args = parser.parse_args()
+
+    perf_test(args.genes, args.compounds)
@@ -1,190 +1,83 @@
-import struct
-import zlib
-import sqlite3
-import pandas as pd
-import numpy as np
-
-from dataclasses import dataclass
-
-
-@dataclass
-class InputMatrixDesc:
-    given_ids: list[str]
-    taiga_id: str
-    name: str
-
-
-ROW_BYTE_SIZE = 4 + 4 + 4  # 32 bit int, 32 bit float, 32 bit float
-
+from typing import Tuple
 
-def write_dim_labels(cursor, dim_i, given_ids):
-    cursor.execute(
-        f"create table dim_{dim_i}_given_id (dim_{dim_i} integer, given_id varchar)"
-    )
-    cursor.executemany(
-        f"insert into dim_{dim_i}_given_id (dim_{dim_i} , given_id ) values (?, ?)",
-        list(enumerate(given_ids)),
-    )
-
-
-def write_cor_df(
-    df: pd.DataFrame,
-    dim_0_desc: InputMatrixDesc,
-    dim_1_desc: InputMatrixDesc,
-    filename: str,
-):
-    """Writes a sqlite3 table which packs the correlations for a given feature into a single compressed blob"""
-    assert set(df.columns) == set(["dim_0", "dim_1", "cor", "log10qvalue"])
-
-    rows = []
+import pandas as pd
 
-    for dim_0, group in df.groupby("dim_0"):
-        # sort indices to reduce the amount of entropy in the column and compress better
-        # the other columns are floats, so they'll compress poorly regardless
-        sorted_group = group.copy().sort_values("dim_1")
+from . import v1, v2
+from .common import InputMatrixDesc, InvalidAssociationTable
+from .v1 import write_cor_df
+from .v2 import write_cor_df as write_cor_df_v2
 
-        buf = bytearray()
-        buf.extend(sorted_group["dim_1"].values.astype("int32").tobytes())
-        buf.extend(sorted_group["cor"].values.astype("float32").tobytes())
-        buf.extend(sorted_group["log10qvalue"].values.astype("float32").tobytes())
+SQLITE_MAGIC = b"SQLite format 3\x00"
 
-        cbuf = zlib.compress(buf)
-        rows.append((dim_0, cbuf))
 
-    # create file and write out everything
-    conn = sqlite3.connect(filename)
-    conn.execute("create table correlation (dim_0 int primary key, cbuf blob)")
-    conn.executemany("insert into correlation(dim_0, cbuf) values (?, ?)", rows)
+def get_format_version(filename) -> int:
+    """Returns which version of the format the table in filename was written with"""
+    with open(filename, "rb") as fd:
+        magic = fd.read(len(SQLITE_MAGIC))
+    if magic.startswith(v2.MAGIC):
+        return 2
+    if magic == SQLITE_MAGIC:
+        return 1
+    raise InvalidAssociationTable(f"{filename} is not an association table")
 
-    write_dim_labels(conn, 0, dim_0_desc.given_ids)
-    write_dim_labels(conn, 1, dim_1_desc.given_ids)
 
-    pd.DataFrame(
-        dict(
-            dim_index=[0, 1],
-            taiga_id=[dim_0_desc.taiga_id, dim_1_desc.taiga_id],
-            dataset_given_id=[dim_0_desc.name, dim_1_desc.name],
-        )
-    ).to_sql("dataset", conn, if_exists="replace", index=False)
+def read_cor_for_given_id(filename, feature_id):
+    if get_format_version(filename) == 2:
+        return v2.open_table(filename).read_cor_for_given_id(feature_id)
+    return v1.read_cor_for_given_id(filename, feature_id)
 
-    print(f"Building indices...")
-    for dim_i in [0, 1]:
-        conn.execute(
-            f"CREATE INDEX dim_{dim_i}_given_id_idx_1 ON dim_{dim_i}_given_id (given_id)"
-        )
-        conn.execute(
-            f"CREATE INDEX dim_{dim_i}_given_id_idx_2 ON dim_{dim_i}_given_id (dim_{dim_i})"
-        )
 
-    conn.commit()
-    conn.close()
+def read_cor_for_given_ids(filename, feature_ids):
+    """Returns the correlations of each of feature_ids, reading the table once. Features without any
+    correlations are skipped"""
+    if get_format_version(filename) == 2:
+        return v2.open_table(filename).read_cor_for_given_ids(feature_ids)
+    return v1.read_cor_for_given_ids(filename, feature_ids)
 
 
 def read_full(filename):
     "return dataframe of all correlations"
+    if get_format_version(filename) == 1:
+        return v1.read_full(filename)
+
+    table = v2.open_table(filename)
+    df, _, _ = table.read_cor_df()
+    labels_0, labels_1 = table.get_labels(0), table.get_labels(1)
+    return pd.DataFrame(
+        {
+            "cor": df["cor"],
+            "log10qvalue": df["log10qvalue"],
+            "feature_given_id_0": labels_0[df["dim_0"].to_numpy(dtype="int64")],
+            "feature_given_id_1": labels_1[df["dim_1"].to_numpy(dtype="int64")],
+        }
+    )
 
-    conn = sqlite3.connect(filename)
 
-    # fetch the blob for the given feature
-    cursor = conn.cursor()
-    cursor.execute(
-        "select f.given_id, c.cbuf from correlation c join dim_0_given_id f on f.dim_0=c.dim_0",
-    )
-    dfs = []
-    for f_givenid, cbuf in cursor.fetchall():
-        df = _unpack(cbuf)
-        df["feature_given_id_0"] = f_givenid
-        df["feature_given_id_1"] = _map_dim_index_to_given_ids(cursor, 1, df["dim_1"])
-        df.drop(columns=["dim_1"], inplace=True)
-        dfs.append(df)
-    return pd.concat(dfs, ignore_index=True)
-
-
-def _unpack(cbuf):
-    buf = zlib.decompress(cbuf)
-    row_count = len(buf) // ROW_BYTE_SIZE
-    start = 0
-    end = 4 * row_count
-    dim_1 = np.frombuffer(buf[start:end], dtype="int32")
-    start = end
-    end += 4 * row_count
-    cor = np.frombuffer(buf[start:end], dtype="float32")
-    start = end
-    end += 4 * row_count
-    log10qvalue = np.frombuffer(buf[start:end], dtype="float32")
-
-    df = pd.DataFrame({"dim_1": dim_1, "cor": cor, "log10qvalue": log10qvalue})
-    return df
-
-
-def _map_dim_index_to_given_ids(cursor, dim_i, positions):
-    indices = list(set(positions))
-    param_str = ",".join(["?"] * len(indices))
-    cursor.execute(
-        f"select given_id, dim_{dim_i} from dim_{dim_i}_given_id where dim_{dim_i} in ({ param_str })",
-        indices,
-    )
-    position_to_label = {i: given_id for given_id, i in cursor.fetchall()}
-    return [position_to_label[position] for position in positions]
+def get_given_ids(filename: str, dim: str):
+    try:
+        format_version = get_format_version(filename)
+    except OSError as ex:
+        raise InvalidAssociationTable() from ex
 
+    if format_version == 2:
+        return set(v2.open_table(filename).get_labels(int(dim)))
+    return v1.get_given_ids(filename, dim)
 
-def read_cor_for_given_id(filename, feature_id):
-    conn = sqlite3.connect(filename)
 
-    # fetch the blob for the given feature
-    cursor = conn.cursor()
-    cursor.execute(
-        "select c.dim_0, c.cbuf from correlation c join dim_0_given_id f on f.dim_0=c.dim_0 where f.given_id = ?",
-        [feature_id],
-    )
-    row = cursor.fetchone()
-    if row is None:
-        return pd.DataFrame(
-            {
-                "dim_0": [],
-                "dim_1": [],
-                "cor": [],
-                "log10qvalue": [],
-                "feature_given_id_0": [],
-                "dataset_given_id_0": [],
-                "feature_given_id_1": [],
-                "dataset_given_id_1": [],
-            }
-        )
-    index, cbuf = row
-    # now unpack the value
-    df = _unpack(cbuf)
-    df["dim_0"] = index
-
-    cursor.execute("select dim_index, dataset_given_id from dataset")
-    given_id_by_dataset_index = {
-        dim_index: given_id for dim_index, given_id in cursor.fetchall()
-    }
-
-    df["feature_given_id_0"] = _map_dim_index_to_given_ids(cursor, 0, df["dim_0"])
-    df["feature_given_id_1"] = _map_dim_index_to_given_ids(cursor, 1, df["dim_1"])
-    df["dataset_given_id_0"] = given_id_by_dataset_index[0]
-    df["dataset_given_id_1"] = given_id_by_dataset_index[1]
-
-    cursor.close()
-    conn.close()
-
-    return df.drop(columns=["dim_0", "dim_1"])
-
-
-class InvalidAssociationTable(Exception):
-    pass
+def read_cor_df(filename) -> Tuple[pd.DataFrame, InputMatrixDesc, InputMatrixDesc]:
+    """Returns all the correlations in filename (of either version) as a dataframe with the columns
+    dim_0, dim_1, cor and log10qvalue, along with the descriptions of both dimensions"""
+    if get_format_version(filename) == 2:
+        return v2.open_table(filename).read_cor_df()
+    return v1.read_cor_df(filename)
 
 
-def get_given_ids(filename: str, dim: str):
-    conn = sqlite3.connect(filename)
-    cur = conn.cursor()
-    try:
-        cur.execute(f"SELECT given_id from dim_{dim}_given_id")
-        assoc_dataset_given_ids = set([x[0] for x in cur.fetchall()])
-        return assoc_dataset_given_ids
-    except sqlite3.OperationalError as ex:
-        raise InvalidAssociationTable() from ex
-    finally:
-        cur.close()
-        conn.close()
+def convert(src_filename, dest_filename, format_version=2, codec=v2.DEFAULT_CODEC):
+    """Rewrites the table in src_filename in the given version of the format"""
+    df, dim_0_desc, dim_1_desc = read_cor_df(src_filename)
+    if format_version == 2:
+        write_cor_df_v2(df, dim_0_desc, dim_1_desc, dest_filename, codec=codec)
+    elif format_version == 1:
+        write_cor_df(df, dim_0_desc, dim_1_desc, dest_filename)
+    else:
+        raise ValueError(f"Unknown format version: {format_version}")
@@ -0,0 +1,22 @@
+import argparse
+
+from . import convert, v2
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts a packed correlation table between versions of the format"
+    )
+    parser.add_argument("src")
+    parser.add_argument("dest")
+    parser.add_argument("--format-version", type=int, choices=[1, 2], default=2)
+    parser.add_argument(
+        "--codec", choices=["none", "zlib", "zstd"], default=v2.DEFAULT_CODEC
+    )
+    args = parser.parse_args()
+
+    convert(args.src, args.dest, format_version=args.format_version, codec=args.codec)
+
+
+if __name__ == "__main__":
+    main()
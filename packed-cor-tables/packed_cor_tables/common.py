@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+
+import pandas as pd
+
+
+@dataclass
+class InputMatrixDesc:
+    given_ids: list[str]
+    taiga_id: str
+    name: str
+
+
+class InvalidAssociationTable(Exception):
+    pass
+
+
+COR_DF_COLUMNS = ["dim_0", "dim_1", "cor", "log10qvalue"]
+
+
+def empty_result():
+    return pd.DataFrame(
+        {
+            "dim_0": [],
+            "dim_1": [],
+            "cor": [],
+            "log10qvalue": [],
+            "feature_given_id_0": [],
+            "dataset_given_id_0": [],
+            "feature_given_id_1": [],
+            "dataset_given_id_1": [],
+        }
+    )
@@ -0,0 +1,261 @@
+"""The original (v1) format: a sqlite3 database with one zlib compressed blob per dim_0 feature."""
+import zlib
+import sqlite3
+import pandas as pd
+import numpy as np
+
+from .common import (
+    COR_DF_COLUMNS,
+    InputMatrixDesc,
+    InvalidAssociationTable,
+    empty_result,
+)
+
+ROW_BYTE_SIZE = 4 + 4 + 4  # 32 bit int, 32 bit float, 32 bit float
+
+
+def write_dim_labels(cursor, dim_i, given_ids):
+    cursor.execute(
+        f"create table dim_{dim_i}_given_id (dim_{dim_i} integer, given_id varchar)"
+    )
+    cursor.executemany(
+        f"insert into dim_{dim_i}_given_id (dim_{dim_i} , given_id ) values (?, ?)",
+        list(enumerate(given_ids)),
+    )
+
+
+def write_cor_df(
+    df: pd.DataFrame,
+    dim_0_desc: InputMatrixDesc,
+    dim_1_desc: InputMatrixDesc,
+    filename: str,
+):
+    """Writes a sqlite3 table which packs the correlations for a given feature into a single compressed blob"""
+    assert set(df.columns) == set(COR_DF_COLUMNS)
+
+    rows = []
+
+    for dim_0, group in df.groupby("dim_0"):
+        # sort indices to reduce the amount of entropy in the column and compress better
+        # the other columns are floats, so they'll compress poorly regardless
+        sorted_group = group.copy().sort_values("dim_1")
+
+        buf = bytearray()
+        buf.extend(sorted_group["dim_1"].values.astype("int32").tobytes())
+        buf.extend(sorted_group["cor"].values.astype("float32").tobytes())
+        buf.extend(sorted_group["log10qvalue"].values.astype("float32").tobytes())
+
+        cbuf = zlib.compress(buf)
+        rows.append((dim_0, cbuf))
+
+    # create file and write out everything
+    conn = sqlite3.connect(filename)
+    conn.execute("create table correlation (dim_0 int primary key, cbuf blob)")
+    conn.executemany("insert into correlation(dim_0, cbuf) values (?, ?)", rows)
+
+    write_dim_labels(conn, 0, dim_0_desc.given_ids)
+    write_dim_labels(conn, 1, dim_1_desc.given_ids)
+
+    pd.DataFrame(
+        dict(
+            dim_index=[0, 1],
+            taiga_id=[dim_0_desc.taiga_id, dim_1_desc.taiga_id],
+            dataset_given_id=[dim_0_desc.name, dim_1_desc.name],
+        )
+    ).to_sql("dataset", conn, if_exists="replace", index=False)
+
+    print(f"Building indices...")
+    for dim_i in [0, 1]:
+        conn.execute(
+            f"CREATE INDEX dim_{dim_i}_given_id_idx_1 ON dim_{dim_i}_given_id (given_id)"
+        )
+        conn.execute(
+            f"CREATE INDEX dim_{dim_i}_given_id_idx_2 ON dim_{dim_i}_given_id (dim_{dim_i})"
+        )
+
+    conn.commit()
+    conn.close()
+
+
+def read_full(filename):
+    "return dataframe of all correlations"
+
+    conn = sqlite3.connect(filename)
+
+    # fetch the blob for the given feature
+    cursor = conn.cursor()
+    cursor.execute(
+        "select f.given_id, c.cbuf from correlation c join dim_0_given_id f on f.dim_0=c.dim_0",
+    )
+    dfs = []
+    for f_givenid, cbuf in cursor.fetchall():
+        df = _unpack(cbuf)
+        df["feature_given_id_0"] = f_givenid
+        df["feature_given_id_1"] = _map_dim_index_to_given_ids(cursor, 1, df["dim_1"])
+        df.drop(columns=["dim_1"], inplace=True)
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def _unpack(cbuf):
+    buf = zlib.decompress(cbuf)
+    row_count = len(buf) // ROW_BYTE_SIZE
+    start = 0
+    end = 4 * row_count
+    dim_1 = np.frombuffer(buf[start:end], dtype="int32")
+    start = end
+    end += 4 * row_count
+    cor = np.frombuffer(buf[start:end], dtype="float32")
+    start = end
+    end += 4 * row_count
+    log10qvalue = np.frombuffer(buf[start:end], dtype="float32")
+
+    df = pd.DataFrame({"dim_1": dim_1, "cor": cor, "log10qvalue": log10qvalue})
+    return df
+
+
+def _map_dim_index_to_given_ids(cursor, dim_i, positions):
+    indices = list(set(positions))
+    param_str = ",".join(["?"] * len(indices))
+    cursor.execute(
+        f"select given_id, dim_{dim_i} from dim_{dim_i}_given_id where dim_{dim_i} in ({ param_str })",
+        indices,
+    )
+    position_to_label = {i: given_id for given_id, i in cursor.fetchall()}
+    return [position_to_label[position] for position in positions]
+
+
+def read_cor_for_given_id(filename, feature_id):
+    conn = sqlite3.connect(filename)
+
+    # fetch the blob for the given feature
+    cursor = conn.cursor()
+    cursor.execute(
+        "select c.dim_0, c.cbuf from correlation c join dim_0_given_id f on f.dim_0=c.dim_0 where f.given_id = ?",
+        [feature_id],
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return empty_result()
+    index, cbuf = row
+    # now unpack the value
+    df = _unpack(cbuf)
+    df["dim_0"] = index
+
+    cursor.execute("select dim_index, dataset_given_id from dataset")
+    given_id_by_dataset_index = {
+        dim_index: given_id for dim_index, given_id in cursor.fetchall()
+    }
+
+    df["feature_given_id_0"] = _map_dim_index_to_given_ids(cursor, 0, df["dim_0"])
+    df["feature_given_id_1"] = _map_dim_index_to_given_ids(cursor, 1, df["dim_1"])
+    df["dataset_given_id_0"] = given_id_by_dataset_index[0]
+    df["dataset_given_id_1"] = given_id_by_dataset_index[1]
+
+    cursor.close()
+    conn.close()
+
+    return df.drop(columns=["dim_0", "dim_1"])
+
+
+def read_cor_for_given_ids(filename, feature_ids):
+    """Like read_cor_for_given_id, but returns the correlations of all the given features (in the order
+    given) using a single connection"""
+    feature_ids = list(dict.fromkeys(feature_ids))
+    conn = sqlite3.connect(filename)
+    try:
+        cursor = conn.cursor()
+
+        cbuf_by_feature_id = {}
+        for i in range(0, len(feature_ids), 500):
+            chunk = feature_ids[i : i + 500]
+            param_str = ",".join(["?"] * len(chunk))
+            cursor.execute(
+                f"select f.given_id, c.cbuf from correlation c join dim_0_given_id f on f.dim_0=c.dim_0 where f.given_id in ({param_str})",
+                chunk,
+            )
+            cbuf_by_feature_id.update(cursor.fetchall())
+
+        dfs = []
+        for feature_id in feature_ids:
+            cbuf = cbuf_by_feature_id.get(feature_id)
+            if cbuf is not None:
+                df = _unpack(cbuf)
+                df["feature_given_id_0"] = feature_id
+                dfs.append(df)
+        if len(dfs) == 0:
+            return empty_result()
+        df = pd.concat(dfs, ignore_index=True)
+
+        cursor.execute("select dim_index, dataset_given_id from dataset")
+        given_id_by_dataset_index = {
+            dim_index: given_id for dim_index, given_id in cursor.fetchall()
+        }
+        # many features will usually share the same correlated features, so fetch all the labels at once
+        cursor.execute("select dim_1, given_id from dim_1_given_id")
+        labels = pd.Series(dict(cursor.fetchall()))
+    finally:
+        conn.close()
+
+    return pd.DataFrame(
+        {
+            "cor": df["cor"],
+            "log10qvalue": df["log10qvalue"],
+            "feature_given_id_0": df["feature_given_id_0"],
+            "feature_given_id_1": labels.reindex(df["dim_1"]).to_numpy(),
+            "dataset_given_id_0": given_id_by_dataset_index[0],
+            "dataset_given_id_1": given_id_by_dataset_index[1],
+        }
+    )
+
+
+def get_given_ids(filename: str, dim: str):
+    conn = sqlite3.connect(filename)
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT given_id from dim_{dim}_given_id")
+        assoc_dataset_given_ids = set([x[0] for x in cur.fetchall()])
+        return assoc_dataset_given_ids
+    except sqlite3.OperationalError as ex:
+        raise InvalidAssociationTable() from ex
+    finally:
+        cur.close()
+        conn.close()
+
+
+def read_cor_df(filename):
+    """Returns the correlations as a dataframe in the shape write_cor_df accepts, along with the
+    descriptions of both dimensions"""
+    conn = sqlite3.connect(filename)
+    try:
+        cursor = conn.cursor()
+
+        descs = []
+        for dim_i in [0, 1]:
+            cursor.execute(
+                "select taiga_id, dataset_given_id from dataset where dim_index = ?",
+                [dim_i],
+            )
+            taiga_id, name = cursor.fetchone()
+            cursor.execute(
+                f"select given_id from dim_{dim_i}_given_id order by dim_{dim_i}"
+            )
+            given_ids = [given_id for (given_id,) in cursor.fetchall()]
+            descs.append(
+                InputMatrixDesc(given_ids=given_ids, taiga_id=taiga_id, name=name)
+            )
+
+        cursor.execute("select dim_0, cbuf from correlation order by dim_0")
+        dfs = []
+        for dim_0, cbuf in cursor.fetchall():
+            df = _unpack(cbuf)
+            df.insert(0, "dim_0", dim_0)
+            dfs.append(df)
+    finally:
+        conn.close()
+
+    if len(dfs) == 0:
+        df = pd.DataFrame({column: [] for column in COR_DF_COLUMNS})
+    else:
+        df = pd.concat(dfs, ignore_index=True)
+    return df, descs[0], descs[1]
@@ -0,0 +1,349 @@
+"""Version 2 of the packed correlation table format.
+
+Looking up a feature in a v1 table means opening a sqlite connection and querying the labels of every
+correlated feature. A v2 table is instead a single flat file which is memory mapped once per process:
+
+    magic (8 bytes) | header length (uint64) | header (json) | sections
+
+The header records the codec, both datasets and the (offset, length) of each section. Offsets are
+relative to the first 8-byte boundary after the header, and every section starts on an 8-byte boundary.
+
+- dim_0_labels, dim_1_labels: the given ids of each dimension as a compressed json list
+- index: uncompressed int64 offsets (one per dim_0 feature, plus one) of each feature's block within
+  the blocks section. A feature without any correlations has an empty block.
+- blocks: one compressed block per dim_0 feature holding dim_1 (int32, delta encoded so the sorted
+  indices compress well), cor (float32) and log10qvalue (float32), each column stored contiguously.
+
+All numbers are little endian.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .common import (
+    COR_DF_COLUMNS,
+    InputMatrixDesc,
+    InvalidAssociationTable,
+    empty_result,
+)
+
+MAGIC = b"PCTBLv2\x00"
+PREAMBLE = struct.Struct("<8sQ")
+ROW_BYTE_SIZE = 4 + 4 + 4  # 32 bit int, 32 bit float, 32 bit float
+
+DEFAULT_CODEC = "zlib"
+
+# the number of tables to keep mapped (along with their labels) per process
+MAX_OPEN_TABLES = 128
+
+
+def _get_compressor(codec: str) -> Callable[[bytes], bytes]:
+    if codec == "none":
+        return bytes
+    if codec == "zlib":
+        return zlib.compress
+    if codec == "zstd":
+        return _import_zstandard().ZstdCompressor().compress
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def _get_decompressor(codec: str) -> Callable[[bytes], bytes]:
+    if codec == "none":
+        return bytes
+    if codec == "zlib":
+        return zlib.decompress
+    if codec == "zstd":
+        zstandard = _import_zstandard()
+        # decompressors aren't thread safe, but are cheap to create
+        return lambda buf: zstandard.ZstdDecompressor().decompress(buf)
+    raise InvalidAssociationTable(f"Unknown codec: {codec}")
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as ex:
+        raise ImportError(
+            "The zstd codec requires the zstandard package to be installed"
+        ) from ex
+    return zstandard
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def write_cor_df(
+    df: pd.DataFrame,
+    dim_0_desc: InputMatrixDesc,
+    dim_1_desc: InputMatrixDesc,
+    filename: str,
+    codec: str = DEFAULT_CODEC,
+):
+    """Writes the correlations in df (with the columns dim_0, dim_1, cor and log10qvalue) as a v2 table"""
+    assert set(df.columns) == set(COR_DF_COLUMNS)
+    compress = _get_compressor(codec)
+
+    df = df.sort_values(["dim_0", "dim_1"], kind="stable")
+    dim_0 = df["dim_0"].to_numpy(dtype="int64")
+    dim_1 = df["dim_1"].to_numpy(dtype="int32")
+    cor = df["cor"].to_numpy(dtype="<f4")
+    log10qvalue = df["log10qvalue"].to_numpy(dtype="<f4")
+
+    dim_0_count = len(dim_0_desc.given_ids)
+    assert len(dim_0) == 0 or (dim_0[0] >= 0 and dim_0[-1] < dim_0_count)
+    assert len(dim_1) == 0 or (
+        dim_1.min() >= 0 and dim_1.max() < len(dim_1_desc.given_ids)
+    )
+
+    boundaries = np.searchsorted(dim_0, np.arange(dim_0_count + 1))
+    block_offsets = np.zeros(dim_0_count + 1, dtype="<i8")
+    blocks = []
+    for i in range(dim_0_count):
+        start, end = boundaries[i], boundaries[i + 1]
+        if start < end:
+            deltas = np.diff(dim_1[start:end], prepend=0).astype("<i4")
+            cbuf = compress(
+                deltas.tobytes()
+                + cor[start:end].tobytes()
+                + log10qvalue[start:end].tobytes()
+            )
+            blocks.append(cbuf)
+            block_offsets[i + 1] = block_offsets[i] + len(cbuf)
+        else:
+            block_offsets[i + 1] = block_offsets[i]
+
+    sections: Dict[str, List[bytes]] = {
+        "dim_0_labels": [
+            compress(json.dumps(list(dim_0_desc.given_ids)).encode("utf8"))
+        ],
+        "dim_1_labels": [
+            compress(json.dumps(list(dim_1_desc.given_ids)).encode("utf8"))
+        ],
+        "index": [block_offsets.tobytes()],
+        "blocks": blocks,
+    }
+    section_locations = {}
+    offset = 0
+    for name, parts in sections.items():
+        length = sum(len(part) for part in parts)
+        section_locations[name] = [offset, length]
+        offset = _align(offset + length)
+
+    header = json.dumps(
+        {
+            "codec": codec,
+            "datasets": [
+                {
+                    "taiga_id": desc.taiga_id,
+                    "name": desc.name,
+                    "size": len(desc.given_ids),
+                }
+                for desc in [dim_0_desc, dim_1_desc]
+            ],
+            "sections": section_locations,
+        }
+    ).encode("utf8")
+
+    with open(filename, "wb") as fd:
+        fd.write(PREAMBLE.pack(MAGIC, len(header)))
+        fd.write(header)
+        data_start = _align(fd.tell())
+        for name, parts in sections.items():
+            fd.write(b"\0" * (data_start + section_locations[name][0] - fd.tell()))
+            for part in parts:
+                fd.write(part)
+
+
+class CorTable:
+    """A v2 table mapped into memory. The labels of each dimension are only decoded the first time they're needed."""
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as fd:
+            try:
+                self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as ex:
+                # raised when the file is empty
+                raise InvalidAssociationTable(f"{filename} is empty") from ex
+
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise InvalidAssociationTable(f"{filename} is not a v2 association table")
+        _, header_length = PREAMBLE.unpack_from(self._mmap)
+        header = json.loads(
+            self._mmap[PREAMBLE.size : PREAMBLE.size + header_length].decode("utf8")
+        )
+
+        self.codec = header["codec"]
+        self.dataset_given_ids = [dataset["name"] for dataset in header["datasets"]]
+        self.taiga_ids = [dataset["taiga_id"] for dataset in header["datasets"]]
+        self._decompress = _get_decompressor(self.codec)
+        self._data_start = _align(PREAMBLE.size + header_length)
+        self._sections: Dict[str, Tuple[int, int]] = {
+            name: (self._data_start + offset, length)
+            for name, (offset, length) in header["sections"].items()
+        }
+
+        index_offset, _ = self._sections["index"]
+        self._block_offsets = np.frombuffer(
+            self._mmap,
+            dtype="<i8",
+            count=header["datasets"][0]["size"] + 1,
+            offset=index_offset,
+        )
+        self._labels: List[Optional[np.ndarray]] = [None, None]
+        self._dim_0_positions: Optional[Dict[str, int]] = None
+
+    def _read_section(self, name: str) -> bytes:
+        offset, length = self._sections[name]
+        return self._decompress(self._mmap[offset : offset + length])
+
+    def get_labels(self, dim_i: int) -> np.ndarray:
+        labels = self._labels[dim_i]
+        if labels is None:
+            given_ids = json.loads(self._read_section(f"dim_{dim_i}_labels"))
+            labels = np.empty(len(given_ids), dtype=object)
+            labels[:] = given_ids
+            self._labels[dim_i] = labels
+        return labels
+
+    def get_dim_0_position(self, given_id: str) -> Optional[int]:
+        if self._dim_0_positions is None:
+            self._dim_0_positions = {
+                label: i for i, label in enumerate(self.get_labels(0))
+            }
+        return self._dim_0_positions.get(given_id)
+
+    def read_block(self, dim_0: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the dim_1, cor and log10qvalue arrays stored for the feature at position dim_0"""
+        blocks_offset, _ = self._sections["blocks"]
+        start, end = self._block_offsets[dim_0 : dim_0 + 2]
+        buf = self._decompress(self._mmap[blocks_offset + start : blocks_offset + end])
+        row_count = len(buf) // ROW_BYTE_SIZE
+        deltas = np.frombuffer(buf, dtype="<i4", count=row_count)
+        cor = np.frombuffer(buf, dtype="<f4", count=row_count, offset=4 * row_count)
+        log10qvalue = np.frombuffer(
+            buf, dtype="<f4", count=row_count, offset=8 * row_count
+        )
+        return np.cumsum(deltas, dtype="int32"), cor, log10qvalue
+
+    def read_cor_for_given_id(self, feature_id: str) -> pd.DataFrame:
+        dim_0 = self.get_dim_0_position(feature_id)
+        if (
+            dim_0 is None
+            or self._block_offsets[dim_0] == self._block_offsets[dim_0 + 1]
+        ):
+            return empty_result()
+
+        dim_1, cor, log10qvalue = self.read_block(dim_0)
+        return pd.DataFrame(
+            {
+                "cor": cor,
+                "log10qvalue": log10qvalue,
+                "feature_given_id_0": feature_id,
+                "feature_given_id_1": self.get_labels(1)[dim_1],
+                "dataset_given_id_0": self.dataset_given_ids[0],
+                "dataset_given_id_1": self.dataset_given_ids[1],
+            }
+        )
+
+    def read_cor_for_given_ids(self, feature_ids: List[str]) -> pd.DataFrame:
+        feature_ids = list(dict.fromkeys(feature_ids))
+        found_ids = []
+        columns: List[List[np.ndarray]] = [[], [], []]
+        for feature_id in feature_ids:
+            dim_0 = self.get_dim_0_position(feature_id)
+            if (
+                dim_0 is None
+                or self._block_offsets[dim_0] == self._block_offsets[dim_0 + 1]
+            ):
+                continue
+            for column, values in zip(columns, self.read_block(dim_0)):
+                column.append(values)
+            found_ids.append(feature_id)
+
+        if len(found_ids) == 0:
+            return empty_result()
+
+        dim_1, cor, log10qvalue = [np.concatenate(column) for column in columns]
+        return pd.DataFrame(
+            {
+                "cor": cor,
+                "log10qvalue": log10qvalue,
+                "feature_given_id_0": np.repeat(
+                    np.array(found_ids, dtype=object),
+                    [len(values) for values in columns[0]],
+                ),
+                "feature_given_id_1": self.get_labels(1)[dim_1],
+                "dataset_given_id_0": self.dataset_given_ids[0],
+                "dataset_given_id_1": self.dataset_given_ids[1],
+            }
+        )
+
+    def read_cor_df(self) -> Tuple[pd.DataFrame, InputMatrixDesc, InputMatrixDesc]:
+        """Returns the correlations as a dataframe in the shape write_cor_df accepts, along with the
+        descriptions of both dimensions"""
+        row_counts = []
+        columns: List[List[np.ndarray]] = [[], [], []]
+        for dim_0 in range(len(self._block_offsets) - 1):
+            if self._block_offsets[dim_0] == self._block_offsets[dim_0 + 1]:
+                row_counts.append(0)
+                continue
+            for column, values in zip(columns, self.read_block(dim_0)):
+                column.append(values)
+            row_counts.append(len(columns[0][-1]))
+
+        dim_1, cor, log10qvalue = [
+            np.concatenate(column) if len(column) > 0 else np.array([], dtype=dtype)
+            for column, dtype in zip(columns, ["int32", "float32", "float32"])
+        ]
+        df = pd.DataFrame(
+            {
+                "dim_0": np.repeat(np.arange(len(row_counts)), row_counts),
+                "dim_1": dim_1,
+                "cor": cor,
+                "log10qvalue": log10qvalue,
+            }
+        )
+
+        dim_0_desc, dim_1_desc = [
+            InputMatrixDesc(
+                given_ids=self.get_labels(dim_i).tolist(),
+                taiga_id=self.taiga_ids[dim_i],
+                name=self.dataset_given_ids[dim_i],
+            )
+            for dim_i in [0, 1]
+        ]
+        return df, dim_0_desc, dim_1_desc
+
+
+_open_tables: "OrderedDict[str, Tuple[Tuple[int, int, int], CorTable]]" = OrderedDict()
+_open_tables_lock = threading.Lock()
+
+
+def open_table(filename: str) -> CorTable:
+    """Returns the table for filename, reusing the one already mapped by this process if the file hasn't changed since"""
+    filename = os.fspath(filename)
+    stat = os.stat(filename)
+    version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    with _open_tables_lock:
+        entry = _open_tables.get(filename)
+        if entry is not None and entry[0] == version:
+            _open_tables.move_to_end(filename)
+            return entry[1]
+
+    table = CorTable(filename)
+    with _open_tables_lock:
+        _open_tables[filename] = (version, table)
+        _open_tables.move_to_end(filename)
+        while len(_open_tables) > MAX_OPEN_TABLES:
+            _open_tables.popitem(last=False)
+    return table
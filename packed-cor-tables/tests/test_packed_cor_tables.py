@@ -1,5 +1,14 @@
+import numpy as np
 import pandas as pd
-from packed_cor_tables import write_cor_df, read_cor_for_given_id, InputMatrixDesc
+import pytest
+
+import packed_cor_tables
+from packed_cor_tables import (
+    write_cor_df,
+    read_cor_for_given_id,
+    InputMatrixDesc,
+    InvalidAssociationTable,
+)
 
 
 def test_write_df(tmpdir):
@@ -34,3 +43,128 @@ def test_write_df(tmpdir):
     df = read_cor_for_given_id(out, "C2").sort_values("feature_given_id_1")
     assert list(df["feature_given_id_1"]) == ["E1", "E4"]
     assert round_list(df["cor"]) == [0.9, 0.001]
+
+
+def _write_example(filename, format_version, codec="zlib"):
+    df = pd.DataFrame(
+        {
+            "dim_0": [0, 0, 1, 1, 3],
+            "dim_1": [1, 2, 3, 0, 2],
+            "cor": [0.1, 0.2, 0.001, 0.9, -0.5],
+            "log10qvalue": [1e-10, 1e-1, 0.1, 1e-12, -np.inf],
+        }
+    )
+    dim_0_desc = InputMatrixDesc(
+        given_ids=["C1", "C2", "C3", "C4"], taiga_id="crispr-taiga", name="crispr"
+    )
+    dim_1_desc = InputMatrixDesc(
+        given_ids=["E1", "E2", "E3", "E4"], taiga_id="expr-taiga", name="expr"
+    )
+    if format_version == 2:
+        packed_cor_tables.write_cor_df_v2(
+            df, dim_0_desc, dim_1_desc, filename, codec=codec
+        )
+    else:
+        write_cor_df(df, dim_0_desc, dim_1_desc, filename)
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+def test_v2_reads_match_v1(tmpdir, codec):
+    v1_filename = str(tmpdir.join("v1.sqlite3"))
+    v2_filename = str(tmpdir.join("v2.cor"))
+    _write_example(v1_filename, 1)
+    _write_example(v2_filename, 2, codec=codec)
+
+    assert packed_cor_tables.get_format_version(v1_filename) == 1
+    assert packed_cor_tables.get_format_version(v2_filename) == 2
+
+    for feature_id in ["C1", "C2", "C4"]:
+        expected = read_cor_for_given_id(v1_filename, feature_id)
+        actual = read_cor_for_given_id(v2_filename, feature_id)
+        pd.testing.assert_frame_equal(
+            actual.sort_values("feature_given_id_1").reset_index(drop=True),
+            expected.sort_values("feature_given_id_1").reset_index(drop=True),
+        )
+
+    # C3 has no correlations and C5 doesn't exist
+    assert len(read_cor_for_given_id(v2_filename, "C3")) == 0
+    assert len(read_cor_for_given_id(v2_filename, "C5")) == 0
+
+    for dim in ["0", "1"]:
+        assert packed_cor_tables.get_given_ids(
+            v2_filename, dim
+        ) == packed_cor_tables.get_given_ids(v1_filename, dim)
+
+    def sort_full(df):
+        return df.sort_values(["feature_given_id_0", "feature_given_id_1"]).reset_index(
+            drop=True
+        )
+
+    pd.testing.assert_frame_equal(
+        sort_full(packed_cor_tables.read_full(v2_filename)),
+        sort_full(packed_cor_tables.read_full(v1_filename)),
+    )
+
+
+def test_v2_table_is_reloaded_when_rewritten(tmpdir):
+    filename = str(tmpdir.join("v2.cor"))
+    _write_example(filename, 2)
+    assert list(read_cor_for_given_id(filename, "C4")["feature_given_id_1"]) == ["E3"]
+
+    packed_cor_tables.write_cor_df_v2(
+        pd.DataFrame({"dim_0": [3], "dim_1": [0], "cor": [0.5], "log10qvalue": [-1.0]}),
+        InputMatrixDesc(given_ids=["C1", "C2", "C3", "C4"], taiga_id="a", name="a"),
+        InputMatrixDesc(given_ids=["X1"], taiga_id="b", name="b"),
+        filename,
+    )
+    df = read_cor_for_given_id(filename, "C4")
+    assert list(df["feature_given_id_1"]) == ["X1"]
+    assert list(df["dataset_given_id_1"]) == ["b"]
+
+
+def test_convert_round_trip(tmpdir):
+    v1_filename = str(tmpdir.join("v1.sqlite3"))
+    v2_filename = str(tmpdir.join("v2.cor"))
+    round_trip_filename = str(tmpdir.join("round_trip.sqlite3"))
+    _write_example(v1_filename, 1)
+
+    packed_cor_tables.convert(v1_filename, v2_filename, format_version=2)
+    packed_cor_tables.convert(v2_filename, round_trip_filename, format_version=1)
+
+    expected, expected_dim_0, expected_dim_1 = packed_cor_tables.read_cor_df(
+        v1_filename
+    )
+    for filename in [v2_filename, round_trip_filename]:
+        df, dim_0_desc, dim_1_desc = packed_cor_tables.read_cor_df(filename)
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+        assert dim_0_desc == expected_dim_0
+        assert dim_1_desc == expected_dim_1
+
+
+def test_invalid_tables(tmpdir):
+    filename = str(tmpdir.join("not-a-table"))
+    with open(filename, "wt") as fd:
+        fd.write("dim_0,dim_1\n")
+
+    with pytest.raises(InvalidAssociationTable):
+        packed_cor_tables.get_given_ids(filename, "0")
+    with pytest.raises(InvalidAssociationTable):
+        packed_cor_tables.get_given_ids(str(tmpdir.join("missing")), "0")
+
+
+@pytest.mark.parametrize("format_version", [1, 2])
+def test_read_cor_for_given_ids(tmpdir, format_version):
+    filename = str(tmpdir.join("table"))
+    _write_example(filename, format_version)
+
+    # unknown features and features without correlations are skipped, and duplicates are only read once
+    df = packed_cor_tables.read_cor_for_given_ids(
+        filename, ["C4", "C5", "C1", "C3", "C4"]
+    )
+    expected = pd.concat(
+        [read_cor_for_given_id(filename, "C4"), read_cor_for_given_id(filename, "C1"),],
+        ignore_index=True,
+    )
+    pd.testing.assert_frame_equal(df, expected)
+
+    assert len(packed_cor_tables.read_cor_for_given_ids(filename, ["C3"])) == 0
@@ -1,14 +1,23 @@
+import logging
+
+import flask
 from flask import current_app
 
 from breadbox_client import Client
 from breadbox_facade import BBClient
+from breadbox_facade.pooling import CallRecord
 from depmap.access_control import get_current_user_for_access_control
 
+log = logging.getLogger(__name__)
+
 
 class BreadboxClientExtension:
     """
-    Contains an instance of the breadbox_facade.BBClient, which the uses autogenerated 
-    breadbox_client module to maintain a connection to the breadbox database.  
+    Contains an instance of the breadbox_facade.BBClient, which the uses autogenerated
+    breadbox_client module to maintain a connection to the breadbox database.
+
+    The calls made to breadbox while handling a request are recorded, and reported in the
+    response's Server-Timing header and in the debug log.
     """
 
     def __init__(self, app=None) -> None:
@@ -17,21 +26,59 @@ class BreadboxClientExtension:
 
     def init_app(self, app):
         self.app = app
+        app.after_request(_report_breadbox_calls)
 
     @property
     def client(self) -> BBClient:
-        # We want to reuse the breadbox client across requests, so create the
-        # client on demand, then reuse the client in all subsequent requests.
-        # This is why it is not being stored on flask.g
+        # The client is cheap to create, since every client in the process shares the same
+        # pool of connections to breadbox (see breadbox_facade.pooling). One is created per
+        # request (for the current user) and stored on flask.g.
         if hasattr(self.app, "__breadbox_client"):
-            client = self.app.__breadbox_client
-        else:
-            base_url = current_app.config["BREADBOX_PROXY_TARGET"]
-            user = get_current_user_for_access_control()
-            client = BBClient(base_url=base_url, user=user)
+            return self.app.__breadbox_client
+
+        if hasattr(flask.g, "_breadbox_client"):
+            return flask.g._breadbox_client
+
+        base_url = current_app.config["BREADBOX_PROXY_TARGET"]
+        user = get_current_user_for_access_control()
+        calls: list[CallRecord] = []
+        client = BBClient(
+            base_url=base_url,
+            user=user,
+            http2=current_app.config.get("BREADBOX_HTTP2", False),
+            on_call=calls.append,
+        )
+        flask.g._breadbox_client = client
+        flask.g._breadbox_calls = calls
         return client
 
     @client.setter
     def client(self, new_client: Client):
         # used for mocking the client in tests
         self._client = new_client
+
+
+def _report_breadbox_calls(response: flask.Response) -> flask.Response:
+    calls: list[CallRecord] = getattr(flask.g, "_breadbox_calls", [])
+    if len(calls) == 0:
+        return response
+
+    # calls made by the *_many methods overlap, so the total can exceed the time spent waiting
+    total_elapsed = sum(call.elapsed for call in calls)
+    response.headers.add(
+        "Server-Timing",
+        f'breadbox;dur={total_elapsed * 1000:.1f};desc="{len(calls)} calls"',
+    )
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(
+            "%s %s made %d breadbox calls (%.1f ms): %s",
+            flask.request.method,
+            flask.request.path,
+            len(calls),
+            total_elapsed * 1000,
+            ", ".join(
+                f"{call.method} {call.path} {call.status_code} {call.elapsed * 1000:.1f}ms"
+                for call in calls
+            ),
+        )
+    return response
@@ -34,7 +34,11 @@ from depmap.compound.views.executive import (
 )
 from depmap.dataset.models import Dataset, DependencyDataset
 from depmap.enums import DependencyEnum
-from depmap.predictability.models import PredictiveFeatureResult, PredictiveModel
+from depmap.predictability.models import (
+    PredictiveFeature,
+    PredictiveFeatureResult,
+    PredictiveModel,
+)
 from depmap.predictability.utilities import (
     get_predictability_input_files_downloads_link,
 )
@@ -215,8 +219,15 @@ def get_predictive_table():
             sorted_feature_results: List[PredictiveFeatureResult] = sorted(
                 model.feature_results, key=lambda result: result.rank
             )
+            correlations = PredictiveFeature.get_correlations_for_entity(
+                [feature_result.feature for feature_result in sorted_feature_results],
+                model.dataset_given_id,
+                compound.compound_id,
+            )
             results = []
-            for feature_result in sorted_feature_results:
+            for feature_result, correlation in zip(
+                sorted_feature_results, correlations
+            ):
                 related_type = feature_result.feature.get_relation_to_entity(
                     compound.compound_id, "compound_v2"
                 )
@@ -224,9 +235,7 @@ def get_predictive_table():
                 row = {
                     "featureName": feature_result.feature.feature_name,
                     "featureImportance": feature_result.importance,
-                    "correlation": feature_result.feature.get_correlation_for_entity(
-                        model.dataset_given_id, compound.compound_id
-                    ),
+                    "correlation": correlation,
                     "featureType": feature_result.feature.feature_type,
                     "relatedType": related_type,
                     "interactiveUrl": feature_result.feature.get_interactive_url_for_entity(
@@ -19,6 +19,7 @@ from .interface import (
     is_continuous,
     dataset_exists,
     get_row_of_values,
+    get_rows_of_values,
     valid_row,
     # compound-specific methods
     get_all_datasets_containing_compound,
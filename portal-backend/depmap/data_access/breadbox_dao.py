@@ -65,29 +65,56 @@ def _get_feature_data_with_caching(
     Certain API endpoints (predictability, compound page) make a lot of 
     repetative calls to load data - this addresses that issue.
     """
-    key_for_lookup = (breadbox_dataset_id, feature, feature_identifier)
+    (result_series,) = _get_features_data_with_caching(
+        breadbox_dataset_id, [feature], feature_identifier
+    )
+    return result_series
 
-    if hasattr(flask.g, "__cached_feature_values"):
-        cached_feature_values = cast(
-            dict[tuple, CellLineSeries],
-            flask.g.__cached_feature_values,
-        )
-        if key_for_lookup in cached_feature_values:
-            return cached_feature_values[key_for_lookup]
-    else:
+
+def _get_features_data_with_caching(
+    breadbox_dataset_id: str,
+    features: list[str],
+    feature_identifier: Literal["id", "label"],
+) -> list[CellLineSeries]:
+    """
+    Like _get_feature_data_with_caching, but for several features at once. The features
+    which aren't already cached are loaded with concurrent requests to breadbox.
+    """
+    if not hasattr(flask.g, "__cached_feature_values"):
         flask.g.__cached_feature_values = {}
+    cached_feature_values = cast(
+        dict[tuple, CellLineSeries], flask.g.__cached_feature_values,
+    )
 
-    single_col_df = extensions.breadbox.client.get_dataset_data(
-        dataset_id=breadbox_dataset_id,
-        features=[feature],
-        feature_identifier=feature_identifier,
-        samples=None,
-        sample_identifier=None,
+    def key_for_lookup(feature):
+        return (breadbox_dataset_id, feature, feature_identifier)
+
+    missing_features = list(
+        dict.fromkeys(
+            feature
+            for feature in features
+            if key_for_lookup(feature) not in cached_feature_values
+        )
     )
-    result_series = CellLineSeries(single_col_df[feature])
-    flask.g.__cached_feature_values[key_for_lookup] = result_series # pyright: ignore
-    return result_series
-    
+    single_col_dfs = extensions.breadbox.client.get_dataset_data_many(
+        [
+            dict(
+                dataset_id=breadbox_dataset_id,
+                features=[feature],
+                feature_identifier=feature_identifier,
+                samples=None,
+                sample_identifier=None,
+            )
+            for feature in missing_features
+        ]
+    )
+    for feature, single_col_df in zip(missing_features, single_col_dfs):
+        cached_feature_values[key_for_lookup(feature)] = CellLineSeries(
+            single_col_df[feature]
+        )
+
+    return [cached_feature_values[key_for_lookup(feature)] for feature in features]
+
 
 def get_all_matrix_datasets() -> list[MatrixDataset]:
     """
@@ -171,9 +198,26 @@ def get_dataset_sample_type(dataset_id: str) -> Optional[str]:
     return get_matrix_dataset(dataset_id).sample_type
 
 
+def _get_dataset_features_with_caching(breadbox_dataset_id: str) -> list[dict[str, str]]:
+    """
+    Cache the features of a dataset, scoped to the flask request. Pages like predictability
+    look up the label of a feature once per row of a table.
+    """
+    if not hasattr(flask.g, "__cached_dataset_features"):
+        flask.g.__cached_dataset_features = {}
+    cached_dataset_features = cast(
+        dict[str, list[dict[str, str]]], flask.g.__cached_dataset_features,
+    )
+    if breadbox_dataset_id not in cached_dataset_features:
+        cached_dataset_features[
+            breadbox_dataset_id
+        ] = extensions.breadbox.client.get_dataset_features(breadbox_dataset_id)
+    return cached_dataset_features[breadbox_dataset_id]
+
+
 def get_dataset_feature_labels_by_id(dataset_id) -> dict[str, str]:
     bb_dataset_id = remove_breadbox_prefix(dataset_id)
-    features = extensions.breadbox.client.get_dataset_features(bb_dataset_id)
+    features = _get_dataset_features_with_caching(bb_dataset_id)
     return {feature["id"]: feature["label"] for feature in features}
 
 
@@ -185,7 +229,7 @@ def get_dataset_sample_labels_by_id(dataset_id) -> dict[str, str]:
 
 def get_dataset_feature_labels(dataset_id: str) -> list[str]:
     bb_dataset_id = remove_breadbox_prefix(dataset_id)
-    features = extensions.breadbox.client.get_dataset_features(bb_dataset_id)
+    features = _get_dataset_features_with_caching(bb_dataset_id)
     return [feature["label"] for feature in features]
 
 
@@ -226,6 +270,21 @@ def get_row_of_values(
     )
 
 
+def get_rows_of_values(
+    dataset_id: str, features: list[str], feature_identifier: Literal["id", "label"]
+) -> list[CellLineSeries]:
+    """
+    Like get_row_of_values, but for several features of the same dataset. The rows
+    which haven't already been loaded during this request are loaded concurrently.
+    """
+    bb_dataset_id = remove_breadbox_prefix(dataset_id)
+    return _get_features_data_with_caching(
+        breadbox_dataset_id=bb_dataset_id,
+        features=features,
+        feature_identifier=feature_identifier,
+    )
+
+
 def get_subsetted_df_by_labels(
     dataset_id: str,
     feature_row_labels: Optional[list[str]],
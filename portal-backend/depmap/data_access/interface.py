@@ -141,6 +141,27 @@ def get_row_of_values(
     return interactive_utils.get_row_of_values(dataset_id=dataset_id, feature=feature)
 
 
+def get_rows_of_values(
+    dataset_id: str,
+    features: list[str],
+    feature_identifier: Literal["id", "label"] = "label",
+) -> list[CellLineSeries]:
+    """
+    Gets a row of values (see get_row_of_values) for each of the given features of a
+    dataset, in the same order. For breadbox datasets, the rows are loaded concurrently.
+    """
+    if is_breadbox_id(dataset_id):
+        return breadbox_dao.get_rows_of_values(
+            dataset_id=dataset_id,
+            features=features,
+            feature_identifier=feature_identifier,
+        )
+    return [
+        interactive_utils.get_row_of_values(dataset_id=dataset_id, feature=feature)
+        for feature in features
+    ]
+
+
 def get_subsetted_df_by_labels(
     dataset_id: str,
     feature_row_labels: Optional[list[str]] = None,
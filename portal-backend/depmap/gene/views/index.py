@@ -25,7 +25,11 @@ from depmap.extensions import memoize_without_user_permissions
 from depmap.gene.models import Gene
 from depmap.gene.views import characterization, utils
 from depmap.gene.views.executive import format_mutation_profile, get_order
-from depmap.predictability.models import PredictiveFeatureResult, PredictiveModel
+from depmap.predictability.models import (
+    PredictiveFeature,
+    PredictiveFeatureResult,
+    PredictiveModel,
+)
 from depmap.predictability.utilities import (
     get_predictability_input_files_downloads_link,
 )
@@ -269,8 +273,15 @@ def get_predictive_table():
             sorted_feature_results: List[PredictiveFeatureResult] = sorted(
                 model.feature_results, key=lambda result: result.rank
             )
+            correlations = PredictiveFeature.get_correlations_for_entity(
+                [feature_result.feature for feature_result in sorted_feature_results],
+                dataset.given_id,
+                str(gene.entrez_id),
+            )
             results = []
-            for feature_result in sorted_feature_results:
+            for feature_result, correlation in zip(
+                sorted_feature_results, correlations
+            ):
                 related_type = feature_result.feature.get_relation_to_entity(
                     gene.entrez_id, dataset.feature_type
                 )
@@ -278,9 +289,7 @@ def get_predictive_table():
                 row = {
                     "featureName": feature_result.feature.feature_name,
                     "featureImportance": feature_result.importance,
-                    "correlation": feature_result.feature.get_correlation_for_entity(
-                        dataset.given_id, str(gene.entrez_id)
-                    ),
+                    "correlation": correlation,
                     "featureType": feature_result.feature.feature_type,
                     "relatedType": related_type,
                     "interactiveUrl": feature_result.feature.get_interactive_url_for_entity(
@@ -1,12 +1,11 @@
 from json import loads as json_loads
 from json import dumps as json_dumps
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 from flask import url_for, current_app
 
 from depmap import data_access
-from depmap.interactive import interactive_utils
 from depmap.compound.models import Compound
 from depmap.database import (
     Column,
@@ -110,6 +109,20 @@ class PredictiveModel(Model):
         if len(feature_results) == 0:
             return None
 
+        predictive_features = [
+            feature_result.feature
+            for feature_result in feature_results
+            if feature_result.feature is not None
+        ]
+        correlations_by_feature_id = dict(
+            zip(
+                [feature.feature_id for feature in predictive_features],
+                PredictiveFeature.get_correlations_for_entity(
+                    predictive_features, dataset_given_id, pred_model_feature_id
+                ),
+            )
+        )
+
         rows = []
         for feature_result in feature_results:
             predictive_model = feature_result.predictive_model
@@ -142,10 +155,9 @@ class PredictiveModel(Model):
                     predictive_model.dataset_given_id,
                     predictive_model.pred_model_feature_id,
                 )
-                row["correlation"] = predictive_feature.get_correlation_for_entity(
-                    predictive_model.dataset_given_id,
-                    predictive_model.pred_model_feature_id,
-                )
+                row["correlation"] = correlations_by_feature_id[
+                    predictive_feature.feature_id
+                ]
                 pred_model_feature_type = data_access.get_dataset_feature_type(
                     predictive_model.dataset_given_id
                 )
@@ -255,37 +267,73 @@ class PredictiveFeature(Model):
     def get_correlation_for_entity(
         self, dataset_given_id: str, pred_model_feature_id: str
     ) -> Optional[float]:
-        if not self._get_feature_is_loaded():
-            return None
+        return PredictiveFeature.get_correlations_for_entity(
+            [self], dataset_given_id, pred_model_feature_id
+        )[0]
+
+    @staticmethod
+    def get_correlations_for_entity(
+        features: List["PredictiveFeature"],
+        dataset_given_id: str,
+        pred_model_feature_id: str,
+    ) -> List[Optional[float]]:
+        """
+        Returns the correlation of each of the given features with the entity, in the same order.
+        The predictability tab needs this for 60+ features at a time, so the entity's values are
+        loaded once and the values of the features in each dataset are loaded in one batch.
+        """
+        loaded_features = [
+            feature for feature in features if feature._get_feature_is_loaded()
+        ]
+        if len(loaded_features) == 0:
+            return [None for _ in features]
 
         dep_dataset_values = data_access.get_row_of_values(
             dataset_given_id, pred_model_feature_id, feature_identifier="id"
         )
+
+        feature_names_by_dataset: Dict[str, List[str]] = {}
+        for feature in loaded_features:
+            feature_names_by_dataset.setdefault(
+                feature._get_values_dataset_id(), []
+            ).append(feature.feature_name)
+
+        values_by_feature: Dict[Tuple[str, str], pd.Series] = {}
+        for values_dataset_id, feature_names in feature_names_by_dataset.items():
+            feature_names = list(dict.fromkeys(feature_names))
+            rows = data_access.get_rows_of_values(values_dataset_id, feature_names)
+            for feature_name, values in zip(feature_names, rows):
+                values_by_feature[(values_dataset_id, feature_name)] = values
+
+        correlations: List[Optional[float]] = []
+        for feature in features:
+            if not feature._get_feature_is_loaded():
+                correlations.append(None)
+                continue
+
+            values = values_by_feature[
+                (feature._get_values_dataset_id(), feature.feature_name)
+            ]
+            if feature.dataset_id == "context":
+                cell_lines_in_self_context = values
+                self_values = pd.Series(
+                    dep_dataset_values.index.map(
+                        lambda depmap_id: depmap_id in cell_lines_in_self_context.index
+                    ),
+                    dep_dataset_values.index,
+                    dtype=int,
+                )
+            else:
+                self_values = values
+            cor = dep_dataset_values.corr(self_values)
+            correlations.append(None if pd.isnull(cor) else cor)
+        return correlations
+
+    def _get_values_dataset_id(self) -> str:
+        # the values of a context feature are which cell lines are in the context
         if self.dataset_id == "context":
-            cell_lines_in_self_context = data_access.get_row_of_values(
-                data_access.get_context_dataset(), self.feature_name
-            )
-            self_values = pd.Series(
-                dep_dataset_values.index.map(
-                    lambda depmap_id: depmap_id in cell_lines_in_self_context.index
-                ),
-                dep_dataset_values.index,
-                dtype=int,
-            )
-        else:
-            # For now, this one method call should continue to use the legacy interactive_utils
-            # interface for performance reasons. This get_correlation_for_entity method is used
-            # to load data for the predictability tab - and is sometimes called 60+ times in a row
-            # to load data for various features. Breadbox is not currently equipped to handle this
-            # many subsequent requests in a performant way. That's fine because predictability is not
-            # breadbox-friendly at the moment anyway.
-            self_values = interactive_utils.get_row_of_values(
-                self.dataset_id, self.feature_name
-            )
-        cor = dep_dataset_values.corr(self_values)
-        if pd.isnull(cor):
-            return None
-        return cor
+            return data_access.get_context_dataset()
+        return self.dataset_id
 
     def get_relation_to_entity(
         self, pred_model_feature_id: str, pred_model_feature_type: str